@@ -1,83 +1,391 @@
 """App logic for the todotxtpy."""
 
-from constants import Colors
-from data import Config, Tag, Task, TaskList
-from utils import get_current_date
+from __future__ import annotations
+import os
+import sys
+import time
+from typing import Callable, Optional
+
+# As in main.py, modules used by only some commands are imported in the
+# methods that need them
+from constants import ARCHIVE_NAME, Colors, DONE_INTENT_NAME, DUE_INDEX_NAME, UNDO_LOG_NAME
+from data import Config, DoneList, DoneTask, Tag, Task
+from durable import commit_done, commit_retract, recover_and_report
+from storage import SqliteStorage, open_storage
+from utils import compile_basic_regex, get_current_date, get_current_day, parse_substitution
 
 
 class TodoApp:
     """The full app for todotxtpy."""
 
-    def __init__(self, config_path, todo_path, done_path) -> None:
-        """Initialize the app."""
-        self.config = Config()
-        self.config.load(config_path)
-        self.tasklist = TaskList.load(todo_path)
+    def __init__(self, config_path, todo_path, done_path, lazy=False) -> None:
+        """Initialize the app.
 
+        With lazy, task text is decoded from todo.txt as it is used, for
+        commands that only read the task list.
+        """
         self.config_path = config_path
         self.todo_path = todo_path
         self.done_path = done_path
+        self.due_index_path = os.path.join(os.path.dirname(todo_path), DUE_INDEX_NAME)
+        self.archive_path = os.path.join(os.path.dirname(done_path), ARCHIVE_NAME)
+        self.intent_path = os.path.join(os.path.dirname(done_path), DONE_INTENT_NAME)
+        self._undo_log = None
+        self.lazy = lazy
+        self.reload()
+
+    @property
+    def undo_log(self):
+        """The undo log, loaded when first used."""
+        if self._undo_log is None:
+            from undo import UndoLog
+            self._undo_log = UndoLog(os.path.join(os.path.dirname(self.todo_path),
+                                                  UNDO_LOG_NAME))
+        return self._undo_log
+
+    def reload(self) -> None:
+        """Load the config, then the task list from the storage it selects."""
+        self.config = Config()
+        self.config.load(self.config_path)
+        self.storage = open_storage(self.config.storage, self.todo_path,
+                                    sync=self.config.durability != "none", lazy=self.lazy)
+        recover_and_report(self.intent_path, self.done_path, self.storage)
+        self.tasklist = self.storage.load()
+        if self.tasklist.invalid:
+            print(f"Skipped {len(self.tasklist.invalid)} invalid lines in "
+                  f"{self.storage.path}; run `t fsck` to find them.", file=sys.stderr)
+
+    def save(self) -> None:
+        """Sort and save the task list, then refresh the indexes derived from it."""
+        from complete import CompletionCache
+        from index import DueIndex
+        self.tasklist.sort()
+        self.storage.save(self.tasklist)
+        DueIndex.build(self.tasklist, self.storage, self.config_path).save(
+            self.due_index_path)
+        CompletionCache.build(self.tasklist, self.storage, self.config_path).save(
+            CompletionCache.path_for(self.todo_path))
+
+    def add(self, priority: str, tag: Tag, text: str, unique: bool = False) -> None:
+        """Process raw output and append onto the task list.
 
-    def add(self, priority: str, tag: Tag, text: str) -> None:
-        """Process raw output and append onto the task list."""
+        If unique, nothing is added when a task with the same tag and text
+        (as compared by dedupe) is already in the list.
+        """
+        from undo import Operation
         new_task = Task(priority, get_current_date(), tag, text)
 
+        if unique:
+            from dedupe import task_hash
+            new_hash = task_hash(new_task)
+            for i, task in enumerate(self.tasklist.tasks):
+                if task_hash(task) == new_hash:
+                    print(f"Already on line {i + 1}: {task}")
+                    return
+
         self.tasklist.tasks.append(new_task)
 
-        self.tasklist.sort()
-        self.tasklist.save(self.todo_path)
+        self.save()
+        self.record(Operation("add", None, str(new_task)))
 
     def pri(self, line_number: str, new_priority: str) -> None:
         """Re-prioritize task."""
+        from undo import Operation
         idx = int(line_number) - 1
 
         if not 0 <= idx <= len(self.tasklist.tasks) - 1:
             raise ValueError("Line number out of range")
 
-        self.tasklist.tasks[idx].priority = new_priority
+        task = self.tasklist.tasks[idx]
+        before = str(task)
+        task.priority = new_priority
 
-        self.tasklist.sort()
-        self.tasklist.save(self.todo_path)
+        self.save()
+        self.record(Operation("pri", before, str(task)))
 
     def do_task(self, line_number: str) -> None:
         """Complete a task."""
-        idx = int(line_number) - 1
+        self.do_tasks([line_number])
 
-        if not 0 <= idx <= len(self.tasklist.tasks) - 1:
+    def do_tasks(self, line_numbers: list[str]) -> None:
+        """Complete tasks, undone and redone together.
+
+        With DURABILITY always, each task is committed to todo.txt and
+        done.txt on its own; otherwise they are committed as one batch.
+        """
+        from undo import Operation
+        indices = sorted({int(line_number) - 1 for line_number in line_numbers})
+
+        if not all(0 <= idx <= len(self.tasklist.tasks) - 1 for idx in indices):
             raise ValueError("Line number out of range")
 
-        task = self.tasklist.tasks.pop(idx)
+        completion_date = get_current_date()
+        tasks = [self.tasklist.tasks[idx] for idx in indices]
+        done_lines = [str(DoneTask(task, completion_date)) for task in tasks]
 
-        with open(self.done_path, mode="a") as file:
-            done_task = "x "
-            done_task += task.priority + " "
-            done_task += task.creation_date + " "
-            done_task += get_current_date() + " "
-            if task.tag.tag is not None:
-              done_task += task.tag.tag + " "
-            done_task += task.text + "\n"
-            file.write(done_task)
+        if self.config.durability == "always":
+            # Saving sorts the list, so tasks are found again by value
+            for task, done_line in zip(tasks, done_lines):
+                self.tasklist.tasks.remove(task)
+                self.save_done([done_line])
+        else:
+            for idx in reversed(indices):
+                self.tasklist.tasks.pop(idx)
+            self.save_done(done_lines)
 
-        self.tasklist.sort()
-        self.tasklist.save(self.todo_path)
+        group = str(time.time_ns()) if len(tasks) > 1 else None
+        self.undo_log.record_group([Operation("do", str(task), None, done_line, group)
+                                    for task, done_line in zip(tasks, done_lines)])
+        self.undo_log.save()
+
+    def save_done(self, done_lines: list[str]) -> None:
+        """Save the task list and append done_lines to done.txt, as one commit."""
+        commit_done(self.intent_path, self.done_path, done_lines, self.storage,
+                    self.save, self.config.durability)
+
+    def match(self, query: str) -> str:
+        """Return the line number of the one task fuzzily matching query.
+
+        If several tasks match about equally well they are displayed, and
+        nothing is chosen.
+        """
+        from fuzzy import TrigramIndex
+        candidates = TrigramIndex.build(self.tasklist).candidates(query)
+        if not candidates:
+            raise ValueError("No task matches.")
+        if len(candidates) > 1:
+            for match in candidates:
+                print(f"{match.index + 1} {match.task}")
+            raise ValueError("Ambiguous match; use a line number.")
+        return str(candidates[0].index + 1)
+
+    def find(self, query: str) -> None:
+        """Display the tasks best matching query, best first."""
+        from fuzzy import TrigramIndex
+        for match in TrigramIndex.build(self.tasklist).search(query):
+            print(f"{match.index + 1} {match.task}")
 
     def remove_task(self, line_number: str) -> None:
         """Remove a task."""
+        from undo import Operation
         idx = int(line_number) - 1
 
         if not 0 <= idx <= len(self.tasklist.tasks) - 1:
             raise ValueError("Line number out of range")
 
-        self.tasklist.tasks.pop(idx)
+        task = self.tasklist.tasks.pop(idx)
+
+        self.save()
+        self.record(Operation("rm", str(task), None))
+
+    def bulk_edit(self, kind: str, edit: Callable[[Task], Optional[str]],
+                  dry_run: bool = False) -> None:
+        """Apply edit to every task in one pass, then save once.
+
+        edit returns the new line for a task, or None to leave it alone.
+        New lines are parsed like todo.txt lines, and nothing is changed if
+        any of them is invalid. With dry_run, only the diff is displayed.
+        """
+        from undo import Operation
+        changes = []  # (index, old line, new task)
+        for i, task in enumerate(self.tasklist.tasks):
+            line = edit(task)
+            if line is None or line == str(task):
+                continue
+            try:
+                changes.append((i, str(task), Task.load(line)))
+            except ValueError as error:
+                raise ValueError(f"Line {i + 1} would become invalid: {error}") from error
+
+        if dry_run:
+            import difflib
+            lines = [str(task) for task in self.tasklist.tasks]
+            edited = lines.copy()
+            for i, _, new_task in changes:
+                edited[i] = str(new_task)
+            sys.stdout.writelines(line + "\n" for line in difflib.unified_diff(
+                lines, edited, self.todo_path, self.todo_path, n=0, lineterm=""))
+            return
+
+        for i, _, new_task in changes:
+            self.tasklist.tasks[i] = new_task
+        self.save()
+        group = str(time.time_ns())
+        self.undo_log.record_group([Operation(kind, old, str(new_task), None, group)
+                                    for _, old, new_task in changes])
+        self.undo_log.save()
+        print(f"Changed {len(changes)} tasks.")
+
+    def sed(self, expression: str, condition: Optional[str] = None,
+            dry_run: bool = False) -> None:
+        """Substitute a sed expression in every task matching a condition.
 
+        The condition is a basic regular expression searched for in the
+        task line; without it every task is edited.
+        """
+        regex, replacement, count = parse_substitution(expression)
+        selector = compile_basic_regex(condition) if condition else None
+
+        def edit(task):
+            line = str(task)
+            if selector is not None and not selector.search(line):
+                return None
+            return regex.sub(replacement, line, count)
+
+        self.bulk_edit("sed", edit, dry_run)
+
+    def pri_all(self, tag: str, priority: str, dry_run: bool = False) -> None:
+        """Re-prioritize every task with tag."""
+        def edit(task):
+            if task.tag.tag != tag:
+                return None
+            return str(Task(priority, task.creation_date, task.tag, task.text))
+
+        self.bulk_edit("pri-all", edit, dry_run)
+
+    def dedupe(self, merge: bool = False, done_days: Optional[int] = None) -> None:
+        """Display (or, with merge, remove) tasks with the same tag and text.
+
+        The first task of each group in list order is kept. If done_days is
+        given, open tasks matching a task completed in the last done_days
+        days are duplicates too.
+        """
+        from dedupe import duplicate_groups, task_hash
+        from undo import Operation
         self.tasklist.sort()
-        self.tasklist.save(self.todo_path)
+        tasks = self.tasklist.tasks
+        hashes = [task_hash(task) for task in tasks]
+        duplicates = [(indices[0], indices[1:]) for indices in duplicate_groups(hashes)]
+        for first, rest in duplicates:
+            for i in [first, *rest]:
+                print(f"{i + 1} {tasks[i]}")
+            print()
+
+        done_matches = []
+        if done_days is not None:
+            today = get_current_day()
+            done_list = DoneList.load(self.done_path, tolerant=True)
+            recent = {task_hash(done_task.task): done_task
+                      for done_task in done_list.between(today - done_days, today)}
+            done_matches = [i for i, task_digest in enumerate(hashes) if task_digest in recent]
+            for i in done_matches:
+                print(f"{i + 1} {tasks[i]}\n  done: {recent[hashes[i]]}")
+        if not duplicates and not done_matches:
+            print("No duplicates.")
+
+        if not merge:
+            return
+        removed = sorted({*done_matches, *(i for _, rest in duplicates for i in rest)})
+        group = str(time.time_ns())
+        operations = [Operation("dedupe", str(tasks[i]), None, None, group) for i in removed]
+        for i in reversed(removed):
+            tasks.pop(i)
+        self.save()
+        self.undo_log.record_group(operations)
+        self.undo_log.save()
+        print(f"Removed {len(removed)} duplicates.")
 
-    def list(self, verbose=False) -> None:
-        """Display tasklist."""
+    def migrate(self, kind: str) -> None:
+        """Copy the task list into the storage of the given kind."""
+        storage = open_storage(kind, self.todo_path)
+        storage.save(self.tasklist)
+        print(f"Copied {len(self.tasklist.tasks)} tasks to {storage.path}; "
+              f"set STORAGE {kind} in {self.config_path} to use it.")
+
+    def sql(self, condition: str) -> None:
+        """Display the tasks matching an SQL condition on the tasks table."""
+        if not isinstance(self.storage, SqliteStorage):
+            raise ValueError("SQL queries need STORAGE sqlite.")
+        for _, line_number, task in self.storage.rows(condition):
+            print(f"{line_number} {task}")
+
+    def query(self, text: str, explain: bool = False) -> None:
+        """Display the tasks matching a query, or how they would be found."""
+        from query import Query, plan
+        query = Query.parse(text)
         self.tasklist.sort()
+        plan_used, candidates = plan(query, self.tasklist, self.storage, self.due_index_path)
+        if explain:
+            print(f"{plan_used}; {len(candidates)} candidates")
+            return
+        for line_number, task in candidates:
+            if query.predicate(task):
+                print(f"{line_number} {task}")
+
+    def record(self, operation) -> None:
+        """Add an operation to the undo log."""
+        self.undo_log.record(operation)
+        self.undo_log.save()
+
+    def undo(self, count: int = 1) -> None:
+        """Undo the last count operations.
+
+        The tasks are saved before their records leave done.txt, so a crash
+        in between never loses a task.
+        """
+        done_lines = []
+        undone = 0
+        for _ in range(count):
+            operations = self.undo_log.undo_group()
+            if not operations:
+                break
+            undone += 1
+            for operation in operations:
+                self.apply(operation.after, operation.before)
+                if operation.done:
+                    done_lines.append(operation.done)
+        if not undone:
+            return
+        missing = commit_retract(self.intent_path, self.done_path, done_lines, self.storage,
+                                 self.save, self.config.durability)
+        for line in missing:
+            print(f"Not in {self.done_path}, it may be archived: {line}", file=sys.stderr)
+        self.undo_log.save()
+
+    def redo(self, count: int = 1) -> None:
+        """Redo the last count undone operations."""
+        done_lines = []
+        redone = 0
+        for _ in range(count):
+            operations = self.undo_log.redo_group()
+            if not operations:
+                break
+            redone += 1
+            for operation in operations:
+                self.apply(operation.before, operation.after)
+                if operation.done:
+                    done_lines.append(operation.done)
+        if not redone:
+            return
+        self.save_done(done_lines)
+        self.undo_log.save()
+
+    def apply(self, old: Optional[str], new: Optional[str]) -> None:
+        """Replace the task whose line is old with a task parsed from new."""
+        if old is not None:
+            lines = [str(task) for task in self.tasklist.tasks]
+            if old not in lines:
+                raise ValueError(f"Task no longer in list: {old}")
+            self.tasklist.tasks.pop(lines.index(old))
+        if new is not None:
+            self.tasklist.tasks.append(Task.load(new))
+
+    def render(self, verbose=False, since: Optional[int] = None,
+               until: Optional[int] = None) -> str:
+        """Return the tasklist as displayed by list.
+
+        If since or until are given, only tasks created between those day
+        numbers (inclusive) are shown; line numbers are left unchanged.
+        """
+        self.tasklist.sort()
+        lines = []
         for i, task in enumerate(self.tasklist.tasks):
 
+            if since is not None and task.created < since:
+                continue
+            if until is not None and task.created > until:
+                continue
+
             # Add line number
             line_number = str(i + 1).zfill(len(str(len(self.tasklist.tasks))))
             display_str = self.config.color_number
@@ -111,4 +419,91 @@ class TodoApp:
             display_str += task.text
             display_str += Colors.ENDC
 
-            print(display_str)
+            lines.append(display_str + "\n")
+        return "".join(lines)
+
+    def list(self, verbose=False, since: Optional[int] = None,
+             until: Optional[int] = None) -> None:
+        """Display tasklist, and cache the output for unchanged repeats."""
+        from cache import ListCache
+        output = self.render(verbose, since, until)
+        sys.stdout.write(output)
+        ListCache(ListCache.key_for(self.config_path, verbose, since, until),
+                  f"{self.storage.kind} {self.storage.path}",
+                  self.storage.signature(),
+                  output).save(ListCache.path_for(self.todo_path))
+
+    def watch(self, verbose=False, since: Optional[int] = None,
+              until: Optional[int] = None) -> None:
+        """Display tasklist until interrupted, redrawing it as it changes.
+
+        The config and task storage are reloaded only after one of their
+        files changed, and only rows that differ are written again.
+        """
+        import shutil
+        from watch import Screen, open_watcher
+
+        def watched_paths():
+            # SQLite writes go to the write-ahead log before the database
+            return [self.config_path, self.storage.path, self.storage.path + "-wal"]
+
+        screen = Screen(sys.stdout)
+        watcher = open_watcher(watched_paths())
+        try:
+            while True:
+                height = shutil.get_terminal_size().lines
+                screen.draw(self.render(verbose, since, until).splitlines()[:height - 1])
+                watcher.wait(watched_paths())
+                try:
+                    self.reload()
+                except ValueError:
+                    # Caught the file halfway through a write; the rest of
+                    # the write will trigger another reload
+                    pass
+        except KeyboardInterrupt:
+            pass
+        finally:
+            watcher.close()
+
+    def done(self, start: int, end: int) -> None:
+        """Display tasks completed between two day numbers, inclusive."""
+        from archive import DoneArchive
+        for done_task in DoneArchive(self.archive_path).between(start, end):
+            print(done_task)
+        from index import DoneRuns
+        runs = DoneRuns.for_done(self.done_path).ranges()
+        for done_task in DoneList.load_between(self.done_path, start, end, runs).tasks:
+            print(done_task)
+
+    def search_done(self, text: str) -> None:
+        """Display completed tasks, archived or not, that contain text."""
+        from archive import DoneArchive
+        for done_task in DoneArchive(self.archive_path).search(text):
+            print(done_task)
+        for done_task in DoneList.load(self.done_path, tolerant=True).tasks:
+            if text in str(done_task):
+                print(done_task)
+
+    def archive(self, before: int) -> None:
+        """Move tasks completed before a day number from done.txt to the archive."""
+        from archive import DoneArchive
+        done_list = DoneList.load(self.done_path)
+        old = [done for done in done_list.tasks if done.completed < before]
+        if not old:
+            return
+        DoneArchive(self.archive_path).append(old)
+
+        recent = [done for done in done_list.tasks if done.completed >= before]
+        tmp_path = self.done_path + ".tmp"
+        with open(tmp_path, mode="w") as file:
+            for done_task in recent:
+                file.write(f"{done_task}\n")
+        os.replace(tmp_path, self.done_path)
+
+    def stats(self) -> None:
+        """Display task counts; archived tasks are counted from the index alone."""
+        from archive import DoneArchive
+        archive = DoneArchive(self.archive_path)
+        print(f"open: {len(self.tasklist.tasks)}")
+        print(f"done: {len(DoneList.load(self.done_path, tolerant=True).tasks)}")
+        print(f"archived: {len(archive)} in {len(archive.blocks)} blocks")
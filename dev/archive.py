@@ -0,0 +1,98 @@
+"""Compressed archive of completed tasks for todotxtpy."""
+
+from __future__ import annotations
+import os
+import zlib
+from dataclasses import dataclass
+from typing import Iterator, Optional
+
+from constants import ARCHIVE_BLOCK_LINES
+from data import DoneTask
+
+
+@dataclass
+class Block:
+    """Location and summary of one compressed block of completed tasks."""
+    offset: int
+    length: int
+    lines: int
+    first: int  # earliest completion day in block
+    last: int  # latest completion day in block
+
+    def overlaps(self, start: Optional[int], end: Optional[int]) -> bool:
+        """Return whether any task in block may be completed in [start, end]."""
+        return ((start is None or self.last >= start)
+                and (end is None or self.first <= end))
+
+
+class DoneArchive:
+    """Completed tasks rolled out of done.txt into zlib-compressed blocks.
+
+    Blocks are appended to the archive file; a small text index next to it
+    records the offset, size, line count and completion date range of each
+    block, so queries only decompress the blocks they need.
+    """
+
+    def __init__(self, path: str) -> None:
+        """Open the archive at path, reading its index if it exists."""
+        self.path = path
+        self.index_path = path + ".idx"
+        self.blocks: list[Block] = []
+        if os.path.exists(self.index_path):
+            with open(self.index_path, mode="r") as file:
+                for line in file:
+                    self.blocks.append(Block(*map(int, line.split())))
+
+    def __len__(self) -> int:
+        return sum(block.lines for block in self.blocks)
+
+    def append(self, tasks: list[DoneTask]) -> None:
+        """Compress tasks into new blocks at the end of the archive."""
+        with open(self.path, mode="ab") as data, \
+                open(self.index_path, mode="a") as index:
+            for i in range(0, len(tasks), ARCHIVE_BLOCK_LINES):
+                chunk = tasks[i:i + ARCHIVE_BLOCK_LINES]
+                raw = "".join(f"{done}\n" for done in chunk).encode()
+                compressed = zlib.compress(raw, 9)
+                block = Block(data.tell(), len(compressed), len(chunk),
+                              min(done.completed for done in chunk),
+                              max(done.completed for done in chunk))
+                data.write(compressed)
+                # Data goes to disk before the index entry that points at it
+                data.flush()
+                os.fsync(data.fileno())
+                index.write(f"{block.offset} {block.length} {block.lines} "
+                            f"{block.first} {block.last}\n")
+                self.blocks.append(block)
+
+    def read_block(self, block: Block) -> list[DoneTask]:
+        """Decompress and parse a single block."""
+        with open(self.path, mode="rb") as file:
+            file.seek(block.offset)
+            raw = zlib.decompress(file.read(block.length)).decode()
+        return [DoneTask.load(line) for line in raw.splitlines()]
+
+    def last(self, count: int) -> list[DoneTask]:
+        """Return the last count archived tasks, decompressing blocks from the end."""
+        tasks = []
+        for block in reversed(self.blocks):
+            if len(tasks) >= count:
+                break
+            tasks = self.read_block(block) + tasks
+        return tasks[max(0, len(tasks) - count):] if count else []
+
+    def between(self, start: Optional[int], end: Optional[int]) -> Iterator[DoneTask]:
+        """Yield archived tasks completed between two day numbers, inclusive."""
+        for block in self.blocks:
+            if block.overlaps(start, end):
+                for done in self.read_block(block):
+                    if ((start is None or done.completed >= start)
+                            and (end is None or done.completed <= end)):
+                        yield done
+
+    def search(self, text: str, start: Optional[int] = None,
+               end: Optional[int] = None) -> Iterator[DoneTask]:
+        """Yield archived tasks containing text, optionally within a date range."""
+        for done in self.between(start, end):
+            if text in str(done):
+                yield done
@@ -0,0 +1,103 @@
+"""Caches derived from the task list for todotxtpy, and how to keep them current."""
+
+from __future__ import annotations
+import os
+import shutil
+from dataclasses import dataclass
+from typing import Optional
+
+from constants import LIST_CACHE_NAME
+from utils import file_signature
+
+
+def source_signature(source: str) -> str:
+    """Return the current signature of a "[storage kind] [path]" source."""
+    kind, path = source.split(" ", 1)
+    # TextStorage.signature is the file signature; checking it here keeps
+    # the storage backends (and sqlite3) out of a cached `t list`
+    if kind == "text":
+        return file_signature(path)
+    from storage import STORAGES
+    return STORAGES[kind](path).signature()
+
+
+def load_current(cls, path: str, config_path: str, todo_path: str):
+    """Load the cache of class cls at path, rebuilding it if it is out of date.
+
+    cls is DueIndex or CompletionCache. A cache is current if the config
+    and the task storage it was built from are both unchanged; otherwise
+    (or without a cache) it is rebuilt from the storage the config selects.
+    """
+    cache = cls.load(path)
+    try:
+        if (cache is not None and cache.config_signature == file_signature(config_path)
+                and source_signature(cache.source) == cache.signature):
+            return cache
+    except (FileNotFoundError, KeyError):
+        pass
+
+    from data import Config
+    from storage import open_storage
+    config = Config()
+    config.load(config_path)
+    storage = open_storage(config.storage, todo_path)
+    tasklist = storage.load()
+    tasklist.sort()
+    cache = cls.build(tasklist, storage, config_path)
+    cache.save(path)
+    return cache
+
+
+@dataclass
+class ListCache:
+    """Rendered output of one `t list`, and what it was rendered from.
+
+    The key covers the list options, the config file and the terminal
+    width; source and signature identify the task storage, as for DueIndex.
+    """
+    key: str
+    source: str  # "[storage kind] [path]"
+    signature: str
+    output: str
+
+    @staticmethod
+    def key_for(config_path: str, verbose=False, since: Optional[int] = None,
+                until: Optional[int] = None) -> str:
+        """Return the key of a listing with the given list options."""
+        width = shutil.get_terminal_size().columns
+        return f"{verbose} {since} {until} {width} {file_signature(config_path)}"
+
+    @staticmethod
+    def path_for(todo_path: str) -> str:
+        """Return the path of the cache in the todo directory of todo_path."""
+        return os.path.join(os.path.dirname(todo_path), LIST_CACHE_NAME)
+
+    @classmethod
+    def load(cls, path: str) -> Optional[ListCache]:
+        """Load the cache at path, or None if it is missing."""
+        try:
+            with open(path, mode="r") as file:
+                key = file.readline().rstrip("\n")
+                source = file.readline().rstrip("\n")
+                signature = file.readline().rstrip("\n")
+                return ListCache(key, source, signature, file.read())
+        except FileNotFoundError:
+            return None
+
+    @classmethod
+    def lookup(cls, todo_path: str, key: str) -> Optional[str]:
+        """Return the cached output for key, if the task storage is unchanged."""
+        cache = cls.load(cls.path_for(todo_path))
+        if cache is None or cache.key != key:
+            return None
+        try:
+            if source_signature(cache.source) != cache.signature:
+                return None
+        except (FileNotFoundError, KeyError):
+            return None
+        return cache.output
+
+    def save(self, path: str) -> None:
+        """Save cache to file specified by path."""
+        with open(path, mode="w") as file:
+            file.write(f"{self.key}\n{self.source}\n{self.signature}\n{self.output}")
@@ -0,0 +1,186 @@
+"""Shell completion for todotxtpy, answered from a small cache file.
+
+The cache holds the tags and priorities in use and a short description
+of each task by line number. It is rewritten whenever the app saves the
+task list, so completing a word reads one small file and stats the config
+and the task storage, without loading the config or parsing any task.
+"""
+
+from __future__ import annotations
+import os
+from dataclasses import dataclass
+from typing import Optional, Union
+
+from cache import load_current
+from utils import file_signature
+from constants import COMPLETE_CACHE_NAME, COMPLETE_TEXT_WIDTH
+
+# Completions of each argument of each command: "line", "priority" and
+# "tag" complete from the cache, tuples are literal choices
+COMMAND_ARGUMENTS: dict[str, list[Union[str, tuple[str, ...]]]] = {
+    "help": [],
+    "add": ["priority", "tag"],
+    "pri": ["line", "priority"],
+    "pri-all": ["tag", "priority"],
+    "do": ["line"],
+    "rm": ["line"],
+    "find": [],
+    "sed": [],
+    "list": [("verbose", "--since", "--until", "--watch")],
+    "done": [("--between", "--search", "--last", "--today")],
+    "archive": [("--older-than",)],
+    "stats": [],
+    "dedupe": [("--merge", "--done")],
+    "migrate": [("text", "sqlite", "binary")],
+    "query": [("--explain",)],
+    "sql": [],
+    "undo": [],
+    "redo": [],
+    "snapshot": [],
+    "snapshots": [],
+    "restore": [],
+    "sync": [],
+    "fsck": [("--quarantine",)],
+    "sort-file": [("--done",)],
+    "export": [("--format",), ("jsonl", "csv"), ("--done",)],
+    "import": [("--format",), ("jsonl", "csv"), ("--done",)],
+    "due": [("--within",)],
+    "overdue": [],
+    "completion": [("bash", "zsh")],
+}
+# Commands whose last kind of argument can be repeated
+REPEATED_ARGUMENTS = {"do", "list", "dedupe"}
+
+BASH_SCRIPT = """\
+_todotxt_complete() {
+    local IFS=$'\\n'
+    COMPREPLY=($(%(program)s complete "${COMP_WORDS[@]:1:COMP_CWORD}" 2>/dev/null | cut -f1))
+}
+complete -o default -o nosort -F _todotxt_complete t %(name)s
+"""
+
+ZSH_SCRIPT = """\
+#compdef t %(name)s
+_todotxt() {
+    local -a candidates
+    local line
+    for line in "${(@f)$(%(program)s complete "${(@)words[2,CURRENT]}" 2>/dev/null)}"; do
+        [[ -z $line ]] && continue
+        if [[ $line == *$'\\t'* ]]; then
+            candidates+=("${${line%%%%$'\\t'*}//:/\\\\:}:${line#*$'\\t'}")
+        else
+            candidates+=("${line//:/\\\\:}")
+        fi
+    done
+    if (( ${#candidates} )); then
+        _describe -V todotxt candidates
+    else
+        _files
+    fi
+}
+compdef _todotxt t %(name)s
+"""
+
+
+@dataclass
+class CompletionCache:
+    """What shell completion offers, and the task storage it was built from."""
+    source: str  # "[storage kind] [path]"
+    signature: str
+    config_signature: str  # of the config selecting the storage
+    tags: list[str]
+    priorities: list[str]  # letters
+    descriptions: list[str]  # of each task, by line number
+
+    @classmethod
+    def build(cls, tasklist, storage, config_path: str) -> CompletionCache:
+        """Summarize a sorted task list that has just been saved to storage."""
+        tags, priorities, descriptions = set(), set(), []
+        for task in tasklist.tasks:
+            tags.add(task.tag.tag)
+            priorities.add(task.priority[1])
+            words = [task.priority, task.tag.tag, task.text]
+            descriptions.append(" ".join(filter(None, words))[:COMPLETE_TEXT_WIDTH])
+        tags.discard(None)
+        return CompletionCache(f"{storage.kind} {storage.path}", storage.signature(),
+                               file_signature(config_path), sorted(tags),
+                               sorted(priorities), descriptions)
+
+    @staticmethod
+    def path_for(todo_path: str) -> str:
+        """Return the path of the cache in the todo directory of todo_path."""
+        return os.path.join(os.path.dirname(todo_path), COMPLETE_CACHE_NAME)
+
+    @classmethod
+    def load(cls, path: str) -> Optional[CompletionCache]:
+        """Load the cache at path, or None if it is missing."""
+        try:
+            with open(path, mode="r") as file:
+                source = file.readline().rstrip("\n")
+                signature = file.readline().rstrip("\n")
+                config_signature = file.readline().rstrip("\n")
+                tags = file.readline().split()
+                priorities = file.readline().split()
+                descriptions = file.read().splitlines()
+                return CompletionCache(source, signature, config_signature, tags,
+                                       priorities, descriptions)
+        except FileNotFoundError:
+            return None
+
+    @classmethod
+    def for_todo(cls, config_path: str, todo_path: str) -> CompletionCache:
+        """Return an up to date cache for the todo directory of todo_path."""
+        return load_current(cls, cls.path_for(todo_path), config_path, todo_path)
+
+    def save(self, path: str) -> None:
+        """Save cache to file specified by path."""
+        with open(path, mode="w") as file:
+            file.write(f"{self.source}\n{self.signature}\n{self.config_signature}\n"
+                       f"{' '.join(self.tags)}\n{' '.join(self.priorities)}\n")
+            file.writelines(f"{description}\n" for description in self.descriptions)
+
+    def candidates(self, kind: Union[str, tuple[str, ...]]) -> list[str]:
+        """Return the completions of one kind of argument, with descriptions."""
+        match kind:
+            case "line":
+                return [f"{i + 1}\t{description}"
+                        for i, description in enumerate(self.descriptions)]
+            case "priority":
+                return self.priorities
+            case "tag":
+                return self.tags
+            case _:
+                return list(kind)
+
+
+def complete_words(words: list[str], config_path: str, todo_path: str) -> list[str]:
+    """Return the completions of the last of words, the arguments of `t`.
+
+    Each completion is a word, optionally followed by a tab and a
+    description. The cache is only read when the word needs it.
+    """
+    *before, current = words or [""]
+    if not before:
+        candidates = list(COMMAND_ARGUMENTS)
+    else:
+        arguments = COMMAND_ARGUMENTS.get(before[0], [])
+        position = len(before) - 1
+        if before[0] in REPEATED_ARGUMENTS and arguments:
+            position = min(position, len(arguments) - 1)
+        if current.startswith("+"):
+            kind = "tag"
+        elif position < len(arguments):
+            kind = arguments[position]
+        else:
+            return []
+        if isinstance(kind, tuple):
+            candidates = list(kind)
+        else:
+            candidates = CompletionCache.for_todo(config_path, todo_path).candidates(kind)
+    return [candidate for candidate in candidates if candidate.startswith(current)]
+
+
+def completion_script(shell: str, program: str) -> str:
+    """Return the bash or zsh script that completes `t` through program."""
+    script = BASH_SCRIPT if shell == "bash" else ZSH_SCRIPT
+    return script % {"program": program, "name": os.path.basename(program)}
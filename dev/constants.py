@@ -9,6 +9,53 @@ CONFIG_PATH = os.path.join(TODO_DIRECTORY, "config")
 TODO_PATH = os.path.join(TODO_DIRECTORY, "todo.txt")
 DONE_PATH = os.path.join(TODO_DIRECTORY, "done.txt")
 
+# Derived files, kept next to todo.txt
+DUE_INDEX_NAME = "due.idx"
+ARCHIVE_NAME = "done.archive"
+UNDO_LOG_NAME = "undo.log"
+SNAPSHOT_DIRECTORY_NAME = "snapshots"
+SYNC_DIRECTORY_NAME = "sync"
+SQLITE_NAME = "todo.db"
+BINARY_NAME = "todo.bin"
+LIST_CACHE_NAME = "list.cache"
+DONE_INTENT_NAME = "done.intent"
+COMPLETE_CACHE_NAME = "complete.cache"
+DONE_RUNS_NAME = "done.runs"
+# Lines moved out of a file by `t fsck --quarantine` go to its name plus this
+REJECTS_SUFFIX = ".rejects"
+
+# Operations remembered by the undo log
+UNDO_LIMIT = 100
+
+# Record formats for export and import
+EXPORT_FORMATS = ["jsonl", "csv"]
+
+# Snapshot chunk boundaries fall after lines whose hash is divisible by
+# SNAPSHOT_CHUNK_DIVISOR, within these size limits (in bytes)
+SNAPSHOT_CHUNK_DIVISOR = 128
+SNAPSHOT_CHUNK_MIN = 2 * 1024
+SNAPSHOT_CHUNK_MAX = 64 * 1024
+
+# Completed tasks per compressed archive block
+ARCHIVE_BLOCK_LINES = 4096
+
+# External sorts hold this many bytes of lines in memory per sorted run,
+# and merge this many runs at once
+SORT_RUN_BYTES = 32 * 1024 * 1024
+SORT_MERGE_FAN_IN = 64
+
+# Fuzzy matches need this share of the query's trigrams; a runner-up
+# within the margin of the best match makes it ambiguous
+FUZZY_THRESHOLD = 0.5
+FUZZY_MARGIN = 0.1
+FUZZY_LIMIT = 10
+
+# Shell completion describes tasks by their first this many characters
+COMPLETE_TEXT_WIDTH = 40
+
+# done.txt is read backwards in blocks of this many bytes by `t done --last`
+TAIL_BLOCK_BYTES = 16 * 1024
+
 
 class Colors:
     """ANSI escape sequences for colors."""
@@ -50,3 +97,6 @@ class DefaultConfig:
     COLOR_TAG = Colors.LIGHT_BLUE
     COLOR_DATE = Colors.LIGHT_PURPLE
     COLOR_NUMBER = Colors.DARK_GREY
+
+    STORAGE = "text"
+    DURABILITY = "batch"
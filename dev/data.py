@@ -1,16 +1,23 @@
 """Data classes for todotxtpy."""
 
 from __future__ import annotations
-from dataclasses import dataclass
+import mmap
+import os
+import re
+from bisect import bisect_left, bisect_right
+from dataclasses import dataclass, field
 from functools import total_ordering
+from itertools import pairwise
 from typing import Optional
 
 from constants import DefaultConfig
 from utils import (
     color_to_color_code,
+    date_to_ordinal,
     is_valid_date,
     is_valid_priority,
     is_valid_tag,
+    read_lines_reversed,
 )
 
 # explicitly define Tags as a class for custom ordering
@@ -34,6 +41,20 @@ class Task:
     creation_date: str
     tag: Tag
     text: str
+    # creation date as a day number, for date arithmetic and range queries
+    created: int = field(init=False, compare=False, repr=False)
+    # due date as a day number, from a "due:yymmdd" word in the text; words
+    # with a malformed date are treated as ordinary text
+    due: Optional[int] = field(init=False, compare=False, repr=False)
+
+    def __post_init__(self) -> None:
+        self.created = date_to_ordinal(self.creation_date)
+        self.due = None
+        if "due:" in self.text:
+            for word in self.text.split():
+                if word.startswith("due:") and is_valid_date(word[4:]):
+                    self.due = date_to_ordinal(word[4:])
+                    break
 
     @classmethod
     def load(cls, line: str) -> Task:
@@ -41,6 +62,7 @@ class Task:
 
         Expected format is
         "[priority] [creation date%] [tag?] [text]"
+        where text may contain a "due:yymmdd" due date.
         """
         priority, creation_date, *rest = line.split()
 
@@ -67,19 +89,219 @@ class Task:
         return " ".join(elements)
 
 
+class LazyTask(Task):
+    """A Task whose text is decoded from the bytes of its line when first used.
+
+    Priority, creation date and tag are parsed up front; so is the day
+    number of the creation date. The due date, which comes from the text,
+    is found when first used too.
+    """
+
+    def __init__(self, priority: str, creation_date: str, created: int, tag: Tag,
+                 line: bytes, start: int, text: Optional[str] = None) -> None:
+        """Make a task whose text is line[start:], or text if already decoded.
+
+        created is the day number of creation_date.
+        """
+        # Task.__init__ would decode the text right away, to find the due date
+        self.priority = priority
+        self.creation_date = creation_date
+        self.tag = tag
+        self.created = created
+        self.line = line
+        self.start = start
+        self._text = text
+        self._due = ()
+
+    @property
+    def text(self) -> str:
+        if self._text is None:
+            self._text = self.line[self.start:].decode()
+        return self._text
+
+    @property
+    def due(self) -> Optional[int]:
+        if self._due == ():
+            self._due = Task(self.priority, self.creation_date, self.tag, self.text).due
+        return self._due
+
+    @property
+    def raw(self) -> bytes:
+        """The text as UTF-8, whose byte order is the order of the text."""
+        return self.line[self.start:] if self._text is None else self._text.encode()
+
+
+@dataclass
+class DoneTask:
+    """A completed task, as stored in done.txt."""
+    task: Task
+    completion_date: str
+    # completion date as a day number
+    completed: int = field(init=False, compare=False, repr=False)
+
+    def __post_init__(self) -> None:
+        self.completed = date_to_ordinal(self.completion_date)
+
+    @classmethod
+    def load(cls, line: str) -> DoneTask:
+        """Populate fields of a DoneTask from the text of a line.
+
+        Expected format is
+        "x [priority] [creation date] [completion date] [tag?] [text]"
+        """
+        mark, priority, creation_date, completion_date, *rest = line.split()
+
+        if mark != "x":
+            raise ValueError(f"Unrecognized completion mark {mark}.")
+        if not is_valid_date(completion_date):
+            raise ValueError(f"Unrecognized date {completion_date}.")
+
+        task = Task.load(" ".join([priority, creation_date, *rest]))
+        return DoneTask(task, completion_date)
+
+    def __str__(self) -> str:
+        elements = ["x", self.task.priority, self.task.creation_date,
+                    self.completion_date, self.task.text]
+        if self.task.tag.tag:
+            elements.insert(4, self.task.tag.tag)
+        return " ".join(elements)
+
+
+@dataclass
+class DoneList:
+    """List of completed tasks, in the order they appear in done.txt."""
+    tasks: list[DoneTask]
+
+    def __post_init__(self) -> None:
+        # done.txt is appended to in completion order, so it is made of a few
+        # long runs sorted by completion date (usually just one); remember
+        # where each run starts so that range queries can bisect them
+        self.completed = [done.completed for done in self.tasks]
+        self.runs = [0] + [i for i in range(1, len(self.completed))
+                           if self.completed[i] < self.completed[i - 1]]
+
+    @classmethod
+    def load(cls, path: str, tolerant: bool = False) -> DoneList:
+        """Load completed tasks from file; a missing file is empty.
+
+        With tolerant, invalid lines are skipped instead of raising ValueError.
+        """
+        if not os.path.exists(path):
+            return DoneList([])
+        tasks = []
+        with open(path, mode="r") as file:
+            for line in file:
+                if line == "\n":
+                    continue
+                try:
+                    tasks.append(DoneTask.load(line.rstrip()))
+                except ValueError:
+                    if not tolerant:
+                        raise
+        return DoneList(tasks)
+
+    @classmethod
+    def tail(cls, path: str, count: Optional[int] = None,
+             since: Optional[int] = None) -> DoneList:
+        """Load the last count tasks of done.txt, or those completed since a day.
+
+        The file is read backwards from its end, so the time taken depends
+        on the tasks returned, not on the size of done.txt. As done.txt is
+        appended to in completion order, reading stops at the first task
+        completed before since. Invalid lines are skipped.
+        """
+        if not os.path.exists(path):
+            return DoneList([])
+        tasks = []
+        for line in read_lines_reversed(path):
+            if count is not None and len(tasks) >= count:
+                break
+            if not line.strip():
+                continue
+            try:
+                done = DoneTask.load(line)
+            except ValueError:
+                continue
+            if since is not None and done.completed < since:
+                break
+            tasks.append(done)
+        tasks.reverse()
+        return DoneList(tasks)
+
+    @classmethod
+    def load_between(cls, path: str, start: int, end: int,
+                     runs: Optional[list[tuple[int, int]]] = None) -> DoneList:
+        """Load the tasks of done.txt completed between two day numbers, inclusive.
+
+        runs are the byte ranges of done.txt that are each in completion
+        order (see index.DoneRuns); without them the whole file is assumed
+        to be. Each run is bisected on completion date, and tasks are parsed
+        from the first one completed on start until one completed after end,
+        so the time taken depends on the tasks returned and the number of
+        runs, not on the size of done.txt. Invalid lines are skipped.
+        """
+        if not os.path.exists(path) or os.path.getsize(path) == 0:
+            return DoneList([])
+        tasks = []
+        with open(path, mode="rb") as file, \
+                mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            def first_task(position, run_end):
+                """Return the first valid task on a line of the run at or after position."""
+                if position > 0:
+                    position = data.find(b"\n", position - 1) + 1 or len(data)
+                while position < run_end:
+                    line_end = data.find(b"\n", position)
+                    line_end = len(data) if line_end == -1 else line_end
+                    try:
+                        return DoneTask.load(data[position:line_end].decode()), line_end + 1
+                    except ValueError:
+                        position = line_end + 1
+                return None, position
+
+            for run_start, run_end in runs or [(0, len(data))]:
+                run_end = min(run_end, len(data))
+                lo, hi = run_start, run_end
+                while lo < hi:
+                    mid = (lo + hi) // 2
+                    done, _ = first_task(mid, run_end)
+                    if done is None or done.completed >= start:
+                        hi = mid
+                    else:
+                        lo = mid + 1
+
+                done, position = first_task(lo, run_end)
+                while done is not None and done.completed <= end:
+                    tasks.append(done)
+                    done, position = first_task(position, run_end)
+        return DoneList(tasks)
+
+    def between(self, start: int, end: int) -> list[DoneTask]:
+        """Return tasks completed between two day numbers, inclusive."""
+        result = []
+        bounds = self.runs + [len(self.completed)]
+        for lo, hi in pairwise(bounds):
+            first = bisect_left(self.completed, start, lo, hi)
+            last = bisect_right(self.completed, end, first, hi)
+            result.extend(self.tasks[first:last])
+        return result
+
+
 @dataclass
 class TaskList:
     """List of tasks."""
     tasks: list[Task]
+    # lines a tolerant load could not parse; saved after the tasks, unchanged
+    invalid: list[str] = field(default_factory=list)
 
     @classmethod
-    def load(cls, path: str) -> TaskList:
-        """Append tasks from file to TaskList."""
+    def load(cls, path: str, tolerant: bool = False) -> TaskList:
+        """Append tasks from file to TaskList.
+
+        Invalid lines raise ValueError, or with tolerant are kept aside in
+        invalid.
+        """
         with open(path, mode="r") as file:
-            lines = file.readlines()
-            return TaskList([Task.load(line.rstrip())
-                             for line in lines
-                             if line != '\n'])
+            return TaskList(*parse_lines(file.readlines(), tolerant))
 
     def save(self, path: str) -> None:
         """Save TaskList to file specified by path.
@@ -89,6 +311,8 @@ class TaskList:
         with open(path, mode="w") as file:
             for task in self.tasks:
                 file.write(f"{str(task)}\n")
+            for line in self.invalid:
+                file.write(f"{line}\n")
 
     def sort(self) -> None:
         """Sort TaskList in order of priority, creation date, tag, text.
@@ -98,6 +322,90 @@ class TaskList:
         self.tasks.sort()
 
 
+@dataclass
+class LazyTaskList(TaskList):
+    """A TaskList of LazyTasks, for commands that mostly read the task list.
+
+    Only lines in the form TaskList.save writes them are left undecoded:
+    printable ASCII with single spaces, so that the raw bytes are the text.
+    Other lines are parsed with Task.load when the file is loaded.
+    """
+
+    # "(P) yymmdd", and what ends it
+    HEADER = re.compile(rb"\([A-Z]\) \d{6}(?: |\Z)")
+    # ASCII characters that str.split splits on, besides spaces
+    WHITESPACE = b"\t\n\x0b\x0c\r\x1c\x1d\x1e\x1f"
+
+    @classmethod
+    def load(cls, path: str, tolerant: bool = False) -> LazyTaskList:
+        """Read the task file at path, and parse the header of each line.
+
+        Invalid lines raise ValueError, or with tolerant are kept aside in
+        invalid.
+        """
+        with open(path, mode="rb") as file:
+            content = file.read()
+        tasks, invalid = [], []
+        # Headers and tags repeat across lines; decode each one once
+        headers, tags = {}, {None: None}
+        # Same line breaks as TaskList.load, which reads in text mode
+        for line in content.splitlines():
+            header = None
+            if (line.isascii() and b"  " not in line and not line.endswith(b" ")
+                    and len(line.translate(None, cls.WHITESPACE)) == len(line)):
+                header = headers.get(line[:11])
+                if header is None and cls.HEADER.match(line):
+                    creation_date = line[4:10].decode()
+                    header = headers[line[:11]] = (
+                        (line[:3].decode(), creation_date, date_to_ordinal(creation_date))
+                        if is_valid_date(creation_date) else False)
+            if header:
+                tag, start = None, min(11, len(line))
+                if line[11:12] == b"+":
+                    end = line.find(b" ", 11)
+                    end = len(line) if end == -1 else end
+                    tag, start = line[11:end], min(end + 1, len(line))
+                    if tag not in tags:
+                        tags[tag] = tag.decode()
+                tasks.append(LazyTask(*header, Tag(tags[tag]), line, start))
+            elif line:
+                line = line.decode()
+                try:
+                    task = Task.load(line.rstrip())
+                    tasks.append(LazyTask(task.priority, task.creation_date, task.created,
+                                          task.tag, b"", 0, task.text))
+                except ValueError:
+                    if not tolerant:
+                        raise
+                    invalid.append(line)
+        return LazyTaskList(tasks, invalid)
+
+    def sort(self) -> None:
+        """Sort as TaskList.sort does, comparing undecoded text as bytes."""
+        self.tasks.sort(key=lambda task: (
+            task.priority, task.creation_date, task.tag,
+            task.raw if isinstance(task, LazyTask) else task.text.encode()))
+
+
+def parse_lines(lines, tolerant: bool = False) -> tuple[list[Task], list[str]]:
+    """Parse task lines, skipping blank ones; return (tasks, invalid lines).
+
+    Without tolerant, the first invalid line raises ValueError instead.
+    """
+    tasks, invalid = [], []
+    for line in lines:
+        line = line.rstrip("\n")
+        if line == "":
+            continue
+        try:
+            tasks.append(Task.load(line.rstrip()))
+        except ValueError:
+            if not tolerant:
+                raise
+            invalid.append(line)
+    return tasks, invalid
+
+
 class Config:
     """User config."""
 
@@ -115,40 +423,50 @@ class Config:
         self.color_date = DefaultConfig.COLOR_DATE
         self.color_number = DefaultConfig.COLOR_NUMBER
 
+        self.storage = DefaultConfig.STORAGE
+        self.durability = DefaultConfig.DURABILITY
+
     def load(self, path: str) -> None:
         """Append tasks from file to TaskList."""
         with open(path, mode="r") as file:
             lines = file.readlines()
             for line in lines:
-                setting = line.rstrip().split()
-                match setting:
-                    case ["COLOR_PRIORITY_A", color]:
-                        self.color_priority_a = color_to_color_code(color)
-                    case ["COLOR_PRIORITY_B", color]:
-                        self.color_priority_b = color_to_color_code(color)
-                    case ["COLOR_PRIORITY_C", color]:
-                        self.color_priority_c = color_to_color_code(color)
-                    case ["COLOR_PRIORITY_D", color]:
-                        self.color_priority_d = color_to_color_code(color)
-                    case ["COLOR_PRIORITY_E", color]:
-                        self.color_priority_e = color_to_color_code(color)
-                    case ["COLOR_PRIORITY_REST", color]:
-                        self.color_priority_rest = color_to_color_code(color)
-                    case ["COLOR_TAG", color]:
-                        self.color_tag = color_to_color_code(color)
-                    case ["COLOR_DATE", color]:
-                        self.color_date = color_to_color_code(color)
-                    case ["COLOR_NUMBER", color]:
-                        self.color_number = color_to_color_code(color)
-                    case ["#", *_]:
-                        # Comment
-                        pass
-                    case []:
-                        # Whitespace
-                        pass
-                    case _:
-                        print(setting)
-                        raise ValueError("Setting not recognized")
+                self.set(line)
+
+    def set(self, line: str) -> None:
+        """Apply one line of a config document."""
+        setting = line.rstrip().split()
+        match setting:
+            case ["COLOR_PRIORITY_A", color]:
+                self.color_priority_a = color_to_color_code(color)
+            case ["COLOR_PRIORITY_B", color]:
+                self.color_priority_b = color_to_color_code(color)
+            case ["COLOR_PRIORITY_C", color]:
+                self.color_priority_c = color_to_color_code(color)
+            case ["COLOR_PRIORITY_D", color]:
+                self.color_priority_d = color_to_color_code(color)
+            case ["COLOR_PRIORITY_E", color]:
+                self.color_priority_e = color_to_color_code(color)
+            case ["COLOR_PRIORITY_REST", color]:
+                self.color_priority_rest = color_to_color_code(color)
+            case ["COLOR_TAG", color]:
+                self.color_tag = color_to_color_code(color)
+            case ["COLOR_DATE", color]:
+                self.color_date = color_to_color_code(color)
+            case ["COLOR_NUMBER", color]:
+                self.color_number = color_to_color_code(color)
+            case ["STORAGE", ("text" | "sqlite" | "binary") as storage]:
+                self.storage = storage
+            case ["DURABILITY", ("none" | "batch" | "always") as durability]:
+                self.durability = durability
+            case ["#", *_]:
+                # Comment
+                pass
+            case []:
+                # Whitespace
+                pass
+            case _:
+                raise ValueError(f"Setting not recognized: {line.strip()}")
 
     def priority_to_color_code(self, priority : str) -> str:
         """Return color code corresponding to a certain priority."""
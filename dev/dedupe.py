@@ -0,0 +1,24 @@
+"""Duplicate task detection for todotxtpy."""
+
+import hashlib
+from collections import defaultdict
+
+from data import Task
+
+
+def task_hash(task: Task) -> bytes:
+    """Return a short hash of a task's tag and text.
+
+    Case and spacing are normalized, and priority and dates are left out,
+    so tasks added again on a later day hash the same.
+    """
+    key = f"{task.tag.tag or ''}\t{' '.join(task.text.casefold().split())}"
+    return hashlib.blake2b(key.encode(), digest_size=8).digest()
+
+
+def duplicate_groups(hashes: list[bytes]) -> list[list[int]]:
+    """Return the indices sharing each hash that occurs more than once."""
+    groups = defaultdict(list)
+    for i, task_digest in enumerate(hashes):
+        groups[task_digest].append(i)
+    return [indices for indices in groups.values() if len(indices) > 1]
@@ -0,0 +1,223 @@
+"""Crash-safe completion of tasks for todotxtpy.
+
+Completing tasks changes two files: the task storage loses the tasks, and
+done.txt gains their records. Unless DURABILITY is none, both are done as
+one transaction:
+
+1. An intent file records where done.txt ends, the records to append and
+   the signature of the storage, and is synced to disk.
+2. The storage is saved (todo.txt through a synced temporary file).
+3. The records are appended to done.txt in a single write, and synced.
+4. The intent file is removed.
+
+If an intent file is found, the transaction was interrupted. A storage
+signature that still matches means step 2 never happened, and nothing
+changed; otherwise the records are written to done.txt unless they are
+already there. Either way no completed task is lost or recorded twice.
+
+Undoing a completion runs the same steps the other way round: the tasks
+are saved back to the storage first, and only then are their records
+removed from done.txt, in one truncation or atomic rewrite. An interrupted
+undo finishes the removal if done.txt still has its size from step 1.
+"""
+
+from __future__ import annotations
+import os
+import sys
+from dataclasses import dataclass
+from typing import Callable, Optional
+
+
+def fsync_directory(path: str) -> None:
+    """Sync the directory holding path, so that renames in it are on disk."""
+    descriptor = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    try:
+        os.fsync(descriptor)
+    finally:
+        os.close(descriptor)
+
+
+def append_records(path: str, records: list[str], sync: bool = False) -> None:
+    """Append records to path, one per line, in a single O_APPEND write."""
+    data = "".join(f"{record}\n" for record in records).encode()
+    descriptor = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        written = os.write(descriptor, data)
+        # Regular files only take less on errors such as a full disk
+        while written < len(data):
+            written += os.write(descriptor, data[written:])
+        if sync:
+            os.fsync(descriptor)
+    finally:
+        os.close(descriptor)
+
+
+def remove_records(path: str, records: list[str], sync: bool = False) -> list[str]:
+    """Remove the last occurrence of each record from path.
+
+    When the records are the last lines of the file, as after the latest
+    t do, it is truncated; otherwise it is rewritten through a temporary
+    file. Returns the records that were not found, say because they were
+    archived.
+    """
+    data = [f"{record}\n".encode() for record in records]
+    with open(path, mode="rb+") as file:
+        size = file.seek(0, os.SEEK_END)
+        length = sum(len(line) for line in data)
+        if length <= size:
+            file.seek(size - length - 1 if length < size else 0)
+            tail = file.read()
+            start = len(tail) - length
+            if (start == 0 or tail[start - 1:start] == b"\n") and \
+                    sorted(tail[start:].splitlines(keepends=True)) == sorted(data):
+                file.truncate(size - length)
+                if sync:
+                    os.fsync(file.fileno())
+                return []
+        file.seek(0)
+        lines = file.read().splitlines(keepends=True)
+
+    missing = []
+    for record, line in zip(records, data):
+        index = next((i for i in range(len(lines) - 1, -1, -1) if lines[i] == line), None)
+        if index is None:
+            missing.append(record)
+        else:
+            del lines[index]
+    if len(missing) < len(records):
+        with open(path + ".tmp", mode="wb") as file:
+            file.writelines(lines)
+            if sync:
+                file.flush()
+                os.fsync(file.fileno())
+        os.replace(path + ".tmp", path)
+        if sync:
+            fsync_directory(path)
+    return missing
+
+
+@dataclass
+class Intent:
+    """Records about to be appended to done.txt at offset.
+
+    With retract, the records are about to be removed from done.txt instead,
+    and offset is its size before.
+    """
+    offset: int
+    signature: str  # of the task storage before it was saved
+    records: list[str]
+    retract: bool = False
+
+    @classmethod
+    def load(cls, path: str) -> Optional[Intent]:
+        """Load the intent file at path, if there is one."""
+        if not os.path.exists(path):
+            return None
+        with open(path, mode="r") as file:
+            offset, signature = file.readline().rstrip("\n").split(" ", 1)
+            retract = offset == "retract"
+            if retract:
+                offset, signature = signature.split(" ", 1)
+            return Intent(int(offset), signature, [line.rstrip("\n") for line in file], retract)
+
+    def save(self, path: str) -> None:
+        """Write the intent file and sync it, replacing it atomically."""
+        with open(path + ".tmp", mode="w") as file:
+            file.write(f"{'retract ' if self.retract else ''}{self.offset} {self.signature}\n")
+            file.writelines(f"{record}\n" for record in self.records)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(path + ".tmp", path)
+        fsync_directory(path)
+
+    def finish(self, done_path: str) -> None:
+        """Make sure done.txt holds the records at offset."""
+        if self.retract:
+            # Removing records always shrinks done.txt, in a single step
+            if os.path.exists(done_path) and os.path.getsize(done_path) == self.offset:
+                remove_records(done_path, self.records, sync=True)
+            return
+        data = "".join(f"{record}\n" for record in self.records).encode()
+        with open(done_path, mode="ab+") as file:
+            size = file.seek(0, os.SEEK_END)
+            file.seek(self.offset)
+            if file.read(len(data)) == data:
+                return
+            if size <= self.offset + len(data):
+                # Only a partial write of the records follows the offset
+                file.truncate(min(size, self.offset))
+        append_records(done_path, self.records, sync=True)
+
+
+def commit_done(intent_path: str, done_path: str, records: list[str], storage,
+                save: Callable[[], None], durability: str) -> None:
+    """Save the task storage with save, then append records to done.txt.
+
+    With durability none, nothing is synced and no intent file is written.
+    """
+    if durability == "none" or not records:
+        save()
+        if records:
+            append_records(done_path, records)
+        return
+
+    offset = os.path.getsize(done_path) if os.path.exists(done_path) else 0
+    Intent(offset, storage.signature(), records).save(intent_path)
+    save()
+    append_records(done_path, records, sync=True)
+    os.remove(intent_path)
+
+
+def commit_retract(intent_path: str, done_path: str, records: list[str], storage,
+                   save: Callable[[], None], durability: str) -> list[str]:
+    """Save the task storage with save, then remove records from done.txt.
+
+    Returns the records that were not in done.txt. With durability none,
+    nothing is synced and no intent file is written.
+    """
+    if not records or not os.path.exists(done_path):
+        save()
+        return records
+    if durability == "none":
+        save()
+        return remove_records(done_path, records)
+
+    Intent(os.path.getsize(done_path), storage.signature(), records, retract=True).save(intent_path)
+    save()
+    missing = remove_records(done_path, records, sync=True)
+    os.remove(intent_path)
+    return missing
+
+
+def recover_done(intent_path: str, done_path: str, storage) -> Optional[bool]:
+    """Finish or drop an interrupted commit_done or commit_retract.
+
+    Returns None if there was nothing to recover, True if the change to
+    done.txt was finished and False if the storage was never saved, so it
+    was dropped.
+    """
+    intent = Intent.load(intent_path)
+    if intent is None:
+        return None
+    saved = storage.signature() != intent.signature
+    if saved:
+        intent.finish(done_path)
+    os.remove(intent_path)
+    return saved
+
+
+def recover_and_report(intent_path: str, done_path: str, storage) -> None:
+    """Run recover_done, and tell the user on stderr what it did."""
+    intent = Intent.load(intent_path)
+    retract = intent is not None and intent.retract
+    match recover_done(intent_path, done_path, storage):
+        case True if retract:
+            print("Finished undoing tasks interrupted by a crash.", file=sys.stderr)
+        case True:
+            print("Finished completing tasks interrupted by a crash.", file=sys.stderr)
+        case False if retract:
+            print("Tasks whose undo was interrupted by a crash are still done.",
+                  file=sys.stderr)
+        case False:
+            print("Tasks whose completion was interrupted by a crash are still open.",
+                  file=sys.stderr)
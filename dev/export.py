@@ -0,0 +1,123 @@
+"""Streaming JSON Lines and CSV export and import for todotxtpy."""
+
+import csv
+import json
+import os
+from itertools import chain
+from typing import Iterable, Iterator, Optional, TextIO
+
+from archive import DoneArchive
+from data import DoneTask, Task
+
+FIELDS = ["priority", "creation_date", "completion_date", "tag", "text"]
+
+
+def task_to_record(task: Task, completion_date: Optional[str] = None) -> dict:
+    """Convert a task to a flat record."""
+    return {
+        "priority": task.priority[1],
+        "creation_date": task.creation_date,
+        "completion_date": completion_date,
+        "tag": task.tag.tag,
+        "text": task.text,
+    }
+
+
+def record_to_line(record: dict, done: bool) -> str:
+    """Convert a record back to a validated todo.txt or done.txt line."""
+    elements = [f"({record['priority']})", record["creation_date"]]
+    if done:
+        elements = ["x", *elements, record["completion_date"] or ""]
+    if record.get("tag"):
+        elements.append(record["tag"])
+    elements.append(record.get("text") or "")
+    line = " ".join(elements)
+    return str(DoneTask.load(line) if done else Task.load(line))
+
+
+def read_records(lines: Iterable[str], done: bool) -> Iterator[dict]:
+    """Parse lines of todo.txt or done.txt into records, one at a time."""
+    for line in lines:
+        if line == "\n":
+            continue
+        if done:
+            done_task = DoneTask.load(line.rstrip())
+            yield task_to_record(done_task.task, done_task.completion_date)
+        else:
+            yield task_to_record(Task.load(line.rstrip()))
+
+
+def write_records(records: Iterable[dict], out: TextIO, fmt: str) -> None:
+    """Write records to out in the given format."""
+    match fmt:
+        case "jsonl":
+            for record in records:
+                out.write(json.dumps(record) + "\n")
+        case "csv":
+            writer = csv.DictWriter(out, FIELDS)
+            writer.writeheader()
+            for record in records:
+                writer.writerow(record)
+        case _:
+            raise ValueError(f"Unrecognized format {fmt}.")
+
+
+def parse_records(file: TextIO, fmt: str) -> Iterator[dict]:
+    """Read records from file in the given format, one at a time."""
+    match fmt:
+        case "jsonl":
+            for line in file:
+                if line.strip():
+                    yield json.loads(line)
+        case "csv":
+            yield from csv.DictReader(file)
+        case _:
+            raise ValueError(f"Unrecognized format {fmt}.")
+
+
+def export_tasks(out: TextIO, path: str, fmt: str, done: bool = False,
+                 archive_path: Optional[str] = None) -> None:
+    """Stream the tasks in path (and, for done tasks, the archive) to out."""
+    with open(path, mode="r") as file:
+        records = read_records(file, done)
+        if done and archive_path is not None and os.path.exists(archive_path):
+            archived = (task_to_record(done_task.task, done_task.completion_date)
+                        for done_task in DoneArchive(archive_path).between(None, None))
+            records = chain(archived, records)
+        write_records(records, out, fmt)
+
+
+def import_tasks(file: TextIO, path: str, fmt: str, done: bool = False) -> int:
+    """Append the records read from file to path; return how many there were."""
+    count = 0
+    with open(path, mode="a") as out:
+        for count, record in enumerate(parse_records(file, fmt), start=1):
+            out.write(f"{record_to_line(record, done)}\n")
+    return count
+
+
+def export_storage(out: TextIO, storage, fmt: str) -> None:
+    """Stream the open tasks of a task storage to out.
+
+    todo.txt is read a line at a time; other storages are loaded whole.
+    """
+    if storage.kind == "text":
+        export_tasks(out, storage.path, fmt)
+        return
+    write_records((task_to_record(task) for task in storage.load().tasks), out, fmt)
+
+
+def import_storage(file: TextIO, storage, fmt: str) -> int:
+    """Add the records read from file to a task storage; return how many there were.
+
+    Records are appended to todo.txt; other storages are loaded, added to
+    and saved.
+    """
+    if storage.kind == "text":
+        return import_tasks(file, storage.path, fmt)
+    tasklist = storage.load()
+    lines = [record_to_line(record, False) for record in parse_records(file, fmt)]
+    tasklist.tasks.extend(Task.load(line) for line in lines)
+    tasklist.sort()
+    storage.save(tasklist)
+    return len(lines)
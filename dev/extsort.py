@@ -0,0 +1,87 @@
+"""External merge sort of task files, for files larger than memory."""
+
+import heapq
+import os
+import tempfile
+from typing import Callable, Iterator
+
+from constants import SORT_MERGE_FAN_IN, SORT_RUN_BYTES
+from data import DoneTask, Task
+
+
+def task_key(task: Task) -> Task:
+    """Sort key of todo.txt lines: TaskList.sort order."""
+    return task
+
+
+def done_key(done_task: DoneTask) -> tuple:
+    """Sort key of done.txt lines: completion date, then the task."""
+    return (done_task.completed, done_task.task)
+
+
+def read_run(path: str, load: Callable) -> Iterator:
+    """Parse the lines of a file one at a time, skipping blank lines."""
+    with open(path, mode="r") as file:
+        for line in file:
+            if line != "\n":
+                yield load(line.rstrip())
+
+
+def write_run(path: str, items) -> None:
+    """Write items to a file, one per line."""
+    with open(path, mode="w") as file:
+        file.writelines(f"{item}\n" for item in items)
+
+
+def split_runs(path: str, directory: str, load: Callable, key: Callable,
+               run_bytes: int) -> list[str]:
+    """Write sorted runs of about run_bytes of path each into directory."""
+    runs = []
+    with open(path, mode="r") as file:
+        while True:
+            # readlines stops after the line that passes the hint
+            lines = file.readlines(run_bytes)
+            if not lines:
+                break
+            items = sorted((load(line.rstrip()) for line in lines if line != "\n"), key=key)
+            run = os.path.join(directory, f"run{len(runs)}")
+            write_run(run, items)
+            runs.append(run)
+    return runs
+
+
+def merge_runs(runs: list[str], target: str, load: Callable, key: Callable) -> None:
+    """K-way merge sorted runs into target; equal items keep run order."""
+    write_run(target, heapq.merge(*(read_run(run, load) for run in runs), key=key))
+
+
+def sort_file(path: str, done: bool = False, run_bytes: int = SORT_RUN_BYTES,
+              fan_in: int = SORT_MERGE_FAN_IN) -> int:
+    """Sort a todo.txt (or, with done, done.txt) file in place; return the run count.
+
+    At most run_bytes of lines are held in memory at once, and at most
+    fan_in runs are merged at once, over several passes if needed. The
+    sort is stable, and the file is replaced only once it is complete.
+    """
+    load, key = (DoneTask.load, done_key) if done else (Task.load, task_key)
+    directory = os.path.dirname(os.path.abspath(path))
+    with tempfile.TemporaryDirectory(dir=directory) as work:
+        runs = split_runs(path, work, load, key, run_bytes)
+        run_count = len(runs)
+        merged = 0
+        while len(runs) > fan_in:
+            next_runs = []
+            for start in range(0, len(runs), fan_in):
+                group = runs[start:start + fan_in]
+                target = os.path.join(work, f"merge{merged}")
+                merged += 1
+                merge_runs(group, target, load, key)
+                for run in group:
+                    os.remove(run)
+                next_runs.append(target)
+            runs = next_runs
+
+        target = os.path.join(work, "sorted")
+        merge_runs(runs, target, load, key)
+        os.replace(target, path)
+    return run_count
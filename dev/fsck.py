@@ -0,0 +1,73 @@
+"""Integrity check of the todo files for todotxtpy."""
+
+import os
+from dataclasses import dataclass
+from typing import Callable
+
+from constants import REJECTS_SUFFIX
+from data import Config, DoneTask, Task
+
+
+@dataclass
+class Problem:
+    """A line of a file that does not parse."""
+    path: str
+    line_number: int
+    offset: int  # byte offset of the start of the line
+    line: str
+    message: str
+
+    def __str__(self) -> str:
+        return (f"{self.path}:{self.line_number} (byte {self.offset}): "
+                f"{self.message}: {self.line}")
+
+
+def check_file(path: str, parse: Callable[[str], object],
+               quarantine: bool = False) -> list[Problem]:
+    """Return the problems of each line of path, reading it once.
+
+    Blank lines are fine. With quarantine, lines with problems are moved
+    to path + REJECTS_SUFFIX, and path keeps the rest.
+    """
+    problems = []
+    rejected = []
+    offset = 0
+    tmp_path = path + ".tmp"
+    with open(path, mode="rb") as file, \
+            open(tmp_path if quarantine else os.devnull, mode="wb") as kept:
+        for line_number, raw in enumerate(file, 1):
+            message = None
+            try:
+                line = raw.decode().rstrip("\r\n")
+                if line.strip():
+                    parse(line)
+            except UnicodeDecodeError:
+                line, message = raw.decode(errors="replace").rstrip("\r\n"), "Not UTF-8"
+            except ValueError as error:
+                message = str(error) or "Unrecognized format"
+            if message is None:
+                kept.write(raw)
+            else:
+                problems.append(Problem(path, line_number, offset, line, message))
+                rejected.append(raw if raw.endswith(b"\n") else raw + b"\n")
+            offset += len(raw)
+
+    if quarantine and problems:
+        with open(path + REJECTS_SUFFIX, mode="ab") as rejects:
+            rejects.writelines(rejected)
+        os.replace(tmp_path, path)
+    elif quarantine:
+        os.remove(tmp_path)
+    return problems
+
+
+def fsck(config_path: str, todo_path: str, done_path: str,
+         quarantine: bool = False) -> list[Problem]:
+    """Check config, todo.txt and done.txt, skipping files that do not exist."""
+    problems = []
+    for path, parse in [(config_path, Config().set),
+                        (todo_path, Task.load),
+                        (done_path, DoneTask.load)]:
+        if os.path.exists(path):
+            problems.extend(check_file(path, parse, quarantine))
+    return problems
@@ -0,0 +1,92 @@
+"""Fuzzy matching of tasks by trigrams, for todotxtpy."""
+
+from __future__ import annotations
+from collections import Counter
+from dataclasses import dataclass, field
+
+from constants import FUZZY_LIMIT, FUZZY_MARGIN, FUZZY_THRESHOLD
+from data import Task, TaskList
+
+
+def trigrams(text: str) -> set[str]:
+    """Return the trigrams of the words of text, ignoring case.
+
+    Words are padded as "  word " so that matching word starts count extra;
+    no trigram spans two words.
+    """
+    return {padded[i:i + 3]
+            for word in text.lower().split()
+            for padded in [f"  {word} "]
+            for i in range(len(padded) - 2)}
+
+
+def task_words(task: Task) -> str:
+    """Return the part of a task that is matched against: tag and text."""
+    return task.text if task.tag.tag is None else f"{task.tag.tag} {task.text}"
+
+
+@dataclass
+class Match:
+    """A task matched by a query, with its position in the task list."""
+    index: int
+    containment: float  # share of the query's trigrams found in the task
+    similarity: float  # Jaccard similarity of both trigram sets
+    task: Task
+
+
+@dataclass
+class TrigramIndex:
+    """Task indices by trigram, over a parsed task list.
+
+    Posting lists are filled in as queries need them: a task has a trigram
+    exactly when its padded words contain it, which str's substring search
+    checks much faster than building every task's trigram set.
+    """
+    tasks: list[Task]
+    padded: list[str]  # "  word " for every word of each task, joined
+    postings: dict[str, list[int]] = field(default_factory=dict)
+
+    @classmethod
+    def build(cls, tasklist: TaskList) -> TrigramIndex:
+        """Index the tasks of tasklist, keeping their order."""
+        return TrigramIndex(tasklist.tasks,
+                            ["".join(f"  {word} " for word in task_words(task).lower().split())
+                             for task in tasklist.tasks])
+
+    def posting(self, trigram: str) -> list[int]:
+        """Return the indices of the tasks that have trigram."""
+        if trigram not in self.postings:
+            self.postings[trigram] = [i for i, words in enumerate(self.padded)
+                                      if trigram in words]
+        return self.postings[trigram]
+
+    def search(self, query: str, limit: int = FUZZY_LIMIT) -> list[Match]:
+        """Return up to limit tasks matching query, best first.
+
+        Tasks need at least FUZZY_THRESHOLD of the query's trigrams.
+        """
+        query_trigrams = trigrams(query)
+        if not query_trigrams:
+            return []
+        shared = Counter()
+        for trigram in query_trigrams:
+            shared.update(self.posting(trigram))
+
+        matches = []
+        for i, count in shared.items():
+            containment = count / len(query_trigrams)
+            if containment >= FUZZY_THRESHOLD:
+                size = len(trigrams(task_words(self.tasks[i])))
+                similarity = count / (len(query_trigrams) + size - count)
+                matches.append(Match(i, containment, similarity, self.tasks[i]))
+        matches.sort(key=lambda match: (-match.containment, -match.similarity, match.index))
+        return matches[:limit]
+
+    def candidates(self, query: str) -> list[Match]:
+        """Return the matches for query within FUZZY_MARGIN of the best one.
+
+        A single candidate is an unambiguous match.
+        """
+        matches = self.search(query)
+        return [match for match in matches
+                if matches[0].containment - match.containment < FUZZY_MARGIN]
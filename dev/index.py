@@ -0,0 +1,162 @@
+"""Persistent indexes over the task list for todotxtpy."""
+
+from __future__ import annotations
+import os
+from bisect import bisect_left, bisect_right
+from dataclasses import dataclass
+from typing import Optional
+
+from cache import load_current
+from constants import DONE_RUNS_NAME, DUE_INDEX_NAME
+from utils import date_to_ordinal, file_signature, is_valid_date
+
+
+@dataclass
+class DueIndex:
+    """Tasks with a due date, sorted by due date, then line number.
+
+    Saved next to todo.txt together with the storage it was built from and
+    that storage's signature, so that it can be answered without parsing the
+    task list.
+    """
+    source: str  # "[storage kind] [path]"
+    signature: str
+    config_signature: str  # of the config selecting the storage
+    entries: list[tuple[int, int, str]]  # (due day, line number, task)
+
+    @classmethod
+    def build(cls, tasklist, storage, config_path: str) -> DueIndex:
+        """Index a sorted task list that has just been saved to storage."""
+        entries = sorted((task.due, i + 1, str(task))
+                         for i, task in enumerate(tasklist.tasks)
+                         if task.due is not None)
+        return DueIndex(f"{storage.kind} {storage.path}", storage.signature(),
+                        file_signature(config_path), entries)
+
+    @classmethod
+    def load(cls, path: str) -> Optional[DueIndex]:
+        """Load the index at path, or None if it is missing."""
+        try:
+            with open(path, mode="r") as file:
+                source = file.readline().rstrip("\n")
+                signature = file.readline().rstrip("\n")
+                config_signature = file.readline().rstrip("\n")
+                entries = []
+                for line in file:
+                    due, line_number, task = line.rstrip("\n").split("\t", 2)
+                    entries.append((int(due), int(line_number), task))
+                return DueIndex(source, signature, config_signature, entries)
+        except FileNotFoundError:
+            return None
+
+    @classmethod
+    def for_todo(cls, config_path: str, todo_path: str) -> DueIndex:
+        """Return an up to date index for the todo directory of todo_path."""
+        return load_current(cls, os.path.join(os.path.dirname(todo_path), DUE_INDEX_NAME),
+                            config_path, todo_path)
+
+    def save(self, path: str) -> None:
+        """Save index to file specified by path."""
+        with open(path, mode="w") as file:
+            file.write(f"{self.source}\n{self.signature}\n{self.config_signature}\n")
+            for due, line_number, task in self.entries:
+                file.write(f"{due}\t{line_number}\t{task}\n")
+
+    def between(self, start: Optional[int], end: Optional[int]) -> list[tuple[int, int, str]]:
+        """Return entries due between two day numbers, inclusive."""
+        first = 0 if start is None else bisect_left(self.entries, (start,))
+        last = (len(self.entries) if end is None
+                else bisect_right(self.entries, (end + 1,), first))
+        return self.entries[first:last]
+
+
+@dataclass
+class DoneRuns:
+    """Byte offsets of done.txt where a run sorted by completion date starts.
+
+    `t do` appends in completion order, but `t sync`, `t import --done` and
+    `t redo` can append older tasks, starting a new run. Saved next to
+    done.txt with how far it was scanned and the bytes just before that
+    point, so that only what was appended since is scanned again; any other
+    rewrite of done.txt is scanned from the start.
+    """
+    inode: int
+    scanned: int  # bytes of done.txt scanned, up to the end of a line
+    tail: bytes  # the bytes before scanned, to notice rewrites
+    last: int  # completion day of the last task scanned, or 0
+    starts: list[int]  # first byte of each run; starts[0] is 0
+    size: int = 0  # of done.txt when last checked; not saved
+
+    @staticmethod
+    def path_for(done_path: str) -> str:
+        """Return the path of the runs file in the todo directory of done_path."""
+        return os.path.join(os.path.dirname(done_path), DONE_RUNS_NAME)
+
+    @classmethod
+    def load(cls, path: str) -> Optional[DoneRuns]:
+        """Load the runs at path, or None if they are missing."""
+        try:
+            with open(path, mode="r") as file:
+                inode, scanned, tail, last = file.readline().split()
+                starts = [int(start) for start in file.readline().split()]
+                return DoneRuns(int(inode), int(scanned),
+                                b"" if tail == "-" else bytes.fromhex(tail), int(last), starts)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def save(self, path: str) -> None:
+        """Save runs to file specified by path."""
+        with open(path + ".tmp", mode="w") as file:
+            file.write(f"{self.inode} {self.scanned} {self.tail.hex() or '-'} {self.last}\n"
+                       f"{' '.join(map(str, self.starts))}\n")
+        os.replace(path + ".tmp", path)
+
+    @classmethod
+    def for_done(cls, done_path: str) -> DoneRuns:
+        """Return up to date runs for done_path, scanning what is new in it."""
+        path = cls.path_for(done_path)
+        runs = cls.load(path)
+        if not os.path.exists(done_path):
+            return DoneRuns(0, 0, b"", 0, [0])
+        with open(done_path, mode="rb") as file:
+            stat = os.fstat(file.fileno())
+            if runs is None or runs.inode != stat.st_ino or runs.scanned > stat.st_size:
+                runs = DoneRuns(stat.st_ino, 0, b"", 0, [0])
+            else:
+                file.seek(runs.scanned - len(runs.tail))
+                if file.read(len(runs.tail)) != runs.tail:
+                    runs = DoneRuns(stat.st_ino, 0, b"", 0, [0])
+
+            runs.size = stat.st_size
+            file.seek(runs.scanned)
+            new = file.read(stat.st_size - runs.scanned)
+        complete = new.rfind(b"\n") + 1
+        if complete == 0:
+            return runs
+
+        offset = runs.scanned
+        for line in new[:complete].split(b"\n")[:-1]:
+            words = line.split(None, 4)
+            if len(words) >= 4 and words[0] == b"x":
+                completion_date = words[3].decode(errors="replace")
+                if is_valid_date(completion_date):
+                    day = date_to_ordinal(completion_date)
+                    if day < runs.last:
+                        runs.starts.append(offset)
+                    runs.last = day
+            offset += len(line) + 1
+        runs.scanned = offset
+        runs.tail = (runs.tail + new[:complete])[-64:]
+        runs.save(path)
+        return runs
+
+    def ranges(self) -> list[tuple[int, int]]:
+        """Return the byte range of each run.
+
+        Bytes after the last line scanned, if any, are a run of their own.
+        """
+        bounds = self.starts + [self.scanned]
+        ranges = [(start, end) for start, end in zip(bounds, bounds[1:]) if start < end]
+        if self.size > self.scanned:
+            ranges.append((self.scanned, self.size))
+        return ranges
@@ -2,28 +2,283 @@
 
 """The main function."""
 
+import os
 import sys
 
-from app import TodoApp
-from constants import CONFIG_PATH, DONE_PATH, TODO_PATH
-from utils import is_valid_line_number, is_valid_priority, is_valid_tag
+# Modules behind a single command are imported where they are used, so that
+# other commands do not pay for loading them
+from constants import (
+    ARCHIVE_NAME,
+    CONFIG_PATH,
+    DONE_INTENT_NAME,
+    DONE_PATH,
+    EXPORT_FORMATS,
+    REJECTS_SUFFIX,
+    SNAPSHOT_DIRECTORY_NAME,
+    SQLITE_NAME,
+    TODO_PATH,
+)
+from utils import (
+    date_to_ordinal,
+    get_current_day,
+    is_valid_line_number,
+    is_valid_priority,
+    is_valid_tag,
+    parse_days,
+)
+
+
+def parse_list_options(options):
+    """Parse the options of the list command into keyword arguments."""
+    kwargs = {}
+    while options:
+        match options:
+            case ["verbose", *options]:
+                kwargs["verbose"] = True
+            case ["--since", date, *options]:
+                kwargs["since"] = date_to_ordinal(date)
+            case ["--until", date, *options]:
+                kwargs["until"] = date_to_ordinal(date)
+            case _:
+                raise ValueError("Unrecognized list option.")
+    return kwargs
+
+
+def parse_add(app, raw_priority, text, unique=False):
+    """Parse the arguments of the add command and add the task."""
+    priority = "(" + raw_priority + ")"
+    if not is_valid_priority(priority):
+        raise ValueError("Unrecognized priority.")
+
+    from data import Tag
+    if is_valid_tag(text[0]):
+        tag = text.pop(0)
+        app.add(priority, Tag(tag), " ".join(text), unique)
+    else:
+        app.add(priority, Tag(None), " ".join(text), unique)
+
+
+def parse_dedupe_options(options):
+    """Parse the options of the dedupe command into keyword arguments."""
+    kwargs = {}
+    while options:
+        match options:
+            case ["--merge", *options]:
+                kwargs["merge"] = True
+            case ["--done", span, *options] if not span.startswith("--"):
+                kwargs["done_days"] = parse_days(span)
+            case ["--done", *options]:
+                kwargs["done_days"] = 30
+            case _:
+                raise ValueError("Unrecognized dedupe option.")
+    return kwargs
+
+
+def open_configured_storage(config_path, todo_path):
+    """Return the task storage selected by the config at config_path."""
+    from data import Config
+    from storage import open_storage
+    config = Config()
+    config.load(config_path)
+    return open_storage(config.storage, todo_path, sync=config.durability != "none")
+
+
+def print_help():
+    """Print the supported operations."""
+    print("Supported operations:\n"
+    + "t add [pri] [tag?] [text]: add task with [priority], possibly a [tag?], and [text]\n"
+    + "t add --unique [pri] [tag?] [text]: add task, unless one with the same tag and text is already listed\n"
+    + "t pri [line] [pri]: re-prioritize task on [line] to [priority]\n"
+    + "t pri-all [tag] [pri] [--dry-run]: re-prioritize every task with [tag] to [priority]\n"
+    + "t do [line] [line?...]: complete the tasks on the given lines\n"
+    + "t do ~[text]: complete the one task whose tag and text best match [text]; ambiguous matches are listed\n"
+    + "t find [~text]: list the tasks best matching [text], with line numbers\n"
+    + "t rm [line]: remove task on [line], without completing it\n"
+    + "t sed [s/pattern/replacement/flags] [condition?] [--dry-run]: substitute in every task (matching regex [condition?])\n"
+    + "t list: list all tasks, in order of priority, creation date, tag, text, with creation date hidden\n"
+    + "t list verbose: list all tasks, in order of priority, creation date, tag, text, with creation date included\n"
+    + "t list [--since date] [--until date]: list tasks created within a date range (dates are yymmdd)\n"
+    + "t list --watch [options]: keep the list on screen, redrawing it when todo.txt or config change\n"
+    + "t done --between [date] [date]: list tasks completed within a date range\n"
+    + "t done --search [text]: list completed tasks containing [text]\n"
+    + "t done --last [n]: list the last n completed tasks, reading done.txt from its end\n"
+    + "t done --today: list tasks completed today\n"
+    + "t archive [--older-than span]: compress tasks completed over 30 days (or span) ago out of done.txt\n"
+    + "t stats: count open, done and archived tasks\n"
+    + "t dedupe [--merge] [--done [span]]: list (or remove) tasks with the same tag and text, also against tasks done in the last 30 days (or span)\n"
+    + "t migrate [text|sqlite|binary]: copy tasks to todo.txt, the SQLite database todo.db or the binary todo.bin\n"
+    + "t query [--explain] [query]: list tasks matching a query such as 'pri <= C and tag = +work and text ~ deploy'\n"
+    + "t sql [condition]: list tasks matching an SQL condition (with STORAGE sqlite)\n"
+    + "t undo [n]: undo the last (n) add, pri, do, rm, sed or pri-all operations\n"
+    + "t redo [n]: redo the last (n) undone operations\n"
+    + "t snapshot: save a deduplicated snapshot of the tasks, done.txt and config\n"
+    + "t snapshots: list snapshot ids\n"
+    + "t restore [id]: restore the tasks, done.txt and config from snapshot [id]\n"
+    + "t sync [dir]: merge todo.txt and done.txt with the todo directory [dir] (STORAGE text only)\n"
+    + "t fsck [--quarantine]: report lines of config, todo.txt and done.txt that do not parse (or move them to .rejects files)\n"
+    + "t sort-file [path?] [--done]: sort todo.txt (or done.txt by completion date, or [path]) on disk, in bounded memory\n"
+    + "t export --format [jsonl|csv] [--done]: write open (or completed) tasks to stdout\n"
+    + "t import --format [jsonl|csv] [--done]: add open (or completed) tasks read from stdin\n"
+    + "t complete [words...]: print completions of the last of [words], for shell completion\n"
+    + "t completion [bash|zsh]: print a script that completes t in bash or zsh\n"
+    + "t due [--within span]: list tasks with a due:yymmdd date from today on, or within span (e.g. 7d, 2w)\n"
+    + "t overdue: list tasks whose due date has passed\n")
+
+
+def parse_fast_command(args, config_path, todo_path, done_path):
+    """Parse commands that are answered without loading the full app.
+
+    Returns whether the command was handled.
+    """
+    snapshot_path = os.path.join(os.path.dirname(todo_path), SNAPSHOT_DIRECTORY_NAME)
+    entries = []
+
+    match args:
+
+        case ["help"]:
+            print_help()
+
+        case ["due"]:
+            from index import DueIndex
+            entries = DueIndex.for_todo(config_path, todo_path).between(get_current_day(), None)
+
+        case ["due", "--within", span]:
+            from index import DueIndex
+            today = get_current_day()
+            entries = DueIndex.for_todo(config_path, todo_path).between(
+                today, today + parse_days(span))
+
+        case ["overdue"]:
+            from index import DueIndex
+            entries = DueIndex.for_todo(config_path, todo_path).between(None, get_current_day() - 1)
+
+        case ["snapshot"]:
+            from snapshot import SnapshotStore
+            storage = open_configured_storage(config_path, todo_path)
+            snapshot_id, new_chunks = SnapshotStore(snapshot_path).snapshot(
+                [*storage.snapshot_files(), done_path, config_path])
+            print(f"Snapshot {snapshot_id}: {new_chunks} new chunks")
+
+        case ["snapshots"]:
+            from snapshot import SnapshotStore
+            for snapshot_id in SnapshotStore(snapshot_path).ids():
+                print(snapshot_id)
+
+        case ["restore", snapshot_id] if snapshot_id.isdecimal():
+            from snapshot import SnapshotStore
+            directory = os.path.dirname(todo_path)
+            names = SnapshotStore(snapshot_path).restore(int(snapshot_id), directory)
+            if SQLITE_NAME in names:
+                from storage import SqliteStorage
+                SqliteStorage.discard_log(os.path.join(directory, SQLITE_NAME))
+            for name in names:
+                print(f"Restored {name}")
+
+        case ["sync", other_directory]:
+            from sync import sync
+            if open_configured_storage(config_path, todo_path).kind != "text":
+                raise ValueError("Sync only works with STORAGE text.")
+            result = sync(os.path.dirname(todo_path), other_directory,
+                          os.path.basename(todo_path), os.path.basename(done_path))
+            print(f"todo.txt: {result.todo_ours} lines changed here, "
+                  f"{result.todo_theirs} in {other_directory}")
+            print(f"done.txt: {result.done_ours} lines added here, "
+                  f"{result.done_theirs} in {other_directory}")
+
+        case ["list", *options] if "--watch" not in options:
+            from cache import ListCache
+            key = ListCache.key_for(config_path, **parse_list_options(options))
+            output = ListCache.lookup(todo_path, key)
+            if output is None:
+                return False
+            sys.stdout.write(output)
+
+        case ["complete", *words]:
+            from complete import complete_words
+            for candidate in complete_words(words, config_path, todo_path):
+                print(candidate)
+
+        case ["completion", ("bash" | "zsh") as shell]:
+            from complete import completion_script
+            sys.stdout.write(completion_script(shell, os.path.abspath(sys.argv[0])))
+
+        case ["done", "--last", count] if count.isdecimal():
+            from archive import DoneArchive
+            from data import DoneList
+            done_tasks = DoneList.tail(done_path, count=int(count)).tasks
+            if len(done_tasks) < int(count):
+                archive_path = os.path.join(os.path.dirname(done_path), ARCHIVE_NAME)
+                done_tasks = (DoneArchive(archive_path).last(int(count) - len(done_tasks))
+                              + done_tasks)
+            for done_task in done_tasks:
+                print(done_task)
+
+        case ["done", "--today"]:
+            from archive import DoneArchive
+            from data import DoneList
+            today = get_current_day()
+            archive_path = os.path.join(os.path.dirname(done_path), ARCHIVE_NAME)
+            for done_task in DoneArchive(archive_path).between(today, None):
+                print(done_task)
+            from index import DoneRuns
+            runs = DoneRuns.for_done(done_path).ranges()
+            for done_task in DoneList.load_between(done_path, today, today, runs).tasks:
+                print(done_task)
+
+        case ["fsck", *options] if options in ([], ["--quarantine"]):
+            from fsck import fsck
+            problems = fsck(config_path, todo_path, done_path, quarantine=bool(options))
+            for problem in problems:
+                print(problem)
+            if options and problems:
+                print(f"Moved {len(problems)} lines to files ending in {REJECTS_SUFFIX}")
+            elif problems:
+                sys.exit(1)
+
+        case ["sort-file", *options] if len(options) <= 2:
+            from extsort import sort_file
+            done = "--done" in options
+            paths = [option for option in options if option != "--done"]
+            if len(paths) > 1:
+                raise ValueError("Unrecognized sort-file options.")
+            path = paths[0] if paths else done_path if done else todo_path
+            runs = sort_file(path, done)
+            print(f"Sorted {path} ({runs} runs)")
+
+        case ["export", "--format", fmt] if fmt in EXPORT_FORMATS:
+            from export import export_storage
+            export_storage(sys.stdout, open_configured_storage(config_path, todo_path), fmt)
+
+        case ["export", "--format", fmt, "--done"] if fmt in EXPORT_FORMATS:
+            from export import export_tasks
+            archive_path = os.path.join(os.path.dirname(done_path), ARCHIVE_NAME)
+            export_tasks(sys.stdout, done_path, fmt, done=True, archive_path=archive_path)
+
+        case ["import", "--format", fmt] if fmt in EXPORT_FORMATS:
+            from export import import_storage
+            import_storage(sys.stdin, open_configured_storage(config_path, todo_path), fmt)
+
+        case ["import", "--format", fmt, "--done"] if fmt in EXPORT_FORMATS:
+            from export import import_tasks
+            import_tasks(sys.stdin, done_path, fmt, done=True)
+
+        case _:
+            return False
+
+    for _, line_number, task in entries:
+        print(f"{line_number} {task}")
+    return True
 
 
 def parse_command(args, app):
     """Parse command from command line."""
     match args:
 
-        case ["add", raw_priority, *text]:
+        case ["add", "--unique", raw_priority, *text]:
+            parse_add(app, raw_priority, text, unique=True)
 
-            priority = "(" + raw_priority + ")"
-            if not is_valid_priority(priority):
-                raise ValueError("Unrecognized priority.")
-
-            if is_valid_tag(text[0]):
-                tag = text.pop(0)
-                app.add(priority, tag, " ".join(text))
-            else:
-                app.add(priority, None, " ".join(text))
+        case ["add", raw_priority, *text]:
+            parse_add(app, raw_priority, text)
 
         case ["pri", line_number, raw_priority]:
 
@@ -36,12 +291,18 @@ def parse_command(args, app):
 
             app.pri(line_number, priority)
 
-        case ["do", line_number]:
+        case ["do", query, *text] if query.startswith("~"):
+            app.do_task(app.match(" ".join([query[1:], *text])))
 
-            if not is_valid_line_number(line_number):
+        case ["find", *text] if text:
+            app.find(" ".join(text).removeprefix("~"))
+
+        case ["do", *line_numbers] if line_numbers:
+
+            if not all(is_valid_line_number(line_number) for line_number in line_numbers):
                 raise ValueError("Unrecognized line number.")
 
-            app.do_task(line_number)
+            app.do_tasks(line_numbers)
 
         case ["rm", line_number]:
 
@@ -50,29 +311,93 @@ def parse_command(args, app):
 
             app.remove_task(line_number)
 
-        case ["list"]:
-            app.list()
+        case ["list", "--watch", *options]:
+            app.watch(**parse_list_options(options))
 
-        case ["list", "verbose"]:
-            app.list(verbose=True)
+        case ["list", *options]:
+            app.list(**parse_list_options(options))
 
-        case ["help"]:
-            print("Supported operations:\n"
-            + "t add [pri] [tag?] [text]: add task with [priority], possibly a [tag?], and [text]\n"
-            + "t pri [line] [pri]: re-prioritize task on [line] to [priority]\n"
-            + "t do [line]: complete task on [line]\n"
-            + "t rm [line]: remove task on [line], without completing it\n"
-            + "t list: list all tasks, in order of priority, creation date, tag, text, with creation date hidden\n"
-            + "t list verbose: list all tasks, in order of priority, creation date, tag, text, with creation date included\n")
+        case ["done", "--between", start, end]:
+            app.done(date_to_ordinal(start), date_to_ordinal(end))
+
+        case ["done", "--search", *text]:
+            app.search_done(" ".join(text))
+
+        case ["archive"]:
+            app.archive(get_current_day() - 30)
+
+        case ["archive", "--older-than", span]:
+            app.archive(get_current_day() - parse_days(span))
+
+        case ["stats"]:
+            app.stats()
+
+        case ["sed", expression, *condition]:
+            dry_run = "--dry-run" in condition
+            condition = [word for word in condition if word != "--dry-run"]
+            app.sed(expression, " ".join(condition) or None, dry_run)
+
+        case ["pri-all", tag, raw_priority, *options] if options in ([], ["--dry-run"]):
+
+            if not is_valid_tag(tag):
+                raise ValueError("Unrecognized tag.")
+
+            priority = "(" + raw_priority + ")"
+            if not is_valid_priority(priority):
+                raise ValueError("Unrecognized priority.")
+
+            app.pri_all(tag, priority, dry_run=bool(options))
+
+        case ["dedupe", *options]:
+            app.dedupe(**parse_dedupe_options(options))
+
+        case ["migrate", ("text" | "sqlite" | "binary") as kind]:
+            app.migrate(kind)
+
+        case ["query", "--explain", *text]:
+            app.query(" ".join(text), explain=True)
+
+        case ["query", *text]:
+            app.query(" ".join(text))
+
+        case ["sql", *condition]:
+            app.sql(" ".join(condition))
+
+        case ["undo"]:
+            app.undo()
+
+        case ["undo", count] if count.isdecimal():
+            app.undo(int(count))
+
+        case ["redo"]:
+            app.redo()
+
+        case ["redo", count] if count.isdecimal():
+            app.redo(int(count))
 
         case _:
             raise ValueError("Unrecognized command.")
 
 
+def run(args, config_path, todo_path, done_path):
+    """Run the command in args, after finishing a `t do` interrupted by a crash."""
+    intent_path = os.path.join(os.path.dirname(done_path), DONE_INTENT_NAME)
+    if os.path.exists(intent_path):
+        from durable import recover_and_report
+        recover_and_report(intent_path, done_path,
+                           open_configured_storage(config_path, todo_path))
+    if parse_fast_command(args, config_path, todo_path, done_path):
+        return
+    from app import TodoApp
+    # These only read the task list, so its text is decoded as they use it
+    lazy = args[:1] in (["list"], ["find"], ["query"]) and "--watch" not in args
+    app = TodoApp(config_path, todo_path, done_path, lazy)
+    parse_command(args, app)
+
+
 def main():
     """The main operating loop of app."""
-    app = TodoApp(CONFIG_PATH, TODO_PATH, DONE_PATH)
-    parse_command(sys.argv[1:], app)
+    run(sys.argv[1:], CONFIG_PATH, TODO_PATH, DONE_PATH)
 
 
 if __name__ == "__main__":
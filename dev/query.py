@@ -0,0 +1,305 @@
+"""Query language for filtering tasks, for todotxtpy.
+
+A query compares task fields and combines comparisons with and, or, not
+and parentheses, e.g. `pri <= C and tag = +work and text ~ "deploy"`.
+
+Fields are pri (a letter), tag (+tag, or none), created and due (yymmdd;
+due can also be none) and text. Operators are = != < <= > >= and ~, a
+case-insensitive regex search on tag or text.
+"""
+
+from __future__ import annotations
+import re
+from bisect import bisect_left, bisect_right
+from dataclasses import dataclass, field
+from typing import Callable, Optional, Union
+
+from data import Task, TaskList
+from index import DueIndex
+from utils import date_to_ordinal, is_valid_priority, is_valid_tag
+
+TOKEN = re.compile(r"""\s*(?:("[^"]*"|'[^']*')|(<=|>=|!=|=|<|>|~)|([()])|([^\s()<>=!~"']+))""")
+FIELD_NAMES = {"pri": "pri", "priority": "pri", "tag": "tag", "created": "created",
+          "date": "created", "due": "due", "text": "text"}
+ORDERED_OPERATORS = ["=", "<", "<=", ">", ">="]
+
+
+@dataclass
+class Comparison:
+    """One field compared to a value, as it is written in the query."""
+    field: str  # "pri", "tag", "created", "due" or "text"
+    operator: str
+    value: Union[str, int, None]  # "(A)", "+tag", a day number or a regex
+
+
+@dataclass
+class Node:
+    """Comparisons combined by "and", "or" or "not"."""
+    kind: str
+    children: list[Union[Node, Comparison]]
+
+
+def tokenize(text: str) -> list[str]:
+    """Split query text into strings, operators, parentheses and words."""
+    tokens = []
+    position = 0
+    text = text.rstrip()
+    while position < len(text):
+        match = TOKEN.match(text, position)
+        if match is None:
+            raise ValueError(f"Unrecognized query at {text[position:]!r}.")
+        tokens.append(match.group(match.lastindex))
+        position = match.end()
+    return tokens
+
+
+def parse_value(field: str, operator: str, raw: str) -> Union[str, int, None]:
+    """Convert a value to the representation its field is compared with."""
+    quoted = raw[:1] in "\"'"
+    value = raw[1:-1] if quoted else raw
+    if operator == "~":
+        if field not in ("tag", "text"):
+            raise ValueError(f"Cannot search {field} with ~.")
+        try:
+            return re.compile(value, re.IGNORECASE)
+        except re.error as error:
+            raise ValueError(f"Invalid pattern {value}: {error}.") from error
+    if field == "text":
+        if operator not in ("=", "!="):
+            raise ValueError("Text can only be compared with =, != or ~.")
+        return value
+    if value == "none" and field in ("tag", "due"):
+        if operator not in ("=", "!="):
+            raise ValueError(f"{field} can only be compared to none with = or !=.")
+        return None
+    match field:
+        case "pri":
+            priority = value if value.startswith("(") else f"({value})"
+            if not is_valid_priority(priority):
+                raise ValueError(f"Unrecognized priority {value}.")
+            return priority
+        case "tag":
+            if operator not in ("=", "!=") or not is_valid_tag(value):
+                raise ValueError(f"Unrecognized tag comparison {operator} {value}.")
+            return value
+        case _:
+            return date_to_ordinal(value)
+
+
+class Parser:
+    """Recursive descent parser over the tokens of a query."""
+
+    def __init__(self, tokens: list[str]) -> None:
+        """Parse tokens from the first one."""
+        self.tokens = tokens
+        self.position = 0
+
+    def peek(self) -> Optional[str]:
+        """Return the next token without consuming it."""
+        return self.tokens[self.position] if self.position < len(self.tokens) else None
+
+    def take(self) -> str:
+        """Consume and return the next token."""
+        token = self.peek()
+        if token is None:
+            raise ValueError("Unexpected end of query.")
+        self.position += 1
+        return token
+
+    def parse(self) -> Union[Node, Comparison]:
+        """Parse a whole query."""
+        node = self.parse_binary("or")
+        if self.peek() is not None:
+            raise ValueError(f"Unexpected {self.peek()!r} in query.")
+        return node
+
+    def parse_binary(self, kind: str) -> Union[Node, Comparison]:
+        """Parse operands joined by "or" (or "and", which binds tighter)."""
+        parse_operand = (lambda: self.parse_binary("and")) if kind == "or" else self.parse_unary
+        children = [parse_operand()]
+        while (self.peek() or "").lower() == kind:
+            self.take()
+            children.append(parse_operand())
+        return children[0] if len(children) == 1 else Node(kind, children)
+
+    def parse_unary(self) -> Union[Node, Comparison]:
+        """Parse "not", a parenthesized query or a comparison."""
+        token = self.take()
+        if token.lower() == "not":
+            return Node("not", [self.parse_unary()])
+        if token == "(":
+            node = self.parse_binary("or")
+            if self.take() != ")":
+                raise ValueError("Missing ) in query.")
+            return node
+        if token.lower() not in FIELD_NAMES:
+            raise ValueError(f"Unrecognized field {token}.")
+        field = FIELD_NAMES[token.lower()]
+        operator = self.take()
+        if operator not in ORDERED_OPERATORS + ["!=", "~"]:
+            raise ValueError(f"Unrecognized operator {operator}.")
+        return Comparison(field, operator, parse_value(field, operator, self.take()))
+
+
+@dataclass
+class Query:
+    """A parsed query, compiled to a predicate over tasks."""
+    text: str
+    tree: Union[Node, Comparison]
+    predicate: Callable[[Task], bool] = field(init=False, repr=False)
+
+    def __post_init__(self) -> None:
+        constants = {}
+        source = self.compile(self.tree, constants)
+        self.predicate = eval(compile(f"lambda task: {source}", "<query>", "eval"),
+                              {"__builtins__": {}, **constants})
+
+    @classmethod
+    def parse(cls, text: str) -> Query:
+        """Parse query text."""
+        return Query(text, Parser(tokenize(text)).parse())
+
+    def compile(self, node: Union[Node, Comparison], constants: dict) -> str:
+        """Return Python source for node; values go into constants."""
+        if isinstance(node, Node):
+            if node.kind == "not":
+                return f"(not {self.compile(node.children[0], constants)})"
+            return "(" + f" {node.kind} ".join(self.compile(child, constants)
+                                               for child in node.children) + ")"
+
+        name = f"value{len(constants)}"
+        constants[name] = node.value.search if node.operator == "~" else node.value
+        operator = "==" if node.operator == "=" else node.operator
+        match node.field, node.operator:
+            case "tag", "~":
+                return f"(task.tag.tag is not None and {name}(task.tag.tag) is not None)"
+            case "text", "~":
+                return f"({name}(task.text) is not None)"
+            case "pri", _:
+                return f"(task.priority {operator} {name})"
+            case "tag", _:
+                return f"(task.tag.tag {operator} {name})"
+            case "created", _:
+                return f"(task.created {operator} {name})"
+            case "text", _:
+                return f"(task.text {operator} {name})"
+            case "due", ("=" | "!="):
+                return f"(task.due {operator} {name})"
+            case "due", _:
+                return f"((due := task.due) is not None and due {operator} {name})"
+
+    def conjuncts(self) -> list[Comparison]:
+        """Return the comparisons every matching task satisfies."""
+        if isinstance(self.tree, Comparison):
+            return [self.tree]
+        if self.tree.kind == "and":
+            return [child for child in self.tree.children if isinstance(child, Comparison)]
+        return []
+
+    def bounds(self, field: str) -> tuple[Optional[int], Optional[int]]:
+        """Return inclusive bounds on created, due or pri (as a letter code)."""
+        low = high = None
+        for comparison in self.conjuncts():
+            if comparison.field != field or comparison.operator not in ORDERED_OPERATORS:
+                continue
+            value = comparison.value
+            if value is None:
+                continue
+            if field == "pri":
+                value = ord(value[1])
+            if comparison.operator in ("=", ">", ">="):
+                value_low = value + 1 if comparison.operator == ">" else value
+                low = value_low if low is None else max(low, value_low)
+            if comparison.operator in ("=", "<", "<="):
+                value_high = value - 1 if comparison.operator == "<" else value
+                high = value_high if high is None else min(high, value_high)
+        return low, high
+
+    def equal(self, field: str) -> Optional[Comparison]:
+        """Return a conjunct requiring field to equal a value, if there is one."""
+        for comparison in self.conjuncts():
+            if comparison.field == field and comparison.operator == "=":
+                return comparison
+        return None
+
+
+def sorted_scan(query: Query, tasklist: TaskList) -> tuple[str, list[tuple[int, Task]]]:
+    """Return (plan, candidates) for a sorted tasklist.
+
+    Tasks are sorted by priority, then creation date, so a priority range
+    is found by bisection, and so is a creation date range within each
+    priority.
+    """
+    tasks = tasklist.tasks
+    priority_low, priority_high = query.bounds("pri")
+    start = 0 if priority_low is None else bisect_left(
+        tasks, f"({chr(priority_low)})", key=lambda task: task.priority)
+    end = len(tasks) if priority_high is None else bisect_right(
+        tasks, f"({chr(priority_high)})", start, key=lambda task: task.priority)
+    plan = f"sorted scan of lines {start + 1}-{end}"
+
+    created_low, created_high = query.bounds("created")
+    if created_low is None and created_high is None:
+        return plan, [(i + 1, tasks[i]) for i in range(start, end)]
+
+    candidates = []
+    block_start = start
+    while block_start < end:
+        priority = tasks[block_start].priority
+        block_end = bisect_right(tasks, priority, block_start, end,
+                                 key=lambda task: task.priority)
+        first = block_start if created_low is None else bisect_left(
+            tasks, created_low, block_start, block_end, key=lambda task: task.created)
+        last = block_end if created_high is None else bisect_right(
+            tasks, created_high, first, block_end, key=lambda task: task.created)
+        candidates.extend((i + 1, tasks[i]) for i in range(first, last))
+        block_start = block_end
+    return f"{plan}, bisecting creation dates per priority", candidates
+
+
+def sqlite_conditions(query: Query) -> tuple[list[str], list]:
+    """Return SQL conditions and parameters for the indexed conjuncts."""
+    conditions, params = [], []
+    tag = query.equal("tag")
+    if tag is not None:
+        conditions.append("tag IS NULL" if tag.value is None else "tag = ?")
+        params.extend([] if tag.value is None else [tag.value])
+    for field, column in [("pri", "priority"), ("created", "created"), ("due", "due")]:
+        low, high = query.bounds(field)
+        if field == "pri":
+            low, high = (None if bound is None else f"({chr(bound)})" for bound in (low, high))
+        if low is not None:
+            conditions.append(f"{column} >= ?")
+            params.append(low)
+        if high is not None:
+            conditions.append(f"{column} <= ?")
+            params.append(high)
+    return conditions, params
+
+
+def plan(query: Query, tasklist: TaskList, storage,
+         due_index_path: str) -> tuple[str, list[tuple[int, Task]]]:
+    """Return (plan, candidates): tasks that may match, with line numbers.
+
+    The indexes of an SQLite storage are used for tag, priority and date
+    conjuncts; otherwise an up to date due index answers due date ranges.
+    Everything else is a sorted scan of tasklist, which has to be sorted.
+    """
+    if storage.kind == "sqlite":
+        conditions, params = sqlite_conditions(query)
+        if conditions:
+            condition = " AND ".join(conditions)
+            return (f"sqlite index: {condition}",
+                    [(line_number, task)
+                     for _, line_number, task in storage.rows(condition, tuple(params))])
+
+    due_low, due_high = query.bounds("due")
+    if due_low is not None or due_high is not None:
+        index = DueIndex.load(due_index_path)
+        if (index is not None and index.source == f"{storage.kind} {storage.path}"
+                and index.signature == storage.signature()):
+            return (f"due index: {due_low}-{due_high}",
+                    [(line_number, Task.load(task))
+                     for _, line_number, task in index.between(due_low, due_high)])
+
+    return sorted_scan(query, tasklist)
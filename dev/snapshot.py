@@ -0,0 +1,119 @@
+"""Deduplicated snapshots of the todo directory for todotxtpy."""
+
+import hashlib
+import os
+import zlib
+from typing import BinaryIO, Iterator
+
+from constants import (
+    SNAPSHOT_CHUNK_DIVISOR,
+    SNAPSHOT_CHUNK_MAX,
+    SNAPSHOT_CHUNK_MIN,
+)
+
+
+def split_chunks(file: BinaryIO) -> Iterator[bytes]:
+    """Split a file into content-defined chunks of whole lines.
+
+    A chunk ends after a line whose hash is divisible by the chunk divisor, so
+    an edit only changes the chunks around it, and appending to a file only
+    changes its last chunk.
+    """
+    chunk = []
+    size = 0
+    for line in file:
+        chunk.append(line)
+        size += len(line)
+        if size >= SNAPSHOT_CHUNK_MAX or (
+                size >= SNAPSHOT_CHUNK_MIN
+                and zlib.crc32(line) % SNAPSHOT_CHUNK_DIVISOR == 0):
+            yield b"".join(chunk)
+            chunk = []
+            size = 0
+    if chunk:
+        yield b"".join(chunk)
+
+
+class SnapshotStore:
+    """Content-addressed store of file chunks, plus a manifest per snapshot.
+
+    Chunks are stored compressed under chunks/, named by their SHA-256 hash,
+    and written only if they are not already present. Each snapshot is a
+    numbered manifest listing, for every file, the hashes of its chunks.
+    """
+
+    def __init__(self, path: str) -> None:
+        """Open the store at path."""
+        self.path = path
+        self.chunk_path = os.path.join(path, "chunks")
+
+    def ids(self) -> list[int]:
+        """Return the ids of all snapshots, oldest first."""
+        if not os.path.isdir(self.path):
+            return []
+        return sorted(int(name) for name in os.listdir(self.path)
+                      if name.isdecimal())
+
+    def write_chunk(self, chunk: bytes) -> tuple[str, bool]:
+        """Store chunk if needed; return its hash and whether it was new."""
+        digest = hashlib.sha256(chunk).hexdigest()
+        directory = os.path.join(self.chunk_path, digest[:2])
+        path = os.path.join(directory, digest)
+        if os.path.exists(path):
+            return digest, False
+        os.makedirs(directory, exist_ok=True)
+        with open(path + ".tmp", mode="wb") as file:
+            file.write(zlib.compress(chunk))
+        os.replace(path + ".tmp", path)
+        return digest, True
+
+    def read_chunk(self, digest: str) -> bytes:
+        """Return the contents of a stored chunk."""
+        with open(os.path.join(self.chunk_path, digest[:2], digest), mode="rb") as file:
+            return zlib.decompress(file.read())
+
+    def snapshot(self, paths: list[str]) -> tuple[int, int]:
+        """Snapshot the files at paths that exist.
+
+        Returns the id of the new snapshot and the number of new chunks.
+        """
+        os.makedirs(self.path, exist_ok=True)
+        manifest = []
+        new_chunks = 0
+        for path in paths:
+            if not os.path.exists(path):
+                continue
+            digests = []
+            with open(path, mode="rb") as file:
+                for chunk in split_chunks(file):
+                    digest, new = self.write_chunk(chunk)
+                    digests.append(digest)
+                    new_chunks += new
+            manifest.append(f"{os.path.basename(path)}\t{' '.join(digests)}\n")
+
+        snapshot_id = max(self.ids(), default=0) + 1
+        tmp_path = os.path.join(self.path, f"{snapshot_id}.tmp")
+        with open(tmp_path, mode="w") as file:
+            file.writelines(manifest)
+        os.replace(tmp_path, os.path.join(self.path, str(snapshot_id)))
+        return snapshot_id, new_chunks
+
+    def restore(self, snapshot_id: int, directory: str) -> list[str]:
+        """Restore the files of a snapshot into directory.
+
+        Returns the names of the restored files.
+        """
+        manifest_path = os.path.join(self.path, str(snapshot_id))
+        if not os.path.exists(manifest_path):
+            raise ValueError(f"No snapshot {snapshot_id}.")
+
+        with open(manifest_path, mode="r") as file:
+            manifest = [line.rstrip("\n").split("\t") for line in file]
+
+        for name, digests in manifest:
+            path = os.path.join(directory, name)
+            with open(path + ".tmp", mode="wb") as file:
+                for digest in digests.split():
+                    file.write(self.read_chunk(digest))
+            os.replace(path + ".tmp", path)
+        return [name for name, _ in manifest]
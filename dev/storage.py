@@ -0,0 +1,404 @@
+"""Storage backends for the task list of todotxtpy."""
+
+import mmap
+import os
+import struct
+from collections import Counter
+
+from constants import BINARY_NAME, SQLITE_NAME
+from data import LazyTaskList, Tag, Task, TaskList
+from durable import fsync_directory
+from utils import file_signature, ordinal_to_date
+
+# Matches TaskList.sort: tasks without a tag come after those with one
+SQLITE_ORDER = "priority, creation_date, tag IS NULL, tag, text"
+
+
+class TextStorage:
+    """Tasks stored one per line in todo.txt; the default."""
+
+    kind = "text"
+
+    def __init__(self, path: str, sync: bool = False, lazy: bool = False) -> None:
+        """Use the todo.txt file at path; with sync, saves are synced to disk.
+
+        With lazy, the text of tasks is only decoded when used (see
+        LazyTaskList), which suits commands that read the task list.
+        """
+        self.path = path
+        self.sync = sync
+        self.lazy = lazy
+
+    def load(self) -> TaskList:
+        """Load all tasks; invalid lines are kept aside, and saved back as they are."""
+        if self.lazy:
+            return LazyTaskList.load(self.path, tolerant=True)
+        return TaskList.load(self.path, tolerant=True)
+
+    def save(self, tasklist: TaskList) -> None:
+        """Save all tasks to a new file, which then replaces todo.txt."""
+        tmp_path = self.path + ".tmp"
+        tasklist.save(tmp_path)
+        if self.sync:
+            with open(tmp_path, mode="rb") as file:
+                os.fsync(file.fileno())
+        os.replace(tmp_path, self.path)
+        if self.sync:
+            fsync_directory(self.path)
+
+    def signature(self) -> str:
+        """Return a string that changes whenever the stored tasks change."""
+        return file_signature(self.path)
+
+    def snapshot_files(self) -> list[str]:
+        """Return the files holding the tasks, for a snapshot to copy."""
+        return [self.path]
+
+
+class SqliteStorage:
+    """Tasks stored in an SQLite database, indexed by priority, tag and dates.
+
+    Saving only inserts and deletes the rows that changed; rows are never
+    updated in place.
+    """
+
+    kind = "sqlite"
+
+    def __init__(self, path: str) -> None:
+        """Open (or create) the database at path."""
+        import sqlite3  # only SQLite users pay for loading it
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        with self.connection:
+            self.connection.executescript("""
+                CREATE TABLE IF NOT EXISTS tasks (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    priority TEXT NOT NULL,
+                    creation_date TEXT NOT NULL,
+                    created INTEGER NOT NULL,
+                    due INTEGER,
+                    tag TEXT,
+                    text TEXT NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS tasks_priority ON tasks (priority);
+                CREATE INDEX IF NOT EXISTS tasks_tag ON tasks (tag);
+                CREATE INDEX IF NOT EXISTS tasks_created ON tasks (created);
+                CREATE INDEX IF NOT EXISTS tasks_due ON tasks (due);
+            """)
+
+    def rows(self, condition: str = "1", params: tuple = ()) -> list[tuple]:
+        """Return (id, line number, task) for the tasks matching an SQL condition.
+
+        Line numbers are positions in the full sorted list.
+        """
+        cursor = self.connection.execute(f"""
+            SELECT id, line_number, priority, creation_date, tag, text FROM (
+                SELECT *, ROW_NUMBER() OVER (ORDER BY {SQLITE_ORDER}) AS line_number
+                FROM tasks
+            ) WHERE {condition} ORDER BY line_number""", params)
+        return [(row_id, line_number, Task(priority, creation_date, Tag(tag), text))
+                for row_id, line_number, priority, creation_date, tag, text in cursor]
+
+    def load(self) -> TaskList:
+        """Load all tasks, in sorted order."""
+        return TaskList([task for _, _, task in self.rows()])
+
+    def save(self, tasklist: TaskList) -> None:
+        """Store tasklist, touching only the rows that differ."""
+        wanted = Counter(str(task) for task in tasklist.tasks)
+        stale = []
+        for row_id, _, task in self.rows():
+            line = str(task)
+            if wanted[line] > 0:
+                wanted[line] -= 1
+            else:
+                stale.append((row_id,))
+
+        new = []
+        for task in tasklist.tasks:
+            line = str(task)
+            if wanted[line] > 0:
+                wanted[line] -= 1
+                new.append((task.priority, task.creation_date, task.created,
+                            task.due, task.tag.tag, task.text))
+
+        with self.connection:
+            self.connection.executemany("DELETE FROM tasks WHERE id = ?", stale)
+            self.connection.executemany(
+                "INSERT INTO tasks (priority, creation_date, created, due, tag, text) "
+                "VALUES (?, ?, ?, ?, ?, ?)", new)
+
+    def signature(self) -> str:
+        """Return a string that changes whenever the stored tasks change.
+
+        Rows are only ever inserted or deleted, and ids are never reused, so
+        the row count and the last id used identify the contents. Unlike file
+        stats, these are unaffected by WAL checkpoints.
+        """
+        count, = self.connection.execute("SELECT COUNT(*) FROM tasks").fetchone()
+        last = self.connection.execute(
+            "SELECT seq FROM sqlite_sequence WHERE name = 'tasks'").fetchone()
+        return f"{count} {last[0] if last else 0}"
+
+    def snapshot_files(self) -> list[str]:
+        """Return the files holding the tasks, for a snapshot to copy.
+
+        The write-ahead log is checkpointed into the database file first, so
+        that file alone holds every committed task.
+        """
+        self.connection.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        return [self.path]
+
+    @staticmethod
+    def discard_log(path: str) -> None:
+        """Remove the write-ahead log of the database at path.
+
+        Needed after the database file is replaced by a restored copy, which
+        the log of the replaced file would otherwise be replayed onto.
+        """
+        for suffix in ("-wal", "-shm"):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+
+
+class BinaryStorage:
+    """Tasks stored as fixed-width records, updated in place through mmap.
+
+    The record file starts with a header (magic, generation) followed by one
+    record per task: priority letter, flags, creation day, tag id, and the
+    64-bit offset and the length of the task text in a separate text heap.
+    Tag ids index a tag table with one tag per line (0 means no tag).
+
+    Changing a priority overwrites one byte and removing a task sets its
+    tombstone flag; other changes tombstone the old record and append a new
+    one. New text, tags and records are synced before any tombstone is set,
+    so a crash never leaves a task without a live record. Once tombstones
+    outnumber live records (and there are COMPACT_MIN of them), the next
+    save rewrites the files without them, as does converting to this storage.
+    """
+
+    kind = "binary"
+    HEADER = struct.Struct("<8sQ")
+    RECORD = struct.Struct("<cBIHQI")
+    MAGIC = b"TODOBIN2"
+    # Record layouts of older files, which are read and then rewritten
+    OLD_RECORDS = {b"TODOBIN1": struct.Struct("<cBIHII")}
+    TOMBSTONE = 1
+    COMPACT_MIN = 64
+
+    def __init__(self, path: str, sync: bool = False) -> None:
+        """Use the record file at path, with its heap and tag table next to it.
+
+        With sync, saves are synced to disk.
+        """
+        self.path = path
+        self.heap_path = path + ".heap"
+        self.tags_path = path + ".tags"
+        self.sync = sync
+        # (task, record number, line when loaded) for each live record
+        self.loaded = None
+        self.tombstones = 0
+
+    def read_tags(self) -> list[str]:
+        """Return the tag table."""
+        if not os.path.exists(self.tags_path):
+            return []
+        with open(self.tags_path, mode="r") as file:
+            return file.read().splitlines()
+
+    def finish_rewrite(self) -> None:
+        """Finish a write_all interrupted after all its new files were synced."""
+        if not os.path.exists(self.path + ".new"):
+            return
+        for path in [self.heap_path, self.tags_path]:
+            if os.path.exists(path + ".tmp"):
+                os.replace(path + ".tmp", path)
+        os.replace(self.path + ".new", self.path)
+        if self.sync:
+            fsync_directory(self.path)
+
+    def load(self) -> TaskList:
+        """Load all live records, in sorted order."""
+        self.finish_rewrite()
+        self.loaded = []
+        self.tombstones = 0
+        if not os.path.exists(self.path):
+            return TaskList([])
+
+        tags = self.read_tags()
+        with open(self.path, mode="rb") as file, \
+                open(self.heap_path, mode="rb") as heap_file:
+            records = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            heap = (mmap.mmap(heap_file.fileno(), 0, access=mmap.ACCESS_READ)
+                    if os.fstat(heap_file.fileno()).st_size else b"")
+            magic, _ = self.HEADER.unpack_from(records)
+            record = self.OLD_RECORDS.get(magic, self.RECORD)
+            if magic != self.MAGIC and magic not in self.OLD_RECORDS:
+                raise ValueError(f"Unrecognized binary storage {self.path}.")
+
+            count = (len(records) - self.HEADER.size) // record.size
+            for i in range(count):
+                priority, flags, created, tag_id, offset, length = \
+                    record.unpack_from(records, self.HEADER.size + i * record.size)
+                if flags & self.TOMBSTONE:
+                    self.tombstones += 1
+                    continue
+                task = Task(f"({priority.decode()})", ordinal_to_date(created),
+                            Tag(tags[tag_id - 1] if tag_id else None),
+                            heap[offset:offset + length].decode())
+                self.loaded.append((task, i, str(task)))
+            records.close()
+            if isinstance(heap, mmap.mmap):
+                heap.close()
+        # Records are in insertion order; line numbers follow sorted order
+        tasklist = TaskList([task for task, _, _ in self.loaded])
+        tasklist.sort()
+        if magic != self.MAGIC:
+            # The next save writes the current layout from scratch
+            self.loaded = None
+        return tasklist
+
+    def pack(self, task: Task, tags: dict[str, int], offset: int, length: int) -> bytes:
+        """Return the record for task, whose text is at offset in the heap."""
+        priority = task.priority[1].encode()
+        if len(priority) != 1:
+            raise ValueError(f"Binary storage needs ASCII priorities, not {task.priority}.")
+        tag_id = 0
+        if task.tag.tag is not None:
+            tag_id = tags.setdefault(task.tag.tag, len(tags) + 1)
+            if tag_id > 0xFFFF:
+                raise ValueError("Too many tags for binary storage.")
+        return self.RECORD.pack(priority, 0, task.created, tag_id, offset, length)
+
+    def append(self, tasks: list[Task], start: int, heap_size: int,
+               tags: dict[str, int]) -> tuple[bytes, bytes]:
+        """Return the records and heap bytes for tasks, as appended at start."""
+        records, heap = [], []
+        for i, task in enumerate(tasks):
+            text = task.text.encode()
+            records.append(self.pack(task, tags, heap_size, len(text)))
+            heap.append(text)
+            heap_size += len(text)
+            self.loaded.append((task, start + i, str(task)))
+        return b"".join(records), b"".join(heap)
+
+    def write(self, path: str, content: bytes, mode: str = "ab") -> None:
+        """Write content to path, syncing it if saves are synced."""
+        with open(path, mode=mode) as file:
+            file.write(content)
+            if self.sync:
+                file.flush()
+                os.fsync(file.fileno())
+
+    def save(self, tasklist: TaskList) -> None:
+        """Store tasklist, in place where possible."""
+        self.finish_rewrite()
+        if self.loaded is None or not os.path.exists(self.path):
+            self.write_all(tasklist)
+            return
+
+        present = {id(task) for task in tasklist.tasks}
+        kept, dead, repriced = set(), [], []
+        for task, i, line in self.loaded:
+            current = str(task) if id(task) in present else None
+            if current == line:
+                kept.add(id(task))
+            elif current is not None and current[3:] == line[3:]:
+                kept.add(id(task))
+                repriced.append((i, task.priority[1].encode()))
+            else:
+                dead.append(i)
+        tombstones = self.tombstones + len(dead)
+        if tombstones >= self.COMPACT_MIN and tombstones > len(tasklist.tasks):
+            self.write_all(tasklist)
+            return
+        new = [task for task in tasklist.tasks if id(task) not in kept]
+
+        tag_list = self.read_tags()
+        tags = {tag: i + 1 for i, tag in enumerate(tag_list)}
+        count = (os.path.getsize(self.path) - self.HEADER.size) // self.RECORD.size
+        self.loaded = [entry for entry in self.loaded if id(entry[0]) in kept]
+        self.loaded = [(task, i, str(task)) for task, i, _ in self.loaded]
+        records, heap = self.append(new, count, os.path.getsize(self.heap_path), tags)
+
+        # New text and tags go first, so that records never point past them,
+        # and all of them are on disk before the old records are tombstoned
+        if heap:
+            self.write(self.heap_path, heap)
+        if len(tags) > len(tag_list):
+            self.write(self.tags_path,
+                       "".join(f"{tag}\n" for tag in list(tags)[len(tag_list):]).encode())
+        if records:
+            self.write(self.path, records)
+
+        with open(self.path, mode="r+b") as file:
+            data = mmap.mmap(file.fileno(), 0)
+            for i in dead:
+                data[self.HEADER.size + i * self.RECORD.size + 1] = self.TOMBSTONE
+            for i, priority in repriced:
+                data[self.HEADER.size + i * self.RECORD.size] = priority[0]
+            _, generation = self.HEADER.unpack_from(data)
+            self.HEADER.pack_into(data, 0, self.MAGIC, generation + 1)
+            data.flush()
+            data.close()
+            if self.sync:
+                os.fsync(file.fileno())
+        self.tombstones = tombstones
+
+    def write_all(self, tasklist: TaskList) -> None:
+        """Write tasklist from scratch, replacing any existing files.
+
+        The new files are synced under temporary names first; the record
+        file is renamed to .new last, so that finish_rewrite can complete
+        the replacement after a crash.
+        """
+        generation = 0
+        if os.path.exists(self.path):
+            with open(self.path, mode="rb") as file:
+                _, generation = self.HEADER.unpack(file.read(self.HEADER.size))
+        self.loaded = []
+        self.tombstones = 0
+        tags = {}
+        records, heap = self.append(tasklist.tasks, 0, 0, tags)
+        for path, content in [
+            (self.heap_path, heap),
+            (self.tags_path, "".join(f"{tag}\n" for tag in tags).encode()),
+            (self.path, self.HEADER.pack(self.MAGIC, generation + 1) + records),
+        ]:
+            self.write(path + ".tmp", content, mode="wb")
+        os.replace(self.path + ".tmp", self.path + ".new")
+        if self.sync:
+            fsync_directory(self.path)
+        self.finish_rewrite()
+
+    def signature(self) -> str:
+        """Return a string that changes whenever the stored tasks change."""
+        self.finish_rewrite()
+        with open(self.path, mode="rb") as file:
+            _, generation = self.HEADER.unpack(file.read(self.HEADER.size))
+        return f"{generation} {file_signature(self.path)}"
+
+    def snapshot_files(self) -> list[str]:
+        """Return the files holding the tasks, for a snapshot to copy."""
+        return [self.path, self.heap_path, self.tags_path]
+
+
+STORAGES = {"text": TextStorage, "sqlite": SqliteStorage, "binary": BinaryStorage}
+
+
+def open_storage(kind: str, todo_path: str, sync: bool = False, lazy: bool = False):
+    """Return the storage of the given kind for the todo directory of todo_path.
+
+    SQLite syncs its own commits, whatever sync is; lazy only applies to
+    todo.txt, as the other storages decode fields separately anyway.
+    """
+    match kind:
+        case "text":
+            return TextStorage(todo_path, sync, lazy)
+        case "sqlite":
+            return SqliteStorage(os.path.join(os.path.dirname(todo_path), SQLITE_NAME))
+        case "binary":
+            return BinaryStorage(os.path.join(os.path.dirname(todo_path), BINARY_NAME), sync)
+        case _:
+            raise ValueError(f"Unrecognized storage {kind}.")
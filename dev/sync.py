@@ -0,0 +1,157 @@
+"""Three-way sync between two todo directories for todotxtpy."""
+
+import hashlib
+import os
+from collections import Counter
+from dataclasses import dataclass
+
+from constants import SYNC_DIRECTORY_NAME
+from data import Task
+
+
+def line_hash(line: bytes) -> bytes:
+    """Return a short hash identifying a line."""
+    return hashlib.blake2b(line, digest_size=8).digest()
+
+
+def read_lines(path: str) -> list[bytes]:
+    """Return the non-empty lines of a file, without newlines."""
+    if not os.path.exists(path):
+        return []
+    with open(path, mode="rb") as file:
+        return [line for line in file.read().split(b"\n") if line]
+
+
+def write_lines(path: str, lines: list[bytes]) -> None:
+    """Replace the file at path with lines."""
+    with open(path + ".tmp", mode="wb") as file:
+        file.write(b"".join(line + b"\n" for line in lines))
+    os.replace(path + ".tmp", path)
+
+
+def base_path(directory: str, peer: str) -> str:
+    """Return where directory keeps the common base for syncing with peer."""
+    peer_id = hashlib.sha1(os.path.realpath(peer).encode()).hexdigest()[:16]
+    return os.path.join(directory, SYNC_DIRECTORY_NAME, peer_id)
+
+
+def merge_counts(base: Counter, ours: Counter, theirs: Counter) -> Counter:
+    """Three-way merge of line multisets.
+
+    A change made on only one side is taken; when both sides added (or both
+    removed) copies of a line, the larger change wins instead of doubling.
+    """
+    merged = Counter()
+    for key in base.keys() | ours.keys() | theirs.keys():
+        ours_delta = ours[key] - base[key]
+        theirs_delta = theirs[key] - base[key]
+        if ours_delta * theirs_delta > 0:
+            delta = max(ours_delta, theirs_delta, key=abs)
+        else:
+            delta = ours_delta + theirs_delta
+        if base[key] + delta > 0:
+            merged[key] = base[key] + delta
+    return merged
+
+
+def apply_counts(lines: list[bytes], hashes: list[bytes], target: Counter,
+                 extra: dict[bytes, bytes]) -> list[bytes]:
+    """Edit lines so that their hashes occur as in target.
+
+    Surplus lines are dropped and missing ones (looked up in extra) appended,
+    so the order of lines that are kept does not change.
+    """
+    remaining = Counter(target)
+    result = []
+    for line, key in zip(lines, hashes):
+        if remaining[key] > 0:
+            remaining[key] -= 1
+            result.append(line)
+    for key, count in remaining.items():
+        result.extend([extra[key]] * count)
+    return result
+
+
+@dataclass
+class SyncResult:
+    """Number of lines changed in each directory by a sync."""
+    todo_ours: int = 0
+    todo_theirs: int = 0
+    done_ours: int = 0
+    done_theirs: int = 0
+
+
+def sync_todo(ours_path: str, theirs_path: str, base: list[bytes],
+              result: SyncResult) -> list[bytes]:
+    """Merge two todo.txt files against base; return the merged lines."""
+    ours, theirs = read_lines(ours_path), read_lines(theirs_path)
+    ours_hashes = [line_hash(line) for line in ours]
+    theirs_hashes = [line_hash(line) for line in theirs]
+    ours_counts, theirs_counts = Counter(ours_hashes), Counter(theirs_hashes)
+    merged = merge_counts(Counter(map(line_hash, base)), ours_counts, theirs_counts)
+
+    lines = dict(zip(theirs_hashes, theirs)) | dict(zip(ours_hashes, ours))
+    # Only lines new to a side are parsed, to catch malformed input early
+    for key in (merged - ours_counts) | (merged - theirs_counts):
+        Task.load(lines[key].decode())
+
+    merged_ours = ours
+    if merged != ours_counts:
+        merged_ours = apply_counts(ours, ours_hashes, merged, lines)
+        result.todo_ours = (sum((merged - ours_counts).values())
+                            + sum((ours_counts - merged).values()))
+        write_lines(ours_path, merged_ours)
+    if merged != theirs_counts:
+        result.todo_theirs = (sum((merged - theirs_counts).values())
+                              + sum((theirs_counts - merged).values()))
+        write_lines(theirs_path, apply_counts(theirs, theirs_hashes, merged, lines))
+    return merged_ours
+
+
+def sync_done(ours_path: str, theirs_path: str, result: SyncResult) -> None:
+    """Append to each done.txt the completed tasks only the other one has."""
+    ours, theirs = read_lines(ours_path), read_lines(theirs_path)
+    ours_counts = Counter(map(line_hash, ours))
+    theirs_counts = Counter(map(line_hash, theirs))
+
+    for lines, counts, other_counts, path, field in [
+        (theirs, theirs_counts, ours_counts, ours_path, "done_ours"),
+        (ours, ours_counts, theirs_counts, theirs_path, "done_theirs"),
+    ]:
+        missing = counts - other_counts
+        new = []
+        for line in lines:
+            key = line_hash(line)
+            if missing[key] > 0:
+                missing[key] -= 1
+                new.append(line)
+        if new:
+            with open(path, mode="ab") as file:
+                file.write(b"".join(line + b"\n" for line in new))
+            setattr(result, field, len(new))
+
+
+def sync(ours_dir: str, theirs_dir: str, todo_name: str, done_name: str) -> SyncResult:
+    """Sync two todo directories.
+
+    todo.txt is merged three ways against the state recorded at the last
+    sync between the two; done.txt becomes the union of both. Files are only
+    written if they change.
+    """
+    result = SyncResult()
+    ours_base_path = base_path(ours_dir, theirs_dir)
+    theirs_base_path = base_path(theirs_dir, ours_dir)
+    if os.path.exists(ours_base_path):
+        base = read_lines(ours_base_path)
+    else:
+        base = read_lines(theirs_base_path)
+
+    merged = sync_todo(os.path.join(ours_dir, todo_name),
+                       os.path.join(theirs_dir, todo_name), base, result)
+    sync_done(os.path.join(ours_dir, done_name),
+              os.path.join(theirs_dir, done_name), result)
+
+    for path in [ours_base_path, theirs_base_path]:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        write_lines(path, merged)
+    return result
@@ -1,3 +1,525 @@
 """Integration tests for the todotxtpy app."""
 
-# TODO
+import io
+import os
+
+import pytest
+
+from app import TodoApp
+from constants import DefaultConfig
+from main import parse_command, parse_fast_command, run
+from utils import date_to_ordinal, get_current_day, ordinal_to_date
+
+
+@pytest.fixture
+def todo_dir(tmpdir):
+    """A todo directory with an empty config and a few tasks."""
+    open(os.path.join(tmpdir, "config"), "w").close()
+    with open(os.path.join(tmpdir, "todo.txt"), "w") as file:
+        file.write("(A) 211028 +work deploy the thing\n"
+                   "(B) 211101 +home water plants\n"
+                   "(C) 211115 read a book\n")
+    with open(os.path.join(tmpdir, "done.txt"), "w") as file:
+        file.write("x (A) 211001 211005 +work ship it\n"
+                   "x (B) 211001 211020 call mom\n")
+    return tmpdir
+
+
+def make_app(todo_dir):
+    return TodoApp(os.path.join(todo_dir, "config"),
+                   os.path.join(todo_dir, "todo.txt"),
+                   os.path.join(todo_dir, "done.txt"))
+
+
+def fast(args, todo_dir):
+    return parse_fast_command(args,
+                              os.path.join(todo_dir, "config"),
+                              os.path.join(todo_dir, "todo.txt"),
+                              os.path.join(todo_dir, "done.txt"))
+
+
+def read(todo_dir, name):
+    with open(os.path.join(todo_dir, name)) as file:
+        return file.read()
+
+
+class TestDates:
+    """Test date-range queries."""
+
+    def test_01_list_since(self, todo_dir, capsys):
+        parse_command(["list", "--since", "211101"], make_app(todo_dir))
+        lines = capsys.readouterr().out.splitlines()
+        assert len(lines) == 2
+        # Line numbers still refer to the full list
+        assert lines[0].startswith(DefaultConfig.COLOR_NUMBER + "2")
+        assert "water plants" in lines[0]
+        assert "read a book" in lines[1]
+
+    def test_02_list_until_verbose(self, todo_dir, capsys):
+        parse_command(["list", "verbose", "--until", "211031"], make_app(todo_dir))
+        lines = capsys.readouterr().out.splitlines()
+        assert len(lines) == 1
+        assert "211028" in lines[0]
+
+    def test_03_list_invalid_date(self, todo_dir):
+        with pytest.raises(ValueError):
+            parse_command(["list", "--since", "211345"], make_app(todo_dir))
+
+    def test_04_done_between(self, todo_dir, capsys):
+        parse_command(["done", "--between", "211010", "211031"], make_app(todo_dir))
+        assert capsys.readouterr().out == "x (B) 211001 211020 call mom\n"
+
+    def test_05_do_appends_done(self, todo_dir):
+        parse_command(["do", "1"], make_app(todo_dir))
+        last = read(todo_dir, "done.txt").splitlines()[-1]
+        assert last.startswith("x (A) 211028 ")
+        assert last.endswith(" +work deploy the thing")
+
+
+class TestDue:
+    """Test due date commands."""
+
+    def add_due(self, todo_dir, offset):
+        due = ordinal_to_date(get_current_day() + offset)
+        parse_command(["add", "B", f"offset {offset} due:{due}"], make_app(todo_dir))
+
+    def test_01_due_within(self, todo_dir, capsys):
+        for offset in [-3, 0, 5, 10]:
+            self.add_due(todo_dir, offset)
+        assert fast(["due", "--within", "7d"], todo_dir)
+        out = capsys.readouterr().out
+        assert "offset 0 " in out and "offset 5 " in out
+        assert "offset 10 " not in out and "offset -3 " not in out
+
+        assert fast(["overdue"], todo_dir)
+        assert "offset -3 " in capsys.readouterr().out
+
+    def test_02_line_numbers(self, todo_dir, capsys):
+        self.add_due(todo_dir, 1)
+        fast(["due"], todo_dir)
+        line_number = capsys.readouterr().out.split()[0]
+
+        parse_command(["do", line_number], make_app(todo_dir))
+        assert "offset 1 " in read(todo_dir, "done.txt")
+
+    def test_03_not_fast(self, todo_dir):
+        assert not fast(["list"], todo_dir)
+
+
+class TestArchive:
+    """Test archiving completed tasks."""
+
+    def test_01_archive_and_query(self, todo_dir, capsys):
+        parse_command(["archive", "--older-than", "0d"], make_app(todo_dir))
+        assert read(todo_dir, "done.txt") == ""
+
+        parse_command(["done", "--between", "211001", "211010"], make_app(todo_dir))
+        assert capsys.readouterr().out == "x (A) 211001 211005 +work ship it\n"
+
+        parse_command(["stats"], make_app(todo_dir))
+        assert capsys.readouterr().out == "open: 3\ndone: 0\narchived: 2 in 1 blocks\n"
+
+    def test_02_search(self, todo_dir, capsys):
+        app = make_app(todo_dir)
+        app.archive(date_to_ordinal("211010"))
+        parse_command(["done", "--search", "ship", "it"], make_app(todo_dir))
+        assert capsys.readouterr().out == "x (A) 211001 211005 +work ship it\n"
+        assert read(todo_dir, "done.txt") == "x (B) 211001 211020 call mom\n"
+
+    def test_03_done_last_and_today(self, todo_dir, capsys):
+        today = ordinal_to_date(get_current_day())
+        with open(os.path.join(todo_dir, "done.txt"), "a") as file:
+            file.write(f"x (C) 211001 {today} +home finished today\n")
+        assert fast(["done", "--last", "2"], todo_dir)
+        assert capsys.readouterr().out == ("x (B) 211001 211020 call mom\n"
+                                           f"x (C) 211001 {today} +home finished today\n")
+        assert fast(["done", "--today"], todo_dir)
+        assert capsys.readouterr().out == f"x (C) 211001 {today} +home finished today\n"
+
+        make_app(todo_dir).archive(date_to_ordinal("211010"))
+        assert fast(["done", "--last", "5"], todo_dir)
+        assert capsys.readouterr().out.splitlines() == [
+            "x (A) 211001 211005 +work ship it",
+            "x (B) 211001 211020 call mom",
+            f"x (C) 211001 {today} +home finished today",
+        ]
+
+
+class TestUndo:
+    """Test undoing and redoing operations."""
+
+    def test_01_undo_rm(self, todo_dir):
+        before = read(todo_dir, "todo.txt")
+        parse_command(["rm", "2"], make_app(todo_dir))
+        assert "water plants" not in read(todo_dir, "todo.txt")
+        parse_command(["undo"], make_app(todo_dir))
+        assert read(todo_dir, "todo.txt") == before
+
+    def test_02_undo_do_retracts_done(self, todo_dir):
+        todo_before = read(todo_dir, "todo.txt")
+        done_before = read(todo_dir, "done.txt")
+        parse_command(["do", "1"], make_app(todo_dir))
+        parse_command(["undo"], make_app(todo_dir))
+        assert read(todo_dir, "todo.txt") == todo_before
+        assert read(todo_dir, "done.txt") == done_before
+
+        parse_command(["redo"], make_app(todo_dir))
+        assert "deploy the thing" not in read(todo_dir, "todo.txt")
+        assert "deploy the thing" in read(todo_dir, "done.txt")
+
+    def test_03_undo_many(self, todo_dir):
+        before = read(todo_dir, "todo.txt")
+        parse_command(["pri", "3", "A"], make_app(todo_dir))
+        parse_command(["add", "D", "+new", "thing"], make_app(todo_dir))
+        parse_command(["rm", "1"], make_app(todo_dir))
+        after = read(todo_dir, "todo.txt")
+
+        parse_command(["undo", "3"], make_app(todo_dir))
+        assert read(todo_dir, "todo.txt") == before
+        parse_command(["redo", "3"], make_app(todo_dir))
+        assert read(todo_dir, "todo.txt") == after
+
+    def test_04_undo_empty(self, todo_dir, monkeypatch):
+        before = read(todo_dir, "todo.txt")
+        app = make_app(todo_dir)
+        monkeypatch.setattr(app, "save", lambda: pytest.fail("saved with nothing to undo"))
+        parse_command(["undo"], app)
+        parse_command(["redo"], app)
+        assert read(todo_dir, "todo.txt") == before
+
+    def test_05_undo_archived_do(self, todo_dir, capsys):
+        parse_command(["do", "1"], make_app(todo_dir))
+        with open(os.path.join(todo_dir, "done.txt"), "w") as file:
+            file.write("")
+        parse_command(["undo"], make_app(todo_dir))
+        assert "deploy the thing" in read(todo_dir, "todo.txt")
+        assert "may be archived: x (A) 211028" in capsys.readouterr().err
+
+
+class TestSnapshot:
+    """Test snapshotting and restoring the todo directory."""
+
+    def test_01_restore(self, todo_dir, capsys):
+        before = {name: read(todo_dir, name) for name in ["todo.txt", "done.txt"]}
+        assert fast(["snapshot"], todo_dir)
+        parse_command(["do", "1"], make_app(todo_dir))
+        parse_command(["rm", "1"], make_app(todo_dir))
+
+        assert fast(["restore", "1"], todo_dir)
+        for name, content in before.items():
+            assert read(todo_dir, name) == content
+
+    def test_02_restore_missing(self, todo_dir):
+        with pytest.raises(ValueError):
+            fast(["restore", "7"], todo_dir)
+
+
+class TestStorage:
+    """Test running the app on the SQLite backend."""
+
+    def use_sqlite(self, todo_dir):
+        parse_command(["migrate", "sqlite"], make_app(todo_dir))
+        with open(os.path.join(todo_dir, "config"), "w") as file:
+            file.write("STORAGE sqlite\n")
+
+    def test_01_commands(self, todo_dir, capsys):
+        self.use_sqlite(todo_dir)
+        parse_command(["add", "A", "+work", "due:211201", "write report"], make_app(todo_dir))
+        parse_command(["pri", "3", "A"], make_app(todo_dir))
+        parse_command(["do", "1"], make_app(todo_dir))
+        capsys.readouterr()
+
+        parse_command(["list"], make_app(todo_dir))
+        assert len(capsys.readouterr().out.splitlines()) == 3
+        parse_command(["sql", "tag", "=", "'+work'"], make_app(todo_dir))
+        assert capsys.readouterr().out.endswith("+work due:211201 write report\n")
+        assert fast(["overdue"], todo_dir)
+        assert "write report" in capsys.readouterr().out
+
+        parse_command(["migrate", "text"], make_app(todo_dir))
+        assert "write report" in read(todo_dir, "todo.txt")
+
+    def test_02_sql_needs_sqlite(self, todo_dir):
+        with pytest.raises(ValueError):
+            parse_command(["sql", "1"], make_app(todo_dir))
+
+    def test_03_binary(self, todo_dir, capsys):
+        parse_command(["migrate", "binary"], make_app(todo_dir))
+        with open(os.path.join(todo_dir, "config"), "w") as file:
+            file.write("STORAGE binary\n")
+
+        parse_command(["pri", "3", "A"], make_app(todo_dir))
+        parse_command(["rm", "2"], make_app(todo_dir))
+        parse_command(["undo"], make_app(todo_dir))
+        parse_command(["migrate", "text"], make_app(todo_dir))
+        assert read(todo_dir, "todo.txt") == ("(A) 211028 +work deploy the thing\n"
+                                              "(A) 211115 read a book\n"
+                                              "(B) 211101 +home water plants\n")
+
+
+    def test_04_export_import(self, todo_dir, capsys, monkeypatch):
+        self.use_sqlite(todo_dir)
+        parse_command(["add", "A", "only in the database"], make_app(todo_dir))
+        capsys.readouterr()
+        assert fast(["export", "--format", "jsonl"], todo_dir)
+        exported = capsys.readouterr().out
+        assert len(exported.splitlines()) == 4
+        assert "only in the database" in exported
+
+        monkeypatch.setattr("sys.stdin", io.StringIO(exported))
+        assert fast(["import", "--format", "jsonl"], todo_dir)
+        parse_command(["list"], make_app(todo_dir))
+        assert len(capsys.readouterr().out.splitlines()) == 8
+        assert "only in the database" not in read(todo_dir, "todo.txt")
+
+    @pytest.mark.parametrize("kind", ["sqlite", "binary"])
+    def test_05_snapshot(self, todo_dir, capsys, kind):
+        parse_command(["migrate", kind], make_app(todo_dir))
+        with open(os.path.join(todo_dir, "config"), "w") as file:
+            file.write(f"STORAGE {kind}\n")
+        parse_command(["add", "A", "snapshotted"], make_app(todo_dir))
+        assert fast(["snapshot"], todo_dir)
+        parse_command(["rm", "1"], make_app(todo_dir))
+        parse_command(["add", "A", "after the snapshot"], make_app(todo_dir))
+        capsys.readouterr()
+
+        assert fast(["restore", "1"], todo_dir)
+        parse_command(["list"], make_app(todo_dir))
+        listed = capsys.readouterr().out
+        assert "snapshotted" in listed and "after the snapshot" not in listed
+
+    def test_06_sync_needs_text(self, todo_dir, tmpdir_factory):
+        self.use_sqlite(todo_dir)
+        with pytest.raises(ValueError):
+            fast(["sync", str(tmpdir_factory.mktemp("other"))], todo_dir)
+
+class TestListCache:
+    """Test serving repeated listings from the rendered-output cache."""
+
+    def test_01_repeat_is_cached(self, todo_dir, capsys):
+        parse_command(["list", "verbose"], make_app(todo_dir))
+        rendered = capsys.readouterr().out
+
+        assert fast(["list", "verbose"], todo_dir)
+        assert capsys.readouterr().out == rendered
+        # Other options are rendered separately
+        assert not fast(["list"], todo_dir)
+
+    def test_02_changes_invalidate(self, todo_dir, capsys):
+        parse_command(["list"], make_app(todo_dir))
+        parse_command(["add", "A", "new", "task"], make_app(todo_dir))
+        assert not fast(["list"], todo_dir)
+
+        parse_command(["list"], make_app(todo_dir))
+        capsys.readouterr()
+        with open(os.path.join(todo_dir, "config"), "w") as file:
+            file.write("COLOR_TAG red\n")
+        assert not fast(["list"], todo_dir)
+
+
+class TestFuzzy:
+    """Test completing and finding tasks by fuzzy text."""
+
+    def test_01_do_by_text(self, todo_dir):
+        parse_command(["do", "~water", "plan"], make_app(todo_dir))
+        assert "water plants" not in read(todo_dir, "todo.txt")
+        assert "water plants" in read(todo_dir, "done.txt")
+
+    def test_02_ambiguous(self, todo_dir, capsys):
+        parse_command(["add", "C", "+home", "water lawn"], make_app(todo_dir))
+        todo = read(todo_dir, "todo.txt")
+        with pytest.raises(ValueError):
+            parse_command(["do", "~+home water"], make_app(todo_dir))
+        assert read(todo_dir, "todo.txt") == todo
+        assert len(capsys.readouterr().out.splitlines()) == 2
+
+    def test_03_find(self, todo_dir, capsys):
+        parse_command(["find", "~book"], make_app(todo_dir))
+        assert capsys.readouterr().out == "3 (C) 211115 read a book\n"
+
+
+class TestBulkEdit:
+    """Test sed and pri-all."""
+
+    def test_01_sed_tag(self, todo_dir, capsys):
+        parse_command(["sed", "s/+home/+house/"], make_app(todo_dir))
+        assert "(B) 211101 +house water plants" in read(todo_dir, "todo.txt")
+        assert "+home" not in read(todo_dir, "todo.txt")
+
+    def test_02_sed_condition_and_undo(self, todo_dir, capsys):
+        before = read(todo_dir, "todo.txt")
+        parse_command(["sed", "s/ t/ T/g", "+work"], make_app(todo_dir))
+        assert "(A) 211028 +work deploy The Thing" in read(todo_dir, "todo.txt")
+        assert "read a book" in read(todo_dir, "todo.txt")
+
+        parse_command(["undo"], make_app(todo_dir))
+        assert read(todo_dir, "todo.txt") == before
+
+    def test_03_invalid_result(self, todo_dir):
+        before = read(todo_dir, "todo.txt")
+        with pytest.raises(ValueError):
+            parse_command(["sed", "s/^.../(a)/"], make_app(todo_dir))
+        assert read(todo_dir, "todo.txt") == before
+
+    def test_04_dry_run(self, todo_dir, capsys):
+        before = read(todo_dir, "todo.txt")
+        parse_command(["pri-all", "+home", "A", "--dry-run"], make_app(todo_dir))
+        diff = capsys.readouterr().out.splitlines()
+        assert "-(B) 211101 +home water plants" in diff
+        assert "+(A) 211101 +home water plants" in diff
+        assert read(todo_dir, "todo.txt") == before
+
+    def test_05_pri_all(self, todo_dir, capsys):
+        parse_command(["add", "C", "+home", "water lawn"], make_app(todo_dir))
+        parse_command(["pri-all", "+home", "A"], make_app(todo_dir))
+        todo = read(todo_dir, "todo.txt")
+        assert "(A) 211101 +home water plants" in todo
+        assert f"(A) {ordinal_to_date(get_current_day())} +home water lawn" in todo
+        assert capsys.readouterr().out == "Changed 2 tasks.\n"
+
+
+class TestQuery:
+    """Test t query and its plans."""
+
+    def test_01_query(self, todo_dir, capsys):
+        parse_command(["query", "pri", "<=", "B", "and", "tag", "!=", "+work"],
+                      make_app(todo_dir))
+        assert capsys.readouterr().out == "2 (B) 211101 +home water plants\n"
+
+    def test_02_due_index(self, todo_dir, capsys):
+        parse_command(["add", "C", "+work", "due:211201", "write report"], make_app(todo_dir))
+        capsys.readouterr()
+        parse_command(["query", "--explain", "due <= 211231"], make_app(todo_dir))
+        assert capsys.readouterr().out.startswith("due index")
+        parse_command(["query", "due <= 211231"], make_app(todo_dir))
+        assert capsys.readouterr().out.endswith("+work due:211201 write report\n")
+
+    def test_03_sqlite_index(self, todo_dir, capsys):
+        TestStorage().use_sqlite(todo_dir)
+        capsys.readouterr()
+        parse_command(["query", "--explain", "tag = +home"], make_app(todo_dir))
+        assert capsys.readouterr().out.startswith("sqlite index: tag = ?")
+        parse_command(["query", "tag = +home"], make_app(todo_dir))
+        assert capsys.readouterr().out == "2 (B) 211101 +home water plants\n"
+
+    def test_04_lazy_reads(self, todo_dir, capsys):
+        # list, find and query decode task text as they use it
+        with open(os.path.join(todo_dir, "todo.txt"), "a") as file:
+            file.write("(B) 211101  +home\tsweep  floor\n")
+        paths = [os.path.join(todo_dir, name) for name in ["config", "todo.txt", "done.txt"]]
+        for args in [["list", "verbose"], ["find", "plants"], ["query", "tag = +home"]]:
+            parse_command(args, make_app(todo_dir))
+            expected = capsys.readouterr().out
+            if args[0] == "list":
+                # Otherwise the fast path answers from the cache list wrote
+                os.remove(os.path.join(todo_dir, "list.cache"))
+            run(args, *paths)
+            assert capsys.readouterr().out == expected
+        assert expected.splitlines()[1] == "3 (B) 211101 +home water plants"
+        assert TodoApp(*paths, lazy=True).tasklist.tasks[0]._text is None
+
+
+class TestDedupe:
+    """Test dedupe and add --unique."""
+
+    def test_01_report_and_merge(self, todo_dir, capsys):
+        parse_command(["add", "C", "+work", "Deploy", "the", "thing"], make_app(todo_dir))
+        capsys.readouterr()
+        parse_command(["dedupe"], make_app(todo_dir))
+        assert capsys.readouterr().out.splitlines()[:2] == [
+            "1 (A) 211028 +work deploy the thing",
+            f"4 (C) {ordinal_to_date(get_current_day())} +work Deploy the thing"]
+
+        before = read(todo_dir, "todo.txt")
+        parse_command(["dedupe", "--merge"], make_app(todo_dir))
+        assert "Deploy" not in read(todo_dir, "todo.txt")
+        parse_command(["undo"], make_app(todo_dir))
+        assert read(todo_dir, "todo.txt") == before
+
+    def test_02_against_done(self, todo_dir, capsys):
+        parse_command(["add", "B", "call", "mom"], make_app(todo_dir))
+        with open(os.path.join(todo_dir, "done.txt"), "a") as file:
+            file.write(f"x (B) 211001 {ordinal_to_date(get_current_day() - 1)} call mom\n")
+        capsys.readouterr()
+        parse_command(["dedupe", "--done", "7d", "--merge"], make_app(todo_dir))
+        assert "call mom" not in read(todo_dir, "todo.txt")
+        assert capsys.readouterr().out.endswith("Removed 1 duplicates.\n")
+
+    def test_03_add_unique(self, todo_dir, capsys):
+        before = read(todo_dir, "todo.txt")
+        parse_command(["add", "--unique", "B", "+home", "water", "plants"], make_app(todo_dir))
+        assert read(todo_dir, "todo.txt") == before
+        assert capsys.readouterr().out.startswith("Already on line 2:")
+
+        parse_command(["add", "--unique", "B", "+home", "water", "lawn"], make_app(todo_dir))
+        assert "water lawn" in read(todo_dir, "todo.txt")
+
+
+class TestTolerantLoad:
+    """Test running with invalid lines in todo.txt."""
+
+    def test_01_commands_keep_working(self, todo_dir, capsys):
+        with open(os.path.join(todo_dir, "todo.txt"), "a") as file:
+            file.write("(Q) 211399 oops\n")
+        parse_command(["do", "1"], make_app(todo_dir))
+        assert "run `t fsck`" in capsys.readouterr().err
+        assert read(todo_dir, "todo.txt").endswith("(C) 211115 read a book\n(Q) 211399 oops\n")
+
+        assert fast(["fsck", "--quarantine"], todo_dir)
+        assert "todo.txt:3 (byte" in capsys.readouterr().out
+        assert read(todo_dir, "todo.txt.rejects") == "(Q) 211399 oops\n"
+        make_app(todo_dir)
+        assert capsys.readouterr().err == ""
+
+
+class TestDurability:
+    """Test completing several tasks and recovering interrupted completions."""
+
+    def test_01_do_many(self, todo_dir):
+        for durability in ["batch", "always", "none"]:
+            with open(os.path.join(todo_dir, "config"), "w") as file:
+                file.write(f"DURABILITY {durability}\n")
+            app = make_app(todo_dir)
+            parse_command(["do", "3", "1"], app)
+            today = ordinal_to_date(get_current_day())
+            assert read(todo_dir, "todo.txt") == "(B) 211101 +home water plants\n"
+            assert read(todo_dir, "done.txt").endswith(
+                f"x (A) 211028 {today} +work deploy the thing\n"
+                f"x (C) 211115 {today} read a book\n")
+            assert not os.path.exists(os.path.join(todo_dir, "done.intent"))
+
+            app.undo()
+            assert read(todo_dir, "todo.txt").count("\n") == 3
+            assert read(todo_dir, "done.txt").count("\n") == 2
+
+    def test_02_recover_on_start(self, todo_dir, capsys):
+        with open(os.path.join(todo_dir, "done.intent"), "w") as file:
+            file.write(f"{len(read(todo_dir, 'done.txt'))} stale signature\n"
+                       "x (A) 211028 211201 +work deploy the thing\n")
+        make_app(todo_dir)
+        assert "interrupted" in capsys.readouterr().err
+        assert read(todo_dir, "done.txt").endswith("211201 +work deploy the thing\n")
+        assert not os.path.exists(os.path.join(todo_dir, "done.intent"))
+
+    def test_03_fast_command_recovers(self, todo_dir, capsys):
+        with open(os.path.join(todo_dir, "done.intent"), "w") as file:
+            file.write(f"{len(read(todo_dir, 'done.txt'))} stale signature\n"
+                       "x (A) 211028 211201 +work deploy the thing\n")
+        run(["help"], os.path.join(todo_dir, "config"),
+            os.path.join(todo_dir, "todo.txt"), os.path.join(todo_dir, "done.txt"))
+        captured = capsys.readouterr()
+        assert "interrupted" in captured.err
+        assert captured.out.startswith("Supported operations:")
+        assert read(todo_dir, "done.txt").endswith("211201 +work deploy the thing\n")
+        assert not os.path.exists(os.path.join(todo_dir, "done.intent"))
+
+
+class TestComplete:
+    """Test completion from the cache the app keeps."""
+
+    def test_01_cache_follows_saves(self, todo_dir, capsys):
+        parse_command(["add", "D", "+garden", "weed"], make_app(todo_dir))
+        assert fast(["complete", "rm", "4"], todo_dir)
+        assert capsys.readouterr().out == "4\t(D) +garden weed\n"
+        assert fast(["complete", "pri", "1", ""], todo_dir)
+        assert capsys.readouterr().out == "A\nB\nC\nD\n"
@@ -0,0 +1,72 @@
+"""Unittest for the compressed done archive."""
+
+import os
+
+from archive import DoneArchive
+from data import DoneTask
+from utils import date_to_ordinal, ordinal_to_date
+
+
+def make_tasks(count, first="210101"):
+    start = date_to_ordinal(first)
+    return [DoneTask.load(f"x (A) 210101 {ordinal_to_date(start + i // 10)} "
+                          f"+tag{i % 3} finished number {i}")
+            for i in range(count)]
+
+
+class TestDoneArchive:
+    """Test appending to and querying the archive."""
+
+    def test_01_round_trip(self, tmpdir):
+        path = os.path.join(tmpdir, "done.archive")
+        tasks = make_tasks(10000)
+        DoneArchive(path).append(tasks)
+
+        archive = DoneArchive(path)
+        assert len(archive) == 10000
+        assert len(archive.blocks) == 3
+        assert list(archive.between(None, None)) == tasks
+        assert os.path.getsize(path) * 4 < sum(len(str(t)) + 1 for t in tasks)
+
+    def test_02_between_reads_needed_blocks(self, tmpdir, monkeypatch):
+        path = os.path.join(tmpdir, "done.archive")
+        tasks = make_tasks(10000)
+        DoneArchive(path).append(tasks)
+        archive = DoneArchive(path)
+
+        read = []
+        original = archive.read_block
+        monkeypatch.setattr(archive, "read_block",
+                            lambda block: read.append(block) or original(block))
+
+        day = tasks[5000].completed
+        found = list(archive.between(day, day))
+        assert found == [t for t in tasks if t.completed == day]
+        assert read == [archive.blocks[1]]
+
+    def test_03_search(self, tmpdir):
+        path = os.path.join(tmpdir, "done.archive")
+        DoneArchive(path).append(make_tasks(100))
+        found = list(DoneArchive(path).search("number 42"))
+        assert [str(t).endswith("number 42") for t in found] == [True]
+
+    def test_04_empty(self, tmpdir):
+        archive = DoneArchive(os.path.join(tmpdir, "done.archive"))
+        assert len(archive) == 0
+        assert list(archive.between(None, None)) == []
+        assert archive.last(5) == []
+
+    def test_05_last(self, tmpdir, monkeypatch):
+        path = os.path.join(tmpdir, "done.archive")
+        tasks = make_tasks(10000)
+        DoneArchive(path).append(tasks)
+        archive = DoneArchive(path)
+
+        read = []
+        original = archive.read_block
+        monkeypatch.setattr(archive, "read_block",
+                            lambda block: read.append(block) or original(block))
+        assert archive.last(3) == tasks[-3:]
+        assert read == [archive.blocks[-1]]
+        assert archive.last(2000) == tasks[-2000:]
+        assert archive.last(0) == []
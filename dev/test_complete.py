@@ -0,0 +1,76 @@
+"""Unittest for shell completion."""
+
+import os
+
+import pytest
+
+from complete import CompletionCache, complete_words, completion_script
+from data import TaskList
+from storage import TextStorage
+
+
+def config_for(todo_path):
+    return os.path.join(os.path.dirname(todo_path), "config")
+
+
+def complete_words_in(words, todo_path):
+    return complete_words(words, config_for(todo_path), todo_path)
+
+
+@pytest.fixture
+def todo_path(tmpdir):
+    """A todo.txt with a completion cache built from it."""
+    open(os.path.join(tmpdir, "config"), "w").close()
+    path = os.path.join(tmpdir, "todo.txt")
+    with open(path, "w") as file:
+        file.write("(A) 211028 +work deploy the thing, and then a few more words\n"
+                   "(C) 211101 +home water plants\n"
+                   "(C) 211115 read a book\n")
+    storage = TextStorage(path)
+    CompletionCache.build(storage.load(), storage, config_for(path)).save(
+        CompletionCache.path_for(path))
+    return path
+
+
+class TestComplete:
+    """Test completing words."""
+
+    def test_01_commands_and_options(self, todo_path):
+        assert complete_words_in(["pr"], todo_path) == ["pri", "pri-all"]
+        assert complete_words_in(["done", "--"], todo_path) == [
+            "--between", "--search", "--last", "--today"]
+        assert complete_words_in(["export", "--format", ""], todo_path) == ["jsonl", "csv"]
+        assert complete_words_in(["list", "verbose", "--s"], todo_path) == ["--since"]
+        assert complete_words_in(["nope", ""], todo_path) == []
+
+    def test_02_from_cache(self, todo_path):
+        assert complete_words_in(["do", "1", ""], todo_path) == [
+            "1\t(A) +work deploy the thing, and then a f",
+            "2\t(C) +home water plants",
+            "3\t(C) read a book",
+        ]
+        assert complete_words_in(["pri", "2", ""], todo_path) == ["A", "C"]
+        assert complete_words_in(["add", "A", "+h"], todo_path) == ["+home"]
+        assert complete_words_in(["add", "A", "+work", "more", "+"], todo_path) == [
+            "+home", "+work"]
+
+    def test_03_cache_only(self, todo_path, monkeypatch):
+        def load(*_):
+            raise AssertionError("tasks were parsed")
+
+        monkeypatch.setattr(TaskList, "load", load)
+        assert complete_words_in(["rm", "3"], todo_path) == ["3\t(C) read a book"]
+
+    def test_04_stale_cache(self, todo_path):
+        with open(todo_path, "a") as file:
+            file.write("(B) 211201 +errands buy milk\n")
+        assert complete_words_in(["pri-all", "+e"], todo_path) == ["+errands"]
+        assert complete_words_in(["pri-all", "+home", ""], todo_path) == ["A", "B", "C"]
+
+    def test_05_scripts(self):
+        bash = completion_script("bash", "/home/me/bin/todotxt.py")
+        assert "/home/me/bin/todotxt.py complete" in bash
+        assert bash.endswith("-F _todotxt_complete t todotxt.py\n")
+        zsh = completion_script("zsh", "/home/me/bin/todotxt.py")
+        assert "${${line%%$'\\t'*}//:/\\\\:}" in zsh
+        assert zsh.endswith("compdef _todotxt t todotxt.py\n")
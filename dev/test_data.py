@@ -6,8 +6,16 @@ import random
 import pytest
 
 from constants import DefaultConfig
-from data import Config, Task, TaskList
-from utils import color_to_color_code
+from data import (
+    Config,
+    DoneList,
+    DoneTask,
+    LazyTask,
+    LazyTaskList,
+    Task,
+    TaskList,
+)
+from utils import color_to_color_code, date_to_ordinal
 
 
 class TestTask:
@@ -66,6 +74,106 @@ class TestTask:
         task_1 = Task.load(raw_1)
         assert task_0 != task_1
 
+    def test_11_due(self):
+        task = Task.load("(A) 211028 +tag pay rent due:211101 please")
+        assert task.due == date_to_ordinal("211101")
+        assert str(task) == "(A) 211028 +tag pay rent due:211101 please"
+
+    def test_12_no_due(self):
+        assert Task.load("(A) 211028 pay rent").due is None
+        assert Task.load("(A) 211028 pay rent due:tomorrow").due is None
+
+
+class TestDoneTask:
+    """Test DoneTask parsing."""
+
+    def test_01_valid_all(self):
+        raw = "x (A) 211028 211030 +todotxtpy do lots of epic stuff"
+        done = DoneTask.load(raw)
+        assert raw == str(done)
+        assert done.completed == date_to_ordinal("211030")
+        assert done.task.created == date_to_ordinal("211028")
+
+    def test_02_valid_notag(self):
+        raw = "x (A) 211028 211030 do lots of epic stuff"
+        assert raw == str(DoneTask.load(raw))
+
+    def test_03_invalid_mark(self):
+        with pytest.raises(ValueError):
+            DoneTask.load("y (A) 211028 211030 do stuff")
+
+    def test_04_invalid_completion_date(self):
+        with pytest.raises(ValueError):
+            DoneTask.load("x (A) 211028 211330 do stuff")
+
+
+class TestDoneList:
+    """Test DoneList range queries."""
+
+    def make(self, dates):
+        return DoneList([DoneTask.load(f"x (A) 210101 {date} task {i}")
+                         for i, date in enumerate(dates)])
+
+    def test_01_between_sorted(self):
+        done_list = self.make(["210105", "210110", "210110", "210120", "210201"])
+        found = done_list.between(date_to_ordinal("210110"), date_to_ordinal("210120"))
+        assert [str(done) for done in found] == [
+            "x (A) 210101 210110 task 1",
+            "x (A) 210101 210110 task 2",
+            "x (A) 210101 210120 task 3",
+        ]
+
+    def test_02_between_runs(self):
+        dates = ["210105", "210120", "210110", "210115", "210101", "210130"]
+        done_list = self.make(dates)
+        assert done_list.runs == [0, 2, 4]
+
+        start, end = date_to_ordinal("210110"), date_to_ordinal("210120")
+        found = done_list.between(start, end)
+        expected = [done for done in done_list.tasks
+                    if start <= done.completed <= end]
+        assert found == expected
+
+    def test_03_missing_file(self, tmpdir):
+        assert DoneList.load(os.path.join(tmpdir, "done.txt")).tasks == []
+        assert DoneList.tail(os.path.join(tmpdir, "done.txt"), count=3).tasks == []
+
+    def test_04_tail(self, tmpdir):
+        path = os.path.join(tmpdir, "done.txt")
+        done_list = self.make(["210105", "210110", "210110", "210120", "210120"])
+        with open(path, "w") as file:
+            for i, done in enumerate(done_list.tasks):
+                file.write(f"{done}\n" + ("oops\n\n" if i == 2 else ""))
+
+        assert DoneList.tail(path, count=2).tasks == done_list.tasks[3:]
+        assert DoneList.tail(path, count=4).tasks == done_list.tasks[1:]
+        assert DoneList.tail(path, count=9).tasks == done_list.tasks
+        assert DoneList.tail(path, count=0).tasks == []
+        since = DoneList.tail(path, since=date_to_ordinal("210110")).tasks
+        assert since == done_list.tasks[1:]
+
+
+    def test_05_load_between(self, tmpdir, monkeypatch):
+        path = os.path.join(tmpdir, "done.txt")
+        dates = [f"2101{day:02}" for day in range(1, 29) for _ in range(3)]
+        done_list = self.make(dates)
+        with open(path, "w") as file:
+            for i, done in enumerate(done_list.tasks):
+                file.write(f"{done}\n" + ("oops\n\n" if i % 10 == 4 else ""))
+
+        for start, end in [("210101", "210101"), ("210110", "210120"),
+                           ("210127", "210205"), ("201201", "201231")]:
+            found = DoneList.load_between(path, date_to_ordinal(start), date_to_ordinal(end))
+            assert found.tasks == done_list.between(date_to_ordinal(start),
+                                                    date_to_ordinal(end))
+
+        parsed = []
+        load = DoneTask.load
+        monkeypatch.setattr(DoneTask, "load", lambda line: parsed.append(line) or load(line))
+        day = date_to_ordinal("210115")
+        assert len(DoneList.load_between(path, day, day).tasks) == 3
+        assert len(parsed) < 20
+        assert DoneList.load_between(os.path.join(tmpdir, "none.txt"), day, day).tasks == []
 
 class TestTaskList:
     """Test TaskList loading and saving."""
@@ -97,7 +205,7 @@ class TestTaskList:
     def test_03_save(self, tmpdir):
         path = os.path.join(tmpdir, "testtodo.txt")
         task_0_raw = "(A) 420420 +tag do things"
-        task_1_raw = "(B) 696969 +gat thin"
+        task_1_raw = "(B) 220101 +gat thin"
 
         task_0 = Task.load(task_0_raw)
         task_1 = Task.load(task_1_raw)
@@ -112,14 +220,14 @@ class TestTaskList:
 
     def test_04_sort(self):
         raws = [
-            "(A) 012345 +tag text",
-            "(A) 012346 +tag text",
-            "(A) 012346 +zag text",
-            "(A) 012346 +zag zext",
-            "(A) 012346 text zag",
-            "(A) 012346 zext zag",
-            "(B) 012345 +tag text",
-            "(B) 012345 +tag text",
+            "(A) 010203 +tag text",
+            "(A) 010204 +tag text",
+            "(A) 010204 +zag text",
+            "(A) 010204 +zag zext",
+            "(A) 010204 text zag",
+            "(A) 010204 zext zag",
+            "(B) 010203 +tag text",
+            "(B) 010203 +tag text",
         ]
 
         tasks_sorted = [Task.load(raw) for raw in raws]
@@ -132,6 +240,77 @@ class TestTaskList:
 
         assert tasks_sorted == tasks_unsorted
 
+    def test_05_tolerant_load_keeps_invalid(self, tmpdir):
+        path = os.path.join(tmpdir, "testtodo.txt")
+        with open(path, "w") as file:
+            file.write("(B) 211028 second\nnot a task\n(A) 211028 first\n")
+
+        tasklist = TaskList.load(path, tolerant=True)
+        assert [task.text for task in tasklist.tasks] == ["second", "first"]
+        assert tasklist.invalid == ["not a task"]
+
+        tasklist.sort()
+        tasklist.save(path)
+        with open(path) as file:
+            assert file.read() == "(A) 211028 first\n(B) 211028 second\nnot a task\n"
+
+
+class TestLazyTaskList:
+    """Test loading tasks whose text is decoded when first used."""
+
+    raws = [
+        "(B) 211028 +work deploy due:211105",
+        "(A) 211028 +work",
+        "(A) 211028",
+        "(A) 211028 +work deploy",
+        "(A) 211028  +work two  spaces\r",
+        "(A) 211028 +work\ttab due:notadate",
+        "(C) 211029 caf\u00e9 \u00e0 emporter due:211101",
+        "(C) 211029 cafe",
+        "(Z) 211301 bad date",
+        "",
+        "not a task",
+    ]
+
+    def write(self, tmpdir):
+        path = os.path.join(tmpdir, "todo.txt")
+        with open(path, "w", newline="") as file:
+            file.write("\n".join(self.raws))
+        return path
+
+    def test_01_same_as_task_list(self, tmpdir):
+        path = self.write(tmpdir)
+        expected = TaskList.load(path, tolerant=True)
+        lazy = LazyTaskList.load(path, tolerant=True)
+        assert lazy.invalid == expected.invalid == ["(Z) 211301 bad date", "not a task"]
+        assert [task.text for task in lazy.tasks] == [task.text for task in expected.tasks]
+
+        random.shuffle(lazy.tasks)
+        expected.sort()
+        lazy.sort()
+        assert [str(task) for task in lazy.tasks] == [str(task) for task in expected.tasks]
+        assert [(task.created, task.due) for task in lazy.tasks] == \
+            [(task.created, task.due) for task in expected.tasks]
+
+    def test_02_lazy_text(self, tmpdir):
+        path = self.write(tmpdir)
+        tasks = LazyTaskList.load(path, tolerant=True).tasks
+        assert all(isinstance(task, LazyTask) for task in tasks)
+        # Lines as TaskList.save writes them are only decoded when used
+        first = tasks[0]
+        assert first.tag.tag == "+work" and first._text is None
+        assert first.due == date_to_ordinal("211105")
+        assert first._text == "deploy due:211105"
+        assert tasks[4]._text == "two spaces"
+
+    def test_03_invalid_load(self, tmpdir):
+        path = self.write(tmpdir)
+        with pytest.raises(ValueError):
+            LazyTaskList.load(path)
+
+        open(path, "w").close()
+        assert LazyTaskList.load(path).tasks == []
+
 
 class TestConfig:
     """Test Config loading."""
@@ -0,0 +1,24 @@
+"""Unittest for duplicate detection."""
+
+from data import Task
+from dedupe import duplicate_groups, task_hash
+
+
+class TestTaskHash:
+    """Test which tasks count as the same."""
+
+    def test_01_ignores_priority_date_case_spacing(self):
+        assert (task_hash(Task.load("(A) 211028 +work Deploy  the thing"))
+                == task_hash(Task.load("(C) 211101 +work deploy the THING")))
+
+    def test_02_tag_and_text_matter(self):
+        task = task_hash(Task.load("(A) 211028 +work deploy"))
+        assert task != task_hash(Task.load("(A) 211028 +home deploy"))
+        assert task != task_hash(Task.load("(A) 211028 deploy"))
+        assert task != task_hash(Task.load("(A) 211028 +work deploy it"))
+
+
+class TestDuplicateGroups:
+    def test_01_groups(self):
+        assert duplicate_groups([b"a", b"b", b"a", b"c", b"b", b"a"]) == [[0, 2, 5], [1, 4]]
+        assert duplicate_groups([b"a", b"b"]) == []
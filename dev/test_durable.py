@@ -0,0 +1,146 @@
+"""Unittest for crash-safe completion of tasks."""
+
+import os
+
+import pytest
+
+import durable
+from data import TaskList
+from durable import (Intent, append_records, commit_done, commit_retract, recover_done,
+                     remove_records)
+from storage import TextStorage
+
+DONE = ["x (A) 211001 211101 +work ship it", "x (B) 211001 211101 call mom"]
+
+
+@pytest.fixture
+def files(tmpdir):
+    """A todo.txt storage with two tasks, done.txt with one, and an intent path."""
+    todo_path = os.path.join(tmpdir, "todo.txt")
+    with open(todo_path, "w") as file:
+        file.write("(A) 211001 +work ship it\n(B) 211001 call mom\n")
+    done_path = os.path.join(tmpdir, "done.txt")
+    with open(done_path, "w") as file:
+        file.write("x (C) 210101 210102 older\n")
+    return TextStorage(todo_path, sync=True), done_path, os.path.join(tmpdir, "done.intent")
+
+
+def read(path):
+    with open(path) as file:
+        return file.read()
+
+
+class Crash(Exception):
+    pass
+
+
+class TestCommitDone:
+    """Test committing completions and recovering interrupted ones."""
+
+    def test_01_single_write(self, files, monkeypatch):
+        storage, done_path, intent_path = files
+        writes = []
+        original = os.write
+        monkeypatch.setattr(os, "write",
+                            lambda fd, data: writes.append(data) or original(fd, data))
+        append_records(done_path, DONE, sync=True)
+        assert len(writes) == 1
+        assert read(done_path) == "x (C) 210101 210102 older\n" + "".join(f"{r}\n" for r in DONE)
+
+    def test_02_commit(self, files):
+        storage, done_path, intent_path = files
+        for durability in ["batch", "none"]:
+            commit_done(intent_path, done_path, DONE[:1], storage,
+                        lambda: storage.save(TaskList([])), durability)
+            assert not os.path.exists(intent_path)
+        assert read(storage.path) == ""
+        assert read(done_path).endswith(f"{DONE[0]}\n{DONE[0]}\n")
+        assert recover_done(intent_path, done_path, storage) is None
+
+    def test_03_crash_before_save(self, files):
+        storage, done_path, intent_path = files
+
+        def save():
+            raise Crash()
+
+        with pytest.raises(Crash):
+            commit_done(intent_path, done_path, DONE, storage, save, "batch")
+        assert recover_done(intent_path, done_path, storage) is False
+        assert read(done_path) == "x (C) 210101 210102 older\n"
+        assert not os.path.exists(intent_path)
+
+    def test_04_crash_after_save(self, files, monkeypatch):
+        storage, done_path, intent_path = files
+
+        def append(path, records, sync=False):
+            # Half of the first record makes it to disk
+            with open(path, "a") as file:
+                file.write(records[0][:10])
+            raise Crash()
+
+        monkeypatch.setattr(durable, "append_records", append)
+        with pytest.raises(Crash):
+            commit_done(intent_path, done_path, DONE, storage,
+                        lambda: storage.save(TaskList([])), "batch")
+        monkeypatch.undo()
+
+        assert recover_done(intent_path, done_path, storage) is True
+        expected = "x (C) 210101 210102 older\n" + "".join(f"{r}\n" for r in DONE)
+        assert read(done_path) == expected
+
+        # Recovering again, say after a crash before the intent was removed,
+        # does not write the records twice
+        offset = len("x (C) 210101 210102 older\n")
+        Intent(offset, "stale signature", DONE).save(intent_path)
+        assert recover_done(intent_path, done_path, storage) is True
+        assert read(done_path) == expected
+
+
+class TestCommitRetract:
+    """Test removing records from done.txt after the tasks are saved back."""
+
+    def test_01_remove_records(self, files):
+        storage, done_path, intent_path = files
+        append_records(done_path, DONE)
+        # The tail is cut off, whatever order the records are given in
+        assert remove_records(done_path, DONE[::-1]) == []
+        assert read(done_path) == "x (C) 210101 210102 older\n"
+
+        append_records(done_path, DONE)
+        assert remove_records(done_path, ["x (C) 210101 210102 older", "archived"]) == ["archived"]
+        assert read(done_path) == "".join(f"{r}\n" for r in DONE)
+
+    def test_02_crash_after_save(self, files, monkeypatch):
+        storage, done_path, intent_path = files
+        append_records(done_path, DONE)
+
+        def remove(path, records, sync=False):
+            raise Crash()
+
+        monkeypatch.setattr(durable, "remove_records", remove)
+        with pytest.raises(Crash):
+            commit_retract(intent_path, done_path, DONE, storage,
+                           lambda: storage.save(TaskList([])), "batch")
+        monkeypatch.undo()
+
+        assert Intent.load(intent_path).retract
+        assert recover_done(intent_path, done_path, storage) is True
+        assert read(done_path) == "x (C) 210101 210102 older\n"
+
+        # Recovering again does not remove older copies of the records
+        append_records(done_path, DONE[:1])
+        Intent(len(read(done_path)) + 1, "stale signature", DONE[:1], retract=True).save(intent_path)
+        assert recover_done(intent_path, done_path, storage) is True
+        assert read(done_path) == f"x (C) 210101 210102 older\n{DONE[0]}\n"
+
+    def test_03_crash_before_save(self, files):
+        storage, done_path, intent_path = files
+        append_records(done_path, DONE)
+
+        def save():
+            raise Crash()
+
+        with pytest.raises(Crash):
+            commit_retract(intent_path, done_path, DONE, storage, save, "batch")
+        assert recover_done(intent_path, done_path, storage) is False
+        assert read(done_path).endswith(f"{DONE[1]}\n")
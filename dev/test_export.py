@@ -0,0 +1,61 @@
+"""Unittest for export and import."""
+
+import io
+import os
+
+import pytest
+
+from archive import DoneArchive
+from data import DoneTask
+from export import export_tasks, import_tasks, parse_records, read_records
+
+
+class TestRecords:
+    """Test conversion between lines and records."""
+
+    def test_01_todo_record(self):
+        [record] = read_records(["(A) 211028 +tag do things\n"], done=False)
+        assert record == {"priority": "A", "creation_date": "211028",
+                          "completion_date": None, "tag": "+tag",
+                          "text": "do things"}
+
+    def test_02_done_record(self):
+        [record] = read_records(["x (B) 211028 211030 no tag\n"], done=True)
+        assert record["completion_date"] == "211030"
+        assert record["tag"] is None
+
+
+class TestExportImport:
+    """Test round trips through each format."""
+
+    @pytest.mark.parametrize("fmt", ["jsonl", "csv"])
+    def test_01_todo_round_trip(self, tmpdir, fmt):
+        lines = "(A) 211028 +tag do things, \"quoted\"\n(B) 211029 no tag\n"
+        path = os.path.join(tmpdir, "todo.txt")
+        with open(path, "w") as file:
+            file.write(lines)
+
+        out = io.StringIO()
+        export_tasks(out, path, fmt)
+        copy_path = os.path.join(tmpdir, "copy.txt")
+        assert import_tasks(io.StringIO(out.getvalue()), copy_path, fmt) == 2
+        with open(copy_path) as file:
+            assert file.read() == lines
+
+    @pytest.mark.parametrize("fmt", ["jsonl", "csv"])
+    def test_02_done_with_archive(self, tmpdir, fmt):
+        archive_path = os.path.join(tmpdir, "done.archive")
+        DoneArchive(archive_path).append([DoneTask.load("x (A) 211001 211002 archived")])
+        path = os.path.join(tmpdir, "done.txt")
+        with open(path, "w") as file:
+            file.write("x (A) 211001 211005 +tag recent\n")
+
+        out = io.StringIO()
+        export_tasks(out, path, fmt, done=True, archive_path=archive_path)
+        records = list(parse_records(io.StringIO(out.getvalue()), fmt))
+        assert [r["text"] for r in records] == ["archived", "recent"]
+
+    def test_03_import_invalid(self, tmpdir):
+        records = '{"priority": "a", "creation_date": "211028", "text": "x"}\n'
+        with pytest.raises(ValueError):
+            import_tasks(io.StringIO(records), os.path.join(tmpdir, "todo.txt"), "jsonl")
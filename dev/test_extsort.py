@@ -0,0 +1,52 @@
+"""Unittest for the external merge sort."""
+
+import os
+import random
+
+from data import Task, TaskList
+from extsort import sort_file
+
+
+def write_lines(path, lines):
+    with open(path, "w") as file:
+        file.writelines(f"{line}\n" for line in lines)
+
+
+def random_tasks(count):
+    rng = random.Random(0)
+    return [f"({rng.choice('ABC')}) 21{rng.randint(1, 12):02}{rng.randint(1, 28):02} "
+            + ("+work " if rng.random() < 0.5 else "") + f"task {rng.randrange(50)}"
+            for _ in range(count)]
+
+
+class TestSortFile:
+    """Test sorting task files through runs on disk."""
+
+    def test_01_matches_in_memory_sort(self, tmpdir):
+        path = os.path.join(tmpdir, "todo.txt")
+        lines = random_tasks(1000)
+        write_lines(path, lines)
+
+        # About 40 bytes per line, so many runs and several merge passes
+        assert sort_file(path, run_bytes=400, fan_in=4) > 16
+        tasklist = TaskList([Task.load(line) for line in lines])
+        tasklist.sort()
+        with open(path) as file:
+            assert file.read().splitlines() == [str(task) for task in tasklist.tasks]
+        assert os.listdir(tmpdir) == ["todo.txt"]
+
+    def test_02_done_by_completion(self, tmpdir):
+        path = os.path.join(tmpdir, "done.txt")
+        lines = ["x (A) 211001 211020 b", "x (B) 211001 211005 a",
+                 "", "x (A) 211001 211005 c"]
+        write_lines(path, lines)
+        sort_file(path, done=True, run_bytes=30)
+        with open(path) as file:
+            assert file.read().splitlines() == [
+                "x (A) 211001 211005 c", "x (B) 211001 211005 a", "x (A) 211001 211020 b"]
+
+    def test_03_empty(self, tmpdir):
+        path = os.path.join(tmpdir, "todo.txt")
+        write_lines(path, [])
+        assert sort_file(path) == 0
+        assert os.path.getsize(path) == 0
@@ -0,0 +1,49 @@
+"""Unittest for the integrity check."""
+
+import os
+
+from constants import REJECTS_SUFFIX
+from data import Task
+from fsck import check_file, fsck
+
+
+def write(path, content):
+    with open(path, "wb") as file:
+        file.write(content)
+
+
+class TestCheckFile:
+    """Test streaming checks of one file."""
+
+    def test_01_line_and_offset(self, tmpdir):
+        path = os.path.join(tmpdir, "todo.txt")
+        write(path, b"(A) 211028 fine\n\n(B) 211345 bad date\n\xff\xfe\n")
+        problems = check_file(path, Task.load)
+        assert [(p.line_number, p.offset) for p in problems] == [(3, 17), (4, 37)]
+        assert "211345" in problems[0].message
+        assert problems[1].message == "Not UTF-8"
+
+    def test_02_quarantine(self, tmpdir):
+        path = os.path.join(tmpdir, "todo.txt")
+        write(path, b"(A) 211028 fine\nbroken\n(B) 211028 also fine")
+        assert len(check_file(path, Task.load, quarantine=True)) == 1
+        with open(path, "rb") as file:
+            assert file.read() == b"(A) 211028 fine\n(B) 211028 also fine"
+        with open(path + REJECTS_SUFFIX, "rb") as file:
+            assert file.read() == b"broken\n"
+
+    def test_03_clean_file_untouched(self, tmpdir):
+        path = os.path.join(tmpdir, "todo.txt")
+        write(path, b"(A) 211028 fine\n")
+        assert check_file(path, Task.load, quarantine=True) == []
+        assert os.listdir(tmpdir) == ["todo.txt"]
+
+
+class TestFsck:
+    def test_01_all_files(self, tmpdir):
+        config, todo, done = (os.path.join(tmpdir, name)
+                              for name in ["config", "todo.txt", "done.txt"])
+        write(config, b"# comment\nCOLOR_TAG mauve\n")
+        write(todo, b"(A) 211028 fine\n")
+        problems = fsck(config, todo, done)
+        assert [(p.path, p.line_number) for p in problems] == [(config, 2)]
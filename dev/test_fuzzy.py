@@ -0,0 +1,45 @@
+"""Unittest for trigram fuzzy matching."""
+
+from data import Task, TaskList
+from fuzzy import TrigramIndex, trigrams
+
+
+def index_of(*lines):
+    return TrigramIndex.build(TaskList([Task.load(line) for line in lines]))
+
+
+class TestTrigrams:
+    """Test trigram extraction."""
+
+    def test_01_padded_words(self):
+        assert trigrams("Ab cd") == {"  a", " ab", "ab ", "  c", " cd", "cd "}
+
+    def test_02_empty(self):
+        assert trigrams("  ") == set()
+
+
+class TestTrigramIndex:
+    """Test ranking and ambiguity."""
+
+    def test_01_partial_words(self):
+        index = index_of("(A) 211028 +work deploy the thing",
+                         "(B) 211101 +home water plants",
+                         "(B) 211101 +home watering can")
+        matches = index.search("water plan")
+        assert [match.index for match in matches] == [1, 2]
+        assert len(index.candidates("water plan")) == 1
+
+    def test_02_tags(self):
+        index = index_of("(A) 211028 +work deploy the thing",
+                         "(B) 211101 +home water plants")
+        assert [match.index for match in index.search("+home")] == [1]
+
+    def test_03_ambiguous(self):
+        index = index_of("(A) 211028 call mom",
+                         "(B) 211101 call mom again")
+        assert len(index.candidates("call mom")) == 2
+
+    def test_04_no_match(self):
+        index = index_of("(A) 211028 call mom")
+        assert index.search("xyzzy") == []
+        assert index.candidates("xyzzy") == []
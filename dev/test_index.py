@@ -0,0 +1,134 @@
+"""Unittest for persistent indexes."""
+
+import os
+
+from data import DoneList, Task, TaskList
+from index import DoneRuns, DueIndex
+from storage import SqliteStorage, TextStorage
+from utils import date_to_ordinal
+
+
+def config_for(todo_path):
+    """Return the path of an empty config next to todo_path."""
+    path = os.path.join(os.path.dirname(todo_path), "config")
+    if not os.path.exists(path):
+        open(path, "w").close()
+    return path
+
+
+def write_tasks(path, raws):
+    task_list = TaskList([Task.load(raw) for raw in raws])
+    task_list.sort()
+    task_list.save(path)
+    return task_list
+
+
+class TestDueIndex:
+    """Test building, saving and querying the due date index."""
+
+    raws = [
+        "(A) 211028 +work deploy due:211105",
+        "(B) 211028 no due date",
+        "(B) 211029 water plants due:211101",
+        "(C) 211030 due:notadate stays text",
+    ]
+
+    def test_01_build(self, tmpdir):
+        path = os.path.join(tmpdir, "todo.txt")
+        task_list = write_tasks(path, self.raws)
+        index = DueIndex.build(task_list, TextStorage(path), config_for(path))
+        assert index.source == f"text {path}"
+        assert index.entries == [
+            (date_to_ordinal("211101"), 3, "(B) 211029 water plants due:211101"),
+            (date_to_ordinal("211105"), 1, "(A) 211028 +work deploy due:211105"),
+        ]
+
+    def test_02_save_load(self, tmpdir):
+        path = os.path.join(tmpdir, "todo.txt")
+        index_path = os.path.join(tmpdir, "due.idx")
+        index = DueIndex.build(write_tasks(path, self.raws), TextStorage(path), config_for(path))
+        index.save(index_path)
+        assert DueIndex.load(index_path) == index
+
+    def test_03_stale(self, tmpdir):
+        path = os.path.join(tmpdir, "todo.txt")
+        index_path = os.path.join(tmpdir, "due.idx")
+        DueIndex.build(write_tasks(path, self.raws), TextStorage(path), config_for(path)).save(index_path)
+        write_tasks(path, self.raws[:1])
+        assert DueIndex.load(index_path).signature != TextStorage(path).signature()
+
+        index = DueIndex.for_todo(config_for(path), path)
+        assert len(index.entries) == 1
+        assert DueIndex.load(index_path) == index
+
+    def test_04_between(self, tmpdir):
+        path = os.path.join(tmpdir, "todo.txt")
+        index = DueIndex.build(write_tasks(path, self.raws), TextStorage(path), config_for(path))
+        nov_1, nov_5 = date_to_ordinal("211101"), date_to_ordinal("211105")
+        assert [e[1] for e in index.between(None, nov_1)] == [3]
+        assert [e[1] for e in index.between(nov_1 + 1, None)] == [1]
+        assert [e[1] for e in index.between(nov_1, nov_5)] == [3, 1]
+        assert index.between(nov_5 + 1, None) == []
+
+    def test_05_configured_storage(self, tmpdir):
+        path = os.path.join(tmpdir, "todo.txt")
+        config_path = config_for(path)
+        storage = SqliteStorage(os.path.join(tmpdir, "todo.db"))
+        storage.save(TaskList([Task.load(raw) for raw in self.raws]))
+
+        # No index and no todo.txt: the configured storage is read
+        with open(config_path, "w") as file:
+            file.write("STORAGE sqlite\n")
+        assert len(DueIndex.for_todo(config_path, path).entries) == 2
+        assert DueIndex.load(os.path.join(tmpdir, "due.idx")).source.startswith("sqlite ")
+
+        # Switching storage in config invalidates the index
+        write_tasks(path, self.raws[:1])
+        with open(config_path, "w") as file:
+            file.write("STORAGE text\n")
+        assert len(DueIndex.for_todo(config_path, path).entries) == 1
+
+
+class TestDoneRuns:
+    """Test finding the sorted runs of done.txt."""
+
+    def between(self, path, start, end):
+        runs = DoneRuns.for_done(path).ranges()
+        found = DoneList.load_between(path, date_to_ordinal(start), date_to_ordinal(end), runs)
+        return [done.completion_date for done in found.tasks]
+
+    def test_01_unsorted_append(self, tmpdir):
+        path = os.path.join(tmpdir, "done.txt")
+        with open(path, "w") as file:
+            file.write("x (A) 240101 240105 one\nx (A) 240101 240110 two\n"
+                       "x (A) 240101 240103 synced\n")
+
+        assert DoneRuns.for_done(path).starts == [0, 48]
+        assert self.between(path, "240103", "240104") == ["240103"]
+        assert self.between(path, "240101", "240131") == ["240105", "240110", "240103"]
+
+    def test_02_incremental(self, tmpdir):
+        path = os.path.join(tmpdir, "done.txt")
+        with open(path, "w") as file:
+            file.write("x (A) 240101 240105 one\nnot a task\n")
+        first = DoneRuns.for_done(path)
+        assert first.starts == [0] and first.scanned == 35
+
+        with open(path, "a") as file:
+            file.write("x (A) 240101 240102 older\nx (A) 240101 240106 partial")
+        runs = DoneRuns.for_done(path)
+        assert runs.starts == [0, 35] and runs.scanned == 61
+        assert runs.ranges() == [(0, 35), (35, 61), (61, 88)]
+        assert self.between(path, "240106", "240106") == ["240106"]
+
+    def test_03_rewritten(self, tmpdir):
+        path = os.path.join(tmpdir, "done.txt")
+        with open(path, "w") as file:
+            file.write("x (A) 240101 240105 one\nx (A) 240101 240103 two\n")
+        assert DoneRuns.for_done(path).starts == [0, 24]
+
+        # Same size and inode, different contents
+        with open(path, "r+") as file:
+            file.write("x (A) 240101 240101 one\nx (A) 240101 240103 two\n")
+        assert DoneRuns.for_done(path).starts == [0]
+        assert DoneRuns.for_done(os.path.join(tmpdir, "missing.txt")).ranges() == []
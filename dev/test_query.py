@@ -0,0 +1,69 @@
+"""Unittest for the query language and planner."""
+
+import pytest
+
+from data import Task, TaskList
+from query import Query, sorted_scan
+
+LINES = [
+    "(A) 211028 +work deploy the thing",
+    "(A) 211102 +work deploy again due:211110",
+    "(B) 211015 +home water plants",
+    "(B) 211101 +work write Deploy notes",
+    "(C) 211115 read a book due:211120",
+    "(D) 211001 +work someday",
+]
+
+
+def tasklist():
+    return TaskList([Task.load(line) for line in LINES])
+
+
+def matching(text):
+    query = Query.parse(text)
+    return [str(task) for task in tasklist().tasks if query.predicate(task)]
+
+
+class TestQuery:
+    """Test parsing and compiled predicates."""
+
+    def test_01_conjunction(self):
+        assert matching('pri <= C and tag = +work and created >= 211030 '
+                        'and text ~ "deploy"') == [LINES[1], LINES[3]]
+
+    def test_02_or_not_parentheses(self):
+        assert matching("not (tag = +work or pri = C)") == [LINES[2]]
+        assert matching("tag = none or due < 211111") == [LINES[1], LINES[4]]
+
+    def test_03_due(self):
+        assert matching("due != none") == [LINES[1], LINES[4]]
+        assert matching("due >= 211111") == [LINES[4]]
+
+    def test_04_invalid(self):
+        for text in ["pri", "pri <", "pri <= 3", "colour = red", "created ~ 21",
+                     "tag < +work", "(pri = A", "pri = A pri = B", "text > a"]:
+            with pytest.raises(ValueError):
+                Query.parse(text)
+
+
+class TestPlan:
+    """Test narrowing candidates on the sorted order."""
+
+    def test_01_bounds(self):
+        query = Query.parse("pri > A and pri < D and created < 211101")
+        assert query.bounds("pri") == (ord("B"), ord("C"))
+
+    def test_02_sorted_scan(self):
+        plan, candidates = sorted_scan(Query.parse("pri >= B and pri <= C"), tasklist())
+        assert [line for line, _ in candidates] == [3, 4, 5]
+        assert "3-5" in plan
+
+    def test_03_created_per_priority(self):
+        query = Query.parse("created >= 211101 and created <= 211110")
+        _, candidates = sorted_scan(query, tasklist())
+        assert [line for line, _ in candidates] == [2, 4]
+
+    def test_04_no_bounds_under_or(self):
+        query = Query.parse("pri = A or created > 211101")
+        assert query.bounds("pri") == (None, None)
+        assert len(sorted_scan(query, tasklist())[1]) == len(LINES)
@@ -0,0 +1,63 @@
+"""Unittest for deduplicated snapshots."""
+
+import io
+import os
+
+from constants import SNAPSHOT_CHUNK_MAX
+from snapshot import SnapshotStore, split_chunks
+
+
+def write_done(path, count):
+    with open(path, "w") as file:
+        for i in range(count):
+            file.write(f"x (A) 211001 211005 +tag{i % 7} finished task number {i}\n")
+
+
+class TestSplitChunks:
+    """Test content-defined chunking."""
+
+    def test_01_round_trip(self):
+        content = b"".join(b"(A) 211028 line %d\n" % i for i in range(5000))
+        chunks = list(split_chunks(io.BytesIO(content)))
+        assert len(chunks) > 1
+        assert b"".join(chunks) == content
+        assert all(chunk.endswith(b"\n") for chunk in chunks)
+        assert all(len(chunk) <= SNAPSHOT_CHUNK_MAX + 100 for chunk in chunks)
+
+    def test_02_append_keeps_chunks(self):
+        content = b"".join(b"(A) 211028 line %d\n" % i for i in range(5000))
+        before = list(split_chunks(io.BytesIO(content)))
+        after = list(split_chunks(io.BytesIO(content + b"(B) 211029 new\n")))
+        assert before[:-1] == after[:-1]
+
+
+class TestSnapshotStore:
+    """Test snapshots and restores."""
+
+    def test_01_snapshot_restore(self, tmpdir):
+        store = SnapshotStore(os.path.join(tmpdir, "snapshots"))
+        done_path = os.path.join(tmpdir, "done.txt")
+        write_done(done_path, 3000)
+        with open(done_path, "rb") as file:
+            original = file.read()
+
+        snapshot_id, new_chunks = store.snapshot([done_path, os.path.join(tmpdir, "missing")])
+        assert snapshot_id == 1 and new_chunks > 1
+
+        write_done(done_path, 10)
+        assert store.restore(1, tmpdir) == ["done.txt"]
+        with open(done_path, "rb") as file:
+            assert file.read() == original
+
+    def test_02_incremental(self, tmpdir):
+        store = SnapshotStore(os.path.join(tmpdir, "snapshots"))
+        done_path = os.path.join(tmpdir, "done.txt")
+        write_done(done_path, 3000)
+        store.snapshot([done_path])
+
+        assert store.snapshot([done_path]) == (2, 0)
+
+        with open(done_path, "a") as file:
+            file.write("x (A) 211001 211006 one more\n")
+        assert store.snapshot([done_path]) == (3, 1)
+        assert store.ids() == [1, 2, 3]
@@ -0,0 +1,200 @@
+"""Unittest for storage backends."""
+
+import os
+import random
+import struct
+
+from data import Task, TaskList
+from storage import BinaryStorage, SqliteStorage, TextStorage
+
+RAWS = [
+    "(A) 211028 +work deploy due:211101",
+    "(A) 211028 no tag",
+    "(A) 211028 +work deploy",
+    "(B) 211027 +home water plants",
+    "(B) 211027 +home water plants",
+    "(C) 211030 read",
+]
+
+
+def tasklist():
+    return TaskList([Task.load(raw) for raw in RAWS])
+
+
+class TestTextStorage:
+    """Test the todo.txt backend."""
+
+    def test_01_round_trip(self, tmpdir):
+        storage = TextStorage(os.path.join(tmpdir, "todo.txt"))
+        storage.save(tasklist())
+        assert storage.load() == tasklist()
+
+
+class TestSqliteStorage:
+    """Test the SQLite backend."""
+
+    def test_01_load_sorted(self, tmpdir):
+        storage = SqliteStorage(os.path.join(tmpdir, "todo.db"))
+        shuffled = tasklist()
+        random.shuffle(shuffled.tasks)
+        storage.save(shuffled)
+
+        expected = tasklist()
+        expected.sort()
+        assert storage.load() == expected
+
+    def test_02_save_only_changes(self, tmpdir):
+        storage = SqliteStorage(os.path.join(tmpdir, "todo.db"))
+        storage.save(tasklist())
+        ids_before = {row_id for row_id, _, _ in storage.rows()}
+
+        changed = storage.load()
+        changed.tasks[0].priority = "(D)"
+        changed.tasks.pop(3)
+        storage.save(changed)
+
+        ids_after = {row_id for row_id, _, _ in storage.rows()}
+        assert len(ids_before - ids_after) == 2
+        assert len(ids_after - ids_before) == 1
+        changed.sort()
+        assert storage.load() == changed
+
+    def test_03_rows_condition(self, tmpdir):
+        storage = SqliteStorage(os.path.join(tmpdir, "todo.db"))
+        storage.save(tasklist())
+        rows = storage.rows("tag = ? AND due IS NULL", ("+work",))
+        assert [(line_number, str(task)) for _, line_number, task in rows] == [
+            (1, "(A) 211028 +work deploy"),
+        ]
+
+    def test_04_signature(self, tmpdir):
+        storage = SqliteStorage(os.path.join(tmpdir, "todo.db"))
+        storage.save(tasklist())
+        signature = storage.signature()
+        storage.save(tasklist())
+        assert storage.signature() == signature
+
+        changed = tasklist()
+        changed.tasks[-1].priority = "(A)"
+        storage.save(changed)
+        assert storage.signature() != signature
+
+
+class TestBinaryStorage:
+    """Test the fixed-width record backend."""
+
+    def record_count(self, storage):
+        return ((os.path.getsize(storage.path) - BinaryStorage.HEADER.size)
+                // BinaryStorage.RECORD.size)
+
+    def test_01_round_trip(self, tmpdir):
+        path = os.path.join(tmpdir, "todo.bin")
+        BinaryStorage(path).save(tasklist())
+        expected = tasklist()
+        expected.sort()
+        assert BinaryStorage(path).load() == expected
+
+        # Heaps may outgrow 4 GiB
+        record = BinaryStorage(path).pack(Task.load(RAWS[1]), {}, 2**33, 6)
+        assert BinaryStorage.RECORD.unpack(record)[4] == 2**33
+
+    def test_02_in_place(self, tmpdir):
+        path = os.path.join(tmpdir, "todo.bin")
+        BinaryStorage(path).save(tasklist())
+        heap_size = os.path.getsize(path + ".heap")
+
+        storage = BinaryStorage(path)
+        signature = storage.signature()
+        loaded = storage.load()
+        loaded.tasks[1].priority = "(Z)"
+        loaded.tasks.pop(0)
+        storage.save(loaded)
+
+        assert self.record_count(storage) == len(RAWS)
+        assert os.path.getsize(path + ".heap") == heap_size
+        assert storage.signature() != signature
+        loaded.sort()
+        assert BinaryStorage(path).load() == loaded
+
+    def test_03_changed_text_appends(self, tmpdir):
+        path = os.path.join(tmpdir, "todo.bin")
+        BinaryStorage(path).save(tasklist())
+
+        storage = BinaryStorage(path)
+        loaded = storage.load()
+        loaded.tasks[0] = Task.load("(A) 211028 +new tag entirely")
+        loaded.tasks.append(Task.load("(E) 211101 +work another"))
+        storage.save(loaded)
+        loaded.tasks[2].priority = "(B)"
+        storage.save(loaded)
+
+        assert self.record_count(storage) == len(RAWS) + 2
+        loaded.sort()
+        assert BinaryStorage(path).load() == loaded
+        assert BinaryStorage(path).read_tags() == ["+work", "+home", "+new"]
+
+    def test_04_compact(self, tmpdir):
+        path = os.path.join(tmpdir, "todo.bin")
+        storage = BinaryStorage(path)
+        storage.save(tasklist())
+        loaded = storage.load()
+        del loaded.tasks[:3]
+        storage.save(loaded)
+
+        BinaryStorage(path).save(loaded)
+        assert self.record_count(storage) == len(RAWS) - 3
+        assert BinaryStorage(path).load() == loaded
+
+    def test_05_compacts_itself(self, tmpdir):
+        path = os.path.join(tmpdir, "todo.bin")
+        storage = BinaryStorage(path, sync=True)
+        storage.COMPACT_MIN = 2
+        storage.save(tasklist())
+        loaded = storage.load()
+        signature = storage.signature()
+
+        # One tombstone out of six records stays in place
+        loaded.tasks.pop()
+        storage.save(loaded)
+        assert self.record_count(storage) == len(RAWS)
+
+        # Four out of six is more than the live records
+        del loaded.tasks[:3]
+        storage.save(loaded)
+        assert self.record_count(storage) == 2
+        assert storage.tombstones == 0
+        assert storage.signature() != signature
+        assert not os.path.exists(path + ".new")
+        assert BinaryStorage(path).load() == loaded
+
+    def test_06_interrupted_rewrite(self, tmpdir):
+        path = os.path.join(tmpdir, "todo.bin")
+        BinaryStorage(path).save(tasklist())
+        new = TaskList([Task.load("(A) 211028 +other task")])
+
+        # Crash after the new files were synced, before they replaced the old
+        storage = BinaryStorage(os.path.join(tmpdir, "other.bin"))
+        storage.save(new)
+        for suffix in [".heap", ".tags", ""]:
+            os.replace(storage.path + suffix, path + suffix + (".tmp" if suffix else ".new"))
+        assert BinaryStorage(path).load() == new
+
+    def test_07_old_layout(self, tmpdir):
+        path = os.path.join(tmpdir, "todo.bin")
+        old = struct.Struct("<cBIHII")
+        with open(path, "wb") as file:
+            file.write(BinaryStorage.HEADER.pack(b"TODOBIN1", 3))
+            file.write(old.pack(b"B", 0, 738000, 1, 0, 4))
+            file.write(old.pack(b"A", BinaryStorage.TOMBSTONE, 738000, 0, 4, 4))
+        with open(path + ".heap", "wb") as file:
+            file.write(b"keepgone")
+        with open(path + ".tags", "w") as file:
+            file.write("+work\n")
+
+        storage = BinaryStorage(path)
+        loaded = storage.load()
+        assert [task.text for task in loaded.tasks] == ["keep"]
+        storage.save(loaded)
+        assert open(path, "rb").read(8) == BinaryStorage.MAGIC
+        assert self.record_count(storage) == 1
+        assert BinaryStorage(path).load() == loaded
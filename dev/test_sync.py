@@ -0,0 +1,88 @@
+"""Unittest for syncing todo directories."""
+
+import os
+from collections import Counter
+
+import pytest
+
+from sync import merge_counts, sync
+
+
+def write(directory, name, lines):
+    with open(os.path.join(directory, name), "w") as file:
+        file.write("".join(f"{line}\n" for line in lines))
+
+
+def read(directory, name):
+    with open(os.path.join(directory, name)) as file:
+        return file.read().splitlines()
+
+
+@pytest.fixture
+def dirs(tmpdir):
+    ours, theirs = os.path.join(tmpdir, "ours"), os.path.join(tmpdir, "theirs")
+    for directory in [ours, theirs]:
+        os.makedirs(directory)
+        write(directory, "todo.txt", ["(A) 211028 shared one", "(B) 211028 shared two"])
+        write(directory, "done.txt", ["x (A) 211001 211002 old"])
+    sync(ours, theirs, "todo.txt", "done.txt")
+    return ours, theirs
+
+
+class TestMergeCounts:
+    """Test the three-way multiset merge."""
+
+    def test_01_one_sided(self):
+        base = Counter("ab")
+        assert merge_counts(base, Counter("abc"), base) == Counter("abc")
+        assert merge_counts(base, base, Counter("a")) == Counter("a")
+
+    def test_02_both_sides(self):
+        base = Counter("ab")
+        assert merge_counts(base, Counter("bc"), Counter("ad")) == Counter("cd")
+        assert merge_counts(base, Counter("abc"), Counter("abc")) == Counter("abc")
+        assert merge_counts(base, Counter("b"), Counter("b")) == Counter("b")
+
+
+class TestSync:
+    """Test syncing two directories."""
+
+    def test_01_concurrent_edits(self, dirs):
+        ours, theirs = dirs
+        write(ours, "todo.txt", ["(A) 211028 shared one", "(B) 211028 shared two",
+                                 "(C) 211029 added here"])
+        write(theirs, "todo.txt", ["(B) 211028 shared two", "(A) 211030 added there"])
+        write(theirs, "done.txt", ["x (A) 211001 211002 old",
+                                   "x (A) 211028 211030 shared one"])
+
+        result = sync(ours, theirs, "todo.txt", "done.txt")
+        expected = ["(B) 211028 shared two", "(C) 211029 added here",
+                    "(A) 211030 added there"]
+        assert read(ours, "todo.txt") == expected
+        assert sorted(read(theirs, "todo.txt")) == sorted(expected)
+        assert read(ours, "done.txt") == read(theirs, "done.txt")
+        assert (result.todo_ours, result.done_ours, result.done_theirs) == (2, 1, 0)
+
+    def test_02_unchanged_not_rewritten(self, dirs):
+        ours, theirs = dirs
+        path = os.path.join(theirs, "todo.txt")
+        os.utime(path, ns=(0, 0))
+        result = sync(ours, theirs, "todo.txt", "done.txt")
+        assert result.todo_ours == result.todo_theirs == 0
+        assert os.stat(path).st_mtime_ns == 0
+
+    def test_03_no_base_is_union(self, tmpdir):
+        ours, theirs = os.path.join(tmpdir, "ours"), os.path.join(tmpdir, "theirs")
+        os.makedirs(ours)
+        os.makedirs(theirs)
+        write(ours, "todo.txt", ["(A) 211028 mine"])
+        write(theirs, "todo.txt", ["(A) 211028 yours"])
+        sync(ours, theirs, "todo.txt", "done.txt")
+        assert read(ours, "todo.txt") == ["(A) 211028 mine", "(A) 211028 yours"]
+        assert read(theirs, "todo.txt") == ["(A) 211028 yours", "(A) 211028 mine"]
+
+    def test_04_invalid_line(self, dirs):
+        ours, theirs = dirs
+        write(theirs, "todo.txt", ["(A) 211328 bad date"])
+        with pytest.raises(ValueError):
+            sync(ours, theirs, "todo.txt", "done.txt")
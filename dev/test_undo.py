@@ -0,0 +1,89 @@
+"""Unittest for the undo log."""
+
+import os
+
+from constants import UNDO_LIMIT
+from undo import Operation, UndoLog
+
+
+class TestOperation:
+    """Test Operation round trips."""
+
+    def test_01_round_trip(self):
+        for operation in [
+            Operation("add", None, "(A) 211028 text"),
+            Operation("pri", "(A) 211028 text", "(B) 211028 text"),
+            Operation("do", "(A) 211028 text", None, "x (A) 211028 211030 text"),
+        ]:
+            assert Operation.load(f"{operation}\n") == operation
+
+
+class TestUndoLog:
+    """Test the undo cursor and bound."""
+
+    def test_01_undo_redo(self, tmpdir):
+        log = UndoLog(os.path.join(tmpdir, "undo.log"))
+        ops = [Operation("add", None, f"(A) 211028 task {i}") for i in range(3)]
+        for op in ops:
+            log.record(op)
+
+        assert log.undo() == ops[2]
+        assert log.undo() == ops[1]
+        assert log.redo() == ops[1]
+        assert log.redo() == ops[2]
+        assert log.redo() is None
+
+    def test_02_record_drops_redo(self, tmpdir):
+        log = UndoLog(os.path.join(tmpdir, "undo.log"))
+        log.record(Operation("add", None, "(A) 211028 one"))
+        log.record(Operation("add", None, "(A) 211028 two"))
+        log.undo()
+        log.record(Operation("add", None, "(A) 211028 three"))
+        assert log.redo() is None
+        assert [op.after for op in log.operations] == ["(A) 211028 one", "(A) 211028 three"]
+
+    def test_03_bounded(self, tmpdir):
+        log = UndoLog(os.path.join(tmpdir, "undo.log"))
+        for i in range(UNDO_LIMIT + 10):
+            log.record(Operation("add", None, f"(A) 211028 task {i}"))
+        assert len(log.operations) == UNDO_LIMIT
+        assert log.operations[0].after == "(A) 211028 task 10"
+
+    def test_04_save_load(self, tmpdir):
+        path = os.path.join(tmpdir, "undo.log")
+        log = UndoLog(path)
+        log.record(Operation("rm", "(A) 211028 one", None))
+        log.record(Operation("add", None, "(A) 211028 two"))
+        log.undo()
+        log.save()
+
+        loaded = UndoLog(path)
+        assert loaded.operations == log.operations
+        assert loaded.position == 1
+
+    def test_05_groups(self, tmpdir):
+        log = UndoLog(os.path.join(tmpdir, "undo.log"))
+        log.record(Operation("add", None, "(A) 211028 one"))
+        group = [Operation("sed", f"(A) 211028 {i}", f"(A) 211028 x{i}", None, "1")
+                 for i in range(3)]
+        log.record_group(group)
+
+        assert log.undo_group() == group[::-1]
+        assert log.undo_group() == [log.operations[0]]
+        assert log.redo_group() == [log.operations[0]]
+        assert log.redo_group() == group
+
+    def test_06_groups_bounded(self, tmpdir):
+        log = UndoLog(os.path.join(tmpdir, "undo.log"))
+        log.record_group([Operation("sed", None, f"(A) 211028 a{i}", None, "1")
+                          for i in range(UNDO_LIMIT - 5)])
+        log.record(Operation("add", None, "(A) 211028 one"))
+        log.record_group([Operation("sed", None, f"(A) 211028 b{i}", None, "2")
+                          for i in range(10)])
+        # The first group is dropped whole rather than split
+        assert [op.group for op in log.operations] == [None] + ["2"] * 10
+
+        log.record_group([Operation("sed", None, f"(A) 211028 c{i}", None, "3")
+                          for i in range(UNDO_LIMIT + 5)])
+        # The newest group is kept whole even past the limit
+        assert len(log.operations) == UNDO_LIMIT + 5
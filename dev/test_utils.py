@@ -1,14 +1,21 @@
 """Unittest for data classes."""
 
+import os
+
 import pytest
 
 from constants import Colors
 from utils import (
     color_to_color_code,
+    date_to_ordinal,
     is_valid_date,
     is_valid_line_number,
     is_valid_priority,
     is_valid_tag,
+    parse_substitution,
+    ordinal_to_date,
+    parse_days,
+    read_lines_reversed,
 )
 
 
@@ -47,7 +54,7 @@ class TestIsValidPriority:
 
 class TestIsValidDate:
     def test_01_valid(self):
-        raw = "012345"
+        raw = "211028"
         assert is_valid_date(raw)
 
     def test_02_invalid(self):
@@ -62,6 +69,28 @@ class TestIsValidDate:
         raw = "2012345"
         assert not is_valid_date(raw)
 
+    def test_05_invalid_calendar(self):
+        assert not is_valid_date("211345")
+        assert not is_valid_date("210230")
+        assert not is_valid_date("210000")
+
+    def test_06_leap_day(self):
+        assert is_valid_date("240229")
+        assert not is_valid_date("230229")
+
+
+class TestDateToOrdinal:
+    def test_01_round_trip(self):
+        for raw in ["000101", "211028", "240229", "991231"]:
+            assert ordinal_to_date(date_to_ordinal(raw)) == raw
+
+    def test_02_order(self):
+        assert date_to_ordinal("211231") + 1 == date_to_ordinal("220101")
+
+    def test_03_invalid(self):
+        with pytest.raises(ValueError):
+            date_to_ordinal("211345")
+
 
 class TestIsValidTag:
     def test_01_valid(self):
@@ -89,3 +118,50 @@ class TestIsValidLineNumber:
     def test_03_invalid(self):
         raw = "aa"
         assert not is_valid_line_number(raw)
+
+
+class TestParseDays:
+    def test_01_valid(self):
+        assert parse_days("7") == 7
+        assert parse_days("7d") == 7
+        assert parse_days("2w") == 14
+
+    def test_02_invalid(self):
+        for raw in ["", "d", "7x", "-1d"]:
+            with pytest.raises(ValueError):
+                parse_days(raw)
+
+
+class TestParseSubstitution:
+    def test_01_valid(self):
+        regex, replacement, count = parse_substitution("s/+old/+new/")
+        assert regex.sub(replacement, "a +old +old", count) == "a +new +old"
+
+    def test_04_basic_regex(self):
+        regex, replacement, count = parse_substitution(r"s/\(ab\)\+/[&|\1]/")
+        assert regex.sub(replacement, "xababy", count) == "x[abab|ab]y"
+
+    def test_02_flags_and_delimiter(self):
+        regex, replacement, count = parse_substitution("s|A|b|gi")
+        assert regex.sub(replacement, "a A", count) == "b b"
+
+    def test_03_invalid(self):
+        for raw in ["", "s", "y/a/b/", "s/a/b", "s/a/b/x", "s/\\(/b/"]:
+            with pytest.raises(ValueError):
+                parse_substitution(raw)
+
+
+class TestReadLinesReversed:
+    def test_01_lines_across_blocks(self, tmpdir):
+        path = os.path.join(tmpdir, "file.txt")
+        lines = [f"line {i} " + "é" * (i % 7) for i in range(200)] + ["", "last"]
+        for ending in ["", "\n"]:
+            with open(path, "w") as file:
+                file.write("\n".join(lines) + ending)
+            for block_size in [1, 3, 16, 4096]:
+                assert list(read_lines_reversed(path, block_size)) == lines[::-1]
+
+    def test_02_empty(self, tmpdir):
+        path = os.path.join(tmpdir, "file.txt")
+        open(path, "w").close()
+        assert list(read_lines_reversed(path)) == []
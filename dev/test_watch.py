@@ -0,0 +1,57 @@
+"""Unittest for watching files and redrawing the screen."""
+
+import io
+import os
+
+import pytest
+
+from watch import InotifyWatcher, PollingWatcher, Screen
+
+
+class TestScreen:
+    """Test incremental redraws."""
+
+    def test_01_only_changed_rows(self):
+        out = io.StringIO()
+        screen = Screen(out)
+        assert screen.draw(["a", "b", "c"]) == 3
+
+        out.seek(0)
+        out.truncate()
+        assert screen.draw(["a", "x", "c"]) == 1
+        assert "\x1b[2;1Hx" in out.getvalue()
+        assert "a" not in out.getvalue()
+
+    def test_02_shorter_list_is_cleared(self):
+        out = io.StringIO()
+        screen = Screen(out)
+        screen.draw(["a", "b", "c"])
+        assert screen.draw(["a"]) == 0
+        assert "\x1b[2;1H\x1b[J" in out.getvalue()
+
+
+class TestWatchers:
+    """Test noticing changed files."""
+
+    @pytest.fixture
+    def paths(self, tmpdir):
+        paths = [os.path.join(tmpdir, "todo.txt"), os.path.join(tmpdir, "config")]
+        for path in paths:
+            open(path, "w").close()
+        return paths
+
+    def test_01_inotify(self, paths):
+        watcher = InotifyWatcher(paths)
+        with open(os.path.join(os.path.dirname(paths[0]), "other"), "w") as file:
+            file.write("ignored\n")
+        with open(paths[0], "w") as file:
+            file.write("(A) 211028 changed\n")
+        watcher.wait(paths)
+        watcher.close()
+
+    def test_02_polling(self, paths):
+        watcher = PollingWatcher(paths, interval=0.01)
+        with open(paths[1], "w") as file:
+            file.write("COLOR_TAG red\n")
+        watcher.wait(paths)
+        watcher.close()
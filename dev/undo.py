@@ -0,0 +1,123 @@
+"""Undo log for todotxtpy."""
+
+from __future__ import annotations
+import os
+from dataclasses import dataclass
+from typing import Optional
+
+from constants import UNDO_LIMIT
+
+
+@dataclass
+class Operation:
+    """A change to the task list, stored as the task lines it swapped.
+
+    Undoing an operation removes after, restores before and retracts done
+    from done.txt; redoing it does the opposite. Consecutive operations of
+    the same group, from one bulk edit, are undone and redone together.
+    """
+    kind: str  # "add", "pri", "do", "rm", "sed", "pri-all" or "dedupe"
+    before: Optional[str]
+    after: Optional[str]
+    done: Optional[str] = None
+    group: Optional[str] = None
+
+    @classmethod
+    def load(cls, line: str) -> Operation:
+        """Populate an Operation from a tab-separated line of the log."""
+        kind, *fields = line.rstrip("\n").split("\t")
+        return Operation(kind, *(field or None for field in fields))
+
+    def __str__(self) -> str:
+        return "\t".join([self.kind, self.before or "", self.after or "",
+                          self.done or "", self.group or ""])
+
+
+class UndoLog:
+    """Bounded history of operations, with a cursor for undo and redo.
+
+    Operations before the cursor can be undone, operations after it redone.
+    Only the last UNDO_LIMIT operations are kept, but groups are never split
+    and the newest group is kept whole.
+    """
+
+    def __init__(self, path: str) -> None:
+        """Load the log at path, if it exists."""
+        self.path = path
+        self.operations: list[Operation] = []
+        self.position = 0
+        if os.path.exists(path):
+            with open(path, mode="r") as file:
+                self.position = int(file.readline() or 0)
+                self.operations = [Operation.load(line) for line in file]
+
+    def save(self) -> None:
+        """Save log to its file, overwriting it completely."""
+        with open(self.path, mode="w") as file:
+            file.write(f"{self.position}\n")
+            for operation in self.operations:
+                file.write(f"{operation}\n")
+
+    def record(self, operation: Operation) -> None:
+        """Append an operation, discarding anything that could be redone."""
+        del self.operations[self.position:]
+        self.operations.append(operation)
+        self.trim()
+        self.position = len(self.operations)
+
+    def record_group(self, operations: list[Operation]) -> None:
+        """Append operations that are undone and redone as one step."""
+        del self.operations[self.position:]
+        self.operations.extend(operations)
+        self.trim()
+        self.position = len(self.operations)
+
+    def trim(self) -> None:
+        """Drop the oldest operations past UNDO_LIMIT, at a group boundary."""
+        cut = len(self.operations) - UNDO_LIMIT
+        if cut <= 0:
+            return
+        newest = len(self.operations) - 1
+        while newest > 0 and self.same_group(newest - 1, newest):
+            newest -= 1
+        while 0 < cut < newest and self.same_group(cut - 1, cut):
+            cut += 1
+        del self.operations[:min(cut, newest)]
+
+    def same_group(self, i: int, j: int) -> bool:
+        """Return whether operations i and j belong to the same group."""
+        group = self.operations[i].group
+        return group is not None and group == self.operations[j].group
+
+    def undo(self) -> Optional[Operation]:
+        """Step the cursor back, returning the operation to undo."""
+        if self.position == 0:
+            return None
+        self.position -= 1
+        return self.operations[self.position]
+
+    def undo_group(self) -> list[Operation]:
+        """Step the cursor back over a whole group, returning its operations."""
+        operations = []
+        while (operation := self.undo()) is not None:
+            operations.append(operation)
+            if not (self.position > 0 and self.same_group(self.position - 1, self.position)):
+                break
+        return operations
+
+    def redo_group(self) -> list[Operation]:
+        """Step the cursor forward over a whole group, returning its operations."""
+        operations = []
+        while (operation := self.redo()) is not None:
+            operations.append(operation)
+            if not (self.position < len(self.operations)
+                    and self.same_group(self.position - 1, self.position)):
+                break
+        return operations
+
+    def redo(self) -> Optional[Operation]:
+        """Step the cursor forward, returning the operation to redo."""
+        if self.position == len(self.operations):
+            return None
+        self.position += 1
+        return self.operations[self.position - 1]
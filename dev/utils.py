@@ -1,8 +1,11 @@
 """Utility functions for todotxtpy."""
 
 import datetime
+import os
+import re
+from typing import Iterator
 
-from constants import Colors
+from constants import TAIL_BLOCK_BYTES, Colors
 
 
 def get_current_date():
@@ -10,6 +13,43 @@ def get_current_date():
     return datetime.datetime.now().strftime("%y%m%d")
 
 
+def get_current_day() -> int:
+    """Return the current date as a day number."""
+    return datetime.date.today().toordinal()
+
+
+def file_signature(path: str) -> str:
+    """Return a string that changes whenever the file at path is modified."""
+    stat = os.stat(path)
+    return f"{stat.st_mtime_ns} {stat.st_size} {stat.st_ino}"
+
+
+def read_lines_reversed(path: str, block_size: int = TAIL_BLOCK_BYTES) -> Iterator[str]:
+    """Yield the lines of a file, last first, without their newlines.
+
+    Blocks are read from the end of the file only as lines are taken, so
+    taking a few lines costs the same however long the file is. Lines are
+    split as bytes, which is safe in UTF-8: no multi-byte character holds
+    a newline byte.
+    """
+    with open(path, mode="rb") as file:
+        end = position = file.seek(0, os.SEEK_END)
+        partial = b""
+        while position > 0:
+            size = min(block_size, position)
+            position -= size
+            file.seek(position)
+            lines = (file.read(size) + partial).split(b"\n")
+            # the first piece may continue in the previous block
+            partial = lines.pop(0)
+            if position + size == end and lines and lines[-1] == b"":
+                lines.pop()  # after the final newline
+            for line in reversed(lines):
+                yield line.decode(errors="replace")
+        if end:
+            yield partial.decode(errors="replace")
+
+
 def color_to_color_code(color: str) -> str:
     """Convert color to color code."""
     match color:
@@ -66,9 +106,34 @@ def is_valid_priority(priority: str) -> bool:
             return False
 
 
+def date_to_ordinal(date: str) -> int:
+    """Convert a yymmdd date to its proleptic Gregorian day number.
+
+    Years are taken to be in 2000-2099. Raises ValueError if the input is not
+    a real calendar date.
+    """
+    if not (len(date) == 6 and date.isdecimal()):
+        raise ValueError(f"Unrecognized date {date}.")
+    try:
+        return datetime.date(
+            2000 + int(date[:2]), int(date[2:4]), int(date[4:])
+        ).toordinal()
+    except ValueError:
+        raise ValueError(f"Unrecognized date {date}.") from None
+
+
+def ordinal_to_date(ordinal: int) -> str:
+    """Convert a day number back to a date in form of yymmdd."""
+    return datetime.date.fromordinal(ordinal).strftime("%y%m%d")
+
+
 def is_valid_date(date: str) -> bool:
     """Return whether input is a valid date."""
-    return len(date) == 6 and date.isdecimal()
+    try:
+        date_to_ordinal(date)
+    except ValueError:
+        return False
+    return True
 
 
 def is_valid_tag(tag: str) -> bool:
@@ -79,3 +144,61 @@ def is_valid_tag(tag: str) -> bool:
 def is_valid_line_number(line_number: str) -> bool:
     """Return whether input isa valid line number."""
     return line_number.isdecimal()
+
+
+def parse_days(span: str) -> int:
+    """Convert a span such as "7", "7d" or "2w" to a number of days."""
+    match span[-1:], span[:-1]:
+        case "d", count if count.isdecimal():
+            return int(count)
+        case "w", count if count.isdecimal():
+            return 7 * int(count)
+    if span.isdecimal():
+        return int(span)
+    raise ValueError(f"Unrecognized span {span}.")
+
+
+def compile_basic_regex(pattern: str, flags: int = 0) -> re.Pattern:
+    """Compile a sed-style basic regular expression.
+
+    As in GNU sed, "+?(){}|" are literal characters unless escaped with a
+    backslash, so "+tag" matches a tag.
+    """
+    converted = []
+    escaped = False
+    for char in pattern:
+        if escaped:
+            converted.append(char if char in "+?(){}|" else "\\" + char)
+            escaped = False
+        elif char == "\\":
+            escaped = True
+        else:
+            converted.append("\\" + char if char in "+?(){}|" else char)
+    if escaped:
+        converted.append("\\\\")
+    try:
+        return re.compile("".join(converted), flags)
+    except re.error as error:
+        raise ValueError(f"Invalid pattern {pattern}: {error}.") from error
+
+
+def parse_substitution(expression: str) -> tuple[re.Pattern, str, int]:
+    """Convert a sed expression "s/pattern/replacement/flags" for re.sub.
+
+    Any character after "s" can be the delimiter, and the pattern is a
+    basic regular expression. Flags are "g" to replace every match instead
+    of the first and "i" to ignore case. In the replacement, "&" is the
+    whole match and "\\1" to "\\9" are groups.
+    """
+    if len(expression) < 2 or expression[0] != "s":
+        raise ValueError(f"Unrecognized substitution {expression}.")
+    delimiter = expression[1]
+    parts = expression[2:].split(delimiter)
+    if len(parts) != 3 or set(parts[2]) - {"g", "i"}:
+        raise ValueError(f"Unrecognized substitution {expression}.")
+    pattern, replacement, flags = parts
+    regex = compile_basic_regex(pattern, re.IGNORECASE if "i" in flags else 0)
+    # "&" becomes \g<0>, and "\&" a literal "&"
+    replacement = re.sub(r"\\&|&", lambda match: "&" if match[0] == "\\&" else r"\g<0>",
+                         replacement)
+    return regex, replacement, 0 if "g" in flags else 1
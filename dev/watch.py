@@ -0,0 +1,141 @@
+"""Watching the task list for changes, for `t list --watch`."""
+
+from __future__ import annotations
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import time
+from typing import Optional, TextIO
+
+from utils import file_signature
+
+# inotify(7) event masks and struct inotify_event (without its name)
+IN_MODIFY = 0x002
+IN_CLOSE_WRITE = 0x008
+IN_MOVED_TO = 0x080
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_DELETE
+INOTIFY_EVENT = struct.Struct("iIII")
+
+# Saves come as bursts of events; wait for this long without any before redrawing
+SETTLE_SECONDS = 0.05
+POLL_SECONDS = 1.0
+
+
+class InotifyWatcher:
+    """Wait for files to change, using Linux inotify on their directories."""
+
+    def __init__(self, paths: list[str]) -> None:
+        """Watch the directories holding paths."""
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.fd = libc.inotify_init1(os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.directories = {}  # watch descriptor -> directory
+        for directory in {os.path.dirname(os.path.abspath(path)) for path in paths}:
+            wd = libc.inotify_add_watch(self.fd, os.fsencode(directory), WATCH_MASK)
+            if wd < 0:
+                os.close(self.fd)
+                raise OSError(ctypes.get_errno(), f"Cannot watch {directory}")
+            self.directories[wd] = directory
+
+    def read_events(self) -> set[str]:
+        """Return the paths of all files with pending events."""
+        data = os.read(self.fd, 64 * 1024)
+        changed = set()
+        offset = 0
+        while offset < len(data):
+            wd, _, _, length = INOTIFY_EVENT.unpack_from(data, offset)
+            offset += INOTIFY_EVENT.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b"\0"))
+            offset += length
+            changed.add(os.path.join(self.directories[wd], name))
+        return changed
+
+    def wait(self, paths: list[str]) -> None:
+        """Block until one of paths has changed."""
+        paths = {os.path.abspath(path) for path in paths}
+        while not self.read_events() & paths:
+            pass
+        while select.select([self.fd], [], [], SETTLE_SECONDS)[0]:
+            self.read_events()
+
+    def close(self) -> None:
+        """Stop watching."""
+        os.close(self.fd)
+
+
+class PollingWatcher:
+    """Wait for files to change by checking their signatures periodically."""
+
+    def __init__(self, paths: list[str], interval: float = POLL_SECONDS) -> None:
+        """Remember the current state of paths."""
+        self.interval = interval
+        self.signatures = self.read_signatures(paths)
+
+    @staticmethod
+    def read_signatures(paths: list[str]) -> dict[str, Optional[str]]:
+        """Return the signature of every path, or None where it is missing."""
+        signatures = {}
+        for path in paths:
+            try:
+                signatures[path] = file_signature(path)
+            except FileNotFoundError:
+                signatures[path] = None
+        return signatures
+
+    def wait(self, paths: list[str]) -> None:
+        """Block until one of paths differs from the last time it was seen."""
+        while True:
+            signatures = self.read_signatures(paths)
+            if any(self.signatures.get(path, signature) != signature
+                   for path, signature in signatures.items()):
+                self.signatures = signatures
+                return
+            self.signatures.update(signatures)
+            time.sleep(self.interval)
+
+    def close(self) -> None:
+        """Stop watching."""
+
+
+def open_watcher(paths: list[str]):
+    """Return an InotifyWatcher for paths, or a PollingWatcher without inotify."""
+    try:
+        return InotifyWatcher(paths)
+    except (AttributeError, OSError, TypeError):
+        return PollingWatcher(paths)
+
+
+class Screen:
+    """Terminal rows that are redrawn only where they changed."""
+
+    def __init__(self, out: TextIO) -> None:
+        """Draw onto out, which is cleared on the first draw."""
+        self.out = out
+        self.rows: Optional[list[str]] = None
+
+    def draw(self, rows: list[str]) -> int:
+        """Show rows, and return how many of them had to be rewritten."""
+        if self.rows is None:
+            parts, previous = ["\x1b[H\x1b[2J"], []
+        else:
+            parts, previous = [], self.rows
+
+        redrawn = 0
+        for i, row in enumerate(rows):
+            if i >= len(previous) or previous[i] != row:
+                parts.append(f"\x1b[{i + 1};1H{row}\x1b[K")
+                redrawn += 1
+        if len(rows) < len(previous):
+            parts.append(f"\x1b[{len(rows) + 1};1H\x1b[J")
+        # Leave the cursor below the list
+        parts.append(f"\x1b[{len(rows) + 1};1H")
+
+        self.out.write("".join(parts))
+        self.out.flush()
+        self.rows = rows
+        return redrawn
@@ -8,8 +8,11 @@ touch ~/todo/done.txt
 
 cd /tmp
 git clone git@github.com:tzhao42/todotxtpy.git
-mv /tmp/todotxtpy/todotxtpy/todotxt.py ~/bin
+mv /tmp/todotxtpy/todotxtpy/todotxt.pyz ~/bin
 
 echo 'export PATH="/home/$USER/bin:$PATH"' >> ~/.bashrc
-echo 'alias t="todotxt.py"' >> ~/.bash_aliases
+echo 'alias t="todotxt.pyz"' >> ~/.bash_aliases
+
+~/bin/todotxt.pyz completion bash > ~/todo/completion.bash
+echo 'source ~/todo/completion.bash' >> ~/.bashrc
 
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3.10
+"""Measure how many tasks per second `t do` completes under each DURABILITY.
+
+Every policy starts from the same random todo.txt in a fresh directory
+(on the file system of --dir, since syncs cost what the disk makes them
+cost) and completes --batches commands of --batch-size tasks each.
+
+Run from the project root:
+  python scripts/bench_durability.py --tasks 1000 --batch-size 5
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, 'dev')
+from app import TodoApp
+
+POLICIES = ['none', 'batch', 'always']
+
+def write_todo(path, count, seed):
+  rng = random.Random(seed)
+  with open(path, 'w') as file:
+    for i in range(count):
+      created = date(2021, 1, 1) + timedelta(days=rng.randrange(1500))
+      file.write(f'({rng.choice("ABCDE")}) {created:%y%m%d} '
+                 f'+tag{rng.randrange(5)} task number {i}\n')
+
+def run(policy, args):
+  with tempfile.TemporaryDirectory(dir=args.dir) as directory:
+    config_path = os.path.join(directory, 'config')
+    todo_path = os.path.join(directory, 'todo.txt')
+    done_path = os.path.join(directory, 'done.txt')
+    with open(config_path, 'w') as file:
+      file.write(f'DURABILITY {policy}\n')
+    write_todo(todo_path, args.tasks, args.seed)
+    open(done_path, 'w').close()
+
+    app = TodoApp(config_path, todo_path, done_path)
+    rng = random.Random(args.seed)
+    start = time.perf_counter()
+    for _ in range(args.batches):
+      count = len(app.tasklist.tasks)
+      lines = rng.sample(range(1, count + 1), min(args.batch_size, count))
+      app.do_tasks([str(line) for line in lines])
+    elapsed = time.perf_counter() - start
+    with open(done_path) as file:
+      completed = sum(1 for _ in file)
+  return completed, elapsed
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+  parser.add_argument('--tasks', type=int, default=1000)
+  parser.add_argument('--batches', type=int, default=20)
+  parser.add_argument('--batch-size', type=int, default=5)
+  parser.add_argument('--seed', type=int, default=0)
+  parser.add_argument('--dir', default='.',
+                      help='directory to run in (default: the current one)')
+  args = parser.parse_args()
+
+  print(f'{"policy":8} {"tasks":>6} {"seconds":>8} {"tasks/s":>9}')
+  for policy in POLICIES:
+    completed, elapsed = run(policy, args)
+    print(f'{policy:8} {completed:6} {elapsed:8.3f} {completed / elapsed:9.1f}')
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3.10
+"""Run dev/ and a bundled todotxt.py on the same random task files.
+
+The bundle is the committed todotxtpy/todotxt.py, unless --bundle names
+another one, such as an older release.
+
+Both sides load, sort and save every input; the saved files have to match
+byte for byte. Timings are reported as bundle / dev ratios, and with
+--baseline they are checked against a previous run saved with
+--save-baseline: the script fails if either side got slower than
+--threshold times its baseline.
+
+Run from the project root:
+  python scripts/compare_bundle.py --tasks 100000
+"""
+import argparse
+import importlib.util
+import inspect
+import json
+import os
+import random
+import statistics
+import string
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, 'dev')
+import data as dev_data
+
+def load_bundle(path):
+  spec = importlib.util.spec_from_file_location('todotxt_bundle', path)
+  module = importlib.util.module_from_spec(spec)
+  # dataclasses look the module up by name
+  sys.modules[spec.name] = module
+  spec.loader.exec_module(module)
+  return module
+
+def random_line(rng):
+  priority = f'({rng.choice(string.ascii_uppercase[:6])})'
+  created = date(2021, 1, 1) + timedelta(days=rng.randrange(1500))
+  words = [''.join(rng.choices(string.ascii_lowercase, k=rng.randint(1, 8)))
+           for _ in range(rng.randint(1, 10))]
+  if rng.random() < 0.2:
+    due = created + timedelta(days=rng.randrange(60))
+    words.append(f'due:{due:%y%m%d}')
+  tag = [f'+{rng.choice(["home", "work", "todotxtpy", "x"])}'] \
+        if rng.random() < 0.7 else []
+  return ' '.join([priority, f'{created:%y%m%d}', *tag, *words])
+
+def write_input(path, count, seed):
+  rng = random.Random(seed)
+  with open(path, 'w') as file:
+    for _ in range(count):
+      file.write(random_line(rng) + '\n')
+
+class Side:
+  """Load/sort/save for one implementation, whichever TaskList API it has."""
+  def __init__(self, name, module):
+    self.name = name
+    self.module = module
+    # dev has `TaskList.load` as a classmethod, older bundles fill an
+    # empty TaskList in place
+    self.classmethod_load = isinstance(
+        inspect.getattr_static(module.TaskList, 'load'), classmethod)
+
+  def load(self, path):
+    if self.classmethod_load:
+      return self.module.TaskList.load(path)
+    tasklist = self.module.TaskList()
+    tasklist.load(path)
+    return tasklist
+
+  def run(self, source, target, sort):
+    timings = {}
+    start = time.perf_counter()
+    tasklist = self.load(source)
+    timings['load'] = time.perf_counter() - start
+    if sort:
+      start = time.perf_counter()
+      tasklist.sort()
+      timings['sort'] = time.perf_counter() - start
+    start = time.perf_counter()
+    tasklist.save(target)
+    timings['save'] = time.perf_counter() - start
+    return timings
+
+def first_difference(path1, path2):
+  with open(path1) as file1, open(path2) as file2:
+    for number, (line1, line2) in enumerate(zip(file1, file2), 1):
+      if line1 != line2:
+        return f'line {number}:\n  dev:    {line1.rstrip()}\n' \
+               f'  bundle: {line2.rstrip()}'
+  return 'files differ in length'
+
+def compare(sides, source, directory, sort, runs):
+  """Check saved output matches and return median timings per side."""
+  timings = {side.name: {} for side in sides}
+  samples = {side.name: [] for side in sides}
+  for _ in range(runs):
+    for side in sides:
+      target = os.path.join(directory, f'{side.name}.txt')
+      samples[side.name].append(side.run(source, target, sort))
+  for side in sides:
+    for operation in samples[side.name][0]:
+      timings[side.name][operation] = statistics.median(
+          sample[operation] for sample in samples[side.name])
+
+  dev_path, bundle_path = (os.path.join(directory, f'{side.name}.txt')
+                           for side in sides)
+  with open(dev_path, 'rb') as dev, open(bundle_path, 'rb') as bundle:
+    if dev.read() != bundle.read():
+      return timings, first_difference(dev_path, bundle_path)
+  return timings, None
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+  parser.add_argument('--bundle', default='todotxtpy/todotxt.py',
+                      help='bundled script (default: todotxtpy/todotxt.py)')
+  parser.add_argument('--tasks', type=int, nargs='+',
+                      default=[1000, 10000, 100000])
+  parser.add_argument('--seed', type=int, default=0)
+  parser.add_argument('--runs', type=int, default=5)
+  parser.add_argument('--threshold', type=float, default=1.5)
+  parser.add_argument('--baseline')
+  parser.add_argument('--save-baseline')
+  args = parser.parse_args()
+
+  failures = []
+  results = {}
+  with tempfile.TemporaryDirectory() as directory:
+    sides = [Side('dev', dev_data), Side('bundle', load_bundle(args.bundle))]
+    for count in args.tasks:
+      source = os.path.join(directory, 'todo.txt')
+      write_input(source, count, args.seed + count)
+      for sort in [False, True]:
+        case = f'{count} {"sorted" if sort else "as is"}'
+        timings, difference = compare(sides, source, directory, sort, args.runs)
+        results[case] = timings
+        if difference:
+          failures.append(f'{case}: saved files differ at {difference}')
+        for operation in timings['dev']:
+          dev, bundle = timings['dev'][operation], timings['bundle'][operation]
+          print(f'{case:>16} {operation:<5} dev {dev * 1000:9.2f} ms  '
+                f'bundle {bundle * 1000:9.2f} ms  ratio {bundle / dev:5.2f}')
+
+  if args.baseline:
+    with open(args.baseline) as file:
+      baseline = json.load(file)
+    for case, timings in results.items():
+      for name, operations in timings.items():
+        for operation, seconds in operations.items():
+          previous = baseline.get(case, {}).get(name, {}).get(operation)
+          if previous and seconds > previous * args.threshold:
+            failures.append(f'{case}: {name} {operation} took '
+                            f'{seconds / previous:.2f}x its baseline')
+  if args.save_baseline:
+    with open(args.save_baseline, 'w') as file:
+      json.dump(results, file, indent=2)
+
+  for failure in failures:
+    print(failure, file=sys.stderr)
+  sys.exit(1 if failures else 0)
+
+if __name__ == '__main__':
+  main()
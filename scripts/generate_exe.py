@@ -1,28 +1,51 @@
 #!/usr/bin/env python3.10
 import ast
+import os
+import py_compile
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import zipapp
 from itertools import chain
 from pathlib import Path
 
-INTERNAL_MODULES = ['app', 'constants', 'data', 'main', 'utils']
+INTERNAL_MODULES = ['app', 'archive', 'cache', 'complete', 'constants', 'data',
+                    'dedupe', 'durable', 'export', 'extsort', 'fsck', 'fuzzy',
+                    'index', 'main', 'query', 'snapshot', 'storage', 'sync',
+                    'undo', 'utils', 'watch']
 def remove_internal_imports(module: ast.Module) -> ast.Module:
-  def clean(statement):
+  class Cleaner(ast.NodeTransformer):
     # import x, y, z
-    if isinstance(statement, ast.Import):
+    def visit_Import(self, statement):
       filtered_names = [name
                         for name in statement.names
-                        if name not in INTERNAL_MODULES]
+                        if name.name not in INTERNAL_MODULES]
       if filtered_names == []: return None
       return ast.Import(names=filtered_names)
-    # from x import a, b, c
-    if isinstance(statement, ast.ImportFrom):
+    # from x import a, b, c; also inside functions, for lazy imports
+    def visit_ImportFrom(self, statement):
       if statement.module in INTERNAL_MODULES:
         return None
       return statement
-    return statement
+  return ast.fix_missing_locations(Cleaner().visit(
+      ast.Module(body=list(module.body), type_ignores=module.type_ignores)))
+
+def hoist_future_imports(module: ast.Module) -> ast.Module:
+  # `from __future__ import x` has to come first in the combined file
+  is_future = lambda statement: (isinstance(statement, ast.ImportFrom)
+                                 and statement.module == '__future__')
+  names = {alias.name: None
+           for statement in module.body if is_future(statement)
+           for alias in statement.names}
+  future = [ast.ImportFrom(module='__future__',
+                           names=[ast.alias(name=name) for name in names],
+                           level=0)] if names else []
   return ast.Module(
-      body=[cleaned
-            for statement in module.body
-            if (cleaned := clean(statement)) is not None],
+      body=future + [statement
+                     for statement in module.body
+                     if not is_future(statement)],
       type_ignores=module.type_ignores
     )
 
@@ -33,6 +56,38 @@ def generate_script():
     utils_code = ast.parse(utils.read())
   with open('dev/data.py') as data:
     data_code = ast.parse(data.read())
+  with open('dev/durable.py') as durable:
+    durable_code = ast.parse(durable.read())
+  with open('dev/storage.py') as storage:
+    storage_code = ast.parse(storage.read())
+  with open('dev/index.py') as index:
+    index_code = ast.parse(index.read())
+  with open('dev/dedupe.py') as dedupe:
+    dedupe_code = ast.parse(dedupe.read())
+  with open('dev/fuzzy.py') as fuzzy:
+    fuzzy_code = ast.parse(fuzzy.read())
+  with open('dev/query.py') as query:
+    query_code = ast.parse(query.read())
+  with open('dev/cache.py') as cache:
+    cache_code = ast.parse(cache.read())
+  with open('dev/complete.py') as complete:
+    complete_code = ast.parse(complete.read())
+  with open('dev/archive.py') as archive:
+    archive_code = ast.parse(archive.read())
+  with open('dev/export.py') as export:
+    export_code = ast.parse(export.read())
+  with open('dev/extsort.py') as extsort:
+    extsort_code = ast.parse(extsort.read())
+  with open('dev/fsck.py') as fsck:
+    fsck_code = ast.parse(fsck.read())
+  with open('dev/snapshot.py') as snapshot:
+    snapshot_code = ast.parse(snapshot.read())
+  with open('dev/sync.py') as sync:
+    sync_code = ast.parse(sync.read())
+  with open('dev/undo.py') as undo:
+    undo_code = ast.parse(undo.read())
+  with open('dev/watch.py') as watch:
+    watch_code = ast.parse(watch.read())
   with open('dev/app.py') as app:
     app_code = ast.parse(app.read())
   with open('dev/main.py') as main:
@@ -44,9 +99,158 @@ def generate_script():
         type_ignores=[] # we are not parsing the types anyway
       )
 
-  all_code = combine(constants_code, utils_code, data_code, app_code, main_code)
+  all_code = combine(constants_code, utils_code, data_code, durable_code,
+                     storage_code, index_code, dedupe_code, fuzzy_code,
+                     query_code, cache_code, complete_code, archive_code,
+                     export_code, extsort_code, fsck_code, snapshot_code,
+                     sync_code, undo_code, watch_code, app_code, main_code)
   all_code_no_internal_imports = remove_internal_imports(all_code)
-  return ast.unparse(all_code_no_internal_imports)
+  return ast.unparse(hoist_future_imports(all_code_no_internal_imports))
+
+
+def generate_tests():
+  # The dev test modules, combined into one that imports from todotxt; test_app
+  # goes last, as it covers all the others
+  paths = sorted(Path('dev').glob('test_*.py'),
+                 key=lambda path: (path.name == 'test_app.py', path.name))
+  modules = {path.stem: ast.parse(path.read_text()) for path in paths}
+
+  # Names defined at the top of more than one module are kept for the first
+  # one, and suffixed with the module name elsewhere: read_sync, TestQueryApp
+  seen = set()
+  for stem, module in modules.items():
+    suffix = stem.removeprefix('test_')
+    renames = {}
+    for statement in module.body:
+      if isinstance(statement, (ast.FunctionDef, ast.ClassDef)):
+        names = [statement.name]
+      elif isinstance(statement, ast.Assign):
+        names = [target.id for target in statement.targets if isinstance(target, ast.Name)]
+      else:
+        names = []
+      for name in names:
+        if name in seen:
+          renames[name] = (name + suffix.title() if isinstance(statement, ast.ClassDef)
+                           else f'{name}_{suffix}')
+        seen.add(name)
+    for node in ast.walk(module):
+      if isinstance(node, ast.Name) and node.id in renames:
+        node.id = renames[node.id]
+      elif isinstance(node, ast.arg) and node.arg in renames:
+        node.arg = renames[node.arg]
+      elif isinstance(node, (ast.FunctionDef, ast.ClassDef)) and node.name in renames:
+        node.name = renames[node.name]
+
+  class Redirect(ast.NodeTransformer):
+    # import durable -> import todotxt as durable; from data import Task ->
+    # from todotxt import Task
+    def visit_Import(self, statement):
+      return ast.Import(names=[ast.alias(name='todotxt', asname=alias.asname or alias.name)
+                               if alias.name in INTERNAL_MODULES else alias
+                               for alias in statement.names])
+    def visit_ImportFrom(self, statement):
+      if statement.module in INTERNAL_MODULES:
+        return ast.ImportFrom(module='todotxt', names=statement.names, level=0)
+      return statement
+
+  # Top level imports are merged, and the rest follows in module order
+  imports, internal, body = [], set(), []
+  for module in modules.values():
+    statements = Redirect().visit(module).body
+    if statements and isinstance(statements[0], ast.Expr) \
+        and isinstance(statements[0].value, ast.Constant):
+      statements = statements[1:]  # the module docstring
+    for statement in statements:
+      if isinstance(statement, ast.ImportFrom) and statement.module == 'todotxt':
+        internal.update(alias.name for alias in statement.names)
+      elif isinstance(statement, (ast.Import, ast.ImportFrom)):
+        if ast.dump(statement) not in map(ast.dump, imports):
+          imports.append(statement)
+      else:
+        body.append(statement)
+  # Standard library, then pytest, then the bundle, as the dev tests have them
+  group = lambda line: ('todotxt' in line, 'pytest' in line, line.startswith('from'), line)
+  lines = sorted(map(ast.unparse, imports), key=group)
+  names = ''.join(f'    {name},\n' for name in sorted(internal))
+  return ('\n'.join(lines) + f'\nfrom todotxt import (\n{names})\n\n\n'
+          + ast.unparse(ast.fix_missing_locations(ast.Module(body=body, type_ignores=[]))))
+
+
+def generate_zipapp(source: str, target: str):
+  # Scripts run as __main__ are recompiled on every run, but modules imported
+  # from a zip can be loaded from bytecode. Ship the bundle as a module with
+  # its .pyc next to it (unchecked-hash, so no timestamps are compared); the
+  # source is kept as a fallback for interpreters with a different magic.
+  with tempfile.TemporaryDirectory() as build:
+    module = Path(build) / 'todotxt.py'
+    module.write_text(source)
+    py_compile.compile(
+        str(module),
+        cfile=str(Path(build) / 'todotxt.pyc'),
+        doraise=True,
+        invalidation_mode=py_compile.PycInvalidationMode.UNCHECKED_HASH)
+    (Path(build) / '__main__.py').write_text('from todotxt import main\nmain()\n')
+    zipapp.create_archive(build, target, interpreter='/usr/bin/env python3.10')
+
+
+LAZY_LOADER = """
+import sys
+from importlib.machinery import ModuleSpec
+
+
+class EmbeddedModules:
+    \"\"\"Import hook that compiles and runs embedded module sources on first import.\"\"\"
+
+    def __init__(self, sources):
+        self.sources = sources
+
+    def find_spec(self, name, path=None, target=None):
+        if name in self.sources:
+            return ModuleSpec(name, self)
+        return None
+
+    def create_module(self, spec):
+        return None
+
+    def exec_module(self, module):
+        code = compile(self.sources[module.__name__], f"<todotxt/{module.__name__}.py>", "exec")
+        exec(code, module.__dict__)
+
+
+sys.meta_path.insert(0, EmbeddedModules(SOURCES))
+
+if __name__ == "__main__":
+    from main import main
+    main()
+"""
+
+def generate_lazy_script():
+  # Every module listed in INTERNAL_MODULES is embedded as a string, and only
+  # compiled and run when something imports it; `t help` never builds Config,
+  # and `t due` never loads the app
+  sources = {}
+  for name in INTERNAL_MODULES:
+    with open(f'dev/{name}.py') as module:
+      sources[name] = module.read()
+  entries = ''.join(f'    {name!r}: {source!r},\n'
+                    for name, source in sources.items())
+  return f'SOURCES = {{\n{entries}}}\n' + LAZY_LOADER
+
+
+def measure_startup(path: str, runs: int = 10) -> float:
+  # Median wall time of `t help` against an empty todo directory
+  with tempfile.TemporaryDirectory() as home:
+    os.makedirs(Path(home) / 'todo')
+    for name in ['config', 'todo.txt', 'done.txt']:
+      (Path(home) / 'todo' / name).touch()
+    env = dict(os.environ, HOME=home)
+    times = []
+    for _ in range(runs):
+      start = time.perf_counter()
+      subprocess.run([sys.executable, path, 'help'], env=env, check=True,
+                     stdout=subprocess.DEVNULL)
+      times.append(time.perf_counter() - start)
+  return statistics.median(times)
 
 
 def main():
@@ -54,9 +258,22 @@ def main():
     print('Run `python scripts/generate_exe.py` from the project root.')
     exit()
 
+  source = ("#!/bin/python3.10\n\"\"\"Full executable file.\"\"\"\n\n"
+            + generate_script())
   with open('todotxtpy/todotxt.py', 'w') as file:
-    file.write("#!/bin/python3.10\n\"\"\"Full executable file.\"\"\"\n\n")
-    file.write(generate_script())
+    file.write(source)
+  with open('todotxtpy/test_todotxt.py', 'w') as file:
+    file.write('"""Unittests for the full executable file."""\n\n' + generate_tests())
+  generate_zipapp(source, 'todotxtpy/todotxt.pyz')
+  with open('todotxtpy/todotxt_lazy.py', 'w') as file:
+    file.write("#!/bin/python3.10\n\"\"\"Full executable file, with modules "
+               "loaded on first use.\"\"\"\n")
+    file.write(generate_lazy_script())
+
+  times = [(path, measure_startup(f'todotxtpy/{path}'))
+           for path in ['todotxt.py', 'todotxt.pyz', 'todotxt_lazy.py']]
+  print('Startup of `t help` (median of 10 runs): '
+        + ', '.join(f'{path} {time * 1000:.1f} ms' for path, time in times))
 
 if __name__ == '__main__':
   main()
@@ -1,368 +1,1925 @@
-"""Unittests for aggregate class."""
+"""Unittests for the full executable file."""
 
+import io
 import os
 import random
-
+import struct
+from collections import Counter
 import pytest
-
+import todotxt as durable
 from todotxt import (
+    BinaryStorage,
     Colors,
+    CompletionCache,
     Config,
     DefaultConfig,
+    DoneArchive,
+    DoneList,
+    DoneRuns,
+    DoneTask,
+    DueIndex,
+    InotifyWatcher,
+    Intent,
+    LazyTask,
+    LazyTaskList,
+    Operation,
+    PollingWatcher,
+    Query,
+    REJECTS_SUFFIX,
+    SNAPSHOT_CHUNK_MAX,
+    Screen,
+    SnapshotStore,
+    SqliteStorage,
     Task,
     TaskList,
+    TextStorage,
+    TodoApp,
+    TrigramIndex,
+    UNDO_LIMIT,
+    UndoLog,
+    append_records,
+    check_file,
     color_to_color_code,
+    commit_done,
+    commit_retract,
+    complete_words,
+    completion_script,
+    date_to_ordinal,
+    duplicate_groups,
+    export_tasks,
+    fsck,
+    get_current_day,
+    import_tasks,
     is_valid_date,
     is_valid_line_number,
     is_valid_priority,
     is_valid_tag,
+    merge_counts,
+    ordinal_to_date,
+    parse_command,
+    parse_days,
+    parse_fast_command,
+    parse_records,
+    parse_substitution,
+    read_lines_reversed,
+    read_records,
+    recover_done,
+    remove_records,
+    run,
+    sort_file,
+    sorted_scan,
+    split_chunks,
+    sync,
+    task_hash,
+    trigrams,
 )
 
-# Data:
 
+def make_tasks(count, first='210101'):
+    start = date_to_ordinal(first)
+    return [DoneTask.load(f'x (A) 210101 {ordinal_to_date(start + i // 10)} +tag{i % 3} finished number {i}') for i in range(count)]
+
+class TestDoneArchive:
+    """Test appending to and querying the archive."""
+
+    def test_01_round_trip(self, tmpdir):
+        path = os.path.join(tmpdir, 'done.archive')
+        tasks = make_tasks(10000)
+        DoneArchive(path).append(tasks)
+        archive = DoneArchive(path)
+        assert len(archive) == 10000
+        assert len(archive.blocks) == 3
+        assert list(archive.between(None, None)) == tasks
+        assert os.path.getsize(path) * 4 < sum((len(str(t)) + 1 for t in tasks))
+
+    def test_02_between_reads_needed_blocks(self, tmpdir, monkeypatch):
+        path = os.path.join(tmpdir, 'done.archive')
+        tasks = make_tasks(10000)
+        DoneArchive(path).append(tasks)
+        archive = DoneArchive(path)
+        read = []
+        original = archive.read_block
+        monkeypatch.setattr(archive, 'read_block', lambda block: read.append(block) or original(block))
+        day = tasks[5000].completed
+        found = list(archive.between(day, day))
+        assert found == [t for t in tasks if t.completed == day]
+        assert read == [archive.blocks[1]]
+
+    def test_03_search(self, tmpdir):
+        path = os.path.join(tmpdir, 'done.archive')
+        DoneArchive(path).append(make_tasks(100))
+        found = list(DoneArchive(path).search('number 42'))
+        assert [str(t).endswith('number 42') for t in found] == [True]
+
+    def test_04_empty(self, tmpdir):
+        archive = DoneArchive(os.path.join(tmpdir, 'done.archive'))
+        assert len(archive) == 0
+        assert list(archive.between(None, None)) == []
+        assert archive.last(5) == []
+
+    def test_05_last(self, tmpdir, monkeypatch):
+        path = os.path.join(tmpdir, 'done.archive')
+        tasks = make_tasks(10000)
+        DoneArchive(path).append(tasks)
+        archive = DoneArchive(path)
+        read = []
+        original = archive.read_block
+        monkeypatch.setattr(archive, 'read_block', lambda block: read.append(block) or original(block))
+        assert archive.last(3) == tasks[-3:]
+        assert read == [archive.blocks[-1]]
+        assert archive.last(2000) == tasks[-2000:]
+        assert archive.last(0) == []
+
+def config_for(todo_path):
+    return os.path.join(os.path.dirname(todo_path), 'config')
+
+def complete_words_in(words, todo_path):
+    return complete_words(words, config_for(todo_path), todo_path)
+
+@pytest.fixture
+def todo_path(tmpdir):
+    """A todo.txt with a completion cache built from it."""
+    open(os.path.join(tmpdir, 'config'), 'w').close()
+    path = os.path.join(tmpdir, 'todo.txt')
+    with open(path, 'w') as file:
+        file.write('(A) 211028 +work deploy the thing, and then a few more words\n(C) 211101 +home water plants\n(C) 211115 read a book\n')
+    storage = TextStorage(path)
+    CompletionCache.build(storage.load(), storage, config_for(path)).save(CompletionCache.path_for(path))
+    return path
+
+class TestComplete:
+    """Test completing words."""
+
+    def test_01_commands_and_options(self, todo_path):
+        assert complete_words_in(['pr'], todo_path) == ['pri', 'pri-all']
+        assert complete_words_in(['done', '--'], todo_path) == ['--between', '--search', '--last', '--today']
+        assert complete_words_in(['export', '--format', ''], todo_path) == ['jsonl', 'csv']
+        assert complete_words_in(['list', 'verbose', '--s'], todo_path) == ['--since']
+        assert complete_words_in(['nope', ''], todo_path) == []
+
+    def test_02_from_cache(self, todo_path):
+        assert complete_words_in(['do', '1', ''], todo_path) == ['1\t(A) +work deploy the thing, and then a f', '2\t(C) +home water plants', '3\t(C) read a book']
+        assert complete_words_in(['pri', '2', ''], todo_path) == ['A', 'C']
+        assert complete_words_in(['add', 'A', '+h'], todo_path) == ['+home']
+        assert complete_words_in(['add', 'A', '+work', 'more', '+'], todo_path) == ['+home', '+work']
+
+    def test_03_cache_only(self, todo_path, monkeypatch):
+
+        def load(*_):
+            raise AssertionError('tasks were parsed')
+        monkeypatch.setattr(TaskList, 'load', load)
+        assert complete_words_in(['rm', '3'], todo_path) == ['3\t(C) read a book']
+
+    def test_04_stale_cache(self, todo_path):
+        with open(todo_path, 'a') as file:
+            file.write('(B) 211201 +errands buy milk\n')
+        assert complete_words_in(['pri-all', '+e'], todo_path) == ['+errands']
+        assert complete_words_in(['pri-all', '+home', ''], todo_path) == ['A', 'B', 'C']
+
+    def test_05_scripts(self):
+        bash = completion_script('bash', '/home/me/bin/todotxt.py')
+        assert '/home/me/bin/todotxt.py complete' in bash
+        assert bash.endswith('-F _todotxt_complete t todotxt.py\n')
+        zsh = completion_script('zsh', '/home/me/bin/todotxt.py')
+        assert "${${line%%$'\\t'*}//:/\\\\:}" in zsh
+        assert zsh.endswith('compdef _todotxt t todotxt.py\n')
 
 class TestTask:
     """Test Task parsing and equality."""
 
     def test_01_valid_all(self):
-        raw = "(A) 211028 +todotxtpy do lots of epic stuff"
-        task = Task()
-        task.load(raw)
+        raw = '(A) 211028 +todotxtpy do lots of epic stuff'
+        task = Task.load(raw)
         assert raw == str(task)
 
     def test_02_valid_notag(self):
-        raw = "(A) 211028 todotxtpy do lots of epic stuff"
-        task = Task()
-        task.load(raw)
+        raw = '(A) 211028 todotxtpy do lots of epic stuff'
+        task = Task.load(raw)
         assert raw == str(task)
 
     def test_04_invalid_priority(self):
-        raw = "[A) 211028 todotxtpy do lots of epic stuff"
+        raw = '[A) 211028 todotxtpy do lots of epic stuff'
         with pytest.raises(ValueError):
-            task = Task()
-            task.load(raw)
+            Task.load(raw)
 
     def test_05_invalid_priority(self):
-        raw = "(!) 211028 todotxtpy do lots of epic stuff"
+        raw = '(!) 211028 todotxtpy do lots of epic stuff'
         with pytest.raises(ValueError):
-            task = Task()
-            task.load(raw)
+            Task.load(raw)
 
     def test_06_invalid_priority(self):
-        raw = "(a) 211028 todotxtpy do lots of epic stuff"
+        raw = '(a) 211028 todotxtpy do lots of epic stuff'
         with pytest.raises(ValueError):
-            task = Task()
-            task.load(raw)
+            Task.load(raw)
 
     def test_07_invalid_priority(self):
-        raw = "(a|]] 211028 todotxtpy do lots of epic stuff"
+        raw = '(a|]] 211028 todotxtpy do lots of epic stuff'
         with pytest.raises(ValueError):
-            task = Task()
-            task.load(raw)
+            Task.load(raw)
 
     def test_08_invalid_date(self):
-        raw = "(A) 21102 todotxtpy do lots of epic stuff todotxtpy"
+        raw = '(A) 21102 todotxtpy do lots of epic stuff todotxtpy'
         with pytest.raises(ValueError):
-            task = Task()
-            task.load(raw)
+            Task.load(raw)
 
     def test_09_invalid_date(self):
-        raw = "(A) 21102d todotxtpy do lots of epic stuff todotxtpy"
+        raw = '(A) 21102d todotxtpy do lots of epic stuff todotxtpy'
         with pytest.raises(ValueError):
-            task = Task()
-            task.load(raw)
+            Task.load(raw)
 
     def test_10_equal(self):
-        raw = "(A) 211023 +todotxtpy do lots of epic stuff todotxtpy"
-        task_0 = Task()
-        task_0.load(raw)
-        task_1 = Task()
-        task_1.load(raw)
+        raw = '(A) 211023 +todotxtpy do lots of epic stuff todotxtpy'
+        task_0 = Task.load(raw)
+        task_1 = Task.load(raw)
         assert task_0 == task_1
 
     def test_10_not_equal(self):
-        raw_0 = "(A) 211023 +todotxtpy do lots of epic stuff todotxtpy"
-        raw_1 = "(A) 211023 +todotxtpy do bots of epic stuff todotxtpy"
-        task_0 = Task()
-        task_0.load(raw_0)
-        task_1 = Task()
-        task_1.load(raw_1)
+        raw_0 = '(A) 211023 +todotxtpy do lots of epic stuff todotxtpy'
+        raw_1 = '(A) 211023 +todotxtpy do bots of epic stuff todotxtpy'
+        task_0 = Task.load(raw_0)
+        task_1 = Task.load(raw_1)
         assert task_0 != task_1
 
+    def test_11_due(self):
+        task = Task.load('(A) 211028 +tag pay rent due:211101 please')
+        assert task.due == date_to_ordinal('211101')
+        assert str(task) == '(A) 211028 +tag pay rent due:211101 please'
+
+    def test_12_no_due(self):
+        assert Task.load('(A) 211028 pay rent').due is None
+        assert Task.load('(A) 211028 pay rent due:tomorrow').due is None
+
+class TestDoneTask:
+    """Test DoneTask parsing."""
+
+    def test_01_valid_all(self):
+        raw = 'x (A) 211028 211030 +todotxtpy do lots of epic stuff'
+        done = DoneTask.load(raw)
+        assert raw == str(done)
+        assert done.completed == date_to_ordinal('211030')
+        assert done.task.created == date_to_ordinal('211028')
+
+    def test_02_valid_notag(self):
+        raw = 'x (A) 211028 211030 do lots of epic stuff'
+        assert raw == str(DoneTask.load(raw))
+
+    def test_03_invalid_mark(self):
+        with pytest.raises(ValueError):
+            DoneTask.load('y (A) 211028 211030 do stuff')
+
+    def test_04_invalid_completion_date(self):
+        with pytest.raises(ValueError):
+            DoneTask.load('x (A) 211028 211330 do stuff')
+
+class TestDoneList:
+    """Test DoneList range queries."""
+
+    def make(self, dates):
+        return DoneList([DoneTask.load(f'x (A) 210101 {date} task {i}') for (i, date) in enumerate(dates)])
+
+    def test_01_between_sorted(self):
+        done_list = self.make(['210105', '210110', '210110', '210120', '210201'])
+        found = done_list.between(date_to_ordinal('210110'), date_to_ordinal('210120'))
+        assert [str(done) for done in found] == ['x (A) 210101 210110 task 1', 'x (A) 210101 210110 task 2', 'x (A) 210101 210120 task 3']
+
+    def test_02_between_runs(self):
+        dates = ['210105', '210120', '210110', '210115', '210101', '210130']
+        done_list = self.make(dates)
+        assert done_list.runs == [0, 2, 4]
+        (start, end) = (date_to_ordinal('210110'), date_to_ordinal('210120'))
+        found = done_list.between(start, end)
+        expected = [done for done in done_list.tasks if start <= done.completed <= end]
+        assert found == expected
+
+    def test_03_missing_file(self, tmpdir):
+        assert DoneList.load(os.path.join(tmpdir, 'done.txt')).tasks == []
+        assert DoneList.tail(os.path.join(tmpdir, 'done.txt'), count=3).tasks == []
+
+    def test_04_tail(self, tmpdir):
+        path = os.path.join(tmpdir, 'done.txt')
+        done_list = self.make(['210105', '210110', '210110', '210120', '210120'])
+        with open(path, 'w') as file:
+            for (i, done) in enumerate(done_list.tasks):
+                file.write(f'{done}\n' + ('oops\n\n' if i == 2 else ''))
+        assert DoneList.tail(path, count=2).tasks == done_list.tasks[3:]
+        assert DoneList.tail(path, count=4).tasks == done_list.tasks[1:]
+        assert DoneList.tail(path, count=9).tasks == done_list.tasks
+        assert DoneList.tail(path, count=0).tasks == []
+        since = DoneList.tail(path, since=date_to_ordinal('210110')).tasks
+        assert since == done_list.tasks[1:]
+
+    def test_05_load_between(self, tmpdir, monkeypatch):
+        path = os.path.join(tmpdir, 'done.txt')
+        dates = [f'2101{day:02}' for day in range(1, 29) for _ in range(3)]
+        done_list = self.make(dates)
+        with open(path, 'w') as file:
+            for (i, done) in enumerate(done_list.tasks):
+                file.write(f'{done}\n' + ('oops\n\n' if i % 10 == 4 else ''))
+        for (start, end) in [('210101', '210101'), ('210110', '210120'), ('210127', '210205'), ('201201', '201231')]:
+            found = DoneList.load_between(path, date_to_ordinal(start), date_to_ordinal(end))
+            assert found.tasks == done_list.between(date_to_ordinal(start), date_to_ordinal(end))
+        parsed = []
+        load = DoneTask.load
+        monkeypatch.setattr(DoneTask, 'load', lambda line: parsed.append(line) or load(line))
+        day = date_to_ordinal('210115')
+        assert len(DoneList.load_between(path, day, day).tasks) == 3
+        assert len(parsed) < 20
+        assert DoneList.load_between(os.path.join(tmpdir, 'none.txt'), day, day).tasks == []
 
 class TestTaskList:
     """Test TaskList loading and saving."""
 
     def test_01_valid_load(self, tmpdir):
-        task_0_raw = "(A) 420420 +tag do things"
-        task_1_raw = "(B) 420420 +gat thin"
-        path = os.path.join(tmpdir, "testtodo.txt")
-
-        with open(path, "w") as file:
-            file.write(f"{task_0_raw}\n{task_1_raw}\n")
-
-        task_list = TaskList()
-        task_list.load(path)
+        task_0_raw = '(A) 420420 +tag do things'
+        task_1_raw = '(B) 420420 +gat thin'
+        path = os.path.join(tmpdir, 'testtodo.txt')
+        with open(path, 'w') as file:
+            file.write(f'{task_0_raw}\n{task_1_raw}\n')
+        task_list = TaskList.load(path)
         assert len(task_list.tasks) == 2
         assert str(task_list.tasks[0]) == task_0_raw
         assert str(task_list.tasks[1]) == task_1_raw
 
     def test_02_invalid_load(self, tmpdir):
-        task_0_raw = "(A) 420420 +tag do things"
-        task_1_raw = "(B) 69696969 +gat thin"
-        path = os.path.join(tmpdir, "testtodo.txt")
-
-        with open(path, "w") as file:
-            file.write(f"{task_0_raw}\n{task_1_raw}\n")
-
-        task_list = TaskList()
+        task_0_raw = '(A) 420420 +tag do things'
+        task_1_raw = '(B) 69696969 +gat thin'
+        path = os.path.join(tmpdir, 'testtodo.txt')
+        with open(path, 'w') as file:
+            file.write(f'{task_0_raw}\n{task_1_raw}\n')
         with pytest.raises(ValueError):
-            task_list.load(path)
+            TaskList.load(path)
 
     def test_03_save(self, tmpdir):
-        path = os.path.join(tmpdir, "testtodo.txt")
-        task_0_raw = "(A) 420420 +tag do things"
-        task_1_raw = "(B) 696969 +gat thin"
-
-        task_0 = Task()
-        task_0.load(task_0_raw)
-        task_1 = Task()
-        task_1.load(task_1_raw)
-
-        task_list = TaskList()
-        task_list.tasks.append(task_0)
-        task_list.tasks.append(task_1)
-
+        path = os.path.join(tmpdir, 'testtodo.txt')
+        task_0_raw = '(A) 420420 +tag do things'
+        task_1_raw = '(B) 220101 +gat thin'
+        task_0 = Task.load(task_0_raw)
+        task_1 = Task.load(task_1_raw)
+        task_list = TaskList([task_0, task_1])
         task_list.save(path)
-
-        with open(path, "r") as file:
+        with open(path, 'r') as file:
             file_text = file.read()
-        assert file_text == f"{task_0_raw}\n{task_1_raw}\n"
+        assert file_text == f'{task_0_raw}\n{task_1_raw}\n'
 
     def test_04_sort(self):
-        raws = [
-            "(A) 012345 +tag text",
-            "(A) 012346 +tag text",
-            "(A) 012346 +zag text",
-            "(A) 012346 +zag zext",
-            "(A) 012346 text zag",
-            "(A) 012346 zext zag",
-            "(B) 012345 +tag text",
-            "(B) 012345 +tag text",
-        ]
-
-        tasks_sorted = [Task() for _ in raws]
-        for i, task in enumerate(tasks_sorted):
-            task.load(raws[i])
-
-        tasks_unsorted = [Task() for _ in raws]
-        for i, task in enumerate(tasks_unsorted):
-            task.load(raws[i])
-
+        raws = ['(A) 010203 +tag text', '(A) 010204 +tag text', '(A) 010204 +zag text', '(A) 010204 +zag zext', '(A) 010204 text zag', '(A) 010204 zext zag', '(B) 010203 +tag text', '(B) 010203 +tag text']
+        tasks_sorted = [Task.load(raw) for raw in raws]
+        tasks_unsorted = [Task.load(raw) for raw in raws]
         random.shuffle(tasks_unsorted)
-
-        task_list = TaskList()
-        for task in tasks_unsorted:
-            task_list.tasks.append(task)
+        task_list = TaskList(tasks_unsorted)
         task_list.sort()
-
-        for (task_sorted, task_unsorted) in zip(tasks_sorted, task_list.tasks):
-            assert task_sorted == task_unsorted
-
+        assert tasks_sorted == tasks_unsorted
+
+    def test_05_tolerant_load_keeps_invalid(self, tmpdir):
+        path = os.path.join(tmpdir, 'testtodo.txt')
+        with open(path, 'w') as file:
+            file.write('(B) 211028 second\nnot a task\n(A) 211028 first\n')
+        tasklist = TaskList.load(path, tolerant=True)
+        assert [task.text for task in tasklist.tasks] == ['second', 'first']
+        assert tasklist.invalid == ['not a task']
+        tasklist.sort()
+        tasklist.save(path)
+        with open(path) as file:
+            assert file.read() == '(A) 211028 first\n(B) 211028 second\nnot a task\n'
+
+class TestLazyTaskList:
+    """Test loading tasks whose text is decoded when first used."""
+    raws = ['(B) 211028 +work deploy due:211105', '(A) 211028 +work', '(A) 211028', '(A) 211028 +work deploy', '(A) 211028  +work two  spaces\r', '(A) 211028 +work\ttab due:notadate', '(C) 211029 café à emporter due:211101', '(C) 211029 cafe', '(Z) 211301 bad date', '', 'not a task']
+
+    def write(self, tmpdir):
+        path = os.path.join(tmpdir, 'todo.txt')
+        with open(path, 'w', newline='') as file:
+            file.write('\n'.join(self.raws))
+        return path
+
+    def test_01_same_as_task_list(self, tmpdir):
+        path = self.write(tmpdir)
+        expected = TaskList.load(path, tolerant=True)
+        lazy = LazyTaskList.load(path, tolerant=True)
+        assert lazy.invalid == expected.invalid == ['(Z) 211301 bad date', 'not a task']
+        assert [task.text for task in lazy.tasks] == [task.text for task in expected.tasks]
+        random.shuffle(lazy.tasks)
+        expected.sort()
+        lazy.sort()
+        assert [str(task) for task in lazy.tasks] == [str(task) for task in expected.tasks]
+        assert [(task.created, task.due) for task in lazy.tasks] == [(task.created, task.due) for task in expected.tasks]
+
+    def test_02_lazy_text(self, tmpdir):
+        path = self.write(tmpdir)
+        tasks = LazyTaskList.load(path, tolerant=True).tasks
+        assert all((isinstance(task, LazyTask) for task in tasks))
+        first = tasks[0]
+        assert first.tag.tag == '+work' and first._text is None
+        assert first.due == date_to_ordinal('211105')
+        assert first._text == 'deploy due:211105'
+        assert tasks[4]._text == 'two spaces'
+
+    def test_03_invalid_load(self, tmpdir):
+        path = self.write(tmpdir)
+        with pytest.raises(ValueError):
+            LazyTaskList.load(path)
+        open(path, 'w').close()
+        assert LazyTaskList.load(path).tasks == []
 
 class TestConfig:
     """Test Config loading."""
 
     def test_01_empty_load(self, tmpdir):
-        config_content = ""
-        path = os.path.join(tmpdir, "config")
-
-        with open(path, "w") as file:
+        config_content = ''
+        path = os.path.join(tmpdir, 'config')
+        with open(path, 'w') as file:
             file.write(config_content)
-
         config = Config()
         config.load(path)
-        for k, v in DefaultConfig.__dict__.items():
-            if k[0] != "_":
+        for (k, v) in DefaultConfig.__dict__.items():
+            if k[0] != '_':
                 assert config.__dict__[k.lower()] == v
 
     def test_02_custom_load(self, tmpdir):
-        content = {
-            "COLOR_PRIORITY_A": "RED",
-            "COLOR_PRIORITY_B": "BLUE",
-        }
-        config_content = "\n".join([f"{k} {v}" for k, v in content.items()]) + "\n"
-        path = os.path.join(tmpdir, "config")
-
-        with open(path, "w") as file:
+        content = {'COLOR_PRIORITY_A': 'RED', 'COLOR_PRIORITY_B': 'BLUE'}
+        config_content = '\n'.join([f'{k} {v}' for (k, v) in content.items()]) + '\n'
+        path = os.path.join(tmpdir, 'config')
+        with open(path, 'w') as file:
             file.write(config_content)
-
         config = Config()
         config.load(path)
-
-        for k, v in DefaultConfig.__dict__.items():
-            if k[0] != "_":
+        for (k, v) in DefaultConfig.__dict__.items():
+            if k[0] != '_':
                 if k not in content:
                     assert config.__dict__[k.lower()] == v
                 else:
                     assert config.__dict__[k.lower()] == color_to_color_code(content[k])
 
     def test_03_custom_load_comment(self, tmpdir):
-        content = {
-            "COLOR_PRIORITY_A": "RED",
-            "COLOR_PRIORITY_B": "BLUE",
-        }
-        config_content = (
-            "\n".join([f"{k} {v}" for k, v in content.items()]) + "\n# comment stuff\n"
-        )
-        path = os.path.join(tmpdir, "config")
-
-        with open(path, "w") as file:
+        content = {'COLOR_PRIORITY_A': 'RED', 'COLOR_PRIORITY_B': 'BLUE'}
+        config_content = '\n'.join([f'{k} {v}' for (k, v) in content.items()]) + '\n# comment stuff\n'
+        path = os.path.join(tmpdir, 'config')
+        with open(path, 'w') as file:
             file.write(config_content)
-
         config = Config()
         config.load(path)
-
-        for k, v in DefaultConfig.__dict__.items():
-            if k[0] != "_":
+        for (k, v) in DefaultConfig.__dict__.items():
+            if k[0] != '_':
                 if k not in content:
                     assert config.__dict__[k.lower()] == v
                 else:
                     assert config.__dict__[k.lower()] == color_to_color_code(content[k])
 
     def test_04_custom_load_whitespace(self, tmpdir):
-        content = {
-            "COLOR_PRIORITY_A": "RED",
-            "COLOR_PRIORITY_B": "BLUE",
-        }
-        config_content = (
-            "\n".join([f"{k} {v}" for k, v in content.items()]) + "\n\n\n\n"
-        )
-        path = os.path.join(tmpdir, "config")
-
-        with open(path, "w") as file:
+        content = {'COLOR_PRIORITY_A': 'RED', 'COLOR_PRIORITY_B': 'BLUE'}
+        config_content = '\n'.join([f'{k} {v}' for (k, v) in content.items()]) + '\n\n\n\n'
+        path = os.path.join(tmpdir, 'config')
+        with open(path, 'w') as file:
             file.write(config_content)
-
         config = Config()
         config.load(path)
-
-        for k, v in DefaultConfig.__dict__.items():
-            if k[0] != "_":
+        for (k, v) in DefaultConfig.__dict__.items():
+            if k[0] != '_':
                 if k not in content:
                     assert config.__dict__[k.lower()] == v
                 else:
                     assert config.__dict__[k.lower()] == color_to_color_code(content[k])
 
     def test_05_custom_load_wrong_key_fail(self, tmpdir):
-        content = {
-            "COLOR_PRIORITY_A": "RED",
-            "COLOR_PRIORDTY_B": "BLUE",
-        }
-        config_content = "\n".join([f"{k} {v}" for k, v in content.items()]) + "\n"
-        path = os.path.join(tmpdir, "config")
-
-        with open(path, "w") as file:
+        content = {'COLOR_PRIORITY_A': 'RED', 'COLOR_PRIORDTY_B': 'BLUE'}
+        config_content = '\n'.join([f'{k} {v}' for (k, v) in content.items()]) + '\n'
+        path = os.path.join(tmpdir, 'config')
+        with open(path, 'w') as file:
             file.write(config_content)
-
         config = Config()
-
         with pytest.raises(ValueError):
             config.load(path)
 
     def test_06_custom_load_wrong_value_fail(self, tmpdir):
-        content = {
-            "COLOR_PRIORITY_A": "RED",
-            "COLOR_PRIORITY_B": "BLLLUE",
-        }
-        config_content = "\n".join([f"{k} {v}" for k, v in content.items()]) + "\n"
-        path = os.path.join(tmpdir, "config")
-
-        with open(path, "w") as file:
+        content = {'COLOR_PRIORITY_A': 'RED', 'COLOR_PRIORITY_B': 'BLLLUE'}
+        config_content = '\n'.join([f'{k} {v}' for (k, v) in content.items()]) + '\n'
+        path = os.path.join(tmpdir, 'config')
+        with open(path, 'w') as file:
             file.write(config_content)
-
         config = Config()
-
         with pytest.raises(ValueError):
             config.load(path)
 
-
-# Utils:
-
+class TestTaskHash:
+    """Test which tasks count as the same."""
+
+    def test_01_ignores_priority_date_case_spacing(self):
+        assert task_hash(Task.load('(A) 211028 +work Deploy  the thing')) == task_hash(Task.load('(C) 211101 +work deploy the THING'))
+
+    def test_02_tag_and_text_matter(self):
+        task = task_hash(Task.load('(A) 211028 +work deploy'))
+        assert task != task_hash(Task.load('(A) 211028 +home deploy'))
+        assert task != task_hash(Task.load('(A) 211028 deploy'))
+        assert task != task_hash(Task.load('(A) 211028 +work deploy it'))
+
+class TestDuplicateGroups:
+
+    def test_01_groups(self):
+        assert duplicate_groups([b'a', b'b', b'a', b'c', b'b', b'a']) == [[0, 2, 5], [1, 4]]
+        assert duplicate_groups([b'a', b'b']) == []
+DONE = ['x (A) 211001 211101 +work ship it', 'x (B) 211001 211101 call mom']
+
+@pytest.fixture
+def files(tmpdir):
+    """A todo.txt storage with two tasks, done.txt with one, and an intent path."""
+    todo_path = os.path.join(tmpdir, 'todo.txt')
+    with open(todo_path, 'w') as file:
+        file.write('(A) 211001 +work ship it\n(B) 211001 call mom\n')
+    done_path = os.path.join(tmpdir, 'done.txt')
+    with open(done_path, 'w') as file:
+        file.write('x (C) 210101 210102 older\n')
+    return (TextStorage(todo_path, sync=True), done_path, os.path.join(tmpdir, 'done.intent'))
+
+def read(path):
+    with open(path) as file:
+        return file.read()
+
+class Crash(Exception):
+    pass
+
+class TestCommitDone:
+    """Test committing completions and recovering interrupted ones."""
+
+    def test_01_single_write(self, files, monkeypatch):
+        (storage, done_path, intent_path) = files
+        writes = []
+        original = os.write
+        monkeypatch.setattr(os, 'write', lambda fd, data: writes.append(data) or original(fd, data))
+        append_records(done_path, DONE, sync=True)
+        assert len(writes) == 1
+        assert read(done_path) == 'x (C) 210101 210102 older\n' + ''.join((f'{r}\n' for r in DONE))
+
+    def test_02_commit(self, files):
+        (storage, done_path, intent_path) = files
+        for durability in ['batch', 'none']:
+            commit_done(intent_path, done_path, DONE[:1], storage, lambda : storage.save(TaskList([])), durability)
+            assert not os.path.exists(intent_path)
+        assert read(storage.path) == ''
+        assert read(done_path).endswith(f'{DONE[0]}\n{DONE[0]}\n')
+        assert recover_done(intent_path, done_path, storage) is None
+
+    def test_03_crash_before_save(self, files):
+        (storage, done_path, intent_path) = files
+
+        def save():
+            raise Crash()
+        with pytest.raises(Crash):
+            commit_done(intent_path, done_path, DONE, storage, save, 'batch')
+        assert recover_done(intent_path, done_path, storage) is False
+        assert read(done_path) == 'x (C) 210101 210102 older\n'
+        assert not os.path.exists(intent_path)
+
+    def test_04_crash_after_save(self, files, monkeypatch):
+        (storage, done_path, intent_path) = files
+
+        def append(path, records, sync=False):
+            with open(path, 'a') as file:
+                file.write(records[0][:10])
+            raise Crash()
+        monkeypatch.setattr(durable, 'append_records', append)
+        with pytest.raises(Crash):
+            commit_done(intent_path, done_path, DONE, storage, lambda : storage.save(TaskList([])), 'batch')
+        monkeypatch.undo()
+        assert recover_done(intent_path, done_path, storage) is True
+        expected = 'x (C) 210101 210102 older\n' + ''.join((f'{r}\n' for r in DONE))
+        assert read(done_path) == expected
+        offset = len('x (C) 210101 210102 older\n')
+        Intent(offset, 'stale signature', DONE).save(intent_path)
+        assert recover_done(intent_path, done_path, storage) is True
+        assert read(done_path) == expected
+
+class TestCommitRetract:
+    """Test removing records from done.txt after the tasks are saved back."""
+
+    def test_01_remove_records(self, files):
+        (storage, done_path, intent_path) = files
+        append_records(done_path, DONE)
+        assert remove_records(done_path, DONE[::-1]) == []
+        assert read(done_path) == 'x (C) 210101 210102 older\n'
+        append_records(done_path, DONE)
+        assert remove_records(done_path, ['x (C) 210101 210102 older', 'archived']) == ['archived']
+        assert read(done_path) == ''.join((f'{r}\n' for r in DONE))
+
+    def test_02_crash_after_save(self, files, monkeypatch):
+        (storage, done_path, intent_path) = files
+        append_records(done_path, DONE)
+
+        def remove(path, records, sync=False):
+            raise Crash()
+        monkeypatch.setattr(durable, 'remove_records', remove)
+        with pytest.raises(Crash):
+            commit_retract(intent_path, done_path, DONE, storage, lambda : storage.save(TaskList([])), 'batch')
+        monkeypatch.undo()
+        assert Intent.load(intent_path).retract
+        assert recover_done(intent_path, done_path, storage) is True
+        assert read(done_path) == 'x (C) 210101 210102 older\n'
+        append_records(done_path, DONE[:1])
+        Intent(len(read(done_path)) + 1, 'stale signature', DONE[:1], retract=True).save(intent_path)
+        assert recover_done(intent_path, done_path, storage) is True
+        assert read(done_path) == f'x (C) 210101 210102 older\n{DONE[0]}\n'
+
+    def test_03_crash_before_save(self, files):
+        (storage, done_path, intent_path) = files
+        append_records(done_path, DONE)
+
+        def save():
+            raise Crash()
+        with pytest.raises(Crash):
+            commit_retract(intent_path, done_path, DONE, storage, save, 'batch')
+        assert recover_done(intent_path, done_path, storage) is False
+        assert read(done_path).endswith(f'{DONE[1]}\n')
+
+class TestRecords:
+    """Test conversion between lines and records."""
+
+    def test_01_todo_record(self):
+        [record] = read_records(['(A) 211028 +tag do things\n'], done=False)
+        assert record == {'priority': 'A', 'creation_date': '211028', 'completion_date': None, 'tag': '+tag', 'text': 'do things'}
+
+    def test_02_done_record(self):
+        [record] = read_records(['x (B) 211028 211030 no tag\n'], done=True)
+        assert record['completion_date'] == '211030'
+        assert record['tag'] is None
+
+class TestExportImport:
+    """Test round trips through each format."""
+
+    @pytest.mark.parametrize('fmt', ['jsonl', 'csv'])
+    def test_01_todo_round_trip(self, tmpdir, fmt):
+        lines = '(A) 211028 +tag do things, "quoted"\n(B) 211029 no tag\n'
+        path = os.path.join(tmpdir, 'todo.txt')
+        with open(path, 'w') as file:
+            file.write(lines)
+        out = io.StringIO()
+        export_tasks(out, path, fmt)
+        copy_path = os.path.join(tmpdir, 'copy.txt')
+        assert import_tasks(io.StringIO(out.getvalue()), copy_path, fmt) == 2
+        with open(copy_path) as file:
+            assert file.read() == lines
+
+    @pytest.mark.parametrize('fmt', ['jsonl', 'csv'])
+    def test_02_done_with_archive(self, tmpdir, fmt):
+        archive_path = os.path.join(tmpdir, 'done.archive')
+        DoneArchive(archive_path).append([DoneTask.load('x (A) 211001 211002 archived')])
+        path = os.path.join(tmpdir, 'done.txt')
+        with open(path, 'w') as file:
+            file.write('x (A) 211001 211005 +tag recent\n')
+        out = io.StringIO()
+        export_tasks(out, path, fmt, done=True, archive_path=archive_path)
+        records = list(parse_records(io.StringIO(out.getvalue()), fmt))
+        assert [r['text'] for r in records] == ['archived', 'recent']
+
+    def test_03_import_invalid(self, tmpdir):
+        records = '{"priority": "a", "creation_date": "211028", "text": "x"}\n'
+        with pytest.raises(ValueError):
+            import_tasks(io.StringIO(records), os.path.join(tmpdir, 'todo.txt'), 'jsonl')
+
+def write_lines(path, lines):
+    with open(path, 'w') as file:
+        file.writelines((f'{line}\n' for line in lines))
+
+def random_tasks(count):
+    rng = random.Random(0)
+    return [f"({rng.choice('ABC')}) 21{rng.randint(1, 12):02}{rng.randint(1, 28):02} " + ('+work ' if rng.random() < 0.5 else '') + f'task {rng.randrange(50)}' for _ in range(count)]
+
+class TestSortFile:
+    """Test sorting task files through runs on disk."""
+
+    def test_01_matches_in_memory_sort(self, tmpdir):
+        path = os.path.join(tmpdir, 'todo.txt')
+        lines = random_tasks(1000)
+        write_lines(path, lines)
+        assert sort_file(path, run_bytes=400, fan_in=4) > 16
+        tasklist = TaskList([Task.load(line) for line in lines])
+        tasklist.sort()
+        with open(path) as file:
+            assert file.read().splitlines() == [str(task) for task in tasklist.tasks]
+        assert os.listdir(tmpdir) == ['todo.txt']
+
+    def test_02_done_by_completion(self, tmpdir):
+        path = os.path.join(tmpdir, 'done.txt')
+        lines = ['x (A) 211001 211020 b', 'x (B) 211001 211005 a', '', 'x (A) 211001 211005 c']
+        write_lines(path, lines)
+        sort_file(path, done=True, run_bytes=30)
+        with open(path) as file:
+            assert file.read().splitlines() == ['x (A) 211001 211005 c', 'x (B) 211001 211005 a', 'x (A) 211001 211020 b']
+
+    def test_03_empty(self, tmpdir):
+        path = os.path.join(tmpdir, 'todo.txt')
+        write_lines(path, [])
+        assert sort_file(path) == 0
+        assert os.path.getsize(path) == 0
+
+def write(path, content):
+    with open(path, 'wb') as file:
+        file.write(content)
+
+class TestCheckFile:
+    """Test streaming checks of one file."""
+
+    def test_01_line_and_offset(self, tmpdir):
+        path = os.path.join(tmpdir, 'todo.txt')
+        write(path, b'(A) 211028 fine\n\n(B) 211345 bad date\n\xff\xfe\n')
+        problems = check_file(path, Task.load)
+        assert [(p.line_number, p.offset) for p in problems] == [(3, 17), (4, 37)]
+        assert '211345' in problems[0].message
+        assert problems[1].message == 'Not UTF-8'
+
+    def test_02_quarantine(self, tmpdir):
+        path = os.path.join(tmpdir, 'todo.txt')
+        write(path, b'(A) 211028 fine\nbroken\n(B) 211028 also fine')
+        assert len(check_file(path, Task.load, quarantine=True)) == 1
+        with open(path, 'rb') as file:
+            assert file.read() == b'(A) 211028 fine\n(B) 211028 also fine'
+        with open(path + REJECTS_SUFFIX, 'rb') as file:
+            assert file.read() == b'broken\n'
+
+    def test_03_clean_file_untouched(self, tmpdir):
+        path = os.path.join(tmpdir, 'todo.txt')
+        write(path, b'(A) 211028 fine\n')
+        assert check_file(path, Task.load, quarantine=True) == []
+        assert os.listdir(tmpdir) == ['todo.txt']
+
+class TestFsck:
+
+    def test_01_all_files(self, tmpdir):
+        (config, todo, done) = (os.path.join(tmpdir, name) for name in ['config', 'todo.txt', 'done.txt'])
+        write(config, b'# comment\nCOLOR_TAG mauve\n')
+        write(todo, b'(A) 211028 fine\n')
+        problems = fsck(config, todo, done)
+        assert [(p.path, p.line_number) for p in problems] == [(config, 2)]
+
+def index_of(*lines):
+    return TrigramIndex.build(TaskList([Task.load(line) for line in lines]))
+
+class TestTrigrams:
+    """Test trigram extraction."""
+
+    def test_01_padded_words(self):
+        assert trigrams('Ab cd') == {'  a', ' ab', 'ab ', '  c', ' cd', 'cd '}
+
+    def test_02_empty(self):
+        assert trigrams('  ') == set()
+
+class TestTrigramIndex:
+    """Test ranking and ambiguity."""
+
+    def test_01_partial_words(self):
+        index = index_of('(A) 211028 +work deploy the thing', '(B) 211101 +home water plants', '(B) 211101 +home watering can')
+        matches = index.search('water plan')
+        assert [match.index for match in matches] == [1, 2]
+        assert len(index.candidates('water plan')) == 1
+
+    def test_02_tags(self):
+        index = index_of('(A) 211028 +work deploy the thing', '(B) 211101 +home water plants')
+        assert [match.index for match in index.search('+home')] == [1]
+
+    def test_03_ambiguous(self):
+        index = index_of('(A) 211028 call mom', '(B) 211101 call mom again')
+        assert len(index.candidates('call mom')) == 2
+
+    def test_04_no_match(self):
+        index = index_of('(A) 211028 call mom')
+        assert index.search('xyzzy') == []
+        assert index.candidates('xyzzy') == []
+
+def config_for_index(todo_path):
+    """Return the path of an empty config next to todo_path."""
+    path = os.path.join(os.path.dirname(todo_path), 'config')
+    if not os.path.exists(path):
+        open(path, 'w').close()
+    return path
+
+def write_tasks(path, raws):
+    task_list = TaskList([Task.load(raw) for raw in raws])
+    task_list.sort()
+    task_list.save(path)
+    return task_list
+
+class TestDueIndex:
+    """Test building, saving and querying the due date index."""
+    raws = ['(A) 211028 +work deploy due:211105', '(B) 211028 no due date', '(B) 211029 water plants due:211101', '(C) 211030 due:notadate stays text']
+
+    def test_01_build(self, tmpdir):
+        path = os.path.join(tmpdir, 'todo.txt')
+        task_list = write_tasks(path, self.raws)
+        index = DueIndex.build(task_list, TextStorage(path), config_for_index(path))
+        assert index.source == f'text {path}'
+        assert index.entries == [(date_to_ordinal('211101'), 3, '(B) 211029 water plants due:211101'), (date_to_ordinal('211105'), 1, '(A) 211028 +work deploy due:211105')]
+
+    def test_02_save_load(self, tmpdir):
+        path = os.path.join(tmpdir, 'todo.txt')
+        index_path = os.path.join(tmpdir, 'due.idx')
+        index = DueIndex.build(write_tasks(path, self.raws), TextStorage(path), config_for_index(path))
+        index.save(index_path)
+        assert DueIndex.load(index_path) == index
+
+    def test_03_stale(self, tmpdir):
+        path = os.path.join(tmpdir, 'todo.txt')
+        index_path = os.path.join(tmpdir, 'due.idx')
+        DueIndex.build(write_tasks(path, self.raws), TextStorage(path), config_for_index(path)).save(index_path)
+        write_tasks(path, self.raws[:1])
+        assert DueIndex.load(index_path).signature != TextStorage(path).signature()
+        index = DueIndex.for_todo(config_for_index(path), path)
+        assert len(index.entries) == 1
+        assert DueIndex.load(index_path) == index
+
+    def test_04_between(self, tmpdir):
+        path = os.path.join(tmpdir, 'todo.txt')
+        index = DueIndex.build(write_tasks(path, self.raws), TextStorage(path), config_for_index(path))
+        (nov_1, nov_5) = (date_to_ordinal('211101'), date_to_ordinal('211105'))
+        assert [e[1] for e in index.between(None, nov_1)] == [3]
+        assert [e[1] for e in index.between(nov_1 + 1, None)] == [1]
+        assert [e[1] for e in index.between(nov_1, nov_5)] == [3, 1]
+        assert index.between(nov_5 + 1, None) == []
+
+    def test_05_configured_storage(self, tmpdir):
+        path = os.path.join(tmpdir, 'todo.txt')
+        config_path = config_for_index(path)
+        storage = SqliteStorage(os.path.join(tmpdir, 'todo.db'))
+        storage.save(TaskList([Task.load(raw) for raw in self.raws]))
+        with open(config_path, 'w') as file:
+            file.write('STORAGE sqlite\n')
+        assert len(DueIndex.for_todo(config_path, path).entries) == 2
+        assert DueIndex.load(os.path.join(tmpdir, 'due.idx')).source.startswith('sqlite ')
+        write_tasks(path, self.raws[:1])
+        with open(config_path, 'w') as file:
+            file.write('STORAGE text\n')
+        assert len(DueIndex.for_todo(config_path, path).entries) == 1
+
+class TestDoneRuns:
+    """Test finding the sorted runs of done.txt."""
+
+    def between(self, path, start, end):
+        runs = DoneRuns.for_done(path).ranges()
+        found = DoneList.load_between(path, date_to_ordinal(start), date_to_ordinal(end), runs)
+        return [done.completion_date for done in found.tasks]
+
+    def test_01_unsorted_append(self, tmpdir):
+        path = os.path.join(tmpdir, 'done.txt')
+        with open(path, 'w') as file:
+            file.write('x (A) 240101 240105 one\nx (A) 240101 240110 two\nx (A) 240101 240103 synced\n')
+        assert DoneRuns.for_done(path).starts == [0, 48]
+        assert self.between(path, '240103', '240104') == ['240103']
+        assert self.between(path, '240101', '240131') == ['240105', '240110', '240103']
+
+    def test_02_incremental(self, tmpdir):
+        path = os.path.join(tmpdir, 'done.txt')
+        with open(path, 'w') as file:
+            file.write('x (A) 240101 240105 one\nnot a task\n')
+        first = DoneRuns.for_done(path)
+        assert first.starts == [0] and first.scanned == 35
+        with open(path, 'a') as file:
+            file.write('x (A) 240101 240102 older\nx (A) 240101 240106 partial')
+        runs = DoneRuns.for_done(path)
+        assert runs.starts == [0, 35] and runs.scanned == 61
+        assert runs.ranges() == [(0, 35), (35, 61), (61, 88)]
+        assert self.between(path, '240106', '240106') == ['240106']
+
+    def test_03_rewritten(self, tmpdir):
+        path = os.path.join(tmpdir, 'done.txt')
+        with open(path, 'w') as file:
+            file.write('x (A) 240101 240105 one\nx (A) 240101 240103 two\n')
+        assert DoneRuns.for_done(path).starts == [0, 24]
+        with open(path, 'r+') as file:
+            file.write('x (A) 240101 240101 one\nx (A) 240101 240103 two\n')
+        assert DoneRuns.for_done(path).starts == [0]
+        assert DoneRuns.for_done(os.path.join(tmpdir, 'missing.txt')).ranges() == []
+LINES = ['(A) 211028 +work deploy the thing', '(A) 211102 +work deploy again due:211110', '(B) 211015 +home water plants', '(B) 211101 +work write Deploy notes', '(C) 211115 read a book due:211120', '(D) 211001 +work someday']
+
+def tasklist():
+    return TaskList([Task.load(line) for line in LINES])
+
+def matching(text):
+    query = Query.parse(text)
+    return [str(task) for task in tasklist().tasks if query.predicate(task)]
+
+class TestQuery:
+    """Test parsing and compiled predicates."""
+
+    def test_01_conjunction(self):
+        assert matching('pri <= C and tag = +work and created >= 211030 and text ~ "deploy"') == [LINES[1], LINES[3]]
+
+    def test_02_or_not_parentheses(self):
+        assert matching('not (tag = +work or pri = C)') == [LINES[2]]
+        assert matching('tag = none or due < 211111') == [LINES[1], LINES[4]]
+
+    def test_03_due(self):
+        assert matching('due != none') == [LINES[1], LINES[4]]
+        assert matching('due >= 211111') == [LINES[4]]
+
+    def test_04_invalid(self):
+        for text in ['pri', 'pri <', 'pri <= 3', 'colour = red', 'created ~ 21', 'tag < +work', '(pri = A', 'pri = A pri = B', 'text > a']:
+            with pytest.raises(ValueError):
+                Query.parse(text)
+
+class TestPlan:
+    """Test narrowing candidates on the sorted order."""
+
+    def test_01_bounds(self):
+        query = Query.parse('pri > A and pri < D and created < 211101')
+        assert query.bounds('pri') == (ord('B'), ord('C'))
+
+    def test_02_sorted_scan(self):
+        (plan, candidates) = sorted_scan(Query.parse('pri >= B and pri <= C'), tasklist())
+        assert [line for (line, _) in candidates] == [3, 4, 5]
+        assert '3-5' in plan
+
+    def test_03_created_per_priority(self):
+        query = Query.parse('created >= 211101 and created <= 211110')
+        (_, candidates) = sorted_scan(query, tasklist())
+        assert [line for (line, _) in candidates] == [2, 4]
+
+    def test_04_no_bounds_under_or(self):
+        query = Query.parse('pri = A or created > 211101')
+        assert query.bounds('pri') == (None, None)
+        assert len(sorted_scan(query, tasklist())[1]) == len(LINES)
+
+def write_done(path, count):
+    with open(path, 'w') as file:
+        for i in range(count):
+            file.write(f'x (A) 211001 211005 +tag{i % 7} finished task number {i}\n')
+
+class TestSplitChunks:
+    """Test content-defined chunking."""
+
+    def test_01_round_trip(self):
+        content = b''.join((b'(A) 211028 line %d\n' % i for i in range(5000)))
+        chunks = list(split_chunks(io.BytesIO(content)))
+        assert len(chunks) > 1
+        assert b''.join(chunks) == content
+        assert all((chunk.endswith(b'\n') for chunk in chunks))
+        assert all((len(chunk) <= SNAPSHOT_CHUNK_MAX + 100 for chunk in chunks))
+
+    def test_02_append_keeps_chunks(self):
+        content = b''.join((b'(A) 211028 line %d\n' % i for i in range(5000)))
+        before = list(split_chunks(io.BytesIO(content)))
+        after = list(split_chunks(io.BytesIO(content + b'(B) 211029 new\n')))
+        assert before[:-1] == after[:-1]
+
+class TestSnapshotStore:
+    """Test snapshots and restores."""
+
+    def test_01_snapshot_restore(self, tmpdir):
+        store = SnapshotStore(os.path.join(tmpdir, 'snapshots'))
+        done_path = os.path.join(tmpdir, 'done.txt')
+        write_done(done_path, 3000)
+        with open(done_path, 'rb') as file:
+            original = file.read()
+        (snapshot_id, new_chunks) = store.snapshot([done_path, os.path.join(tmpdir, 'missing')])
+        assert snapshot_id == 1 and new_chunks > 1
+        write_done(done_path, 10)
+        assert store.restore(1, tmpdir) == ['done.txt']
+        with open(done_path, 'rb') as file:
+            assert file.read() == original
+
+    def test_02_incremental(self, tmpdir):
+        store = SnapshotStore(os.path.join(tmpdir, 'snapshots'))
+        done_path = os.path.join(tmpdir, 'done.txt')
+        write_done(done_path, 3000)
+        store.snapshot([done_path])
+        assert store.snapshot([done_path]) == (2, 0)
+        with open(done_path, 'a') as file:
+            file.write('x (A) 211001 211006 one more\n')
+        assert store.snapshot([done_path]) == (3, 1)
+        assert store.ids() == [1, 2, 3]
+RAWS = ['(A) 211028 +work deploy due:211101', '(A) 211028 no tag', '(A) 211028 +work deploy', '(B) 211027 +home water plants', '(B) 211027 +home water plants', '(C) 211030 read']
+
+def tasklist_storage():
+    return TaskList([Task.load(raw) for raw in RAWS])
+
+class TestTextStorage:
+    """Test the todo.txt backend."""
+
+    def test_01_round_trip(self, tmpdir):
+        storage = TextStorage(os.path.join(tmpdir, 'todo.txt'))
+        storage.save(tasklist_storage())
+        assert storage.load() == tasklist_storage()
+
+class TestSqliteStorage:
+    """Test the SQLite backend."""
+
+    def test_01_load_sorted(self, tmpdir):
+        storage = SqliteStorage(os.path.join(tmpdir, 'todo.db'))
+        shuffled = tasklist_storage()
+        random.shuffle(shuffled.tasks)
+        storage.save(shuffled)
+        expected = tasklist_storage()
+        expected.sort()
+        assert storage.load() == expected
+
+    def test_02_save_only_changes(self, tmpdir):
+        storage = SqliteStorage(os.path.join(tmpdir, 'todo.db'))
+        storage.save(tasklist_storage())
+        ids_before = {row_id for (row_id, _, _) in storage.rows()}
+        changed = storage.load()
+        changed.tasks[0].priority = '(D)'
+        changed.tasks.pop(3)
+        storage.save(changed)
+        ids_after = {row_id for (row_id, _, _) in storage.rows()}
+        assert len(ids_before - ids_after) == 2
+        assert len(ids_after - ids_before) == 1
+        changed.sort()
+        assert storage.load() == changed
+
+    def test_03_rows_condition(self, tmpdir):
+        storage = SqliteStorage(os.path.join(tmpdir, 'todo.db'))
+        storage.save(tasklist_storage())
+        rows = storage.rows('tag = ? AND due IS NULL', ('+work',))
+        assert [(line_number, str(task)) for (_, line_number, task) in rows] == [(1, '(A) 211028 +work deploy')]
+
+    def test_04_signature(self, tmpdir):
+        storage = SqliteStorage(os.path.join(tmpdir, 'todo.db'))
+        storage.save(tasklist_storage())
+        signature = storage.signature()
+        storage.save(tasklist_storage())
+        assert storage.signature() == signature
+        changed = tasklist_storage()
+        changed.tasks[-1].priority = '(A)'
+        storage.save(changed)
+        assert storage.signature() != signature
+
+class TestBinaryStorage:
+    """Test the fixed-width record backend."""
+
+    def record_count(self, storage):
+        return (os.path.getsize(storage.path) - BinaryStorage.HEADER.size) // BinaryStorage.RECORD.size
+
+    def test_01_round_trip(self, tmpdir):
+        path = os.path.join(tmpdir, 'todo.bin')
+        BinaryStorage(path).save(tasklist_storage())
+        expected = tasklist_storage()
+        expected.sort()
+        assert BinaryStorage(path).load() == expected
+        record = BinaryStorage(path).pack(Task.load(RAWS[1]), {}, 2 ** 33, 6)
+        assert BinaryStorage.RECORD.unpack(record)[4] == 2 ** 33
+
+    def test_02_in_place(self, tmpdir):
+        path = os.path.join(tmpdir, 'todo.bin')
+        BinaryStorage(path).save(tasklist_storage())
+        heap_size = os.path.getsize(path + '.heap')
+        storage = BinaryStorage(path)
+        signature = storage.signature()
+        loaded = storage.load()
+        loaded.tasks[1].priority = '(Z)'
+        loaded.tasks.pop(0)
+        storage.save(loaded)
+        assert self.record_count(storage) == len(RAWS)
+        assert os.path.getsize(path + '.heap') == heap_size
+        assert storage.signature() != signature
+        loaded.sort()
+        assert BinaryStorage(path).load() == loaded
+
+    def test_03_changed_text_appends(self, tmpdir):
+        path = os.path.join(tmpdir, 'todo.bin')
+        BinaryStorage(path).save(tasklist_storage())
+        storage = BinaryStorage(path)
+        loaded = storage.load()
+        loaded.tasks[0] = Task.load('(A) 211028 +new tag entirely')
+        loaded.tasks.append(Task.load('(E) 211101 +work another'))
+        storage.save(loaded)
+        loaded.tasks[2].priority = '(B)'
+        storage.save(loaded)
+        assert self.record_count(storage) == len(RAWS) + 2
+        loaded.sort()
+        assert BinaryStorage(path).load() == loaded
+        assert BinaryStorage(path).read_tags() == ['+work', '+home', '+new']
+
+    def test_04_compact(self, tmpdir):
+        path = os.path.join(tmpdir, 'todo.bin')
+        storage = BinaryStorage(path)
+        storage.save(tasklist_storage())
+        loaded = storage.load()
+        del loaded.tasks[:3]
+        storage.save(loaded)
+        BinaryStorage(path).save(loaded)
+        assert self.record_count(storage) == len(RAWS) - 3
+        assert BinaryStorage(path).load() == loaded
+
+    def test_05_compacts_itself(self, tmpdir):
+        path = os.path.join(tmpdir, 'todo.bin')
+        storage = BinaryStorage(path, sync=True)
+        storage.COMPACT_MIN = 2
+        storage.save(tasklist_storage())
+        loaded = storage.load()
+        signature = storage.signature()
+        loaded.tasks.pop()
+        storage.save(loaded)
+        assert self.record_count(storage) == len(RAWS)
+        del loaded.tasks[:3]
+        storage.save(loaded)
+        assert self.record_count(storage) == 2
+        assert storage.tombstones == 0
+        assert storage.signature() != signature
+        assert not os.path.exists(path + '.new')
+        assert BinaryStorage(path).load() == loaded
+
+    def test_06_interrupted_rewrite(self, tmpdir):
+        path = os.path.join(tmpdir, 'todo.bin')
+        BinaryStorage(path).save(tasklist_storage())
+        new = TaskList([Task.load('(A) 211028 +other task')])
+        storage = BinaryStorage(os.path.join(tmpdir, 'other.bin'))
+        storage.save(new)
+        for suffix in ['.heap', '.tags', '']:
+            os.replace(storage.path + suffix, path + suffix + ('.tmp' if suffix else '.new'))
+        assert BinaryStorage(path).load() == new
+
+    def test_07_old_layout(self, tmpdir):
+        path = os.path.join(tmpdir, 'todo.bin')
+        old = struct.Struct('<cBIHII')
+        with open(path, 'wb') as file:
+            file.write(BinaryStorage.HEADER.pack(b'TODOBIN1', 3))
+            file.write(old.pack(b'B', 0, 738000, 1, 0, 4))
+            file.write(old.pack(b'A', BinaryStorage.TOMBSTONE, 738000, 0, 4, 4))
+        with open(path + '.heap', 'wb') as file:
+            file.write(b'keepgone')
+        with open(path + '.tags', 'w') as file:
+            file.write('+work\n')
+        storage = BinaryStorage(path)
+        loaded = storage.load()
+        assert [task.text for task in loaded.tasks] == ['keep']
+        storage.save(loaded)
+        assert open(path, 'rb').read(8) == BinaryStorage.MAGIC
+        assert self.record_count(storage) == 1
+        assert BinaryStorage(path).load() == loaded
+
+def write_sync(directory, name, lines):
+    with open(os.path.join(directory, name), 'w') as file:
+        file.write(''.join((f'{line}\n' for line in lines)))
+
+def read_sync(directory, name):
+    with open(os.path.join(directory, name)) as file:
+        return file.read().splitlines()
+
+@pytest.fixture
+def dirs(tmpdir):
+    (ours, theirs) = (os.path.join(tmpdir, 'ours'), os.path.join(tmpdir, 'theirs'))
+    for directory in [ours, theirs]:
+        os.makedirs(directory)
+        write_sync(directory, 'todo.txt', ['(A) 211028 shared one', '(B) 211028 shared two'])
+        write_sync(directory, 'done.txt', ['x (A) 211001 211002 old'])
+    sync(ours, theirs, 'todo.txt', 'done.txt')
+    return (ours, theirs)
+
+class TestMergeCounts:
+    """Test the three-way multiset merge."""
+
+    def test_01_one_sided(self):
+        base = Counter('ab')
+        assert merge_counts(base, Counter('abc'), base) == Counter('abc')
+        assert merge_counts(base, base, Counter('a')) == Counter('a')
+
+    def test_02_both_sides(self):
+        base = Counter('ab')
+        assert merge_counts(base, Counter('bc'), Counter('ad')) == Counter('cd')
+        assert merge_counts(base, Counter('abc'), Counter('abc')) == Counter('abc')
+        assert merge_counts(base, Counter('b'), Counter('b')) == Counter('b')
+
+class TestSync:
+    """Test syncing two directories."""
+
+    def test_01_concurrent_edits(self, dirs):
+        (ours, theirs) = dirs
+        write_sync(ours, 'todo.txt', ['(A) 211028 shared one', '(B) 211028 shared two', '(C) 211029 added here'])
+        write_sync(theirs, 'todo.txt', ['(B) 211028 shared two', '(A) 211030 added there'])
+        write_sync(theirs, 'done.txt', ['x (A) 211001 211002 old', 'x (A) 211028 211030 shared one'])
+        result = sync(ours, theirs, 'todo.txt', 'done.txt')
+        expected = ['(B) 211028 shared two', '(C) 211029 added here', '(A) 211030 added there']
+        assert read_sync(ours, 'todo.txt') == expected
+        assert sorted(read_sync(theirs, 'todo.txt')) == sorted(expected)
+        assert read_sync(ours, 'done.txt') == read_sync(theirs, 'done.txt')
+        assert (result.todo_ours, result.done_ours, result.done_theirs) == (2, 1, 0)
+
+    def test_02_unchanged_not_rewritten(self, dirs):
+        (ours, theirs) = dirs
+        path = os.path.join(theirs, 'todo.txt')
+        os.utime(path, ns=(0, 0))
+        result = sync(ours, theirs, 'todo.txt', 'done.txt')
+        assert result.todo_ours == result.todo_theirs == 0
+        assert os.stat(path).st_mtime_ns == 0
+
+    def test_03_no_base_is_union(self, tmpdir):
+        (ours, theirs) = (os.path.join(tmpdir, 'ours'), os.path.join(tmpdir, 'theirs'))
+        os.makedirs(ours)
+        os.makedirs(theirs)
+        write_sync(ours, 'todo.txt', ['(A) 211028 mine'])
+        write_sync(theirs, 'todo.txt', ['(A) 211028 yours'])
+        sync(ours, theirs, 'todo.txt', 'done.txt')
+        assert read_sync(ours, 'todo.txt') == ['(A) 211028 mine', '(A) 211028 yours']
+        assert read_sync(theirs, 'todo.txt') == ['(A) 211028 yours', '(A) 211028 mine']
+
+    def test_04_invalid_line(self, dirs):
+        (ours, theirs) = dirs
+        write_sync(theirs, 'todo.txt', ['(A) 211328 bad date'])
+        with pytest.raises(ValueError):
+            sync(ours, theirs, 'todo.txt', 'done.txt')
+
+class TestOperation:
+    """Test Operation round trips."""
+
+    def test_01_round_trip(self):
+        for operation in [Operation('add', None, '(A) 211028 text'), Operation('pri', '(A) 211028 text', '(B) 211028 text'), Operation('do', '(A) 211028 text', None, 'x (A) 211028 211030 text')]:
+            assert Operation.load(f'{operation}\n') == operation
+
+class TestUndoLog:
+    """Test the undo cursor and bound."""
+
+    def test_01_undo_redo(self, tmpdir):
+        log = UndoLog(os.path.join(tmpdir, 'undo.log'))
+        ops = [Operation('add', None, f'(A) 211028 task {i}') for i in range(3)]
+        for op in ops:
+            log.record(op)
+        assert log.undo() == ops[2]
+        assert log.undo() == ops[1]
+        assert log.redo() == ops[1]
+        assert log.redo() == ops[2]
+        assert log.redo() is None
+
+    def test_02_record_drops_redo(self, tmpdir):
+        log = UndoLog(os.path.join(tmpdir, 'undo.log'))
+        log.record(Operation('add', None, '(A) 211028 one'))
+        log.record(Operation('add', None, '(A) 211028 two'))
+        log.undo()
+        log.record(Operation('add', None, '(A) 211028 three'))
+        assert log.redo() is None
+        assert [op.after for op in log.operations] == ['(A) 211028 one', '(A) 211028 three']
+
+    def test_03_bounded(self, tmpdir):
+        log = UndoLog(os.path.join(tmpdir, 'undo.log'))
+        for i in range(UNDO_LIMIT + 10):
+            log.record(Operation('add', None, f'(A) 211028 task {i}'))
+        assert len(log.operations) == UNDO_LIMIT
+        assert log.operations[0].after == '(A) 211028 task 10'
+
+    def test_04_save_load(self, tmpdir):
+        path = os.path.join(tmpdir, 'undo.log')
+        log = UndoLog(path)
+        log.record(Operation('rm', '(A) 211028 one', None))
+        log.record(Operation('add', None, '(A) 211028 two'))
+        log.undo()
+        log.save()
+        loaded = UndoLog(path)
+        assert loaded.operations == log.operations
+        assert loaded.position == 1
+
+    def test_05_groups(self, tmpdir):
+        log = UndoLog(os.path.join(tmpdir, 'undo.log'))
+        log.record(Operation('add', None, '(A) 211028 one'))
+        group = [Operation('sed', f'(A) 211028 {i}', f'(A) 211028 x{i}', None, '1') for i in range(3)]
+        log.record_group(group)
+        assert log.undo_group() == group[::-1]
+        assert log.undo_group() == [log.operations[0]]
+        assert log.redo_group() == [log.operations[0]]
+        assert log.redo_group() == group
+
+    def test_06_groups_bounded(self, tmpdir):
+        log = UndoLog(os.path.join(tmpdir, 'undo.log'))
+        log.record_group([Operation('sed', None, f'(A) 211028 a{i}', None, '1') for i in range(UNDO_LIMIT - 5)])
+        log.record(Operation('add', None, '(A) 211028 one'))
+        log.record_group([Operation('sed', None, f'(A) 211028 b{i}', None, '2') for i in range(10)])
+        assert [op.group for op in log.operations] == [None] + ['2'] * 10
+        log.record_group([Operation('sed', None, f'(A) 211028 c{i}', None, '3') for i in range(UNDO_LIMIT + 5)])
+        assert len(log.operations) == UNDO_LIMIT + 5
 
 class TestColorToColorcode:
+
     def test_01_valid_color(self):
-        color = "BLACK"
+        color = 'BLACK'
         assert color_to_color_code(color) == Colors.BLACK
 
     def test_02_invalid_color(self):
-        color = "BLLACK"
+        color = 'BLLACK'
         with pytest.raises(ValueError):
             color_to_color_code(color)
 
-
 class TestIsValidPriority:
+
     def test_01_valid(self):
-        raw = "(A)"
+        raw = '(A)'
         assert is_valid_priority(raw)
 
     def test_02_invalid_braces(self):
-        raw = "[A)"
+        raw = '[A)'
         assert not is_valid_priority(raw)
 
     def test_03_invalid_long(self):
-        raw = "(A))"
+        raw = '(A))'
         assert not is_valid_priority(raw)
 
     def test_04_invalid_middle(self):
-        raw = "(!)"
+        raw = '(!)'
         assert not is_valid_priority(raw)
 
     def test_05_invalid_middle_long(self):
-        raw = "(AA)"
+        raw = '(AA)'
         assert not is_valid_priority(raw)
 
-
 class TestIsValidDate:
+
     def test_01_valid(self):
-        raw = "012345"
+        raw = '211028'
         assert is_valid_date(raw)
 
     def test_02_invalid(self):
-        raw = "012a45"
+        raw = '012a45'
         assert not is_valid_date(raw)
 
     def test_03_invalid_short(self):
-        raw = "01345"
+        raw = '01345'
         assert not is_valid_date(raw)
 
     def test_04_invalid_long(self):
-        raw = "2012345"
+        raw = '2012345'
         assert not is_valid_date(raw)
 
+    def test_05_invalid_calendar(self):
+        assert not is_valid_date('211345')
+        assert not is_valid_date('210230')
+        assert not is_valid_date('210000')
+
+    def test_06_leap_day(self):
+        assert is_valid_date('240229')
+        assert not is_valid_date('230229')
+
+class TestDateToOrdinal:
+
+    def test_01_round_trip(self):
+        for raw in ['000101', '211028', '240229', '991231']:
+            assert ordinal_to_date(date_to_ordinal(raw)) == raw
+
+    def test_02_order(self):
+        assert date_to_ordinal('211231') + 1 == date_to_ordinal('220101')
+
+    def test_03_invalid(self):
+        with pytest.raises(ValueError):
+            date_to_ordinal('211345')
 
 class TestIsValidTag:
+
     def test_01_valid(self):
-        raw = "+tag"
+        raw = '+tag'
         assert is_valid_tag(raw)
 
     def test_02_invalid(self):
-        raw = "tag"
+        raw = 'tag'
         assert not is_valid_tag(raw)
 
     def test_03_invalid_empty(self):
-        raw = ""
+        raw = ''
         assert not is_valid_tag(raw)
 
-
 class TestIsValidLineNumber:
+
     def test_01_valid(self):
-        raw = "1"
+        raw = '1'
         assert is_valid_line_number(raw)
 
     def test_02_valid_long(self):
-        raw = "1234"
+        raw = '1234'
         assert is_valid_line_number(raw)
 
     def test_03_invalid(self):
-        raw = "aa"
+        raw = 'aa'
         assert not is_valid_line_number(raw)
+
+class TestParseDays:
+
+    def test_01_valid(self):
+        assert parse_days('7') == 7
+        assert parse_days('7d') == 7
+        assert parse_days('2w') == 14
+
+    def test_02_invalid(self):
+        for raw in ['', 'd', '7x', '-1d']:
+            with pytest.raises(ValueError):
+                parse_days(raw)
+
+class TestParseSubstitution:
+
+    def test_01_valid(self):
+        (regex, replacement, count) = parse_substitution('s/+old/+new/')
+        assert regex.sub(replacement, 'a +old +old', count) == 'a +new +old'
+
+    def test_04_basic_regex(self):
+        (regex, replacement, count) = parse_substitution('s/\\(ab\\)\\+/[&|\\1]/')
+        assert regex.sub(replacement, 'xababy', count) == 'x[abab|ab]y'
+
+    def test_02_flags_and_delimiter(self):
+        (regex, replacement, count) = parse_substitution('s|A|b|gi')
+        assert regex.sub(replacement, 'a A', count) == 'b b'
+
+    def test_03_invalid(self):
+        for raw in ['', 's', 'y/a/b/', 's/a/b', 's/a/b/x', 's/\\(/b/']:
+            with pytest.raises(ValueError):
+                parse_substitution(raw)
+
+class TestReadLinesReversed:
+
+    def test_01_lines_across_blocks(self, tmpdir):
+        path = os.path.join(tmpdir, 'file.txt')
+        lines = [f'line {i} ' + 'é' * (i % 7) for i in range(200)] + ['', 'last']
+        for ending in ['', '\n']:
+            with open(path, 'w') as file:
+                file.write('\n'.join(lines) + ending)
+            for block_size in [1, 3, 16, 4096]:
+                assert list(read_lines_reversed(path, block_size)) == lines[::-1]
+
+    def test_02_empty(self, tmpdir):
+        path = os.path.join(tmpdir, 'file.txt')
+        open(path, 'w').close()
+        assert list(read_lines_reversed(path)) == []
+
+class TestScreen:
+    """Test incremental redraws."""
+
+    def test_01_only_changed_rows(self):
+        out = io.StringIO()
+        screen = Screen(out)
+        assert screen.draw(['a', 'b', 'c']) == 3
+        out.seek(0)
+        out.truncate()
+        assert screen.draw(['a', 'x', 'c']) == 1
+        assert '\x1b[2;1Hx' in out.getvalue()
+        assert 'a' not in out.getvalue()
+
+    def test_02_shorter_list_is_cleared(self):
+        out = io.StringIO()
+        screen = Screen(out)
+        screen.draw(['a', 'b', 'c'])
+        assert screen.draw(['a']) == 0
+        assert '\x1b[2;1H\x1b[J' in out.getvalue()
+
+class TestWatchers:
+    """Test noticing changed files."""
+
+    @pytest.fixture
+    def paths(self, tmpdir):
+        paths = [os.path.join(tmpdir, 'todo.txt'), os.path.join(tmpdir, 'config')]
+        for path in paths:
+            open(path, 'w').close()
+        return paths
+
+    def test_01_inotify(self, paths):
+        watcher = InotifyWatcher(paths)
+        with open(os.path.join(os.path.dirname(paths[0]), 'other'), 'w') as file:
+            file.write('ignored\n')
+        with open(paths[0], 'w') as file:
+            file.write('(A) 211028 changed\n')
+        watcher.wait(paths)
+        watcher.close()
+
+    def test_02_polling(self, paths):
+        watcher = PollingWatcher(paths, interval=0.01)
+        with open(paths[1], 'w') as file:
+            file.write('COLOR_TAG red\n')
+        watcher.wait(paths)
+        watcher.close()
+
+@pytest.fixture
+def todo_dir(tmpdir):
+    """A todo directory with an empty config and a few tasks."""
+    open(os.path.join(tmpdir, 'config'), 'w').close()
+    with open(os.path.join(tmpdir, 'todo.txt'), 'w') as file:
+        file.write('(A) 211028 +work deploy the thing\n(B) 211101 +home water plants\n(C) 211115 read a book\n')
+    with open(os.path.join(tmpdir, 'done.txt'), 'w') as file:
+        file.write('x (A) 211001 211005 +work ship it\nx (B) 211001 211020 call mom\n')
+    return tmpdir
+
+def make_app(todo_dir):
+    return TodoApp(os.path.join(todo_dir, 'config'), os.path.join(todo_dir, 'todo.txt'), os.path.join(todo_dir, 'done.txt'))
+
+def fast(args, todo_dir):
+    return parse_fast_command(args, os.path.join(todo_dir, 'config'), os.path.join(todo_dir, 'todo.txt'), os.path.join(todo_dir, 'done.txt'))
+
+def read_app(todo_dir, name):
+    with open(os.path.join(todo_dir, name)) as file:
+        return file.read()
+
+class TestDates:
+    """Test date-range queries."""
+
+    def test_01_list_since(self, todo_dir, capsys):
+        parse_command(['list', '--since', '211101'], make_app(todo_dir))
+        lines = capsys.readouterr().out.splitlines()
+        assert len(lines) == 2
+        assert lines[0].startswith(DefaultConfig.COLOR_NUMBER + '2')
+        assert 'water plants' in lines[0]
+        assert 'read a book' in lines[1]
+
+    def test_02_list_until_verbose(self, todo_dir, capsys):
+        parse_command(['list', 'verbose', '--until', '211031'], make_app(todo_dir))
+        lines = capsys.readouterr().out.splitlines()
+        assert len(lines) == 1
+        assert '211028' in lines[0]
+
+    def test_03_list_invalid_date(self, todo_dir):
+        with pytest.raises(ValueError):
+            parse_command(['list', '--since', '211345'], make_app(todo_dir))
+
+    def test_04_done_between(self, todo_dir, capsys):
+        parse_command(['done', '--between', '211010', '211031'], make_app(todo_dir))
+        assert capsys.readouterr().out == 'x (B) 211001 211020 call mom\n'
+
+    def test_05_do_appends_done(self, todo_dir):
+        parse_command(['do', '1'], make_app(todo_dir))
+        last = read_app(todo_dir, 'done.txt').splitlines()[-1]
+        assert last.startswith('x (A) 211028 ')
+        assert last.endswith(' +work deploy the thing')
+
+class TestDue:
+    """Test due date commands."""
+
+    def add_due(self, todo_dir, offset):
+        due = ordinal_to_date(get_current_day() + offset)
+        parse_command(['add', 'B', f'offset {offset} due:{due}'], make_app(todo_dir))
+
+    def test_01_due_within(self, todo_dir, capsys):
+        for offset in [-3, 0, 5, 10]:
+            self.add_due(todo_dir, offset)
+        assert fast(['due', '--within', '7d'], todo_dir)
+        out = capsys.readouterr().out
+        assert 'offset 0 ' in out and 'offset 5 ' in out
+        assert 'offset 10 ' not in out and 'offset -3 ' not in out
+        assert fast(['overdue'], todo_dir)
+        assert 'offset -3 ' in capsys.readouterr().out
+
+    def test_02_line_numbers(self, todo_dir, capsys):
+        self.add_due(todo_dir, 1)
+        fast(['due'], todo_dir)
+        line_number = capsys.readouterr().out.split()[0]
+        parse_command(['do', line_number], make_app(todo_dir))
+        assert 'offset 1 ' in read_app(todo_dir, 'done.txt')
+
+    def test_03_not_fast(self, todo_dir):
+        assert not fast(['list'], todo_dir)
+
+class TestArchive:
+    """Test archiving completed tasks."""
+
+    def test_01_archive_and_query(self, todo_dir, capsys):
+        parse_command(['archive', '--older-than', '0d'], make_app(todo_dir))
+        assert read_app(todo_dir, 'done.txt') == ''
+        parse_command(['done', '--between', '211001', '211010'], make_app(todo_dir))
+        assert capsys.readouterr().out == 'x (A) 211001 211005 +work ship it\n'
+        parse_command(['stats'], make_app(todo_dir))
+        assert capsys.readouterr().out == 'open: 3\ndone: 0\narchived: 2 in 1 blocks\n'
+
+    def test_02_search(self, todo_dir, capsys):
+        app = make_app(todo_dir)
+        app.archive(date_to_ordinal('211010'))
+        parse_command(['done', '--search', 'ship', 'it'], make_app(todo_dir))
+        assert capsys.readouterr().out == 'x (A) 211001 211005 +work ship it\n'
+        assert read_app(todo_dir, 'done.txt') == 'x (B) 211001 211020 call mom\n'
+
+    def test_03_done_last_and_today(self, todo_dir, capsys):
+        today = ordinal_to_date(get_current_day())
+        with open(os.path.join(todo_dir, 'done.txt'), 'a') as file:
+            file.write(f'x (C) 211001 {today} +home finished today\n')
+        assert fast(['done', '--last', '2'], todo_dir)
+        assert capsys.readouterr().out == f'x (B) 211001 211020 call mom\nx (C) 211001 {today} +home finished today\n'
+        assert fast(['done', '--today'], todo_dir)
+        assert capsys.readouterr().out == f'x (C) 211001 {today} +home finished today\n'
+        make_app(todo_dir).archive(date_to_ordinal('211010'))
+        assert fast(['done', '--last', '5'], todo_dir)
+        assert capsys.readouterr().out.splitlines() == ['x (A) 211001 211005 +work ship it', 'x (B) 211001 211020 call mom', f'x (C) 211001 {today} +home finished today']
+
+class TestUndo:
+    """Test undoing and redoing operations."""
+
+    def test_01_undo_rm(self, todo_dir):
+        before = read_app(todo_dir, 'todo.txt')
+        parse_command(['rm', '2'], make_app(todo_dir))
+        assert 'water plants' not in read_app(todo_dir, 'todo.txt')
+        parse_command(['undo'], make_app(todo_dir))
+        assert read_app(todo_dir, 'todo.txt') == before
+
+    def test_02_undo_do_retracts_done(self, todo_dir):
+        todo_before = read_app(todo_dir, 'todo.txt')
+        done_before = read_app(todo_dir, 'done.txt')
+        parse_command(['do', '1'], make_app(todo_dir))
+        parse_command(['undo'], make_app(todo_dir))
+        assert read_app(todo_dir, 'todo.txt') == todo_before
+        assert read_app(todo_dir, 'done.txt') == done_before
+        parse_command(['redo'], make_app(todo_dir))
+        assert 'deploy the thing' not in read_app(todo_dir, 'todo.txt')
+        assert 'deploy the thing' in read_app(todo_dir, 'done.txt')
+
+    def test_03_undo_many(self, todo_dir):
+        before = read_app(todo_dir, 'todo.txt')
+        parse_command(['pri', '3', 'A'], make_app(todo_dir))
+        parse_command(['add', 'D', '+new', 'thing'], make_app(todo_dir))
+        parse_command(['rm', '1'], make_app(todo_dir))
+        after = read_app(todo_dir, 'todo.txt')
+        parse_command(['undo', '3'], make_app(todo_dir))
+        assert read_app(todo_dir, 'todo.txt') == before
+        parse_command(['redo', '3'], make_app(todo_dir))
+        assert read_app(todo_dir, 'todo.txt') == after
+
+    def test_04_undo_empty(self, todo_dir, monkeypatch):
+        before = read_app(todo_dir, 'todo.txt')
+        app = make_app(todo_dir)
+        monkeypatch.setattr(app, 'save', lambda : pytest.fail('saved with nothing to undo'))
+        parse_command(['undo'], app)
+        parse_command(['redo'], app)
+        assert read_app(todo_dir, 'todo.txt') == before
+
+    def test_05_undo_archived_do(self, todo_dir, capsys):
+        parse_command(['do', '1'], make_app(todo_dir))
+        with open(os.path.join(todo_dir, 'done.txt'), 'w') as file:
+            file.write('')
+        parse_command(['undo'], make_app(todo_dir))
+        assert 'deploy the thing' in read_app(todo_dir, 'todo.txt')
+        assert 'may be archived: x (A) 211028' in capsys.readouterr().err
+
+class TestSnapshot:
+    """Test snapshotting and restoring the todo directory."""
+
+    def test_01_restore(self, todo_dir, capsys):
+        before = {name: read_app(todo_dir, name) for name in ['todo.txt', 'done.txt']}
+        assert fast(['snapshot'], todo_dir)
+        parse_command(['do', '1'], make_app(todo_dir))
+        parse_command(['rm', '1'], make_app(todo_dir))
+        assert fast(['restore', '1'], todo_dir)
+        for (name, content) in before.items():
+            assert read_app(todo_dir, name) == content
+
+    def test_02_restore_missing(self, todo_dir):
+        with pytest.raises(ValueError):
+            fast(['restore', '7'], todo_dir)
+
+class TestStorage:
+    """Test running the app on the SQLite backend."""
+
+    def use_sqlite(self, todo_dir):
+        parse_command(['migrate', 'sqlite'], make_app(todo_dir))
+        with open(os.path.join(todo_dir, 'config'), 'w') as file:
+            file.write('STORAGE sqlite\n')
+
+    def test_01_commands(self, todo_dir, capsys):
+        self.use_sqlite(todo_dir)
+        parse_command(['add', 'A', '+work', 'due:211201', 'write report'], make_app(todo_dir))
+        parse_command(['pri', '3', 'A'], make_app(todo_dir))
+        parse_command(['do', '1'], make_app(todo_dir))
+        capsys.readouterr()
+        parse_command(['list'], make_app(todo_dir))
+        assert len(capsys.readouterr().out.splitlines()) == 3
+        parse_command(['sql', 'tag', '=', "'+work'"], make_app(todo_dir))
+        assert capsys.readouterr().out.endswith('+work due:211201 write report\n')
+        assert fast(['overdue'], todo_dir)
+        assert 'write report' in capsys.readouterr().out
+        parse_command(['migrate', 'text'], make_app(todo_dir))
+        assert 'write report' in read_app(todo_dir, 'todo.txt')
+
+    def test_02_sql_needs_sqlite(self, todo_dir):
+        with pytest.raises(ValueError):
+            parse_command(['sql', '1'], make_app(todo_dir))
+
+    def test_03_binary(self, todo_dir, capsys):
+        parse_command(['migrate', 'binary'], make_app(todo_dir))
+        with open(os.path.join(todo_dir, 'config'), 'w') as file:
+            file.write('STORAGE binary\n')
+        parse_command(['pri', '3', 'A'], make_app(todo_dir))
+        parse_command(['rm', '2'], make_app(todo_dir))
+        parse_command(['undo'], make_app(todo_dir))
+        parse_command(['migrate', 'text'], make_app(todo_dir))
+        assert read_app(todo_dir, 'todo.txt') == '(A) 211028 +work deploy the thing\n(A) 211115 read a book\n(B) 211101 +home water plants\n'
+
+    def test_04_export_import(self, todo_dir, capsys, monkeypatch):
+        self.use_sqlite(todo_dir)
+        parse_command(['add', 'A', 'only in the database'], make_app(todo_dir))
+        capsys.readouterr()
+        assert fast(['export', '--format', 'jsonl'], todo_dir)
+        exported = capsys.readouterr().out
+        assert len(exported.splitlines()) == 4
+        assert 'only in the database' in exported
+        monkeypatch.setattr('sys.stdin', io.StringIO(exported))
+        assert fast(['import', '--format', 'jsonl'], todo_dir)
+        parse_command(['list'], make_app(todo_dir))
+        assert len(capsys.readouterr().out.splitlines()) == 8
+        assert 'only in the database' not in read_app(todo_dir, 'todo.txt')
+
+    @pytest.mark.parametrize('kind', ['sqlite', 'binary'])
+    def test_05_snapshot(self, todo_dir, capsys, kind):
+        parse_command(['migrate', kind], make_app(todo_dir))
+        with open(os.path.join(todo_dir, 'config'), 'w') as file:
+            file.write(f'STORAGE {kind}\n')
+        parse_command(['add', 'A', 'snapshotted'], make_app(todo_dir))
+        assert fast(['snapshot'], todo_dir)
+        parse_command(['rm', '1'], make_app(todo_dir))
+        parse_command(['add', 'A', 'after the snapshot'], make_app(todo_dir))
+        capsys.readouterr()
+        assert fast(['restore', '1'], todo_dir)
+        parse_command(['list'], make_app(todo_dir))
+        listed = capsys.readouterr().out
+        assert 'snapshotted' in listed and 'after the snapshot' not in listed
+
+    def test_06_sync_needs_text(self, todo_dir, tmpdir_factory):
+        self.use_sqlite(todo_dir)
+        with pytest.raises(ValueError):
+            fast(['sync', str(tmpdir_factory.mktemp('other'))], todo_dir)
+
+class TestListCache:
+    """Test serving repeated listings from the rendered-output cache."""
+
+    def test_01_repeat_is_cached(self, todo_dir, capsys):
+        parse_command(['list', 'verbose'], make_app(todo_dir))
+        rendered = capsys.readouterr().out
+        assert fast(['list', 'verbose'], todo_dir)
+        assert capsys.readouterr().out == rendered
+        assert not fast(['list'], todo_dir)
+
+    def test_02_changes_invalidate(self, todo_dir, capsys):
+        parse_command(['list'], make_app(todo_dir))
+        parse_command(['add', 'A', 'new', 'task'], make_app(todo_dir))
+        assert not fast(['list'], todo_dir)
+        parse_command(['list'], make_app(todo_dir))
+        capsys.readouterr()
+        with open(os.path.join(todo_dir, 'config'), 'w') as file:
+            file.write('COLOR_TAG red\n')
+        assert not fast(['list'], todo_dir)
+
+class TestFuzzy:
+    """Test completing and finding tasks by fuzzy text."""
+
+    def test_01_do_by_text(self, todo_dir):
+        parse_command(['do', '~water', 'plan'], make_app(todo_dir))
+        assert 'water plants' not in read_app(todo_dir, 'todo.txt')
+        assert 'water plants' in read_app(todo_dir, 'done.txt')
+
+    def test_02_ambiguous(self, todo_dir, capsys):
+        parse_command(['add', 'C', '+home', 'water lawn'], make_app(todo_dir))
+        todo = read_app(todo_dir, 'todo.txt')
+        with pytest.raises(ValueError):
+            parse_command(['do', '~+home water'], make_app(todo_dir))
+        assert read_app(todo_dir, 'todo.txt') == todo
+        assert len(capsys.readouterr().out.splitlines()) == 2
+
+    def test_03_find(self, todo_dir, capsys):
+        parse_command(['find', '~book'], make_app(todo_dir))
+        assert capsys.readouterr().out == '3 (C) 211115 read a book\n'
+
+class TestBulkEdit:
+    """Test sed and pri-all."""
+
+    def test_01_sed_tag(self, todo_dir, capsys):
+        parse_command(['sed', 's/+home/+house/'], make_app(todo_dir))
+        assert '(B) 211101 +house water plants' in read_app(todo_dir, 'todo.txt')
+        assert '+home' not in read_app(todo_dir, 'todo.txt')
+
+    def test_02_sed_condition_and_undo(self, todo_dir, capsys):
+        before = read_app(todo_dir, 'todo.txt')
+        parse_command(['sed', 's/ t/ T/g', '+work'], make_app(todo_dir))
+        assert '(A) 211028 +work deploy The Thing' in read_app(todo_dir, 'todo.txt')
+        assert 'read a book' in read_app(todo_dir, 'todo.txt')
+        parse_command(['undo'], make_app(todo_dir))
+        assert read_app(todo_dir, 'todo.txt') == before
+
+    def test_03_invalid_result(self, todo_dir):
+        before = read_app(todo_dir, 'todo.txt')
+        with pytest.raises(ValueError):
+            parse_command(['sed', 's/^.../(a)/'], make_app(todo_dir))
+        assert read_app(todo_dir, 'todo.txt') == before
+
+    def test_04_dry_run(self, todo_dir, capsys):
+        before = read_app(todo_dir, 'todo.txt')
+        parse_command(['pri-all', '+home', 'A', '--dry-run'], make_app(todo_dir))
+        diff = capsys.readouterr().out.splitlines()
+        assert '-(B) 211101 +home water plants' in diff
+        assert '+(A) 211101 +home water plants' in diff
+        assert read_app(todo_dir, 'todo.txt') == before
+
+    def test_05_pri_all(self, todo_dir, capsys):
+        parse_command(['add', 'C', '+home', 'water lawn'], make_app(todo_dir))
+        parse_command(['pri-all', '+home', 'A'], make_app(todo_dir))
+        todo = read_app(todo_dir, 'todo.txt')
+        assert '(A) 211101 +home water plants' in todo
+        assert f'(A) {ordinal_to_date(get_current_day())} +home water lawn' in todo
+        assert capsys.readouterr().out == 'Changed 2 tasks.\n'
+
+class TestQueryApp:
+    """Test t query and its plans."""
+
+    def test_01_query(self, todo_dir, capsys):
+        parse_command(['query', 'pri', '<=', 'B', 'and', 'tag', '!=', '+work'], make_app(todo_dir))
+        assert capsys.readouterr().out == '2 (B) 211101 +home water plants\n'
+
+    def test_02_due_index(self, todo_dir, capsys):
+        parse_command(['add', 'C', '+work', 'due:211201', 'write report'], make_app(todo_dir))
+        capsys.readouterr()
+        parse_command(['query', '--explain', 'due <= 211231'], make_app(todo_dir))
+        assert capsys.readouterr().out.startswith('due index')
+        parse_command(['query', 'due <= 211231'], make_app(todo_dir))
+        assert capsys.readouterr().out.endswith('+work due:211201 write report\n')
+
+    def test_03_sqlite_index(self, todo_dir, capsys):
+        TestStorage().use_sqlite(todo_dir)
+        capsys.readouterr()
+        parse_command(['query', '--explain', 'tag = +home'], make_app(todo_dir))
+        assert capsys.readouterr().out.startswith('sqlite index: tag = ?')
+        parse_command(['query', 'tag = +home'], make_app(todo_dir))
+        assert capsys.readouterr().out == '2 (B) 211101 +home water plants\n'
+
+    def test_04_lazy_reads(self, todo_dir, capsys):
+        with open(os.path.join(todo_dir, 'todo.txt'), 'a') as file:
+            file.write('(B) 211101  +home\tsweep  floor\n')
+        paths = [os.path.join(todo_dir, name) for name in ['config', 'todo.txt', 'done.txt']]
+        for args in [['list', 'verbose'], ['find', 'plants'], ['query', 'tag = +home']]:
+            parse_command(args, make_app(todo_dir))
+            expected = capsys.readouterr().out
+            if args[0] == 'list':
+                os.remove(os.path.join(todo_dir, 'list.cache'))
+            run(args, *paths)
+            assert capsys.readouterr().out == expected
+        assert expected.splitlines()[1] == '3 (B) 211101 +home water plants'
+        assert TodoApp(*paths, lazy=True).tasklist.tasks[0]._text is None
+
+class TestDedupe:
+    """Test dedupe and add --unique."""
+
+    def test_01_report_and_merge(self, todo_dir, capsys):
+        parse_command(['add', 'C', '+work', 'Deploy', 'the', 'thing'], make_app(todo_dir))
+        capsys.readouterr()
+        parse_command(['dedupe'], make_app(todo_dir))
+        assert capsys.readouterr().out.splitlines()[:2] == ['1 (A) 211028 +work deploy the thing', f'4 (C) {ordinal_to_date(get_current_day())} +work Deploy the thing']
+        before = read_app(todo_dir, 'todo.txt')
+        parse_command(['dedupe', '--merge'], make_app(todo_dir))
+        assert 'Deploy' not in read_app(todo_dir, 'todo.txt')
+        parse_command(['undo'], make_app(todo_dir))
+        assert read_app(todo_dir, 'todo.txt') == before
+
+    def test_02_against_done(self, todo_dir, capsys):
+        parse_command(['add', 'B', 'call', 'mom'], make_app(todo_dir))
+        with open(os.path.join(todo_dir, 'done.txt'), 'a') as file:
+            file.write(f'x (B) 211001 {ordinal_to_date(get_current_day() - 1)} call mom\n')
+        capsys.readouterr()
+        parse_command(['dedupe', '--done', '7d', '--merge'], make_app(todo_dir))
+        assert 'call mom' not in read_app(todo_dir, 'todo.txt')
+        assert capsys.readouterr().out.endswith('Removed 1 duplicates.\n')
+
+    def test_03_add_unique(self, todo_dir, capsys):
+        before = read_app(todo_dir, 'todo.txt')
+        parse_command(['add', '--unique', 'B', '+home', 'water', 'plants'], make_app(todo_dir))
+        assert read_app(todo_dir, 'todo.txt') == before
+        assert capsys.readouterr().out.startswith('Already on line 2:')
+        parse_command(['add', '--unique', 'B', '+home', 'water', 'lawn'], make_app(todo_dir))
+        assert 'water lawn' in read_app(todo_dir, 'todo.txt')
+
+class TestTolerantLoad:
+    """Test running with invalid lines in todo.txt."""
+
+    def test_01_commands_keep_working(self, todo_dir, capsys):
+        with open(os.path.join(todo_dir, 'todo.txt'), 'a') as file:
+            file.write('(Q) 211399 oops\n')
+        parse_command(['do', '1'], make_app(todo_dir))
+        assert 'run `t fsck`' in capsys.readouterr().err
+        assert read_app(todo_dir, 'todo.txt').endswith('(C) 211115 read a book\n(Q) 211399 oops\n')
+        assert fast(['fsck', '--quarantine'], todo_dir)
+        assert 'todo.txt:3 (byte' in capsys.readouterr().out
+        assert read_app(todo_dir, 'todo.txt.rejects') == '(Q) 211399 oops\n'
+        make_app(todo_dir)
+        assert capsys.readouterr().err == ''
+
+class TestDurability:
+    """Test completing several tasks and recovering interrupted completions."""
+
+    def test_01_do_many(self, todo_dir):
+        for durability in ['batch', 'always', 'none']:
+            with open(os.path.join(todo_dir, 'config'), 'w') as file:
+                file.write(f'DURABILITY {durability}\n')
+            app = make_app(todo_dir)
+            parse_command(['do', '3', '1'], app)
+            today = ordinal_to_date(get_current_day())
+            assert read_app(todo_dir, 'todo.txt') == '(B) 211101 +home water plants\n'
+            assert read_app(todo_dir, 'done.txt').endswith(f'x (A) 211028 {today} +work deploy the thing\nx (C) 211115 {today} read a book\n')
+            assert not os.path.exists(os.path.join(todo_dir, 'done.intent'))
+            app.undo()
+            assert read_app(todo_dir, 'todo.txt').count('\n') == 3
+            assert read_app(todo_dir, 'done.txt').count('\n') == 2
+
+    def test_02_recover_on_start(self, todo_dir, capsys):
+        with open(os.path.join(todo_dir, 'done.intent'), 'w') as file:
+            file.write(f"{len(read_app(todo_dir, 'done.txt'))} stale signature\nx (A) 211028 211201 +work deploy the thing\n")
+        make_app(todo_dir)
+        assert 'interrupted' in capsys.readouterr().err
+        assert read_app(todo_dir, 'done.txt').endswith('211201 +work deploy the thing\n')
+        assert not os.path.exists(os.path.join(todo_dir, 'done.intent'))
+
+    def test_03_fast_command_recovers(self, todo_dir, capsys):
+        with open(os.path.join(todo_dir, 'done.intent'), 'w') as file:
+            file.write(f"{len(read_app(todo_dir, 'done.txt'))} stale signature\nx (A) 211028 211201 +work deploy the thing\n")
+        run(['help'], os.path.join(todo_dir, 'config'), os.path.join(todo_dir, 'todo.txt'), os.path.join(todo_dir, 'done.txt'))
+        captured = capsys.readouterr()
+        assert 'interrupted' in captured.err
+        assert captured.out.startswith('Supported operations:')
+        assert read_app(todo_dir, 'done.txt').endswith('211201 +work deploy the thing\n')
+        assert not os.path.exists(os.path.join(todo_dir, 'done.intent'))
+
+class TestCompleteApp:
+    """Test completion from the cache the app keeps."""
+
+    def test_01_cache_follows_saves(self, todo_dir, capsys):
+        parse_command(['add', 'D', '+garden', 'weed'], make_app(todo_dir))
+        assert fast(['complete', 'rm', '4'], todo_dir)
+        assert capsys.readouterr().out == '4\t(D) +garden weed\n'
+        assert fast(['complete', 'pri', '1', ''], todo_dir)
+        assert capsys.readouterr().out == 'A\nB\nC\nD\n'
\ No newline at end of file
@@ -1,521 +1,3336 @@
 #!/bin/python3.10
-
 """Full executable file."""
 
+from __future__ import annotations
+'Constants for todotxtpy.'
 import os
-import sys
-import datetime
-from functools import cmp_to_key
-from typing import Optional
-
-# Constants
-
-TODO_DIRECTORY = os.path.join(os.path.expanduser("~"), "todo")
-CONFIG_PATH = os.path.join(TODO_DIRECTORY, "config")
-TODO_PATH = os.path.join(TODO_DIRECTORY, "todo.txt")
-DONE_PATH = os.path.join(TODO_DIRECTORY, "done.txt")
-
+TODO_DIRECTORY = os.path.join(os.path.expanduser('~'), 'todo')
+CONFIG_PATH = os.path.join(TODO_DIRECTORY, 'config')
+TODO_PATH = os.path.join(TODO_DIRECTORY, 'todo.txt')
+DONE_PATH = os.path.join(TODO_DIRECTORY, 'done.txt')
+DUE_INDEX_NAME = 'due.idx'
+ARCHIVE_NAME = 'done.archive'
+UNDO_LOG_NAME = 'undo.log'
+SNAPSHOT_DIRECTORY_NAME = 'snapshots'
+SYNC_DIRECTORY_NAME = 'sync'
+SQLITE_NAME = 'todo.db'
+BINARY_NAME = 'todo.bin'
+LIST_CACHE_NAME = 'list.cache'
+DONE_INTENT_NAME = 'done.intent'
+COMPLETE_CACHE_NAME = 'complete.cache'
+DONE_RUNS_NAME = 'done.runs'
+REJECTS_SUFFIX = '.rejects'
+UNDO_LIMIT = 100
+EXPORT_FORMATS = ['jsonl', 'csv']
+SNAPSHOT_CHUNK_DIVISOR = 128
+SNAPSHOT_CHUNK_MIN = 2 * 1024
+SNAPSHOT_CHUNK_MAX = 64 * 1024
+ARCHIVE_BLOCK_LINES = 4096
+SORT_RUN_BYTES = 32 * 1024 * 1024
+SORT_MERGE_FAN_IN = 64
+FUZZY_THRESHOLD = 0.5
+FUZZY_MARGIN = 0.1
+FUZZY_LIMIT = 10
+COMPLETE_TEXT_WIDTH = 40
+TAIL_BLOCK_BYTES = 16 * 1024
 
 class Colors:
     """ANSI escape sequences for colors."""
-
-    BLACK = "\033[0;30m"
-    RED = "\033[0;31m"
-    GREEN = "\033[0;32m"
-    BROWN = "\033[0;33m"
-    BLUE = "\033[0;34m"
-    PURPLE = "\033[0;35m"
-    CYAN = "\033[0;36m"
-    LIGHT_GREY = "\033[0;37m"
-    DARK_GREY = "\033[1;30m"
-    LIGHT_RED = "\033[1;31m"
-    LIGHT_GREEN = "\033[1;32m"
-    YELLOW = "\033[1;33m"
-    LIGHT_BLUE = "\033[1;34m"
-    LIGHT_PURPLE = "\033[1;35m"
-    LIGHT_CYAN = "\033[1;36m"
-    WHITE = "\033[1;37m"
-    DEFAULT = "\033[0m"
-
-    # Non-color options
-    BOLD = "\033[1m"
-    UNDERLINE = "\033[4m"
-    ENDC = "\033[0m"
-
+    BLACK = '\x1b[0;30m'
+    RED = '\x1b[0;31m'
+    GREEN = '\x1b[0;32m'
+    BROWN = '\x1b[0;33m'
+    BLUE = '\x1b[0;34m'
+    PURPLE = '\x1b[0;35m'
+    CYAN = '\x1b[0;36m'
+    LIGHT_GREY = '\x1b[0;37m'
+    DARK_GREY = '\x1b[1;30m'
+    LIGHT_RED = '\x1b[1;31m'
+    LIGHT_GREEN = '\x1b[1;32m'
+    YELLOW = '\x1b[1;33m'
+    LIGHT_BLUE = '\x1b[1;34m'
+    LIGHT_PURPLE = '\x1b[1;35m'
+    LIGHT_CYAN = '\x1b[1;36m'
+    WHITE = '\x1b[1;37m'
+    DEFAULT = '\x1b[0m'
+    BOLD = '\x1b[1m'
+    UNDERLINE = '\x1b[4m'
+    ENDC = '\x1b[0m'
 
 class DefaultConfig:
     """Default settings."""
-
     COLOR_PRIORITY_A = Colors.YELLOW
     COLOR_PRIORITY_B = Colors.BROWN
     COLOR_PRIORITY_C = Colors.GREEN
     COLOR_PRIORITY_D = Colors.BLUE
     COLOR_PRIORITY_E = Colors.CYAN
     COLOR_PRIORITY_REST = Colors.WHITE
-
     COLOR_TAG = Colors.LIGHT_BLUE
     COLOR_DATE = Colors.LIGHT_PURPLE
     COLOR_NUMBER = Colors.DARK_GREY
+    STORAGE = 'text'
+    DURABILITY = 'batch'
+'Utility functions for todotxtpy.'
+import datetime
+import os
+import re
+from typing import Iterator
+
+def get_current_date():
+    """Return date in form of yymmdd."""
+    return datetime.datetime.now().strftime('%y%m%d')
+
+def get_current_day() -> int:
+    """Return the current date as a day number."""
+    return datetime.date.today().toordinal()
+
+def file_signature(path: str) -> str:
+    """Return a string that changes whenever the file at path is modified."""
+    stat = os.stat(path)
+    return f'{stat.st_mtime_ns} {stat.st_size} {stat.st_ino}'
+
+def read_lines_reversed(path: str, block_size: int=TAIL_BLOCK_BYTES) -> Iterator[str]:
+    """Yield the lines of a file, last first, without their newlines.
+
+    Blocks are read from the end of the file only as lines are taken, so
+    taking a few lines costs the same however long the file is. Lines are
+    split as bytes, which is safe in UTF-8: no multi-byte character holds
+    a newline byte.
+    """
+    with open(path, mode='rb') as file:
+        end = position = file.seek(0, os.SEEK_END)
+        partial = b''
+        while position > 0:
+            size = min(block_size, position)
+            position -= size
+            file.seek(position)
+            lines = (file.read(size) + partial).split(b'\n')
+            partial = lines.pop(0)
+            if position + size == end and lines and (lines[-1] == b''):
+                lines.pop()
+            for line in reversed(lines):
+                yield line.decode(errors='replace')
+        if end:
+            yield partial.decode(errors='replace')
+
+def color_to_color_code(color: str) -> str:
+    """Convert color to color code."""
+    match color:
+        case 'BLACK':
+            return Colors.BLACK
+        case 'RED':
+            return Colors.RED
+        case 'GREEN':
+            return Colors.GREEN
+        case 'BROWN':
+            return Colors.BROWN
+        case 'BLUE':
+            return Colors.BLUE
+        case 'PURPLE':
+            return Colors.PURPLE
+        case 'CYAN':
+            return Colors.CYAN
+        case 'LIGHT_GREY':
+            return Colors.LIGHT_GREY
+        case 'DARK_GREY':
+            return Colors.DARK_GREY
+        case 'LIGHT_RED':
+            return Colors.LIGHT_RED
+        case 'LIGHT_GREEN':
+            return Colors.LIGHT_GREEN
+        case 'YELLOW':
+            return Colors.YELLOW
+        case 'LIGHT_BLUE':
+            return Colors.LIGHT_BLUE
+        case 'LIGHT_PURPLE':
+            return Colors.LIGHT_PURPLE
+        case 'LIGHT_CYAN':
+            return Colors.LIGHT_CYAN
+        case 'WHITE':
+            return Colors.WHITE
+        case 'DEFAULT':
+            return Colors.DEFAULT
+        case 'BOLD':
+            return Colors.BOLD
+        case 'UNDERLINE':
+            return Colors.UNDERLINE
+        case 'ENDC':
+            return Colors.ENDC
+        case _:
+            raise ValueError('Unrecognized color.')
 
+def is_valid_priority(priority: str) -> bool:
+    """Return whether input is a valid priority."""
+    match list(priority):
+        case ['(', letter, ')']:
+            return letter.isupper()
+        case _:
+            return False
+
+def date_to_ordinal(date: str) -> int:
+    """Convert a yymmdd date to its proleptic Gregorian day number.
 
-# Data
+    Years are taken to be in 2000-2099. Raises ValueError if the input is not
+    a real calendar date.
+    """
+    if not (len(date) == 6 and date.isdecimal()):
+        raise ValueError(f'Unrecognized date {date}.')
+    try:
+        return datetime.date(2000 + int(date[:2]), int(date[2:4]), int(date[4:])).toordinal()
+    except ValueError:
+        raise ValueError(f'Unrecognized date {date}.') from None
 
+def ordinal_to_date(ordinal: int) -> str:
+    """Convert a day number back to a date in form of yymmdd."""
+    return datetime.date.fromordinal(ordinal).strftime('%y%m%d')
 
+def is_valid_date(date: str) -> bool:
+    """Return whether input is a valid date."""
+    try:
+        date_to_ordinal(date)
+    except ValueError:
+        return False
+    return True
+
+def is_valid_tag(tag: str) -> bool:
+    """Return whether input is a valid tag."""
+    return len(tag) > 0 and tag[0] == '+'
+
+def is_valid_line_number(line_number: str) -> bool:
+    """Return whether input isa valid line number."""
+    return line_number.isdecimal()
+
+def parse_days(span: str) -> int:
+    """Convert a span such as "7", "7d" or "2w" to a number of days."""
+    match (span[-1:], span[:-1]):
+        case ['d', count] if count.isdecimal():
+            return int(count)
+        case ['w', count] if count.isdecimal():
+            return 7 * int(count)
+    if span.isdecimal():
+        return int(span)
+    raise ValueError(f'Unrecognized span {span}.')
+
+def compile_basic_regex(pattern: str, flags: int=0) -> re.Pattern:
+    """Compile a sed-style basic regular expression.
+
+    As in GNU sed, "+?(){}|" are literal characters unless escaped with a
+    backslash, so "+tag" matches a tag.
+    """
+    converted = []
+    escaped = False
+    for char in pattern:
+        if escaped:
+            converted.append(char if char in '+?(){}|' else '\\' + char)
+            escaped = False
+        elif char == '\\':
+            escaped = True
+        else:
+            converted.append('\\' + char if char in '+?(){}|' else char)
+    if escaped:
+        converted.append('\\\\')
+    try:
+        return re.compile(''.join(converted), flags)
+    except re.error as error:
+        raise ValueError(f'Invalid pattern {pattern}: {error}.') from error
+
+def parse_substitution(expression: str) -> tuple[re.Pattern, str, int]:
+    """Convert a sed expression "s/pattern/replacement/flags" for re.sub.
+
+    Any character after "s" can be the delimiter, and the pattern is a
+    basic regular expression. Flags are "g" to replace every match instead
+    of the first and "i" to ignore case. In the replacement, "&" is the
+    whole match and "\\1" to "\\9" are groups.
+    """
+    if len(expression) < 2 or expression[0] != 's':
+        raise ValueError(f'Unrecognized substitution {expression}.')
+    delimiter = expression[1]
+    parts = expression[2:].split(delimiter)
+    if len(parts) != 3 or set(parts[2]) - {'g', 'i'}:
+        raise ValueError(f'Unrecognized substitution {expression}.')
+    (pattern, replacement, flags) = parts
+    regex = compile_basic_regex(pattern, re.IGNORECASE if 'i' in flags else 0)
+    replacement = re.sub('\\\\&|&', lambda match: '&' if match[0] == '\\&' else '\\g<0>', replacement)
+    return (regex, replacement, 0 if 'g' in flags else 1)
+'Data classes for todotxtpy.'
+import mmap
+import os
+import re
+from bisect import bisect_left, bisect_right
+from dataclasses import dataclass, field
+from functools import total_ordering
+from itertools import pairwise
+from typing import Optional
+
+@total_ordering
+@dataclass
+class Tag:
+    """A tag for a Task."""
+    tag: Optional[str]
+
+    def __gt__(self, other):
+        if self.tag is None:
+            return True
+        if other.tag is None:
+            return False
+        return self.tag > other.tag
+
+@dataclass(order=True)
 class Task:
     """Simple task class."""
-
-    def __init__(self) -> None:
-        """Initialize empty Task."""
-        # Type hinting
-        self.priority: str = None  # "([capital letter])"
-        self.creation_date: str = None
-        self.tag: Optional[str] = None
-        self.text: str = None
-
-    def load(self, line: str) -> None:
+    priority: str
+    creation_date: str
+    tag: Tag
+    text: str
+    created: int = field(init=False, compare=False, repr=False)
+    due: Optional[int] = field(init=False, compare=False, repr=False)
+
+    def __post_init__(self) -> None:
+        self.created = date_to_ordinal(self.creation_date)
+        self.due = None
+        if 'due:' in self.text:
+            for word in self.text.split():
+                if word.startswith('due:') and is_valid_date(word[4:]):
+                    self.due = date_to_ordinal(word[4:])
+                    break
+
+    @classmethod
+    def load(cls, line: str) -> Task:
         """Populate fields of a Task from the text of a line.
 
         Expected format is
         "[priority] [creation date%] [tag?] [text]"
+        where text may contain a "due:yymmdd" due date.
         """
-        tokens = line.split()
-
-        # Recognize priority
-        head = tokens.pop(0)
-        if is_valid_priority(head):
-            self.priority = head
+        (priority, creation_date, *rest) = line.split()
+        if not is_valid_priority(priority):
+            raise ValueError(f'Unrecognized priority {priority}.')
+        if not is_valid_date(creation_date):
+            raise ValueError(f'Unrecognized date {creation_date}.')
+        if len(rest) > 0 and is_valid_tag(rest[0]):
+            (tag, *text_words) = rest
+            text = ' '.join(text_words)
         else:
-            raise ValueError("Unrecognized format.")
+            tag = None
+            text = ' '.join(rest)
+        return Task(priority, creation_date, Tag(tag), text)
 
-        # Recognize creation date
-        head = tokens.pop(0)
-        if is_valid_date(head):
-            self.creation_date = head
-        else:
-            raise ValueError("Unrecognized format.")
+    def __str__(self) -> str:
+        elements = [self.priority, self.creation_date, self.text]
+        if self.tag.tag:
+            elements.insert(2, self.tag.tag)
+        return ' '.join(elements)
 
-        # Recognize tag, if present
-        head = tokens[0]
-        if is_valid_tag(head):
-            self.tag = tokens.pop(0)
+class LazyTask(Task):
+    """A Task whose text is decoded from the bytes of its line when first used.
 
-        # Dump rest of text in text field
-        self.text = " ".join(tokens)
+    Priority, creation date and tag are parsed up front; so is the day
+    number of the creation date. The due date, which comes from the text,
+    is found when first used too.
+    """
+
+    def __init__(self, priority: str, creation_date: str, created: int, tag: Tag, line: bytes, start: int, text: Optional[str]=None) -> None:
+        """Make a task whose text is line[start:], or text if already decoded.
+
+        created is the day number of creation_date.
+        """
+        self.priority = priority
+        self.creation_date = creation_date
+        self.tag = tag
+        self.created = created
+        self.line = line
+        self.start = start
+        self._text = text
+        self._due = ()
+
+    @property
+    def text(self) -> str:
+        if self._text is None:
+            self._text = self.line[self.start:].decode()
+        return self._text
+
+    @property
+    def due(self) -> Optional[int]:
+        if self._due == ():
+            self._due = Task(self.priority, self.creation_date, self.tag, self.text).due
+        return self._due
+
+    @property
+    def raw(self) -> bytes:
+        """The text as UTF-8, whose byte order is the order of the text."""
+        return self.line[self.start:] if self._text is None else self._text.encode()
+
+@dataclass
+class DoneTask:
+    """A completed task, as stored in done.txt."""
+    task: Task
+    completion_date: str
+    completed: int = field(init=False, compare=False, repr=False)
+
+    def __post_init__(self) -> None:
+        self.completed = date_to_ordinal(self.completion_date)
+
+    @classmethod
+    def load(cls, line: str) -> DoneTask:
+        """Populate fields of a DoneTask from the text of a line.
+
+        Expected format is
+        "x [priority] [creation date] [completion date] [tag?] [text]"
+        """
+        (mark, priority, creation_date, completion_date, *rest) = line.split()
+        if mark != 'x':
+            raise ValueError(f'Unrecognized completion mark {mark}.')
+        if not is_valid_date(completion_date):
+            raise ValueError(f'Unrecognized date {completion_date}.')
+        task = Task.load(' '.join([priority, creation_date, *rest]))
+        return DoneTask(task, completion_date)
 
     def __str__(self) -> str:
-        # This is used for saving, display is handeled differently
-        elements = [self.priority, self.creation_date, self.text]
-        if self.tag:
-            elements.insert(2, self.tag)
-        return " ".join(elements)
+        elements = ['x', self.task.priority, self.task.creation_date, self.completion_date, self.task.text]
+        if self.task.tag.tag:
+            elements.insert(4, self.task.tag.tag)
+        return ' '.join(elements)
+
+@dataclass
+class DoneList:
+    """List of completed tasks, in the order they appear in done.txt."""
+    tasks: list[DoneTask]
 
-    def __eq__(self, o: object) -> bool:
-        return isinstance(o, self.__class__) and self.__dict__ == o.__dict__
+    def __post_init__(self) -> None:
+        self.completed = [done.completed for done in self.tasks]
+        self.runs = [0] + [i for i in range(1, len(self.completed)) if self.completed[i] < self.completed[i - 1]]
 
+    @classmethod
+    def load(cls, path: str, tolerant: bool=False) -> DoneList:
+        """Load completed tasks from file; a missing file is empty.
 
+        With tolerant, invalid lines are skipped instead of raising ValueError.
+        """
+        if not os.path.exists(path):
+            return DoneList([])
+        tasks = []
+        with open(path, mode='r') as file:
+            for line in file:
+                if line == '\n':
+                    continue
+                try:
+                    tasks.append(DoneTask.load(line.rstrip()))
+                except ValueError:
+                    if not tolerant:
+                        raise
+        return DoneList(tasks)
+
+    @classmethod
+    def tail(cls, path: str, count: Optional[int]=None, since: Optional[int]=None) -> DoneList:
+        """Load the last count tasks of done.txt, or those completed since a day.
+
+        The file is read backwards from its end, so the time taken depends
+        on the tasks returned, not on the size of done.txt. As done.txt is
+        appended to in completion order, reading stops at the first task
+        completed before since. Invalid lines are skipped.
+        """
+        if not os.path.exists(path):
+            return DoneList([])
+        tasks = []
+        for line in read_lines_reversed(path):
+            if count is not None and len(tasks) >= count:
+                break
+            if not line.strip():
+                continue
+            try:
+                done = DoneTask.load(line)
+            except ValueError:
+                continue
+            if since is not None and done.completed < since:
+                break
+            tasks.append(done)
+        tasks.reverse()
+        return DoneList(tasks)
+
+    @classmethod
+    def load_between(cls, path: str, start: int, end: int, runs: Optional[list[tuple[int, int]]]=None) -> DoneList:
+        """Load the tasks of done.txt completed between two day numbers, inclusive.
+
+        runs are the byte ranges of done.txt that are each in completion
+        order (see index.DoneRuns); without them the whole file is assumed
+        to be. Each run is bisected on completion date, and tasks are parsed
+        from the first one completed on start until one completed after end,
+        so the time taken depends on the tasks returned and the number of
+        runs, not on the size of done.txt. Invalid lines are skipped.
+        """
+        if not os.path.exists(path) or os.path.getsize(path) == 0:
+            return DoneList([])
+        tasks = []
+        with open(path, mode='rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+
+            def first_task(position, run_end):
+                """Return the first valid task on a line of the run at or after position."""
+                if position > 0:
+                    position = data.find(b'\n', position - 1) + 1 or len(data)
+                while position < run_end:
+                    line_end = data.find(b'\n', position)
+                    line_end = len(data) if line_end == -1 else line_end
+                    try:
+                        return (DoneTask.load(data[position:line_end].decode()), line_end + 1)
+                    except ValueError:
+                        position = line_end + 1
+                return (None, position)
+            for (run_start, run_end) in runs or [(0, len(data))]:
+                run_end = min(run_end, len(data))
+                (lo, hi) = (run_start, run_end)
+                while lo < hi:
+                    mid = (lo + hi) // 2
+                    (done, _) = first_task(mid, run_end)
+                    if done is None or done.completed >= start:
+                        hi = mid
+                    else:
+                        lo = mid + 1
+                (done, position) = first_task(lo, run_end)
+                while done is not None and done.completed <= end:
+                    tasks.append(done)
+                    (done, position) = first_task(position, run_end)
+        return DoneList(tasks)
+
+    def between(self, start: int, end: int) -> list[DoneTask]:
+        """Return tasks completed between two day numbers, inclusive."""
+        result = []
+        bounds = self.runs + [len(self.completed)]
+        for (lo, hi) in pairwise(bounds):
+            first = bisect_left(self.completed, start, lo, hi)
+            last = bisect_right(self.completed, end, first, hi)
+            result.extend(self.tasks[first:last])
+        return result
+
+@dataclass
 class TaskList:
     """List of tasks."""
+    tasks: list[Task]
+    invalid: list[str] = field(default_factory=list)
 
-    def __init__(self) -> None:
-        """Initialize a TaskList."""
-        self.tasks = []
+    @classmethod
+    def load(cls, path: str, tolerant: bool=False) -> TaskList:
+        """Append tasks from file to TaskList.
 
-    def load(self, path: str) -> None:
-        """Append tasks from file to TaskList."""
-        with open(path, mode="r") as file:
-            lines = file.readlines()
-            for line in lines:
-                if line != "\n":
-                    task = Task()
-                    task.load(line.rstrip())
-                    self.tasks.append(task)
+        Invalid lines raise ValueError, or with tolerant are kept aside in
+        invalid.
+        """
+        with open(path, mode='r') as file:
+            return TaskList(*parse_lines(file.readlines(), tolerant))
 
     def save(self, path: str) -> None:
         """Save TaskList to file specified by path.
 
         If file already exists, overwrites file completely.
         """
-        with open(path, mode="w") as file:
+        with open(path, mode='w') as file:
             for task in self.tasks:
-                file.write(f"{str(task)}\n")
+                file.write(f'{str(task)}\n')
+            for line in self.invalid:
+                file.write(f'{line}\n')
 
     def sort(self) -> None:
         """Sort TaskList in order of priority, creation date, tag, text.
 
         Entries without tag come last; otherwise everything is string order.
         """
-        self.tasks.sort(key=cmp_to_key(task_compare))
+        self.tasks.sort()
+
+@dataclass
+class LazyTaskList(TaskList):
+    """A TaskList of LazyTasks, for commands that mostly read the task list.
+
+    Only lines in the form TaskList.save writes them are left undecoded:
+    printable ASCII with single spaces, so that the raw bytes are the text.
+    Other lines are parsed with Task.load when the file is loaded.
+    """
+    HEADER = re.compile(b'\\([A-Z]\\) \\d{6}(?: |\\Z)')
+    WHITESPACE = b'\t\n\x0b\x0c\r\x1c\x1d\x1e\x1f'
+
+    @classmethod
+    def load(cls, path: str, tolerant: bool=False) -> LazyTaskList:
+        """Read the task file at path, and parse the header of each line.
+
+        Invalid lines raise ValueError, or with tolerant are kept aside in
+        invalid.
+        """
+        with open(path, mode='rb') as file:
+            content = file.read()
+        (tasks, invalid) = ([], [])
+        (headers, tags) = ({}, {None: None})
+        for line in content.splitlines():
+            header = None
+            if line.isascii() and b'  ' not in line and (not line.endswith(b' ')) and (len(line.translate(None, cls.WHITESPACE)) == len(line)):
+                header = headers.get(line[:11])
+                if header is None and cls.HEADER.match(line):
+                    creation_date = line[4:10].decode()
+                    header = headers[line[:11]] = (line[:3].decode(), creation_date, date_to_ordinal(creation_date)) if is_valid_date(creation_date) else False
+            if header:
+                (tag, start) = (None, min(11, len(line)))
+                if line[11:12] == b'+':
+                    end = line.find(b' ', 11)
+                    end = len(line) if end == -1 else end
+                    (tag, start) = (line[11:end], min(end + 1, len(line)))
+                    if tag not in tags:
+                        tags[tag] = tag.decode()
+                tasks.append(LazyTask(*header, Tag(tags[tag]), line, start))
+            elif line:
+                line = line.decode()
+                try:
+                    task = Task.load(line.rstrip())
+                    tasks.append(LazyTask(task.priority, task.creation_date, task.created, task.tag, b'', 0, task.text))
+                except ValueError:
+                    if not tolerant:
+                        raise
+                    invalid.append(line)
+        return LazyTaskList(tasks, invalid)
 
+    def sort(self) -> None:
+        """Sort as TaskList.sort does, comparing undecoded text as bytes."""
+        self.tasks.sort(key=lambda task: (task.priority, task.creation_date, task.tag, task.raw if isinstance(task, LazyTask) else task.text.encode()))
+
+def parse_lines(lines, tolerant: bool=False) -> tuple[list[Task], list[str]]:
+    """Parse task lines, skipping blank ones; return (tasks, invalid lines).
+
+    Without tolerant, the first invalid line raises ValueError instead.
+    """
+    (tasks, invalid) = ([], [])
+    for line in lines:
+        line = line.rstrip('\n')
+        if line == '':
+            continue
+        try:
+            tasks.append(Task.load(line.rstrip()))
+        except ValueError:
+            if not tolerant:
+                raise
+            invalid.append(line)
+    return (tasks, invalid)
 
 class Config:
     """User config."""
 
     def __init__(self) -> None:
         """Initialize a Config from a compliant config document."""
-
         self.color_priority_a = DefaultConfig.COLOR_PRIORITY_A
         self.color_priority_b = DefaultConfig.COLOR_PRIORITY_B
         self.color_priority_c = DefaultConfig.COLOR_PRIORITY_C
         self.color_priority_d = DefaultConfig.COLOR_PRIORITY_D
         self.color_priority_e = DefaultConfig.COLOR_PRIORITY_E
         self.color_priority_rest = DefaultConfig.COLOR_PRIORITY_REST
-
         self.color_tag = DefaultConfig.COLOR_TAG
         self.color_date = DefaultConfig.COLOR_DATE
         self.color_number = DefaultConfig.COLOR_NUMBER
+        self.storage = DefaultConfig.STORAGE
+        self.durability = DefaultConfig.DURABILITY
 
     def load(self, path: str) -> None:
         """Append tasks from file to TaskList."""
-        with open(path, mode="r") as file:
+        with open(path, mode='r') as file:
             lines = file.readlines()
             for line in lines:
-                setting = line.rstrip().split()
-                match setting:
-                    case ["COLOR_PRIORITY_A", color]:
-                        self.color_priority_a = color_to_color_code(color)
-                    case ["COLOR_PRIORITY_B", color]:
-                        self.color_priority_b = color_to_color_code(color)
-                    case ["COLOR_PRIORITY_C", color]:
-                        self.color_priority_c = color_to_color_code(color)
-                    case ["COLOR_PRIORITY_D", color]:
-                        self.color_priority_d = color_to_color_code(color)
-                    case ["COLOR_PRIORITY_E", color]:
-                        self.color_priority_e = color_to_color_code(color)
-                    case ["COLOR_PRIORITY_REST", color]:
-                        self.color_priority_rest = color_to_color_code(color)
-                    case ["COLOR_TAG", color]:
-                        self.color_tag = color_to_color_code(color)
-                    case ["COLOR_DATE", color]:
-                        self.color_date = color_to_color_code(color)
-                    case ["COLOR_NUMBER", color]:
-                        self.color_number = color_to_color_code(color)
-                    case ["#", *_]:
-                        # Comment
-                        pass
-                    case []:
-                        # Whitespace
-                        pass
-                    case _:
-                        print(setting)
-                        raise ValueError("Setting not recognized")
-
-    def priority_to_color_code(self, priority : str) -> str:
+                self.set(line)
+
+    def set(self, line: str) -> None:
+        """Apply one line of a config document."""
+        setting = line.rstrip().split()
+        match setting:
+            case ['COLOR_PRIORITY_A', color]:
+                self.color_priority_a = color_to_color_code(color)
+            case ['COLOR_PRIORITY_B', color]:
+                self.color_priority_b = color_to_color_code(color)
+            case ['COLOR_PRIORITY_C', color]:
+                self.color_priority_c = color_to_color_code(color)
+            case ['COLOR_PRIORITY_D', color]:
+                self.color_priority_d = color_to_color_code(color)
+            case ['COLOR_PRIORITY_E', color]:
+                self.color_priority_e = color_to_color_code(color)
+            case ['COLOR_PRIORITY_REST', color]:
+                self.color_priority_rest = color_to_color_code(color)
+            case ['COLOR_TAG', color]:
+                self.color_tag = color_to_color_code(color)
+            case ['COLOR_DATE', color]:
+                self.color_date = color_to_color_code(color)
+            case ['COLOR_NUMBER', color]:
+                self.color_number = color_to_color_code(color)
+            case ['STORAGE', 'text' | 'sqlite' | 'binary' as storage]:
+                self.storage = storage
+            case ['DURABILITY', 'none' | 'batch' | 'always' as durability]:
+                self.durability = durability
+            case ['#', *_]:
+                pass
+            case []:
+                pass
+            case _:
+                raise ValueError(f'Setting not recognized: {line.strip()}')
+
+    def priority_to_color_code(self, priority: str) -> str:
         """Return color code corresponding to a certain priority."""
         match priority:
-            case "(A)":
+            case '(A)':
                 return self.color_priority_a
-            case "(B)":
+            case '(B)':
                 return self.color_priority_b
-            case "(C)":
+            case '(C)':
                 return self.color_priority_c
-            case "(D)":
+            case '(D)':
                 return self.color_priority_d
-            case "(E)":
+            case '(E)':
                 return self.color_priority_e
             case _:
                 return self.color_priority_rest
+'Crash-safe completion of tasks for todotxtpy.\n\nCompleting tasks changes two files: the task storage loses the tasks, and\ndone.txt gains their records. Unless DURABILITY is none, both are done as\none transaction:\n\n1. An intent file records where done.txt ends, the records to append and\n   the signature of the storage, and is synced to disk.\n2. The storage is saved (todo.txt through a synced temporary file).\n3. The records are appended to done.txt in a single write, and synced.\n4. The intent file is removed.\n\nIf an intent file is found, the transaction was interrupted. A storage\nsignature that still matches means step 2 never happened, and nothing\nchanged; otherwise the records are written to done.txt unless they are\nalready there. Either way no completed task is lost or recorded twice.\n\nUndoing a completion runs the same steps the other way round: the tasks\nare saved back to the storage first, and only then are their records\nremoved from done.txt, in one truncation or atomic rewrite. An interrupted\nundo finishes the removal if done.txt still has its size from step 1.\n'
+import os
+import sys
+from dataclasses import dataclass
+from typing import Callable, Optional
+
+def fsync_directory(path: str) -> None:
+    """Sync the directory holding path, so that renames in it are on disk."""
+    descriptor = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    try:
+        os.fsync(descriptor)
+    finally:
+        os.close(descriptor)
+
+def append_records(path: str, records: list[str], sync: bool=False) -> None:
+    """Append records to path, one per line, in a single O_APPEND write."""
+    data = ''.join((f'{record}\n' for record in records)).encode()
+    descriptor = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 420)
+    try:
+        written = os.write(descriptor, data)
+        while written < len(data):
+            written += os.write(descriptor, data[written:])
+        if sync:
+            os.fsync(descriptor)
+    finally:
+        os.close(descriptor)
+
+def remove_records(path: str, records: list[str], sync: bool=False) -> list[str]:
+    """Remove the last occurrence of each record from path.
+
+    When the records are the last lines of the file, as after the latest
+    t do, it is truncated; otherwise it is rewritten through a temporary
+    file. Returns the records that were not found, say because they were
+    archived.
+    """
+    data = [f'{record}\n'.encode() for record in records]
+    with open(path, mode='rb+') as file:
+        size = file.seek(0, os.SEEK_END)
+        length = sum((len(line) for line in data))
+        if length <= size:
+            file.seek(size - length - 1 if length < size else 0)
+            tail = file.read()
+            start = len(tail) - length
+            if (start == 0 or tail[start - 1:start] == b'\n') and sorted(tail[start:].splitlines(keepends=True)) == sorted(data):
+                file.truncate(size - length)
+                if sync:
+                    os.fsync(file.fileno())
+                return []
+        file.seek(0)
+        lines = file.read().splitlines(keepends=True)
+    missing = []
+    for (record, line) in zip(records, data):
+        index = next((i for i in range(len(lines) - 1, -1, -1) if lines[i] == line), None)
+        if index is None:
+            missing.append(record)
+        else:
+            del lines[index]
+    if len(missing) < len(records):
+        with open(path + '.tmp', mode='wb') as file:
+            file.writelines(lines)
+            if sync:
+                file.flush()
+                os.fsync(file.fileno())
+        os.replace(path + '.tmp', path)
+        if sync:
+            fsync_directory(path)
+    return missing
+
+@dataclass
+class Intent:
+    """Records about to be appended to done.txt at offset.
+
+    With retract, the records are about to be removed from done.txt instead,
+    and offset is its size before.
+    """
+    offset: int
+    signature: str
+    records: list[str]
+    retract: bool = False
+
+    @classmethod
+    def load(cls, path: str) -> Optional[Intent]:
+        """Load the intent file at path, if there is one."""
+        if not os.path.exists(path):
+            return None
+        with open(path, mode='r') as file:
+            (offset, signature) = file.readline().rstrip('\n').split(' ', 1)
+            retract = offset == 'retract'
+            if retract:
+                (offset, signature) = signature.split(' ', 1)
+            return Intent(int(offset), signature, [line.rstrip('\n') for line in file], retract)
 
+    def save(self, path: str) -> None:
+        """Write the intent file and sync it, replacing it atomically."""
+        with open(path + '.tmp', mode='w') as file:
+            file.write(f"{('retract ' if self.retract else '')}{self.offset} {self.signature}\n")
+            file.writelines((f'{record}\n' for record in self.records))
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(path + '.tmp', path)
+        fsync_directory(path)
+
+    def finish(self, done_path: str) -> None:
+        """Make sure done.txt holds the records at offset."""
+        if self.retract:
+            if os.path.exists(done_path) and os.path.getsize(done_path) == self.offset:
+                remove_records(done_path, self.records, sync=True)
+            return
+        data = ''.join((f'{record}\n' for record in self.records)).encode()
+        with open(done_path, mode='ab+') as file:
+            size = file.seek(0, os.SEEK_END)
+            file.seek(self.offset)
+            if file.read(len(data)) == data:
+                return
+            if size <= self.offset + len(data):
+                file.truncate(min(size, self.offset))
+        append_records(done_path, self.records, sync=True)
+
+def commit_done(intent_path: str, done_path: str, records: list[str], storage, save: Callable[[], None], durability: str) -> None:
+    """Save the task storage with save, then append records to done.txt.
+
+    With durability none, nothing is synced and no intent file is written.
+    """
+    if durability == 'none' or not records:
+        save()
+        if records:
+            append_records(done_path, records)
+        return
+    offset = os.path.getsize(done_path) if os.path.exists(done_path) else 0
+    Intent(offset, storage.signature(), records).save(intent_path)
+    save()
+    append_records(done_path, records, sync=True)
+    os.remove(intent_path)
+
+def commit_retract(intent_path: str, done_path: str, records: list[str], storage, save: Callable[[], None], durability: str) -> list[str]:
+    """Save the task storage with save, then remove records from done.txt.
+
+    Returns the records that were not in done.txt. With durability none,
+    nothing is synced and no intent file is written.
+    """
+    if not records or not os.path.exists(done_path):
+        save()
+        return records
+    if durability == 'none':
+        save()
+        return remove_records(done_path, records)
+    Intent(os.path.getsize(done_path), storage.signature(), records, retract=True).save(intent_path)
+    save()
+    missing = remove_records(done_path, records, sync=True)
+    os.remove(intent_path)
+    return missing
+
+def recover_done(intent_path: str, done_path: str, storage) -> Optional[bool]:
+    """Finish or drop an interrupted commit_done or commit_retract.
+
+    Returns None if there was nothing to recover, True if the change to
+    done.txt was finished and False if the storage was never saved, so it
+    was dropped.
+    """
+    intent = Intent.load(intent_path)
+    if intent is None:
+        return None
+    saved = storage.signature() != intent.signature
+    if saved:
+        intent.finish(done_path)
+    os.remove(intent_path)
+    return saved
+
+def recover_and_report(intent_path: str, done_path: str, storage) -> None:
+    """Run recover_done, and tell the user on stderr what it did."""
+    intent = Intent.load(intent_path)
+    retract = intent is not None and intent.retract
+    match recover_done(intent_path, done_path, storage):
+        case True if retract:
+            print('Finished undoing tasks interrupted by a crash.', file=sys.stderr)
+        case True:
+            print('Finished completing tasks interrupted by a crash.', file=sys.stderr)
+        case False if retract:
+            print('Tasks whose undo was interrupted by a crash are still done.', file=sys.stderr)
+        case False:
+            print('Tasks whose completion was interrupted by a crash are still open.', file=sys.stderr)
+'Storage backends for the task list of todotxtpy.'
+import mmap
+import os
+import struct
+from collections import Counter
+SQLITE_ORDER = 'priority, creation_date, tag IS NULL, tag, text'
 
-# Utils
+class TextStorage:
+    """Tasks stored one per line in todo.txt; the default."""
+    kind = 'text'
 
+    def __init__(self, path: str, sync: bool=False, lazy: bool=False) -> None:
+        """Use the todo.txt file at path; with sync, saves are synced to disk.
 
-def get_current_date():
-    """Return date in form of yymmdd."""
-    return datetime.datetime.now().strftime("%y%m%d")
+        With lazy, the text of tasks is only decoded when used (see
+        LazyTaskList), which suits commands that read the task list.
+        """
+        self.path = path
+        self.sync = sync
+        self.lazy = lazy
+
+    def load(self) -> TaskList:
+        """Load all tasks; invalid lines are kept aside, and saved back as they are."""
+        if self.lazy:
+            return LazyTaskList.load(self.path, tolerant=True)
+        return TaskList.load(self.path, tolerant=True)
+
+    def save(self, tasklist: TaskList) -> None:
+        """Save all tasks to a new file, which then replaces todo.txt."""
+        tmp_path = self.path + '.tmp'
+        tasklist.save(tmp_path)
+        if self.sync:
+            with open(tmp_path, mode='rb') as file:
+                os.fsync(file.fileno())
+        os.replace(tmp_path, self.path)
+        if self.sync:
+            fsync_directory(self.path)
+
+    def signature(self) -> str:
+        """Return a string that changes whenever the stored tasks change."""
+        return file_signature(self.path)
+
+    def snapshot_files(self) -> list[str]:
+        """Return the files holding the tasks, for a snapshot to copy."""
+        return [self.path]
+
+class SqliteStorage:
+    """Tasks stored in an SQLite database, indexed by priority, tag and dates.
+
+    Saving only inserts and deletes the rows that changed; rows are never
+    updated in place.
+    """
+    kind = 'sqlite'
+
+    def __init__(self, path: str) -> None:
+        """Open (or create) the database at path."""
+        import sqlite3
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        with self.connection:
+            self.connection.executescript('\n                CREATE TABLE IF NOT EXISTS tasks (\n                    id INTEGER PRIMARY KEY AUTOINCREMENT,\n                    priority TEXT NOT NULL,\n                    creation_date TEXT NOT NULL,\n                    created INTEGER NOT NULL,\n                    due INTEGER,\n                    tag TEXT,\n                    text TEXT NOT NULL\n                );\n                CREATE INDEX IF NOT EXISTS tasks_priority ON tasks (priority);\n                CREATE INDEX IF NOT EXISTS tasks_tag ON tasks (tag);\n                CREATE INDEX IF NOT EXISTS tasks_created ON tasks (created);\n                CREATE INDEX IF NOT EXISTS tasks_due ON tasks (due);\n            ')
+
+    def rows(self, condition: str='1', params: tuple=()) -> list[tuple]:
+        """Return (id, line number, task) for the tasks matching an SQL condition.
+
+        Line numbers are positions in the full sorted list.
+        """
+        cursor = self.connection.execute(f'\n            SELECT id, line_number, priority, creation_date, tag, text FROM (\n                SELECT *, ROW_NUMBER() OVER (ORDER BY {SQLITE_ORDER}) AS line_number\n                FROM tasks\n            ) WHERE {condition} ORDER BY line_number', params)
+        return [(row_id, line_number, Task(priority, creation_date, Tag(tag), text)) for (row_id, line_number, priority, creation_date, tag, text) in cursor]
+
+    def load(self) -> TaskList:
+        """Load all tasks, in sorted order."""
+        return TaskList([task for (_, _, task) in self.rows()])
+
+    def save(self, tasklist: TaskList) -> None:
+        """Store tasklist, touching only the rows that differ."""
+        wanted = Counter((str(task) for task in tasklist.tasks))
+        stale = []
+        for (row_id, _, task) in self.rows():
+            line = str(task)
+            if wanted[line] > 0:
+                wanted[line] -= 1
+            else:
+                stale.append((row_id,))
+        new = []
+        for task in tasklist.tasks:
+            line = str(task)
+            if wanted[line] > 0:
+                wanted[line] -= 1
+                new.append((task.priority, task.creation_date, task.created, task.due, task.tag.tag, task.text))
+        with self.connection:
+            self.connection.executemany('DELETE FROM tasks WHERE id = ?', stale)
+            self.connection.executemany('INSERT INTO tasks (priority, creation_date, created, due, tag, text) VALUES (?, ?, ?, ?, ?, ?)', new)
+
+    def signature(self) -> str:
+        """Return a string that changes whenever the stored tasks change.
+
+        Rows are only ever inserted or deleted, and ids are never reused, so
+        the row count and the last id used identify the contents. Unlike file
+        stats, these are unaffected by WAL checkpoints.
+        """
+        (count,) = self.connection.execute('SELECT COUNT(*) FROM tasks').fetchone()
+        last = self.connection.execute("SELECT seq FROM sqlite_sequence WHERE name = 'tasks'").fetchone()
+        return f'{count} {(last[0] if last else 0)}'
 
+    def snapshot_files(self) -> list[str]:
+        """Return the files holding the tasks, for a snapshot to copy.
 
-def color_to_color_code(color: str) -> str:
-    """Convert color to color code."""
-    match color:
-        case "BLACK" :
-            return Colors.BLACK
-        case "RED" :
-            return Colors.RED
-        case "GREEN" :
-            return Colors.GREEN
-        case "BROWN" :
-            return Colors.BROWN
-        case "BLUE" :
-            return Colors.BLUE
-        case "PURPLE" :
-            return Colors.PURPLE
-        case "CYAN" :
-            return Colors.CYAN
-        case "LIGHT_GREY" :
-            return Colors.LIGHT_GREY
-        case "DARK_GREY" :
-            return Colors.DARK_GREY
-        case "LIGHT_RED" :
-            return Colors.LIGHT_RED
-        case "LIGHT_GREEN" :
-            return Colors.LIGHT_GREEN
-        case "YELLOW" :
-            return Colors.YELLOW
-        case "LIGHT_BLUE" :
-            return Colors.LIGHT_BLUE
-        case "LIGHT_PURPLE" :
-            return Colors.LIGHT_PURPLE
-        case "LIGHT_CYAN" :
-            return Colors.LIGHT_CYAN
-        case "WHITE" :
-            return Colors.WHITE
-        case "DEFAULT" :
-            return Colors.DEFAULT
-        case "BOLD" :
-            return Colors.BOLD
-        case "UNDERLINE" :
-            return Colors.UNDERLINE
-        case "ENDC" :
-            return Colors.ENDC
-        case _:
-            raise ValueError("Unrecognized color.")
+        The write-ahead log is checkpointed into the database file first, so
+        that file alone holds every committed task.
+        """
+        self.connection.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        return [self.path]
 
+    @staticmethod
+    def discard_log(path: str) -> None:
+        """Remove the write-ahead log of the database at path.
 
-def is_valid_priority(priority: str) -> bool:
-    """Return whether input is a valid priority."""
-    match list(priority):
-        case ["(", letter, ")"]:
-            return letter.isupper()
+        Needed after the database file is replaced by a restored copy, which
+        the log of the replaced file would otherwise be replayed onto.
+        """
+        for suffix in ('-wal', '-shm'):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+
+class BinaryStorage:
+    """Tasks stored as fixed-width records, updated in place through mmap.
+
+    The record file starts with a header (magic, generation) followed by one
+    record per task: priority letter, flags, creation day, tag id, and the
+    64-bit offset and the length of the task text in a separate text heap.
+    Tag ids index a tag table with one tag per line (0 means no tag).
+
+    Changing a priority overwrites one byte and removing a task sets its
+    tombstone flag; other changes tombstone the old record and append a new
+    one. New text, tags and records are synced before any tombstone is set,
+    so a crash never leaves a task without a live record. Once tombstones
+    outnumber live records (and there are COMPACT_MIN of them), the next
+    save rewrites the files without them, as does converting to this storage.
+    """
+    kind = 'binary'
+    HEADER = struct.Struct('<8sQ')
+    RECORD = struct.Struct('<cBIHQI')
+    MAGIC = b'TODOBIN2'
+    OLD_RECORDS = {b'TODOBIN1': struct.Struct('<cBIHII')}
+    TOMBSTONE = 1
+    COMPACT_MIN = 64
+
+    def __init__(self, path: str, sync: bool=False) -> None:
+        """Use the record file at path, with its heap and tag table next to it.
+
+        With sync, saves are synced to disk.
+        """
+        self.path = path
+        self.heap_path = path + '.heap'
+        self.tags_path = path + '.tags'
+        self.sync = sync
+        self.loaded = None
+        self.tombstones = 0
+
+    def read_tags(self) -> list[str]:
+        """Return the tag table."""
+        if not os.path.exists(self.tags_path):
+            return []
+        with open(self.tags_path, mode='r') as file:
+            return file.read().splitlines()
+
+    def finish_rewrite(self) -> None:
+        """Finish a write_all interrupted after all its new files were synced."""
+        if not os.path.exists(self.path + '.new'):
+            return
+        for path in [self.heap_path, self.tags_path]:
+            if os.path.exists(path + '.tmp'):
+                os.replace(path + '.tmp', path)
+        os.replace(self.path + '.new', self.path)
+        if self.sync:
+            fsync_directory(self.path)
+
+    def load(self) -> TaskList:
+        """Load all live records, in sorted order."""
+        self.finish_rewrite()
+        self.loaded = []
+        self.tombstones = 0
+        if not os.path.exists(self.path):
+            return TaskList([])
+        tags = self.read_tags()
+        with open(self.path, mode='rb') as file, open(self.heap_path, mode='rb') as heap_file:
+            records = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            heap = mmap.mmap(heap_file.fileno(), 0, access=mmap.ACCESS_READ) if os.fstat(heap_file.fileno()).st_size else b''
+            (magic, _) = self.HEADER.unpack_from(records)
+            record = self.OLD_RECORDS.get(magic, self.RECORD)
+            if magic != self.MAGIC and magic not in self.OLD_RECORDS:
+                raise ValueError(f'Unrecognized binary storage {self.path}.')
+            count = (len(records) - self.HEADER.size) // record.size
+            for i in range(count):
+                (priority, flags, created, tag_id, offset, length) = record.unpack_from(records, self.HEADER.size + i * record.size)
+                if flags & self.TOMBSTONE:
+                    self.tombstones += 1
+                    continue
+                task = Task(f'({priority.decode()})', ordinal_to_date(created), Tag(tags[tag_id - 1] if tag_id else None), heap[offset:offset + length].decode())
+                self.loaded.append((task, i, str(task)))
+            records.close()
+            if isinstance(heap, mmap.mmap):
+                heap.close()
+        tasklist = TaskList([task for (task, _, _) in self.loaded])
+        tasklist.sort()
+        if magic != self.MAGIC:
+            self.loaded = None
+        return tasklist
+
+    def pack(self, task: Task, tags: dict[str, int], offset: int, length: int) -> bytes:
+        """Return the record for task, whose text is at offset in the heap."""
+        priority = task.priority[1].encode()
+        if len(priority) != 1:
+            raise ValueError(f'Binary storage needs ASCII priorities, not {task.priority}.')
+        tag_id = 0
+        if task.tag.tag is not None:
+            tag_id = tags.setdefault(task.tag.tag, len(tags) + 1)
+            if tag_id > 65535:
+                raise ValueError('Too many tags for binary storage.')
+        return self.RECORD.pack(priority, 0, task.created, tag_id, offset, length)
+
+    def append(self, tasks: list[Task], start: int, heap_size: int, tags: dict[str, int]) -> tuple[bytes, bytes]:
+        """Return the records and heap bytes for tasks, as appended at start."""
+        (records, heap) = ([], [])
+        for (i, task) in enumerate(tasks):
+            text = task.text.encode()
+            records.append(self.pack(task, tags, heap_size, len(text)))
+            heap.append(text)
+            heap_size += len(text)
+            self.loaded.append((task, start + i, str(task)))
+        return (b''.join(records), b''.join(heap))
+
+    def write(self, path: str, content: bytes, mode: str='ab') -> None:
+        """Write content to path, syncing it if saves are synced."""
+        with open(path, mode=mode) as file:
+            file.write(content)
+            if self.sync:
+                file.flush()
+                os.fsync(file.fileno())
+
+    def save(self, tasklist: TaskList) -> None:
+        """Store tasklist, in place where possible."""
+        self.finish_rewrite()
+        if self.loaded is None or not os.path.exists(self.path):
+            self.write_all(tasklist)
+            return
+        present = {id(task) for task in tasklist.tasks}
+        (kept, dead, repriced) = (set(), [], [])
+        for (task, i, line) in self.loaded:
+            current = str(task) if id(task) in present else None
+            if current == line:
+                kept.add(id(task))
+            elif current is not None and current[3:] == line[3:]:
+                kept.add(id(task))
+                repriced.append((i, task.priority[1].encode()))
+            else:
+                dead.append(i)
+        tombstones = self.tombstones + len(dead)
+        if tombstones >= self.COMPACT_MIN and tombstones > len(tasklist.tasks):
+            self.write_all(tasklist)
+            return
+        new = [task for task in tasklist.tasks if id(task) not in kept]
+        tag_list = self.read_tags()
+        tags = {tag: i + 1 for (i, tag) in enumerate(tag_list)}
+        count = (os.path.getsize(self.path) - self.HEADER.size) // self.RECORD.size
+        self.loaded = [entry for entry in self.loaded if id(entry[0]) in kept]
+        self.loaded = [(task, i, str(task)) for (task, i, _) in self.loaded]
+        (records, heap) = self.append(new, count, os.path.getsize(self.heap_path), tags)
+        if heap:
+            self.write(self.heap_path, heap)
+        if len(tags) > len(tag_list):
+            self.write(self.tags_path, ''.join((f'{tag}\n' for tag in list(tags)[len(tag_list):])).encode())
+        if records:
+            self.write(self.path, records)
+        with open(self.path, mode='r+b') as file:
+            data = mmap.mmap(file.fileno(), 0)
+            for i in dead:
+                data[self.HEADER.size + i * self.RECORD.size + 1] = self.TOMBSTONE
+            for (i, priority) in repriced:
+                data[self.HEADER.size + i * self.RECORD.size] = priority[0]
+            (_, generation) = self.HEADER.unpack_from(data)
+            self.HEADER.pack_into(data, 0, self.MAGIC, generation + 1)
+            data.flush()
+            data.close()
+            if self.sync:
+                os.fsync(file.fileno())
+        self.tombstones = tombstones
+
+    def write_all(self, tasklist: TaskList) -> None:
+        """Write tasklist from scratch, replacing any existing files.
+
+        The new files are synced under temporary names first; the record
+        file is renamed to .new last, so that finish_rewrite can complete
+        the replacement after a crash.
+        """
+        generation = 0
+        if os.path.exists(self.path):
+            with open(self.path, mode='rb') as file:
+                (_, generation) = self.HEADER.unpack(file.read(self.HEADER.size))
+        self.loaded = []
+        self.tombstones = 0
+        tags = {}
+        (records, heap) = self.append(tasklist.tasks, 0, 0, tags)
+        for (path, content) in [(self.heap_path, heap), (self.tags_path, ''.join((f'{tag}\n' for tag in tags)).encode()), (self.path, self.HEADER.pack(self.MAGIC, generation + 1) + records)]:
+            self.write(path + '.tmp', content, mode='wb')
+        os.replace(self.path + '.tmp', self.path + '.new')
+        if self.sync:
+            fsync_directory(self.path)
+        self.finish_rewrite()
+
+    def signature(self) -> str:
+        """Return a string that changes whenever the stored tasks change."""
+        self.finish_rewrite()
+        with open(self.path, mode='rb') as file:
+            (_, generation) = self.HEADER.unpack(file.read(self.HEADER.size))
+        return f'{generation} {file_signature(self.path)}'
+
+    def snapshot_files(self) -> list[str]:
+        """Return the files holding the tasks, for a snapshot to copy."""
+        return [self.path, self.heap_path, self.tags_path]
+STORAGES = {'text': TextStorage, 'sqlite': SqliteStorage, 'binary': BinaryStorage}
+
+def open_storage(kind: str, todo_path: str, sync: bool=False, lazy: bool=False):
+    """Return the storage of the given kind for the todo directory of todo_path.
+
+    SQLite syncs its own commits, whatever sync is; lazy only applies to
+    todo.txt, as the other storages decode fields separately anyway.
+    """
+    match kind:
+        case 'text':
+            return TextStorage(todo_path, sync, lazy)
+        case 'sqlite':
+            return SqliteStorage(os.path.join(os.path.dirname(todo_path), SQLITE_NAME))
+        case 'binary':
+            return BinaryStorage(os.path.join(os.path.dirname(todo_path), BINARY_NAME), sync)
         case _:
-            return False
-
-
-def is_valid_date(date: str) -> bool:
-    """Return whether input is a valid date."""
-    return len(date) == 6 and date.isdecimal()
-
-
-def is_valid_tag(tag: str) -> bool:
-    """Return whether input is a valid tag."""
-    return len(tag) > 0 and tag[0] == "+"
-
-
-def is_valid_line_number(line_number: str) -> bool:
-    """Return whether input isa valid line number."""
-    return line_number.isdecimal()
-
+            raise ValueError(f'Unrecognized storage {kind}.')
+'Persistent indexes over the task list for todotxtpy.'
+import os
+from bisect import bisect_left, bisect_right
+from dataclasses import dataclass
+from typing import Optional
 
-def task_compare(task1: Task, task2: Task) -> int:
-    """Custom comparator for sorting tasks."""
+@dataclass
+class DueIndex:
+    """Tasks with a due date, sorted by due date, then line number.
+
+    Saved next to todo.txt together with the storage it was built from and
+    that storage's signature, so that it can be answered without parsing the
+    task list.
+    """
+    source: str
+    signature: str
+    config_signature: str
+    entries: list[tuple[int, int, str]]
+
+    @classmethod
+    def build(cls, tasklist, storage, config_path: str) -> DueIndex:
+        """Index a sorted task list that has just been saved to storage."""
+        entries = sorted(((task.due, i + 1, str(task)) for (i, task) in enumerate(tasklist.tasks) if task.due is not None))
+        return DueIndex(f'{storage.kind} {storage.path}', storage.signature(), file_signature(config_path), entries)
+
+    @classmethod
+    def load(cls, path: str) -> Optional[DueIndex]:
+        """Load the index at path, or None if it is missing."""
+        try:
+            with open(path, mode='r') as file:
+                source = file.readline().rstrip('\n')
+                signature = file.readline().rstrip('\n')
+                config_signature = file.readline().rstrip('\n')
+                entries = []
+                for line in file:
+                    (due, line_number, task) = line.rstrip('\n').split('\t', 2)
+                    entries.append((int(due), int(line_number), task))
+                return DueIndex(source, signature, config_signature, entries)
+        except FileNotFoundError:
+            return None
+
+    @classmethod
+    def for_todo(cls, config_path: str, todo_path: str) -> DueIndex:
+        """Return an up to date index for the todo directory of todo_path."""
+        return load_current(cls, os.path.join(os.path.dirname(todo_path), DUE_INDEX_NAME), config_path, todo_path)
 
-    # Compare priorities
-    if task1.priority < task2.priority:
-        return -1
-    if task1.priority > task2.priority:
-        return 1
+    def save(self, path: str) -> None:
+        """Save index to file specified by path."""
+        with open(path, mode='w') as file:
+            file.write(f'{self.source}\n{self.signature}\n{self.config_signature}\n')
+            for (due, line_number, task) in self.entries:
+                file.write(f'{due}\t{line_number}\t{task}\n')
+
+    def between(self, start: Optional[int], end: Optional[int]) -> list[tuple[int, int, str]]:
+        """Return entries due between two day numbers, inclusive."""
+        first = 0 if start is None else bisect_left(self.entries, (start,))
+        last = len(self.entries) if end is None else bisect_right(self.entries, (end + 1,), first)
+        return self.entries[first:last]
+
+@dataclass
+class DoneRuns:
+    """Byte offsets of done.txt where a run sorted by completion date starts.
+
+    `t do` appends in completion order, but `t sync`, `t import --done` and
+    `t redo` can append older tasks, starting a new run. Saved next to
+    done.txt with how far it was scanned and the bytes just before that
+    point, so that only what was appended since is scanned again; any other
+    rewrite of done.txt is scanned from the start.
+    """
+    inode: int
+    scanned: int
+    tail: bytes
+    last: int
+    starts: list[int]
+    size: int = 0
+
+    @staticmethod
+    def path_for(done_path: str) -> str:
+        """Return the path of the runs file in the todo directory of done_path."""
+        return os.path.join(os.path.dirname(done_path), DONE_RUNS_NAME)
+
+    @classmethod
+    def load(cls, path: str) -> Optional[DoneRuns]:
+        """Load the runs at path, or None if they are missing."""
+        try:
+            with open(path, mode='r') as file:
+                (inode, scanned, tail, last) = file.readline().split()
+                starts = [int(start) for start in file.readline().split()]
+                return DoneRuns(int(inode), int(scanned), b'' if tail == '-' else bytes.fromhex(tail), int(last), starts)
+        except (FileNotFoundError, ValueError):
+            return None
 
-    # Priorities equal, compare tag
-    if task1.tag and (not task2.tag):
-        return -1
-    if (not task1.tag) and task2.tag:
-        return 1
-    if task1.tag and task2.tag:
-        if task1.tag < task2.tag:
-            return -1
-        if task1.tag > task2.tag:
-            return 1
+    def save(self, path: str) -> None:
+        """Save runs to file specified by path."""
+        with open(path + '.tmp', mode='w') as file:
+            file.write(f"{self.inode} {self.scanned} {self.tail.hex() or '-'} {self.last}\n{' '.join(map(str, self.starts))}\n")
+        os.replace(path + '.tmp', path)
+
+    @classmethod
+    def for_done(cls, done_path: str) -> DoneRuns:
+        """Return up to date runs for done_path, scanning what is new in it."""
+        path = cls.path_for(done_path)
+        runs = cls.load(path)
+        if not os.path.exists(done_path):
+            return DoneRuns(0, 0, b'', 0, [0])
+        with open(done_path, mode='rb') as file:
+            stat = os.fstat(file.fileno())
+            if runs is None or runs.inode != stat.st_ino or runs.scanned > stat.st_size:
+                runs = DoneRuns(stat.st_ino, 0, b'', 0, [0])
+            else:
+                file.seek(runs.scanned - len(runs.tail))
+                if file.read(len(runs.tail)) != runs.tail:
+                    runs = DoneRuns(stat.st_ino, 0, b'', 0, [0])
+            runs.size = stat.st_size
+            file.seek(runs.scanned)
+            new = file.read(stat.st_size - runs.scanned)
+        complete = new.rfind(b'\n') + 1
+        if complete == 0:
+            return runs
+        offset = runs.scanned
+        for line in new[:complete].split(b'\n')[:-1]:
+            words = line.split(None, 4)
+            if len(words) >= 4 and words[0] == b'x':
+                completion_date = words[3].decode(errors='replace')
+                if is_valid_date(completion_date):
+                    day = date_to_ordinal(completion_date)
+                    if day < runs.last:
+                        runs.starts.append(offset)
+                    runs.last = day
+            offset += len(line) + 1
+        runs.scanned = offset
+        runs.tail = (runs.tail + new[:complete])[-64:]
+        runs.save(path)
+        return runs
+
+    def ranges(self) -> list[tuple[int, int]]:
+        """Return the byte range of each run.
+
+        Bytes after the last line scanned, if any, are a run of their own.
+        """
+        bounds = self.starts + [self.scanned]
+        ranges = [(start, end) for (start, end) in zip(bounds, bounds[1:]) if start < end]
+        if self.size > self.scanned:
+            ranges.append((self.scanned, self.size))
+        return ranges
+'Duplicate task detection for todotxtpy.'
+import hashlib
+from collections import defaultdict
+
+def task_hash(task: Task) -> bytes:
+    """Return a short hash of a task's tag and text.
+
+    Case and spacing are normalized, and priority and dates are left out,
+    so tasks added again on a later day hash the same.
+    """
+    key = f"{task.tag.tag or ''}\t{' '.join(task.text.casefold().split())}"
+    return hashlib.blake2b(key.encode(), digest_size=8).digest()
+
+def duplicate_groups(hashes: list[bytes]) -> list[list[int]]:
+    """Return the indices sharing each hash that occurs more than once."""
+    groups = defaultdict(list)
+    for (i, task_digest) in enumerate(hashes):
+        groups[task_digest].append(i)
+    return [indices for indices in groups.values() if len(indices) > 1]
+'Fuzzy matching of tasks by trigrams, for todotxtpy.'
+from collections import Counter
+from dataclasses import dataclass, field
+
+def trigrams(text: str) -> set[str]:
+    """Return the trigrams of the words of text, ignoring case.
+
+    Words are padded as "  word " so that matching word starts count extra;
+    no trigram spans two words.
+    """
+    return {padded[i:i + 3] for word in text.lower().split() for padded in [f'  {word} '] for i in range(len(padded) - 2)}
+
+def task_words(task: Task) -> str:
+    """Return the part of a task that is matched against: tag and text."""
+    return task.text if task.tag.tag is None else f'{task.tag.tag} {task.text}'
+
+@dataclass
+class Match:
+    """A task matched by a query, with its position in the task list."""
+    index: int
+    containment: float
+    similarity: float
+    task: Task
+
+@dataclass
+class TrigramIndex:
+    """Task indices by trigram, over a parsed task list.
+
+    Posting lists are filled in as queries need them: a task has a trigram
+    exactly when its padded words contain it, which str's substring search
+    checks much faster than building every task's trigram set.
+    """
+    tasks: list[Task]
+    padded: list[str]
+    postings: dict[str, list[int]] = field(default_factory=dict)
+
+    @classmethod
+    def build(cls, tasklist: TaskList) -> TrigramIndex:
+        """Index the tasks of tasklist, keeping their order."""
+        return TrigramIndex(tasklist.tasks, [''.join((f'  {word} ' for word in task_words(task).lower().split())) for task in tasklist.tasks])
+
+    def posting(self, trigram: str) -> list[int]:
+        """Return the indices of the tasks that have trigram."""
+        if trigram not in self.postings:
+            self.postings[trigram] = [i for (i, words) in enumerate(self.padded) if trigram in words]
+        return self.postings[trigram]
+
+    def search(self, query: str, limit: int=FUZZY_LIMIT) -> list[Match]:
+        """Return up to limit tasks matching query, best first.
+
+        Tasks need at least FUZZY_THRESHOLD of the query's trigrams.
+        """
+        query_trigrams = trigrams(query)
+        if not query_trigrams:
+            return []
+        shared = Counter()
+        for trigram in query_trigrams:
+            shared.update(self.posting(trigram))
+        matches = []
+        for (i, count) in shared.items():
+            containment = count / len(query_trigrams)
+            if containment >= FUZZY_THRESHOLD:
+                size = len(trigrams(task_words(self.tasks[i])))
+                similarity = count / (len(query_trigrams) + size - count)
+                matches.append(Match(i, containment, similarity, self.tasks[i]))
+        matches.sort(key=lambda match: (-match.containment, -match.similarity, match.index))
+        return matches[:limit]
+
+    def candidates(self, query: str) -> list[Match]:
+        """Return the matches for query within FUZZY_MARGIN of the best one.
+
+        A single candidate is an unambiguous match.
+        """
+        matches = self.search(query)
+        return [match for match in matches if matches[0].containment - match.containment < FUZZY_MARGIN]
+'Query language for filtering tasks, for todotxtpy.\n\nA query compares task fields and combines comparisons with and, or, not\nand parentheses, e.g. `pri <= C and tag = +work and text ~ "deploy"`.\n\nFields are pri (a letter), tag (+tag, or none), created and due (yymmdd;\ndue can also be none) and text. Operators are = != < <= > >= and ~, a\ncase-insensitive regex search on tag or text.\n'
+import re
+from bisect import bisect_left, bisect_right
+from dataclasses import dataclass, field
+from typing import Callable, Optional, Union
+TOKEN = re.compile('\\s*(?:("[^"]*"|\'[^\']*\')|(<=|>=|!=|=|<|>|~)|([()])|([^\\s()<>=!~"\']+))')
+FIELD_NAMES = {'pri': 'pri', 'priority': 'pri', 'tag': 'tag', 'created': 'created', 'date': 'created', 'due': 'due', 'text': 'text'}
+ORDERED_OPERATORS = ['=', '<', '<=', '>', '>=']
+
+@dataclass
+class Comparison:
+    """One field compared to a value, as it is written in the query."""
+    field: str
+    operator: str
+    value: Union[str, int, None]
+
+@dataclass
+class Node:
+    """Comparisons combined by "and", "or" or "not"."""
+    kind: str
+    children: list[Union[Node, Comparison]]
+
+def tokenize(text: str) -> list[str]:
+    """Split query text into strings, operators, parentheses and words."""
+    tokens = []
+    position = 0
+    text = text.rstrip()
+    while position < len(text):
+        match = TOKEN.match(text, position)
+        if match is None:
+            raise ValueError(f'Unrecognized query at {text[position:]!r}.')
+        tokens.append(match.group(match.lastindex))
+        position = match.end()
+    return tokens
+
+def parse_value(field: str, operator: str, raw: str) -> Union[str, int, None]:
+    """Convert a value to the representation its field is compared with."""
+    quoted = raw[:1] in '"\''
+    value = raw[1:-1] if quoted else raw
+    if operator == '~':
+        if field not in ('tag', 'text'):
+            raise ValueError(f'Cannot search {field} with ~.')
+        try:
+            return re.compile(value, re.IGNORECASE)
+        except re.error as error:
+            raise ValueError(f'Invalid pattern {value}: {error}.') from error
+    if field == 'text':
+        if operator not in ('=', '!='):
+            raise ValueError('Text can only be compared with =, != or ~.')
+        return value
+    if value == 'none' and field in ('tag', 'due'):
+        if operator not in ('=', '!='):
+            raise ValueError(f'{field} can only be compared to none with = or !=.')
+        return None
+    match field:
+        case 'pri':
+            priority = value if value.startswith('(') else f'({value})'
+            if not is_valid_priority(priority):
+                raise ValueError(f'Unrecognized priority {value}.')
+            return priority
+        case 'tag':
+            if operator not in ('=', '!=') or not is_valid_tag(value):
+                raise ValueError(f'Unrecognized tag comparison {operator} {value}.')
+            return value
+        case _:
+            return date_to_ordinal(value)
+
+class Parser:
+    """Recursive descent parser over the tokens of a query."""
+
+    def __init__(self, tokens: list[str]) -> None:
+        """Parse tokens from the first one."""
+        self.tokens = tokens
+        self.position = 0
+
+    def peek(self) -> Optional[str]:
+        """Return the next token without consuming it."""
+        return self.tokens[self.position] if self.position < len(self.tokens) else None
+
+    def take(self) -> str:
+        """Consume and return the next token."""
+        token = self.peek()
+        if token is None:
+            raise ValueError('Unexpected end of query.')
+        self.position += 1
+        return token
+
+    def parse(self) -> Union[Node, Comparison]:
+        """Parse a whole query."""
+        node = self.parse_binary('or')
+        if self.peek() is not None:
+            raise ValueError(f'Unexpected {self.peek()!r} in query.')
+        return node
+
+    def parse_binary(self, kind: str) -> Union[Node, Comparison]:
+        """Parse operands joined by "or" (or "and", which binds tighter)."""
+        parse_operand = (lambda : self.parse_binary('and')) if kind == 'or' else self.parse_unary
+        children = [parse_operand()]
+        while (self.peek() or '').lower() == kind:
+            self.take()
+            children.append(parse_operand())
+        return children[0] if len(children) == 1 else Node(kind, children)
+
+    def parse_unary(self) -> Union[Node, Comparison]:
+        """Parse "not", a parenthesized query or a comparison."""
+        token = self.take()
+        if token.lower() == 'not':
+            return Node('not', [self.parse_unary()])
+        if token == '(':
+            node = self.parse_binary('or')
+            if self.take() != ')':
+                raise ValueError('Missing ) in query.')
+            return node
+        if token.lower() not in FIELD_NAMES:
+            raise ValueError(f'Unrecognized field {token}.')
+        field = FIELD_NAMES[token.lower()]
+        operator = self.take()
+        if operator not in ORDERED_OPERATORS + ['!=', '~']:
+            raise ValueError(f'Unrecognized operator {operator}.')
+        return Comparison(field, operator, parse_value(field, operator, self.take()))
+
+@dataclass
+class Query:
+    """A parsed query, compiled to a predicate over tasks."""
+    text: str
+    tree: Union[Node, Comparison]
+    predicate: Callable[[Task], bool] = field(init=False, repr=False)
+
+    def __post_init__(self) -> None:
+        constants = {}
+        source = self.compile(self.tree, constants)
+        self.predicate = eval(compile(f'lambda task: {source}', '<query>', 'eval'), {'__builtins__': {}, **constants})
+
+    @classmethod
+    def parse(cls, text: str) -> Query:
+        """Parse query text."""
+        return Query(text, Parser(tokenize(text)).parse())
+
+    def compile(self, node: Union[Node, Comparison], constants: dict) -> str:
+        """Return Python source for node; values go into constants."""
+        if isinstance(node, Node):
+            if node.kind == 'not':
+                return f'(not {self.compile(node.children[0], constants)})'
+            return '(' + f' {node.kind} '.join((self.compile(child, constants) for child in node.children)) + ')'
+        name = f'value{len(constants)}'
+        constants[name] = node.value.search if node.operator == '~' else node.value
+        operator = '==' if node.operator == '=' else node.operator
+        match (node.field, node.operator):
+            case ['tag', '~']:
+                return f'(task.tag.tag is not None and {name}(task.tag.tag) is not None)'
+            case ['text', '~']:
+                return f'({name}(task.text) is not None)'
+            case ['pri', _]:
+                return f'(task.priority {operator} {name})'
+            case ['tag', _]:
+                return f'(task.tag.tag {operator} {name})'
+            case ['created', _]:
+                return f'(task.created {operator} {name})'
+            case ['text', _]:
+                return f'(task.text {operator} {name})'
+            case ['due', '=' | '!=']:
+                return f'(task.due {operator} {name})'
+            case ['due', _]:
+                return f'((due := task.due) is not None and due {operator} {name})'
+
+    def conjuncts(self) -> list[Comparison]:
+        """Return the comparisons every matching task satisfies."""
+        if isinstance(self.tree, Comparison):
+            return [self.tree]
+        if self.tree.kind == 'and':
+            return [child for child in self.tree.children if isinstance(child, Comparison)]
+        return []
+
+    def bounds(self, field: str) -> tuple[Optional[int], Optional[int]]:
+        """Return inclusive bounds on created, due or pri (as a letter code)."""
+        low = high = None
+        for comparison in self.conjuncts():
+            if comparison.field != field or comparison.operator not in ORDERED_OPERATORS:
+                continue
+            value = comparison.value
+            if value is None:
+                continue
+            if field == 'pri':
+                value = ord(value[1])
+            if comparison.operator in ('=', '>', '>='):
+                value_low = value + 1 if comparison.operator == '>' else value
+                low = value_low if low is None else max(low, value_low)
+            if comparison.operator in ('=', '<', '<='):
+                value_high = value - 1 if comparison.operator == '<' else value
+                high = value_high if high is None else min(high, value_high)
+        return (low, high)
+
+    def equal(self, field: str) -> Optional[Comparison]:
+        """Return a conjunct requiring field to equal a value, if there is one."""
+        for comparison in self.conjuncts():
+            if comparison.field == field and comparison.operator == '=':
+                return comparison
+        return None
+
+def sorted_scan(query: Query, tasklist: TaskList) -> tuple[str, list[tuple[int, Task]]]:
+    """Return (plan, candidates) for a sorted tasklist.
+
+    Tasks are sorted by priority, then creation date, so a priority range
+    is found by bisection, and so is a creation date range within each
+    priority.
+    """
+    tasks = tasklist.tasks
+    (priority_low, priority_high) = query.bounds('pri')
+    start = 0 if priority_low is None else bisect_left(tasks, f'({chr(priority_low)})', key=lambda task: task.priority)
+    end = len(tasks) if priority_high is None else bisect_right(tasks, f'({chr(priority_high)})', start, key=lambda task: task.priority)
+    plan = f'sorted scan of lines {start + 1}-{end}'
+    (created_low, created_high) = query.bounds('created')
+    if created_low is None and created_high is None:
+        return (plan, [(i + 1, tasks[i]) for i in range(start, end)])
+    candidates = []
+    block_start = start
+    while block_start < end:
+        priority = tasks[block_start].priority
+        block_end = bisect_right(tasks, priority, block_start, end, key=lambda task: task.priority)
+        first = block_start if created_low is None else bisect_left(tasks, created_low, block_start, block_end, key=lambda task: task.created)
+        last = block_end if created_high is None else bisect_right(tasks, created_high, first, block_end, key=lambda task: task.created)
+        candidates.extend(((i + 1, tasks[i]) for i in range(first, last)))
+        block_start = block_end
+    return (f'{plan}, bisecting creation dates per priority', candidates)
+
+def sqlite_conditions(query: Query) -> tuple[list[str], list]:
+    """Return SQL conditions and parameters for the indexed conjuncts."""
+    (conditions, params) = ([], [])
+    tag = query.equal('tag')
+    if tag is not None:
+        conditions.append('tag IS NULL' if tag.value is None else 'tag = ?')
+        params.extend([] if tag.value is None else [tag.value])
+    for (field, column) in [('pri', 'priority'), ('created', 'created'), ('due', 'due')]:
+        (low, high) = query.bounds(field)
+        if field == 'pri':
+            (low, high) = (None if bound is None else f'({chr(bound)})' for bound in (low, high))
+        if low is not None:
+            conditions.append(f'{column} >= ?')
+            params.append(low)
+        if high is not None:
+            conditions.append(f'{column} <= ?')
+            params.append(high)
+    return (conditions, params)
+
+def plan(query: Query, tasklist: TaskList, storage, due_index_path: str) -> tuple[str, list[tuple[int, Task]]]:
+    """Return (plan, candidates): tasks that may match, with line numbers.
+
+    The indexes of an SQLite storage are used for tag, priority and date
+    conjuncts; otherwise an up to date due index answers due date ranges.
+    Everything else is a sorted scan of tasklist, which has to be sorted.
+    """
+    if storage.kind == 'sqlite':
+        (conditions, params) = sqlite_conditions(query)
+        if conditions:
+            condition = ' AND '.join(conditions)
+            return (f'sqlite index: {condition}', [(line_number, task) for (_, line_number, task) in storage.rows(condition, tuple(params))])
+    (due_low, due_high) = query.bounds('due')
+    if due_low is not None or due_high is not None:
+        index = DueIndex.load(due_index_path)
+        if index is not None and index.source == f'{storage.kind} {storage.path}' and (index.signature == storage.signature()):
+            return (f'due index: {due_low}-{due_high}', [(line_number, Task.load(task)) for (_, line_number, task) in index.between(due_low, due_high)])
+    return sorted_scan(query, tasklist)
+'Caches derived from the task list for todotxtpy, and how to keep them current.'
+import os
+import shutil
+from dataclasses import dataclass
+from typing import Optional
 
-    # Tags equal, compare creation date
-    if task1.creation_date < task2.creation_date:
-        return -1
-    if task1.creation_date > task2.creation_date:
-        return 1
+def source_signature(source: str) -> str:
+    """Return the current signature of a "[storage kind] [path]" source."""
+    (kind, path) = source.split(' ', 1)
+    if kind == 'text':
+        return file_signature(path)
+    return STORAGES[kind](path).signature()
+
+def load_current(cls, path: str, config_path: str, todo_path: str):
+    """Load the cache of class cls at path, rebuilding it if it is out of date.
+
+    cls is DueIndex or CompletionCache. A cache is current if the config
+    and the task storage it was built from are both unchanged; otherwise
+    (or without a cache) it is rebuilt from the storage the config selects.
+    """
+    cache = cls.load(path)
+    try:
+        if cache is not None and cache.config_signature == file_signature(config_path) and (source_signature(cache.source) == cache.signature):
+            return cache
+    except (FileNotFoundError, KeyError):
+        pass
+    config = Config()
+    config.load(config_path)
+    storage = open_storage(config.storage, todo_path)
+    tasklist = storage.load()
+    tasklist.sort()
+    cache = cls.build(tasklist, storage, config_path)
+    cache.save(path)
+    return cache
+
+@dataclass
+class ListCache:
+    """Rendered output of one `t list`, and what it was rendered from.
+
+    The key covers the list options, the config file and the terminal
+    width; source and signature identify the task storage, as for DueIndex.
+    """
+    key: str
+    source: str
+    signature: str
+    output: str
+
+    @staticmethod
+    def key_for(config_path: str, verbose=False, since: Optional[int]=None, until: Optional[int]=None) -> str:
+        """Return the key of a listing with the given list options."""
+        width = shutil.get_terminal_size().columns
+        return f'{verbose} {since} {until} {width} {file_signature(config_path)}'
+
+    @staticmethod
+    def path_for(todo_path: str) -> str:
+        """Return the path of the cache in the todo directory of todo_path."""
+        return os.path.join(os.path.dirname(todo_path), LIST_CACHE_NAME)
+
+    @classmethod
+    def load(cls, path: str) -> Optional[ListCache]:
+        """Load the cache at path, or None if it is missing."""
+        try:
+            with open(path, mode='r') as file:
+                key = file.readline().rstrip('\n')
+                source = file.readline().rstrip('\n')
+                signature = file.readline().rstrip('\n')
+                return ListCache(key, source, signature, file.read())
+        except FileNotFoundError:
+            return None
+
+    @classmethod
+    def lookup(cls, todo_path: str, key: str) -> Optional[str]:
+        """Return the cached output for key, if the task storage is unchanged."""
+        cache = cls.load(cls.path_for(todo_path))
+        if cache is None or cache.key != key:
+            return None
+        try:
+            if source_signature(cache.source) != cache.signature:
+                return None
+        except (FileNotFoundError, KeyError):
+            return None
+        return cache.output
 
-    # Tags equal, compare text
-    if task1.text < task2.text:
-        return -1
-    if task1.text > task2.text:
-        return 1
+    def save(self, path: str) -> None:
+        """Save cache to file specified by path."""
+        with open(path, mode='w') as file:
+            file.write(f'{self.key}\n{self.source}\n{self.signature}\n{self.output}')
+'Shell completion for todotxtpy, answered from a small cache file.\n\nThe cache holds the tags and priorities in use and a short description\nof each task by line number. It is rewritten whenever the app saves the\ntask list, so completing a word reads one small file and stats the config\nand the task storage, without loading the config or parsing any task.\n'
+import os
+from dataclasses import dataclass
+from typing import Optional, Union
+COMMAND_ARGUMENTS: dict[str, list[Union[str, tuple[str, ...]]]] = {'help': [], 'add': ['priority', 'tag'], 'pri': ['line', 'priority'], 'pri-all': ['tag', 'priority'], 'do': ['line'], 'rm': ['line'], 'find': [], 'sed': [], 'list': [('verbose', '--since', '--until', '--watch')], 'done': [('--between', '--search', '--last', '--today')], 'archive': [('--older-than',)], 'stats': [], 'dedupe': [('--merge', '--done')], 'migrate': [('text', 'sqlite', 'binary')], 'query': [('--explain',)], 'sql': [], 'undo': [], 'redo': [], 'snapshot': [], 'snapshots': [], 'restore': [], 'sync': [], 'fsck': [('--quarantine',)], 'sort-file': [('--done',)], 'export': [('--format',), ('jsonl', 'csv'), ('--done',)], 'import': [('--format',), ('jsonl', 'csv'), ('--done',)], 'due': [('--within',)], 'overdue': [], 'completion': [('bash', 'zsh')]}
+REPEATED_ARGUMENTS = {'do', 'list', 'dedupe'}
+BASH_SCRIPT = '_todotxt_complete() {\n    local IFS=$\'\\n\'\n    COMPREPLY=($(%(program)s complete "${COMP_WORDS[@]:1:COMP_CWORD}" 2>/dev/null | cut -f1))\n}\ncomplete -o default -o nosort -F _todotxt_complete t %(name)s\n'
+ZSH_SCRIPT = '#compdef t %(name)s\n_todotxt() {\n    local -a candidates\n    local line\n    for line in "${(@f)$(%(program)s complete "${(@)words[2,CURRENT]}" 2>/dev/null)}"; do\n        [[ -z $line ]] && continue\n        if [[ $line == *$\'\\t\'* ]]; then\n            candidates+=("${${line%%%%$\'\\t\'*}//:/\\\\:}:${line#*$\'\\t\'}")\n        else\n            candidates+=("${line//:/\\\\:}")\n        fi\n    done\n    if (( ${#candidates} )); then\n        _describe -V todotxt candidates\n    else\n        _files\n    fi\n}\ncompdef _todotxt t %(name)s\n'
+
+@dataclass
+class CompletionCache:
+    """What shell completion offers, and the task storage it was built from."""
+    source: str
+    signature: str
+    config_signature: str
+    tags: list[str]
+    priorities: list[str]
+    descriptions: list[str]
+
+    @classmethod
+    def build(cls, tasklist, storage, config_path: str) -> CompletionCache:
+        """Summarize a sorted task list that has just been saved to storage."""
+        (tags, priorities, descriptions) = (set(), set(), [])
+        for task in tasklist.tasks:
+            tags.add(task.tag.tag)
+            priorities.add(task.priority[1])
+            words = [task.priority, task.tag.tag, task.text]
+            descriptions.append(' '.join(filter(None, words))[:COMPLETE_TEXT_WIDTH])
+        tags.discard(None)
+        return CompletionCache(f'{storage.kind} {storage.path}', storage.signature(), file_signature(config_path), sorted(tags), sorted(priorities), descriptions)
+
+    @staticmethod
+    def path_for(todo_path: str) -> str:
+        """Return the path of the cache in the todo directory of todo_path."""
+        return os.path.join(os.path.dirname(todo_path), COMPLETE_CACHE_NAME)
+
+    @classmethod
+    def load(cls, path: str) -> Optional[CompletionCache]:
+        """Load the cache at path, or None if it is missing."""
+        try:
+            with open(path, mode='r') as file:
+                source = file.readline().rstrip('\n')
+                signature = file.readline().rstrip('\n')
+                config_signature = file.readline().rstrip('\n')
+                tags = file.readline().split()
+                priorities = file.readline().split()
+                descriptions = file.read().splitlines()
+                return CompletionCache(source, signature, config_signature, tags, priorities, descriptions)
+        except FileNotFoundError:
+            return None
+
+    @classmethod
+    def for_todo(cls, config_path: str, todo_path: str) -> CompletionCache:
+        """Return an up to date cache for the todo directory of todo_path."""
+        return load_current(cls, cls.path_for(todo_path), config_path, todo_path)
 
-    # Everything equal
-    return 0
+    def save(self, path: str) -> None:
+        """Save cache to file specified by path."""
+        with open(path, mode='w') as file:
+            file.write(f"{self.source}\n{self.signature}\n{self.config_signature}\n{' '.join(self.tags)}\n{' '.join(self.priorities)}\n")
+            file.writelines((f'{description}\n' for description in self.descriptions))
+
+    def candidates(self, kind: Union[str, tuple[str, ...]]) -> list[str]:
+        """Return the completions of one kind of argument, with descriptions."""
+        match kind:
+            case 'line':
+                return [f'{i + 1}\t{description}' for (i, description) in enumerate(self.descriptions)]
+            case 'priority':
+                return self.priorities
+            case 'tag':
+                return self.tags
+            case _:
+                return list(kind)
+
+def complete_words(words: list[str], config_path: str, todo_path: str) -> list[str]:
+    """Return the completions of the last of words, the arguments of `t`.
+
+    Each completion is a word, optionally followed by a tab and a
+    description. The cache is only read when the word needs it.
+    """
+    (*before, current) = words or ['']
+    if not before:
+        candidates = list(COMMAND_ARGUMENTS)
+    else:
+        arguments = COMMAND_ARGUMENTS.get(before[0], [])
+        position = len(before) - 1
+        if before[0] in REPEATED_ARGUMENTS and arguments:
+            position = min(position, len(arguments) - 1)
+        if current.startswith('+'):
+            kind = 'tag'
+        elif position < len(arguments):
+            kind = arguments[position]
+        else:
+            return []
+        if isinstance(kind, tuple):
+            candidates = list(kind)
+        else:
+            candidates = CompletionCache.for_todo(config_path, todo_path).candidates(kind)
+    return [candidate for candidate in candidates if candidate.startswith(current)]
+
+def completion_script(shell: str, program: str) -> str:
+    """Return the bash or zsh script that completes `t` through program."""
+    script = BASH_SCRIPT if shell == 'bash' else ZSH_SCRIPT
+    return script % {'program': program, 'name': os.path.basename(program)}
+'Compressed archive of completed tasks for todotxtpy.'
+import os
+import zlib
+from dataclasses import dataclass
+from typing import Iterator, Optional
+
+@dataclass
+class Block:
+    """Location and summary of one compressed block of completed tasks."""
+    offset: int
+    length: int
+    lines: int
+    first: int
+    last: int
+
+    def overlaps(self, start: Optional[int], end: Optional[int]) -> bool:
+        """Return whether any task in block may be completed in [start, end]."""
+        return (start is None or self.last >= start) and (end is None or self.first <= end)
+
+class DoneArchive:
+    """Completed tasks rolled out of done.txt into zlib-compressed blocks.
+
+    Blocks are appended to the archive file; a small text index next to it
+    records the offset, size, line count and completion date range of each
+    block, so queries only decompress the blocks they need.
+    """
+
+    def __init__(self, path: str) -> None:
+        """Open the archive at path, reading its index if it exists."""
+        self.path = path
+        self.index_path = path + '.idx'
+        self.blocks: list[Block] = []
+        if os.path.exists(self.index_path):
+            with open(self.index_path, mode='r') as file:
+                for line in file:
+                    self.blocks.append(Block(*map(int, line.split())))
+
+    def __len__(self) -> int:
+        return sum((block.lines for block in self.blocks))
+
+    def append(self, tasks: list[DoneTask]) -> None:
+        """Compress tasks into new blocks at the end of the archive."""
+        with open(self.path, mode='ab') as data, open(self.index_path, mode='a') as index:
+            for i in range(0, len(tasks), ARCHIVE_BLOCK_LINES):
+                chunk = tasks[i:i + ARCHIVE_BLOCK_LINES]
+                raw = ''.join((f'{done}\n' for done in chunk)).encode()
+                compressed = zlib.compress(raw, 9)
+                block = Block(data.tell(), len(compressed), len(chunk), min((done.completed for done in chunk)), max((done.completed for done in chunk)))
+                data.write(compressed)
+                data.flush()
+                os.fsync(data.fileno())
+                index.write(f'{block.offset} {block.length} {block.lines} {block.first} {block.last}\n')
+                self.blocks.append(block)
+
+    def read_block(self, block: Block) -> list[DoneTask]:
+        """Decompress and parse a single block."""
+        with open(self.path, mode='rb') as file:
+            file.seek(block.offset)
+            raw = zlib.decompress(file.read(block.length)).decode()
+        return [DoneTask.load(line) for line in raw.splitlines()]
+
+    def last(self, count: int) -> list[DoneTask]:
+        """Return the last count archived tasks, decompressing blocks from the end."""
+        tasks = []
+        for block in reversed(self.blocks):
+            if len(tasks) >= count:
+                break
+            tasks = self.read_block(block) + tasks
+        return tasks[max(0, len(tasks) - count):] if count else []
+
+    def between(self, start: Optional[int], end: Optional[int]) -> Iterator[DoneTask]:
+        """Yield archived tasks completed between two day numbers, inclusive."""
+        for block in self.blocks:
+            if block.overlaps(start, end):
+                for done in self.read_block(block):
+                    if (start is None or done.completed >= start) and (end is None or done.completed <= end):
+                        yield done
+
+    def search(self, text: str, start: Optional[int]=None, end: Optional[int]=None) -> Iterator[DoneTask]:
+        """Yield archived tasks containing text, optionally within a date range."""
+        for done in self.between(start, end):
+            if text in str(done):
+                yield done
+'Streaming JSON Lines and CSV export and import for todotxtpy.'
+import csv
+import json
+import os
+from itertools import chain
+from typing import Iterable, Iterator, Optional, TextIO
+FIELDS = ['priority', 'creation_date', 'completion_date', 'tag', 'text']
+
+def task_to_record(task: Task, completion_date: Optional[str]=None) -> dict:
+    """Convert a task to a flat record."""
+    return {'priority': task.priority[1], 'creation_date': task.creation_date, 'completion_date': completion_date, 'tag': task.tag.tag, 'text': task.text}
+
+def record_to_line(record: dict, done: bool) -> str:
+    """Convert a record back to a validated todo.txt or done.txt line."""
+    elements = [f"({record['priority']})", record['creation_date']]
+    if done:
+        elements = ['x', *elements, record['completion_date'] or '']
+    if record.get('tag'):
+        elements.append(record['tag'])
+    elements.append(record.get('text') or '')
+    line = ' '.join(elements)
+    return str(DoneTask.load(line) if done else Task.load(line))
+
+def read_records(lines: Iterable[str], done: bool) -> Iterator[dict]:
+    """Parse lines of todo.txt or done.txt into records, one at a time."""
+    for line in lines:
+        if line == '\n':
+            continue
+        if done:
+            done_task = DoneTask.load(line.rstrip())
+            yield task_to_record(done_task.task, done_task.completion_date)
+        else:
+            yield task_to_record(Task.load(line.rstrip()))
+
+def write_records(records: Iterable[dict], out: TextIO, fmt: str) -> None:
+    """Write records to out in the given format."""
+    match fmt:
+        case 'jsonl':
+            for record in records:
+                out.write(json.dumps(record) + '\n')
+        case 'csv':
+            writer = csv.DictWriter(out, FIELDS)
+            writer.writeheader()
+            for record in records:
+                writer.writerow(record)
+        case _:
+            raise ValueError(f'Unrecognized format {fmt}.')
+
+def parse_records(file: TextIO, fmt: str) -> Iterator[dict]:
+    """Read records from file in the given format, one at a time."""
+    match fmt:
+        case 'jsonl':
+            for line in file:
+                if line.strip():
+                    yield json.loads(line)
+        case 'csv':
+            yield from csv.DictReader(file)
+        case _:
+            raise ValueError(f'Unrecognized format {fmt}.')
+
+def export_tasks(out: TextIO, path: str, fmt: str, done: bool=False, archive_path: Optional[str]=None) -> None:
+    """Stream the tasks in path (and, for done tasks, the archive) to out."""
+    with open(path, mode='r') as file:
+        records = read_records(file, done)
+        if done and archive_path is not None and os.path.exists(archive_path):
+            archived = (task_to_record(done_task.task, done_task.completion_date) for done_task in DoneArchive(archive_path).between(None, None))
+            records = chain(archived, records)
+        write_records(records, out, fmt)
+
+def import_tasks(file: TextIO, path: str, fmt: str, done: bool=False) -> int:
+    """Append the records read from file to path; return how many there were."""
+    count = 0
+    with open(path, mode='a') as out:
+        for (count, record) in enumerate(parse_records(file, fmt), start=1):
+            out.write(f'{record_to_line(record, done)}\n')
+    return count
+
+def export_storage(out: TextIO, storage, fmt: str) -> None:
+    """Stream the open tasks of a task storage to out.
+
+    todo.txt is read a line at a time; other storages are loaded whole.
+    """
+    if storage.kind == 'text':
+        export_tasks(out, storage.path, fmt)
+        return
+    write_records((task_to_record(task) for task in storage.load().tasks), out, fmt)
+
+def import_storage(file: TextIO, storage, fmt: str) -> int:
+    """Add the records read from file to a task storage; return how many there were.
+
+    Records are appended to todo.txt; other storages are loaded, added to
+    and saved.
+    """
+    if storage.kind == 'text':
+        return import_tasks(file, storage.path, fmt)
+    tasklist = storage.load()
+    lines = [record_to_line(record, False) for record in parse_records(file, fmt)]
+    tasklist.tasks.extend((Task.load(line) for line in lines))
+    tasklist.sort()
+    storage.save(tasklist)
+    return len(lines)
+'External merge sort of task files, for files larger than memory.'
+import heapq
+import os
+import tempfile
+from typing import Callable, Iterator
+
+def task_key(task: Task) -> Task:
+    """Sort key of todo.txt lines: TaskList.sort order."""
+    return task
+
+def done_key(done_task: DoneTask) -> tuple:
+    """Sort key of done.txt lines: completion date, then the task."""
+    return (done_task.completed, done_task.task)
+
+def read_run(path: str, load: Callable) -> Iterator:
+    """Parse the lines of a file one at a time, skipping blank lines."""
+    with open(path, mode='r') as file:
+        for line in file:
+            if line != '\n':
+                yield load(line.rstrip())
+
+def write_run(path: str, items) -> None:
+    """Write items to a file, one per line."""
+    with open(path, mode='w') as file:
+        file.writelines((f'{item}\n' for item in items))
+
+def split_runs(path: str, directory: str, load: Callable, key: Callable, run_bytes: int) -> list[str]:
+    """Write sorted runs of about run_bytes of path each into directory."""
+    runs = []
+    with open(path, mode='r') as file:
+        while True:
+            lines = file.readlines(run_bytes)
+            if not lines:
+                break
+            items = sorted((load(line.rstrip()) for line in lines if line != '\n'), key=key)
+            run = os.path.join(directory, f'run{len(runs)}')
+            write_run(run, items)
+            runs.append(run)
+    return runs
+
+def merge_runs(runs: list[str], target: str, load: Callable, key: Callable) -> None:
+    """K-way merge sorted runs into target; equal items keep run order."""
+    write_run(target, heapq.merge(*(read_run(run, load) for run in runs), key=key))
+
+def sort_file(path: str, done: bool=False, run_bytes: int=SORT_RUN_BYTES, fan_in: int=SORT_MERGE_FAN_IN) -> int:
+    """Sort a todo.txt (or, with done, done.txt) file in place; return the run count.
+
+    At most run_bytes of lines are held in memory at once, and at most
+    fan_in runs are merged at once, over several passes if needed. The
+    sort is stable, and the file is replaced only once it is complete.
+    """
+    (load, key) = (DoneTask.load, done_key) if done else (Task.load, task_key)
+    directory = os.path.dirname(os.path.abspath(path))
+    with tempfile.TemporaryDirectory(dir=directory) as work:
+        runs = split_runs(path, work, load, key, run_bytes)
+        run_count = len(runs)
+        merged = 0
+        while len(runs) > fan_in:
+            next_runs = []
+            for start in range(0, len(runs), fan_in):
+                group = runs[start:start + fan_in]
+                target = os.path.join(work, f'merge{merged}')
+                merged += 1
+                merge_runs(group, target, load, key)
+                for run in group:
+                    os.remove(run)
+                next_runs.append(target)
+            runs = next_runs
+        target = os.path.join(work, 'sorted')
+        merge_runs(runs, target, load, key)
+        os.replace(target, path)
+    return run_count
+'Integrity check of the todo files for todotxtpy.'
+import os
+from dataclasses import dataclass
+from typing import Callable
+
+@dataclass
+class Problem:
+    """A line of a file that does not parse."""
+    path: str
+    line_number: int
+    offset: int
+    line: str
+    message: str
 
+    def __str__(self) -> str:
+        return f'{self.path}:{self.line_number} (byte {self.offset}): {self.message}: {self.line}'
+
+def check_file(path: str, parse: Callable[[str], object], quarantine: bool=False) -> list[Problem]:
+    """Return the problems of each line of path, reading it once.
+
+    Blank lines are fine. With quarantine, lines with problems are moved
+    to path + REJECTS_SUFFIX, and path keeps the rest.
+    """
+    problems = []
+    rejected = []
+    offset = 0
+    tmp_path = path + '.tmp'
+    with open(path, mode='rb') as file, open(tmp_path if quarantine else os.devnull, mode='wb') as kept:
+        for (line_number, raw) in enumerate(file, 1):
+            message = None
+            try:
+                line = raw.decode().rstrip('\r\n')
+                if line.strip():
+                    parse(line)
+            except UnicodeDecodeError:
+                (line, message) = (raw.decode(errors='replace').rstrip('\r\n'), 'Not UTF-8')
+            except ValueError as error:
+                message = str(error) or 'Unrecognized format'
+            if message is None:
+                kept.write(raw)
+            else:
+                problems.append(Problem(path, line_number, offset, line, message))
+                rejected.append(raw if raw.endswith(b'\n') else raw + b'\n')
+            offset += len(raw)
+    if quarantine and problems:
+        with open(path + REJECTS_SUFFIX, mode='ab') as rejects:
+            rejects.writelines(rejected)
+        os.replace(tmp_path, path)
+    elif quarantine:
+        os.remove(tmp_path)
+    return problems
+
+def fsck(config_path: str, todo_path: str, done_path: str, quarantine: bool=False) -> list[Problem]:
+    """Check config, todo.txt and done.txt, skipping files that do not exist."""
+    problems = []
+    for (path, parse) in [(config_path, Config().set), (todo_path, Task.load), (done_path, DoneTask.load)]:
+        if os.path.exists(path):
+            problems.extend(check_file(path, parse, quarantine))
+    return problems
+'Deduplicated snapshots of the todo directory for todotxtpy.'
+import hashlib
+import os
+import zlib
+from typing import BinaryIO, Iterator
+
+def split_chunks(file: BinaryIO) -> Iterator[bytes]:
+    """Split a file into content-defined chunks of whole lines.
+
+    A chunk ends after a line whose hash is divisible by the chunk divisor, so
+    an edit only changes the chunks around it, and appending to a file only
+    changes its last chunk.
+    """
+    chunk = []
+    size = 0
+    for line in file:
+        chunk.append(line)
+        size += len(line)
+        if size >= SNAPSHOT_CHUNK_MAX or (size >= SNAPSHOT_CHUNK_MIN and zlib.crc32(line) % SNAPSHOT_CHUNK_DIVISOR == 0):
+            yield b''.join(chunk)
+            chunk = []
+            size = 0
+    if chunk:
+        yield b''.join(chunk)
+
+class SnapshotStore:
+    """Content-addressed store of file chunks, plus a manifest per snapshot.
+
+    Chunks are stored compressed under chunks/, named by their SHA-256 hash,
+    and written only if they are not already present. Each snapshot is a
+    numbered manifest listing, for every file, the hashes of its chunks.
+    """
+
+    def __init__(self, path: str) -> None:
+        """Open the store at path."""
+        self.path = path
+        self.chunk_path = os.path.join(path, 'chunks')
+
+    def ids(self) -> list[int]:
+        """Return the ids of all snapshots, oldest first."""
+        if not os.path.isdir(self.path):
+            return []
+        return sorted((int(name) for name in os.listdir(self.path) if name.isdecimal()))
+
+    def write_chunk(self, chunk: bytes) -> tuple[str, bool]:
+        """Store chunk if needed; return its hash and whether it was new."""
+        digest = hashlib.sha256(chunk).hexdigest()
+        directory = os.path.join(self.chunk_path, digest[:2])
+        path = os.path.join(directory, digest)
+        if os.path.exists(path):
+            return (digest, False)
+        os.makedirs(directory, exist_ok=True)
+        with open(path + '.tmp', mode='wb') as file:
+            file.write(zlib.compress(chunk))
+        os.replace(path + '.tmp', path)
+        return (digest, True)
+
+    def read_chunk(self, digest: str) -> bytes:
+        """Return the contents of a stored chunk."""
+        with open(os.path.join(self.chunk_path, digest[:2], digest), mode='rb') as file:
+            return zlib.decompress(file.read())
+
+    def snapshot(self, paths: list[str]) -> tuple[int, int]:
+        """Snapshot the files at paths that exist.
+
+        Returns the id of the new snapshot and the number of new chunks.
+        """
+        os.makedirs(self.path, exist_ok=True)
+        manifest = []
+        new_chunks = 0
+        for path in paths:
+            if not os.path.exists(path):
+                continue
+            digests = []
+            with open(path, mode='rb') as file:
+                for chunk in split_chunks(file):
+                    (digest, new) = self.write_chunk(chunk)
+                    digests.append(digest)
+                    new_chunks += new
+            manifest.append(f"{os.path.basename(path)}\t{' '.join(digests)}\n")
+        snapshot_id = max(self.ids(), default=0) + 1
+        tmp_path = os.path.join(self.path, f'{snapshot_id}.tmp')
+        with open(tmp_path, mode='w') as file:
+            file.writelines(manifest)
+        os.replace(tmp_path, os.path.join(self.path, str(snapshot_id)))
+        return (snapshot_id, new_chunks)
+
+    def restore(self, snapshot_id: int, directory: str) -> list[str]:
+        """Restore the files of a snapshot into directory.
+
+        Returns the names of the restored files.
+        """
+        manifest_path = os.path.join(self.path, str(snapshot_id))
+        if not os.path.exists(manifest_path):
+            raise ValueError(f'No snapshot {snapshot_id}.')
+        with open(manifest_path, mode='r') as file:
+            manifest = [line.rstrip('\n').split('\t') for line in file]
+        for (name, digests) in manifest:
+            path = os.path.join(directory, name)
+            with open(path + '.tmp', mode='wb') as file:
+                for digest in digests.split():
+                    file.write(self.read_chunk(digest))
+            os.replace(path + '.tmp', path)
+        return [name for (name, _) in manifest]
+'Three-way sync between two todo directories for todotxtpy.'
+import hashlib
+import os
+from collections import Counter
+from dataclasses import dataclass
+
+def line_hash(line: bytes) -> bytes:
+    """Return a short hash identifying a line."""
+    return hashlib.blake2b(line, digest_size=8).digest()
+
+def read_lines(path: str) -> list[bytes]:
+    """Return the non-empty lines of a file, without newlines."""
+    if not os.path.exists(path):
+        return []
+    with open(path, mode='rb') as file:
+        return [line for line in file.read().split(b'\n') if line]
+
+def write_lines(path: str, lines: list[bytes]) -> None:
+    """Replace the file at path with lines."""
+    with open(path + '.tmp', mode='wb') as file:
+        file.write(b''.join((line + b'\n' for line in lines)))
+    os.replace(path + '.tmp', path)
+
+def base_path(directory: str, peer: str) -> str:
+    """Return where directory keeps the common base for syncing with peer."""
+    peer_id = hashlib.sha1(os.path.realpath(peer).encode()).hexdigest()[:16]
+    return os.path.join(directory, SYNC_DIRECTORY_NAME, peer_id)
+
+def merge_counts(base: Counter, ours: Counter, theirs: Counter) -> Counter:
+    """Three-way merge of line multisets.
+
+    A change made on only one side is taken; when both sides added (or both
+    removed) copies of a line, the larger change wins instead of doubling.
+    """
+    merged = Counter()
+    for key in base.keys() | ours.keys() | theirs.keys():
+        ours_delta = ours[key] - base[key]
+        theirs_delta = theirs[key] - base[key]
+        if ours_delta * theirs_delta > 0:
+            delta = max(ours_delta, theirs_delta, key=abs)
+        else:
+            delta = ours_delta + theirs_delta
+        if base[key] + delta > 0:
+            merged[key] = base[key] + delta
+    return merged
+
+def apply_counts(lines: list[bytes], hashes: list[bytes], target: Counter, extra: dict[bytes, bytes]) -> list[bytes]:
+    """Edit lines so that their hashes occur as in target.
+
+    Surplus lines are dropped and missing ones (looked up in extra) appended,
+    so the order of lines that are kept does not change.
+    """
+    remaining = Counter(target)
+    result = []
+    for (line, key) in zip(lines, hashes):
+        if remaining[key] > 0:
+            remaining[key] -= 1
+            result.append(line)
+    for (key, count) in remaining.items():
+        result.extend([extra[key]] * count)
+    return result
+
+@dataclass
+class SyncResult:
+    """Number of lines changed in each directory by a sync."""
+    todo_ours: int = 0
+    todo_theirs: int = 0
+    done_ours: int = 0
+    done_theirs: int = 0
+
+def sync_todo(ours_path: str, theirs_path: str, base: list[bytes], result: SyncResult) -> list[bytes]:
+    """Merge two todo.txt files against base; return the merged lines."""
+    (ours, theirs) = (read_lines(ours_path), read_lines(theirs_path))
+    ours_hashes = [line_hash(line) for line in ours]
+    theirs_hashes = [line_hash(line) for line in theirs]
+    (ours_counts, theirs_counts) = (Counter(ours_hashes), Counter(theirs_hashes))
+    merged = merge_counts(Counter(map(line_hash, base)), ours_counts, theirs_counts)
+    lines = dict(zip(theirs_hashes, theirs)) | dict(zip(ours_hashes, ours))
+    for key in merged - ours_counts | merged - theirs_counts:
+        Task.load(lines[key].decode())
+    merged_ours = ours
+    if merged != ours_counts:
+        merged_ours = apply_counts(ours, ours_hashes, merged, lines)
+        result.todo_ours = sum((merged - ours_counts).values()) + sum((ours_counts - merged).values())
+        write_lines(ours_path, merged_ours)
+    if merged != theirs_counts:
+        result.todo_theirs = sum((merged - theirs_counts).values()) + sum((theirs_counts - merged).values())
+        write_lines(theirs_path, apply_counts(theirs, theirs_hashes, merged, lines))
+    return merged_ours
+
+def sync_done(ours_path: str, theirs_path: str, result: SyncResult) -> None:
+    """Append to each done.txt the completed tasks only the other one has."""
+    (ours, theirs) = (read_lines(ours_path), read_lines(theirs_path))
+    ours_counts = Counter(map(line_hash, ours))
+    theirs_counts = Counter(map(line_hash, theirs))
+    for (lines, counts, other_counts, path, field) in [(theirs, theirs_counts, ours_counts, ours_path, 'done_ours'), (ours, ours_counts, theirs_counts, theirs_path, 'done_theirs')]:
+        missing = counts - other_counts
+        new = []
+        for line in lines:
+            key = line_hash(line)
+            if missing[key] > 0:
+                missing[key] -= 1
+                new.append(line)
+        if new:
+            with open(path, mode='ab') as file:
+                file.write(b''.join((line + b'\n' for line in new)))
+            setattr(result, field, len(new))
+
+def sync(ours_dir: str, theirs_dir: str, todo_name: str, done_name: str) -> SyncResult:
+    """Sync two todo directories.
+
+    todo.txt is merged three ways against the state recorded at the last
+    sync between the two; done.txt becomes the union of both. Files are only
+    written if they change.
+    """
+    result = SyncResult()
+    ours_base_path = base_path(ours_dir, theirs_dir)
+    theirs_base_path = base_path(theirs_dir, ours_dir)
+    if os.path.exists(ours_base_path):
+        base = read_lines(ours_base_path)
+    else:
+        base = read_lines(theirs_base_path)
+    merged = sync_todo(os.path.join(ours_dir, todo_name), os.path.join(theirs_dir, todo_name), base, result)
+    sync_done(os.path.join(ours_dir, done_name), os.path.join(theirs_dir, done_name), result)
+    for path in [ours_base_path, theirs_base_path]:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        write_lines(path, merged)
+    return result
+'Undo log for todotxtpy.'
+import os
+from dataclasses import dataclass
+from typing import Optional
 
-# App
+@dataclass
+class Operation:
+    """A change to the task list, stored as the task lines it swapped.
+
+    Undoing an operation removes after, restores before and retracts done
+    from done.txt; redoing it does the opposite. Consecutive operations of
+    the same group, from one bulk edit, are undone and redone together.
+    """
+    kind: str
+    before: Optional[str]
+    after: Optional[str]
+    done: Optional[str] = None
+    group: Optional[str] = None
+
+    @classmethod
+    def load(cls, line: str) -> Operation:
+        """Populate an Operation from a tab-separated line of the log."""
+        (kind, *fields) = line.rstrip('\n').split('\t')
+        return Operation(kind, *(field or None for field in fields))
 
+    def __str__(self) -> str:
+        return '\t'.join([self.kind, self.before or '', self.after or '', self.done or '', self.group or ''])
+
+class UndoLog:
+    """Bounded history of operations, with a cursor for undo and redo.
+
+    Operations before the cursor can be undone, operations after it redone.
+    Only the last UNDO_LIMIT operations are kept, but groups are never split
+    and the newest group is kept whole.
+    """
+
+    def __init__(self, path: str) -> None:
+        """Load the log at path, if it exists."""
+        self.path = path
+        self.operations: list[Operation] = []
+        self.position = 0
+        if os.path.exists(path):
+            with open(path, mode='r') as file:
+                self.position = int(file.readline() or 0)
+                self.operations = [Operation.load(line) for line in file]
+
+    def save(self) -> None:
+        """Save log to its file, overwriting it completely."""
+        with open(self.path, mode='w') as file:
+            file.write(f'{self.position}\n')
+            for operation in self.operations:
+                file.write(f'{operation}\n')
+
+    def record(self, operation: Operation) -> None:
+        """Append an operation, discarding anything that could be redone."""
+        del self.operations[self.position:]
+        self.operations.append(operation)
+        self.trim()
+        self.position = len(self.operations)
+
+    def record_group(self, operations: list[Operation]) -> None:
+        """Append operations that are undone and redone as one step."""
+        del self.operations[self.position:]
+        self.operations.extend(operations)
+        self.trim()
+        self.position = len(self.operations)
+
+    def trim(self) -> None:
+        """Drop the oldest operations past UNDO_LIMIT, at a group boundary."""
+        cut = len(self.operations) - UNDO_LIMIT
+        if cut <= 0:
+            return
+        newest = len(self.operations) - 1
+        while newest > 0 and self.same_group(newest - 1, newest):
+            newest -= 1
+        while 0 < cut < newest and self.same_group(cut - 1, cut):
+            cut += 1
+        del self.operations[:min(cut, newest)]
+
+    def same_group(self, i: int, j: int) -> bool:
+        """Return whether operations i and j belong to the same group."""
+        group = self.operations[i].group
+        return group is not None and group == self.operations[j].group
+
+    def undo(self) -> Optional[Operation]:
+        """Step the cursor back, returning the operation to undo."""
+        if self.position == 0:
+            return None
+        self.position -= 1
+        return self.operations[self.position]
+
+    def undo_group(self) -> list[Operation]:
+        """Step the cursor back over a whole group, returning its operations."""
+        operations = []
+        while (operation := self.undo()) is not None:
+            operations.append(operation)
+            if not (self.position > 0 and self.same_group(self.position - 1, self.position)):
+                break
+        return operations
+
+    def redo_group(self) -> list[Operation]:
+        """Step the cursor forward over a whole group, returning its operations."""
+        operations = []
+        while (operation := self.redo()) is not None:
+            operations.append(operation)
+            if not (self.position < len(self.operations) and self.same_group(self.position - 1, self.position)):
+                break
+        return operations
+
+    def redo(self) -> Optional[Operation]:
+        """Step the cursor forward, returning the operation to redo."""
+        if self.position == len(self.operations):
+            return None
+        self.position += 1
+        return self.operations[self.position - 1]
+'Watching the task list for changes, for `t list --watch`.'
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import time
+from typing import Optional, TextIO
+IN_MODIFY = 2
+IN_CLOSE_WRITE = 8
+IN_MOVED_TO = 128
+IN_CREATE = 256
+IN_DELETE = 512
+WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_DELETE
+INOTIFY_EVENT = struct.Struct('iIII')
+SETTLE_SECONDS = 0.05
+POLL_SECONDS = 1.0
+
+class InotifyWatcher:
+    """Wait for files to change, using Linux inotify on their directories."""
+
+    def __init__(self, paths: list[str]) -> None:
+        """Watch the directories holding paths."""
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.fd = libc.inotify_init1(os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        self.directories = {}
+        for directory in {os.path.dirname(os.path.abspath(path)) for path in paths}:
+            wd = libc.inotify_add_watch(self.fd, os.fsencode(directory), WATCH_MASK)
+            if wd < 0:
+                os.close(self.fd)
+                raise OSError(ctypes.get_errno(), f'Cannot watch {directory}')
+            self.directories[wd] = directory
+
+    def read_events(self) -> set[str]:
+        """Return the paths of all files with pending events."""
+        data = os.read(self.fd, 64 * 1024)
+        changed = set()
+        offset = 0
+        while offset < len(data):
+            (wd, _, _, length) = INOTIFY_EVENT.unpack_from(data, offset)
+            offset += INOTIFY_EVENT.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b'\x00'))
+            offset += length
+            changed.add(os.path.join(self.directories[wd], name))
+        return changed
+
+    def wait(self, paths: list[str]) -> None:
+        """Block until one of paths has changed."""
+        paths = {os.path.abspath(path) for path in paths}
+        while not self.read_events() & paths:
+            pass
+        while select.select([self.fd], [], [], SETTLE_SECONDS)[0]:
+            self.read_events()
+
+    def close(self) -> None:
+        """Stop watching."""
+        os.close(self.fd)
+
+class PollingWatcher:
+    """Wait for files to change by checking their signatures periodically."""
+
+    def __init__(self, paths: list[str], interval: float=POLL_SECONDS) -> None:
+        """Remember the current state of paths."""
+        self.interval = interval
+        self.signatures = self.read_signatures(paths)
+
+    @staticmethod
+    def read_signatures(paths: list[str]) -> dict[str, Optional[str]]:
+        """Return the signature of every path, or None where it is missing."""
+        signatures = {}
+        for path in paths:
+            try:
+                signatures[path] = file_signature(path)
+            except FileNotFoundError:
+                signatures[path] = None
+        return signatures
+
+    def wait(self, paths: list[str]) -> None:
+        """Block until one of paths differs from the last time it was seen."""
+        while True:
+            signatures = self.read_signatures(paths)
+            if any((self.signatures.get(path, signature) != signature for (path, signature) in signatures.items())):
+                self.signatures = signatures
+                return
+            self.signatures.update(signatures)
+            time.sleep(self.interval)
+
+    def close(self) -> None:
+        """Stop watching."""
+
+def open_watcher(paths: list[str]):
+    """Return an InotifyWatcher for paths, or a PollingWatcher without inotify."""
+    try:
+        return InotifyWatcher(paths)
+    except (AttributeError, OSError, TypeError):
+        return PollingWatcher(paths)
+
+class Screen:
+    """Terminal rows that are redrawn only where they changed."""
+
+    def __init__(self, out: TextIO) -> None:
+        """Draw onto out, which is cleared on the first draw."""
+        self.out = out
+        self.rows: Optional[list[str]] = None
+
+    def draw(self, rows: list[str]) -> int:
+        """Show rows, and return how many of them had to be rewritten."""
+        if self.rows is None:
+            (parts, previous) = (['\x1b[H\x1b[2J'], [])
+        else:
+            (parts, previous) = ([], self.rows)
+        redrawn = 0
+        for (i, row) in enumerate(rows):
+            if i >= len(previous) or previous[i] != row:
+                parts.append(f'\x1b[{i + 1};1H{row}\x1b[K')
+                redrawn += 1
+        if len(rows) < len(previous):
+            parts.append(f'\x1b[{len(rows) + 1};1H\x1b[J')
+        parts.append(f'\x1b[{len(rows) + 1};1H')
+        self.out.write(''.join(parts))
+        self.out.flush()
+        self.rows = rows
+        return redrawn
+'App logic for the todotxtpy.'
+import os
+import sys
+import time
+from typing import Callable, Optional
 
 class TodoApp:
     """The full app for todotxtpy."""
 
-    def __init__(self, config_path, todo_path, done_path) -> None:
-        """Initialize the app."""
-        self.config = Config()
-        self.config.load(config_path)
-        self.tasklist = TaskList()
-        self.tasklist.load(todo_path)
+    def __init__(self, config_path, todo_path, done_path, lazy=False) -> None:
+        """Initialize the app.
 
+        With lazy, task text is decoded from todo.txt as it is used, for
+        commands that only read the task list.
+        """
         self.config_path = config_path
         self.todo_path = todo_path
         self.done_path = done_path
+        self.due_index_path = os.path.join(os.path.dirname(todo_path), DUE_INDEX_NAME)
+        self.archive_path = os.path.join(os.path.dirname(done_path), ARCHIVE_NAME)
+        self.intent_path = os.path.join(os.path.dirname(done_path), DONE_INTENT_NAME)
+        self._undo_log = None
+        self.lazy = lazy
+        self.reload()
+
+    @property
+    def undo_log(self):
+        """The undo log, loaded when first used."""
+        if self._undo_log is None:
+            self._undo_log = UndoLog(os.path.join(os.path.dirname(self.todo_path), UNDO_LOG_NAME))
+        return self._undo_log
+
+    def reload(self) -> None:
+        """Load the config, then the task list from the storage it selects."""
+        self.config = Config()
+        self.config.load(self.config_path)
+        self.storage = open_storage(self.config.storage, self.todo_path, sync=self.config.durability != 'none', lazy=self.lazy)
+        recover_and_report(self.intent_path, self.done_path, self.storage)
+        self.tasklist = self.storage.load()
+        if self.tasklist.invalid:
+            print(f'Skipped {len(self.tasklist.invalid)} invalid lines in {self.storage.path}; run `t fsck` to find them.', file=sys.stderr)
+
+    def save(self) -> None:
+        """Sort and save the task list, then refresh the indexes derived from it."""
+        self.tasklist.sort()
+        self.storage.save(self.tasklist)
+        DueIndex.build(self.tasklist, self.storage, self.config_path).save(self.due_index_path)
+        CompletionCache.build(self.tasklist, self.storage, self.config_path).save(CompletionCache.path_for(self.todo_path))
 
-    def add(self, priority: str, tag: str, text: str) -> None:
-        """Process raw output and append onto the task list."""
-        new_task = Task()
-        new_task.priority = priority
-        new_task.creation_date = get_current_date()
-        new_task.tag = tag
-        new_task.text = text
+    def add(self, priority: str, tag: Tag, text: str, unique: bool=False) -> None:
+        """Process raw output and append onto the task list.
 
+        If unique, nothing is added when a task with the same tag and text
+        (as compared by dedupe) is already in the list.
+        """
+        new_task = Task(priority, get_current_date(), tag, text)
+        if unique:
+            new_hash = task_hash(new_task)
+            for (i, task) in enumerate(self.tasklist.tasks):
+                if task_hash(task) == new_hash:
+                    print(f'Already on line {i + 1}: {task}')
+                    return
         self.tasklist.tasks.append(new_task)
-
-        self.tasklist.sort()
-        self.tasklist.save(self.todo_path)
+        self.save()
+        self.record(Operation('add', None, str(new_task)))
 
     def pri(self, line_number: str, new_priority: str) -> None:
         """Re-prioritize task."""
         idx = int(line_number) - 1
-
         if not 0 <= idx <= len(self.tasklist.tasks) - 1:
-            raise ValueError("Line number out of range")
-
-        self.tasklist.tasks[idx].priority = new_priority
-
-        self.tasklist.sort()
-        self.tasklist.save(self.todo_path)
+            raise ValueError('Line number out of range')
+        task = self.tasklist.tasks[idx]
+        before = str(task)
+        task.priority = new_priority
+        self.save()
+        self.record(Operation('pri', before, str(task)))
 
     def do_task(self, line_number: str) -> None:
         """Complete a task."""
-        idx = int(line_number) - 1
-
-        if not 0 <= idx <= len(self.tasklist.tasks) - 1:
-            raise ValueError("Line number out of range")
-
-        task = self.tasklist.tasks.pop(idx)
+        self.do_tasks([line_number])
 
-        with open(self.done_path, mode="a") as file:
-            done_task = "x "
-            done_task += task.priority + " "
-            done_task += task.creation_date + " "
-            done_task += get_current_date() + " "
-            if task.tag:
-                done_task += task.tag + " "
-            done_task += task.text + "\n"
-            file.write(done_task)
+    def do_tasks(self, line_numbers: list[str]) -> None:
+        """Complete tasks, undone and redone together.
 
-        self.tasklist.sort()
-        self.tasklist.save(self.todo_path)
+        With DURABILITY always, each task is committed to todo.txt and
+        done.txt on its own; otherwise they are committed as one batch.
+        """
+        indices = sorted({int(line_number) - 1 for line_number in line_numbers})
+        if not all((0 <= idx <= len(self.tasklist.tasks) - 1 for idx in indices)):
+            raise ValueError('Line number out of range')
+        completion_date = get_current_date()
+        tasks = [self.tasklist.tasks[idx] for idx in indices]
+        done_lines = [str(DoneTask(task, completion_date)) for task in tasks]
+        if self.config.durability == 'always':
+            for (task, done_line) in zip(tasks, done_lines):
+                self.tasklist.tasks.remove(task)
+                self.save_done([done_line])
+        else:
+            for idx in reversed(indices):
+                self.tasklist.tasks.pop(idx)
+            self.save_done(done_lines)
+        group = str(time.time_ns()) if len(tasks) > 1 else None
+        self.undo_log.record_group([Operation('do', str(task), None, done_line, group) for (task, done_line) in zip(tasks, done_lines)])
+        self.undo_log.save()
+
+    def save_done(self, done_lines: list[str]) -> None:
+        """Save the task list and append done_lines to done.txt, as one commit."""
+        commit_done(self.intent_path, self.done_path, done_lines, self.storage, self.save, self.config.durability)
+
+    def match(self, query: str) -> str:
+        """Return the line number of the one task fuzzily matching query.
+
+        If several tasks match about equally well they are displayed, and
+        nothing is chosen.
+        """
+        candidates = TrigramIndex.build(self.tasklist).candidates(query)
+        if not candidates:
+            raise ValueError('No task matches.')
+        if len(candidates) > 1:
+            for match in candidates:
+                print(f'{match.index + 1} {match.task}')
+            raise ValueError('Ambiguous match; use a line number.')
+        return str(candidates[0].index + 1)
+
+    def find(self, query: str) -> None:
+        """Display the tasks best matching query, best first."""
+        for match in TrigramIndex.build(self.tasklist).search(query):
+            print(f'{match.index + 1} {match.task}')
 
     def remove_task(self, line_number: str) -> None:
         """Remove a task."""
         idx = int(line_number) - 1
-
         if not 0 <= idx <= len(self.tasklist.tasks) - 1:
-            raise ValueError("Line number out of range")
+            raise ValueError('Line number out of range')
+        task = self.tasklist.tasks.pop(idx)
+        self.save()
+        self.record(Operation('rm', str(task), None))
 
-        self.tasklist.tasks.pop(idx)
+    def bulk_edit(self, kind: str, edit: Callable[[Task], Optional[str]], dry_run: bool=False) -> None:
+        """Apply edit to every task in one pass, then save once.
 
+        edit returns the new line for a task, or None to leave it alone.
+        New lines are parsed like todo.txt lines, and nothing is changed if
+        any of them is invalid. With dry_run, only the diff is displayed.
+        """
+        changes = []
+        for (i, task) in enumerate(self.tasklist.tasks):
+            line = edit(task)
+            if line is None or line == str(task):
+                continue
+            try:
+                changes.append((i, str(task), Task.load(line)))
+            except ValueError as error:
+                raise ValueError(f'Line {i + 1} would become invalid: {error}') from error
+        if dry_run:
+            import difflib
+            lines = [str(task) for task in self.tasklist.tasks]
+            edited = lines.copy()
+            for (i, _, new_task) in changes:
+                edited[i] = str(new_task)
+            sys.stdout.writelines((line + '\n' for line in difflib.unified_diff(lines, edited, self.todo_path, self.todo_path, n=0, lineterm='')))
+            return
+        for (i, _, new_task) in changes:
+            self.tasklist.tasks[i] = new_task
+        self.save()
+        group = str(time.time_ns())
+        self.undo_log.record_group([Operation(kind, old, str(new_task), None, group) for (_, old, new_task) in changes])
+        self.undo_log.save()
+        print(f'Changed {len(changes)} tasks.')
+
+    def sed(self, expression: str, condition: Optional[str]=None, dry_run: bool=False) -> None:
+        """Substitute a sed expression in every task matching a condition.
+
+        The condition is a basic regular expression searched for in the
+        task line; without it every task is edited.
+        """
+        (regex, replacement, count) = parse_substitution(expression)
+        selector = compile_basic_regex(condition) if condition else None
+
+        def edit(task):
+            line = str(task)
+            if selector is not None and (not selector.search(line)):
+                return None
+            return regex.sub(replacement, line, count)
+        self.bulk_edit('sed', edit, dry_run)
+
+    def pri_all(self, tag: str, priority: str, dry_run: bool=False) -> None:
+        """Re-prioritize every task with tag."""
+
+        def edit(task):
+            if task.tag.tag != tag:
+                return None
+            return str(Task(priority, task.creation_date, task.tag, task.text))
+        self.bulk_edit('pri-all', edit, dry_run)
+
+    def dedupe(self, merge: bool=False, done_days: Optional[int]=None) -> None:
+        """Display (or, with merge, remove) tasks with the same tag and text.
+
+        The first task of each group in list order is kept. If done_days is
+        given, open tasks matching a task completed in the last done_days
+        days are duplicates too.
+        """
         self.tasklist.sort()
-        self.tasklist.save(self.todo_path)
-
-    def list(self, verbose=False) -> None:
-        """Display tasklist."""
+        tasks = self.tasklist.tasks
+        hashes = [task_hash(task) for task in tasks]
+        duplicates = [(indices[0], indices[1:]) for indices in duplicate_groups(hashes)]
+        for (first, rest) in duplicates:
+            for i in [first, *rest]:
+                print(f'{i + 1} {tasks[i]}')
+            print()
+        done_matches = []
+        if done_days is not None:
+            today = get_current_day()
+            done_list = DoneList.load(self.done_path, tolerant=True)
+            recent = {task_hash(done_task.task): done_task for done_task in done_list.between(today - done_days, today)}
+            done_matches = [i for (i, task_digest) in enumerate(hashes) if task_digest in recent]
+            for i in done_matches:
+                print(f'{i + 1} {tasks[i]}\n  done: {recent[hashes[i]]}')
+        if not duplicates and (not done_matches):
+            print('No duplicates.')
+        if not merge:
+            return
+        removed = sorted({*done_matches, *(i for (_, rest) in duplicates for i in rest)})
+        group = str(time.time_ns())
+        operations = [Operation('dedupe', str(tasks[i]), None, None, group) for i in removed]
+        for i in reversed(removed):
+            tasks.pop(i)
+        self.save()
+        self.undo_log.record_group(operations)
+        self.undo_log.save()
+        print(f'Removed {len(removed)} duplicates.')
+
+    def migrate(self, kind: str) -> None:
+        """Copy the task list into the storage of the given kind."""
+        storage = open_storage(kind, self.todo_path)
+        storage.save(self.tasklist)
+        print(f'Copied {len(self.tasklist.tasks)} tasks to {storage.path}; set STORAGE {kind} in {self.config_path} to use it.')
+
+    def sql(self, condition: str) -> None:
+        """Display the tasks matching an SQL condition on the tasks table."""
+        if not isinstance(self.storage, SqliteStorage):
+            raise ValueError('SQL queries need STORAGE sqlite.')
+        for (_, line_number, task) in self.storage.rows(condition):
+            print(f'{line_number} {task}')
+
+    def query(self, text: str, explain: bool=False) -> None:
+        """Display the tasks matching a query, or how they would be found."""
+        query = Query.parse(text)
         self.tasklist.sort()
-        for i, task in enumerate(self.tasklist.tasks):
-
-            # Add line number
+        (plan_used, candidates) = plan(query, self.tasklist, self.storage, self.due_index_path)
+        if explain:
+            print(f'{plan_used}; {len(candidates)} candidates')
+            return
+        for (line_number, task) in candidates:
+            if query.predicate(task):
+                print(f'{line_number} {task}')
+
+    def record(self, operation) -> None:
+        """Add an operation to the undo log."""
+        self.undo_log.record(operation)
+        self.undo_log.save()
+
+    def undo(self, count: int=1) -> None:
+        """Undo the last count operations.
+
+        The tasks are saved before their records leave done.txt, so a crash
+        in between never loses a task.
+        """
+        done_lines = []
+        undone = 0
+        for _ in range(count):
+            operations = self.undo_log.undo_group()
+            if not operations:
+                break
+            undone += 1
+            for operation in operations:
+                self.apply(operation.after, operation.before)
+                if operation.done:
+                    done_lines.append(operation.done)
+        if not undone:
+            return
+        missing = commit_retract(self.intent_path, self.done_path, done_lines, self.storage, self.save, self.config.durability)
+        for line in missing:
+            print(f'Not in {self.done_path}, it may be archived: {line}', file=sys.stderr)
+        self.undo_log.save()
+
+    def redo(self, count: int=1) -> None:
+        """Redo the last count undone operations."""
+        done_lines = []
+        redone = 0
+        for _ in range(count):
+            operations = self.undo_log.redo_group()
+            if not operations:
+                break
+            redone += 1
+            for operation in operations:
+                self.apply(operation.before, operation.after)
+                if operation.done:
+                    done_lines.append(operation.done)
+        if not redone:
+            return
+        self.save_done(done_lines)
+        self.undo_log.save()
+
+    def apply(self, old: Optional[str], new: Optional[str]) -> None:
+        """Replace the task whose line is old with a task parsed from new."""
+        if old is not None:
+            lines = [str(task) for task in self.tasklist.tasks]
+            if old not in lines:
+                raise ValueError(f'Task no longer in list: {old}')
+            self.tasklist.tasks.pop(lines.index(old))
+        if new is not None:
+            self.tasklist.tasks.append(Task.load(new))
+
+    def render(self, verbose=False, since: Optional[int]=None, until: Optional[int]=None) -> str:
+        """Return the tasklist as displayed by list.
+
+        If since or until are given, only tasks created between those day
+        numbers (inclusive) are shown; line numbers are left unchanged.
+        """
+        self.tasklist.sort()
+        lines = []
+        for (i, task) in enumerate(self.tasklist.tasks):
+            if since is not None and task.created < since:
+                continue
+            if until is not None and task.created > until:
+                continue
             line_number = str(i + 1).zfill(len(str(len(self.tasklist.tasks))))
             display_str = self.config.color_number
             display_str += line_number
             display_str += Colors.ENDC
-
-            display_str += " "
-
-            # Add priority
+            display_str += ' '
             display_str += self.config.priority_to_color_code(task.priority)
             display_str += task.priority
             display_str += Colors.ENDC
-
-            # Add date, if verbose
             if verbose:
-                display_str += " "
+                display_str += ' '
                 display_str += self.config.color_date
                 display_str += task.creation_date
                 display_str += Colors.ENDC
-
-            # Add tag, if exists
-            if task.tag:
-                display_str += " "
+            if task.tag.tag is not None:
+                display_str += ' '
                 display_str += self.config.color_tag
-                display_str += task.tag
+                display_str += task.tag.tag
                 display_str += Colors.ENDC
-
-            # Add text
-            display_str += " "
+            display_str += ' '
             display_str += self.config.priority_to_color_code(task.priority)
             display_str += task.text
             display_str += Colors.ENDC
+            lines.append(display_str + '\n')
+        return ''.join(lines)
 
-            print(display_str)
+    def list(self, verbose=False, since: Optional[int]=None, until: Optional[int]=None) -> None:
+        """Display tasklist, and cache the output for unchanged repeats."""
+        output = self.render(verbose, since, until)
+        sys.stdout.write(output)
+        ListCache(ListCache.key_for(self.config_path, verbose, since, until), f'{self.storage.kind} {self.storage.path}', self.storage.signature(), output).save(ListCache.path_for(self.todo_path))
 
+    def watch(self, verbose=False, since: Optional[int]=None, until: Optional[int]=None) -> None:
+        """Display tasklist until interrupted, redrawing it as it changes.
 
-# Main
+        The config and task storage are reloaded only after one of their
+        files changed, and only rows that differ are written again.
+        """
+        import shutil
+
+        def watched_paths():
+            return [self.config_path, self.storage.path, self.storage.path + '-wal']
+        screen = Screen(sys.stdout)
+        watcher = open_watcher(watched_paths())
+        try:
+            while True:
+                height = shutil.get_terminal_size().lines
+                screen.draw(self.render(verbose, since, until).splitlines()[:height - 1])
+                watcher.wait(watched_paths())
+                try:
+                    self.reload()
+                except ValueError:
+                    pass
+        except KeyboardInterrupt:
+            pass
+        finally:
+            watcher.close()
+
+    def done(self, start: int, end: int) -> None:
+        """Display tasks completed between two day numbers, inclusive."""
+        for done_task in DoneArchive(self.archive_path).between(start, end):
+            print(done_task)
+        runs = DoneRuns.for_done(self.done_path).ranges()
+        for done_task in DoneList.load_between(self.done_path, start, end, runs).tasks:
+            print(done_task)
+
+    def search_done(self, text: str) -> None:
+        """Display completed tasks, archived or not, that contain text."""
+        for done_task in DoneArchive(self.archive_path).search(text):
+            print(done_task)
+        for done_task in DoneList.load(self.done_path, tolerant=True).tasks:
+            if text in str(done_task):
+                print(done_task)
+
+    def archive(self, before: int) -> None:
+        """Move tasks completed before a day number from done.txt to the archive."""
+        done_list = DoneList.load(self.done_path)
+        old = [done for done in done_list.tasks if done.completed < before]
+        if not old:
+            return
+        DoneArchive(self.archive_path).append(old)
+        recent = [done for done in done_list.tasks if done.completed >= before]
+        tmp_path = self.done_path + '.tmp'
+        with open(tmp_path, mode='w') as file:
+            for done_task in recent:
+                file.write(f'{done_task}\n')
+        os.replace(tmp_path, self.done_path)
+
+    def stats(self) -> None:
+        """Display task counts; archived tasks are counted from the index alone."""
+        archive = DoneArchive(self.archive_path)
+        print(f'open: {len(self.tasklist.tasks)}')
+        print(f'done: {len(DoneList.load(self.done_path, tolerant=True).tasks)}')
+        print(f'archived: {len(archive)} in {len(archive.blocks)} blocks')
+'The main function.'
+import os
+import sys
 
+def parse_list_options(options):
+    """Parse the options of the list command into keyword arguments."""
+    kwargs = {}
+    while options:
+        match options:
+            case ['verbose', *options]:
+                kwargs['verbose'] = True
+            case ['--since', date, *options]:
+                kwargs['since'] = date_to_ordinal(date)
+            case ['--until', date, *options]:
+                kwargs['until'] = date_to_ordinal(date)
+            case _:
+                raise ValueError('Unrecognized list option.')
+    return kwargs
+
+def parse_add(app, raw_priority, text, unique=False):
+    """Parse the arguments of the add command and add the task."""
+    priority = '(' + raw_priority + ')'
+    if not is_valid_priority(priority):
+        raise ValueError('Unrecognized priority.')
+    if is_valid_tag(text[0]):
+        tag = text.pop(0)
+        app.add(priority, Tag(tag), ' '.join(text), unique)
+    else:
+        app.add(priority, Tag(None), ' '.join(text), unique)
+
+def parse_dedupe_options(options):
+    """Parse the options of the dedupe command into keyword arguments."""
+    kwargs = {}
+    while options:
+        match options:
+            case ['--merge', *options]:
+                kwargs['merge'] = True
+            case ['--done', span, *options] if not span.startswith('--'):
+                kwargs['done_days'] = parse_days(span)
+            case ['--done', *options]:
+                kwargs['done_days'] = 30
+            case _:
+                raise ValueError('Unrecognized dedupe option.')
+    return kwargs
+
+def open_configured_storage(config_path, todo_path):
+    """Return the task storage selected by the config at config_path."""
+    config = Config()
+    config.load(config_path)
+    return open_storage(config.storage, todo_path, sync=config.durability != 'none')
+
+def print_help():
+    """Print the supported operations."""
+    print('Supported operations:\n' + 't add [pri] [tag?] [text]: add task with [priority], possibly a [tag?], and [text]\n' + 't add --unique [pri] [tag?] [text]: add task, unless one with the same tag and text is already listed\n' + 't pri [line] [pri]: re-prioritize task on [line] to [priority]\n' + 't pri-all [tag] [pri] [--dry-run]: re-prioritize every task with [tag] to [priority]\n' + 't do [line] [line?...]: complete the tasks on the given lines\n' + 't do ~[text]: complete the one task whose tag and text best match [text]; ambiguous matches are listed\n' + 't find [~text]: list the tasks best matching [text], with line numbers\n' + 't rm [line]: remove task on [line], without completing it\n' + 't sed [s/pattern/replacement/flags] [condition?] [--dry-run]: substitute in every task (matching regex [condition?])\n' + 't list: list all tasks, in order of priority, creation date, tag, text, with creation date hidden\n' + 't list verbose: list all tasks, in order of priority, creation date, tag, text, with creation date included\n' + 't list [--since date] [--until date]: list tasks created within a date range (dates are yymmdd)\n' + 't list --watch [options]: keep the list on screen, redrawing it when todo.txt or config change\n' + 't done --between [date] [date]: list tasks completed within a date range\n' + 't done --search [text]: list completed tasks containing [text]\n' + 't done --last [n]: list the last n completed tasks, reading done.txt from its end\n' + 't done --today: list tasks completed today\n' + 't archive [--older-than span]: compress tasks completed over 30 days (or span) ago out of done.txt\n' + 't stats: count open, done and archived tasks\n' + 't dedupe [--merge] [--done [span]]: list (or remove) tasks with the same tag and text, also against tasks done in the last 30 days (or span)\n' + 't migrate [text|sqlite|binary]: copy tasks to todo.txt, the SQLite database todo.db or the binary todo.bin\n' + "t query [--explain] [query]: list tasks matching a query such as 'pri <= C and tag = +work and text ~ deploy'\n" + 't sql [condition]: list tasks matching an SQL condition (with STORAGE sqlite)\n' + 't undo [n]: undo the last (n) add, pri, do, rm, sed or pri-all operations\n' + 't redo [n]: redo the last (n) undone operations\n' + 't snapshot: save a deduplicated snapshot of the tasks, done.txt and config\n' + 't snapshots: list snapshot ids\n' + 't restore [id]: restore the tasks, done.txt and config from snapshot [id]\n' + 't sync [dir]: merge todo.txt and done.txt with the todo directory [dir] (STORAGE text only)\n' + 't fsck [--quarantine]: report lines of config, todo.txt and done.txt that do not parse (or move them to .rejects files)\n' + 't sort-file [path?] [--done]: sort todo.txt (or done.txt by completion date, or [path]) on disk, in bounded memory\n' + 't export --format [jsonl|csv] [--done]: write open (or completed) tasks to stdout\n' + 't import --format [jsonl|csv] [--done]: add open (or completed) tasks read from stdin\n' + 't complete [words...]: print completions of the last of [words], for shell completion\n' + 't completion [bash|zsh]: print a script that completes t in bash or zsh\n' + 't due [--within span]: list tasks with a due:yymmdd date from today on, or within span (e.g. 7d, 2w)\n' + 't overdue: list tasks whose due date has passed\n')
+
+def parse_fast_command(args, config_path, todo_path, done_path):
+    """Parse commands that are answered without loading the full app.
+
+    Returns whether the command was handled.
+    """
+    snapshot_path = os.path.join(os.path.dirname(todo_path), SNAPSHOT_DIRECTORY_NAME)
+    entries = []
+    match args:
+        case ['help']:
+            print_help()
+        case ['due']:
+            entries = DueIndex.for_todo(config_path, todo_path).between(get_current_day(), None)
+        case ['due', '--within', span]:
+            today = get_current_day()
+            entries = DueIndex.for_todo(config_path, todo_path).between(today, today + parse_days(span))
+        case ['overdue']:
+            entries = DueIndex.for_todo(config_path, todo_path).between(None, get_current_day() - 1)
+        case ['snapshot']:
+            storage = open_configured_storage(config_path, todo_path)
+            (snapshot_id, new_chunks) = SnapshotStore(snapshot_path).snapshot([*storage.snapshot_files(), done_path, config_path])
+            print(f'Snapshot {snapshot_id}: {new_chunks} new chunks')
+        case ['snapshots']:
+            for snapshot_id in SnapshotStore(snapshot_path).ids():
+                print(snapshot_id)
+        case ['restore', snapshot_id] if snapshot_id.isdecimal():
+            directory = os.path.dirname(todo_path)
+            names = SnapshotStore(snapshot_path).restore(int(snapshot_id), directory)
+            if SQLITE_NAME in names:
+                SqliteStorage.discard_log(os.path.join(directory, SQLITE_NAME))
+            for name in names:
+                print(f'Restored {name}')
+        case ['sync', other_directory]:
+            if open_configured_storage(config_path, todo_path).kind != 'text':
+                raise ValueError('Sync only works with STORAGE text.')
+            result = sync(os.path.dirname(todo_path), other_directory, os.path.basename(todo_path), os.path.basename(done_path))
+            print(f'todo.txt: {result.todo_ours} lines changed here, {result.todo_theirs} in {other_directory}')
+            print(f'done.txt: {result.done_ours} lines added here, {result.done_theirs} in {other_directory}')
+        case ['list', *options] if '--watch' not in options:
+            key = ListCache.key_for(config_path, **parse_list_options(options))
+            output = ListCache.lookup(todo_path, key)
+            if output is None:
+                return False
+            sys.stdout.write(output)
+        case ['complete', *words]:
+            for candidate in complete_words(words, config_path, todo_path):
+                print(candidate)
+        case ['completion', 'bash' | 'zsh' as shell]:
+            sys.stdout.write(completion_script(shell, os.path.abspath(sys.argv[0])))
+        case ['done', '--last', count] if count.isdecimal():
+            done_tasks = DoneList.tail(done_path, count=int(count)).tasks
+            if len(done_tasks) < int(count):
+                archive_path = os.path.join(os.path.dirname(done_path), ARCHIVE_NAME)
+                done_tasks = DoneArchive(archive_path).last(int(count) - len(done_tasks)) + done_tasks
+            for done_task in done_tasks:
+                print(done_task)
+        case ['done', '--today']:
+            today = get_current_day()
+            archive_path = os.path.join(os.path.dirname(done_path), ARCHIVE_NAME)
+            for done_task in DoneArchive(archive_path).between(today, None):
+                print(done_task)
+            runs = DoneRuns.for_done(done_path).ranges()
+            for done_task in DoneList.load_between(done_path, today, today, runs).tasks:
+                print(done_task)
+        case ['fsck', *options] if options in ([], ['--quarantine']):
+            problems = fsck(config_path, todo_path, done_path, quarantine=bool(options))
+            for problem in problems:
+                print(problem)
+            if options and problems:
+                print(f'Moved {len(problems)} lines to files ending in {REJECTS_SUFFIX}')
+            elif problems:
+                sys.exit(1)
+        case ['sort-file', *options] if len(options) <= 2:
+            done = '--done' in options
+            paths = [option for option in options if option != '--done']
+            if len(paths) > 1:
+                raise ValueError('Unrecognized sort-file options.')
+            path = paths[0] if paths else done_path if done else todo_path
+            runs = sort_file(path, done)
+            print(f'Sorted {path} ({runs} runs)')
+        case ['export', '--format', fmt] if fmt in EXPORT_FORMATS:
+            export_storage(sys.stdout, open_configured_storage(config_path, todo_path), fmt)
+        case ['export', '--format', fmt, '--done'] if fmt in EXPORT_FORMATS:
+            archive_path = os.path.join(os.path.dirname(done_path), ARCHIVE_NAME)
+            export_tasks(sys.stdout, done_path, fmt, done=True, archive_path=archive_path)
+        case ['import', '--format', fmt] if fmt in EXPORT_FORMATS:
+            import_storage(sys.stdin, open_configured_storage(config_path, todo_path), fmt)
+        case ['import', '--format', fmt, '--done'] if fmt in EXPORT_FORMATS:
+            import_tasks(sys.stdin, done_path, fmt, done=True)
+        case _:
+            return False
+    for (_, line_number, task) in entries:
+        print(f'{line_number} {task}')
+    return True
 
 def parse_command(args, app):
     """Parse command from command line."""
     match args:
-
-        case ["add", raw_priority, *text]:
-
-            priority = "(" + raw_priority + ")"
-            if not is_valid_priority(priority):
-                raise ValueError("Unrecognized priority.")
-
-            if is_valid_tag(text[0]):
-                tag = text.pop(0)
-                app.add(priority, tag, " ".join(text))
-            else:
-                app.add(priority, None, " ".join(text))
-
-        case ["pri", line_number, raw_priority]:
-
+        case ['add', '--unique', raw_priority, *text]:
+            parse_add(app, raw_priority, text, unique=True)
+        case ['add', raw_priority, *text]:
+            parse_add(app, raw_priority, text)
+        case ['pri', line_number, raw_priority]:
             if not is_valid_line_number(line_number):
-                raise ValueError("Unrecognized line number.")
-
-            priority = "(" + raw_priority + ")"
+                raise ValueError('Unrecognized line number.')
+            priority = '(' + raw_priority + ')'
             if not is_valid_priority(priority):
-                raise ValueError("Unrecognized priority.")
-
+                raise ValueError('Unrecognized priority.')
             app.pri(line_number, priority)
-
-        case ["do", line_number]:
-
-            if not is_valid_line_number(line_number):
-                raise ValueError("Unrecognized line number.")
-
-            app.do_task(line_number)
-
-        case ["rm", line_number]:
-
+        case ['do', query, *text] if query.startswith('~'):
+            app.do_task(app.match(' '.join([query[1:], *text])))
+        case ['find', *text] if text:
+            app.find(' '.join(text).removeprefix('~'))
+        case ['do', *line_numbers] if line_numbers:
+            if not all((is_valid_line_number(line_number) for line_number in line_numbers)):
+                raise ValueError('Unrecognized line number.')
+            app.do_tasks(line_numbers)
+        case ['rm', line_number]:
             if not is_valid_line_number(line_number):
-                raise ValueError("Unrecognized line number.")
-
+                raise ValueError('Unrecognized line number.')
             app.remove_task(line_number)
-
-        case ["list"]:
-            app.list()
-
-        case ["list", "verbose"]:
-            app.list(verbose=True)
-
-        case ["help"]:
-            print("Supported operations:\n"
-            + "t add [pri] [tag?] [text]: add task with [priority], possibly a [tag?], and [text]\n"
-            + "t pri [line] [pri]: re-prioritize task on [line] to [priority]\n"
-            + "t do [line]: complete task on [line]\n"
-            + "t rm [line]: remove task on [line], without completing it\n"
-            + "t list: list all tasks, in order of priority, creation date, tag, text, with creation date hidden\n"
-            + "t list verbose: list all tasks, in order of priority, creation date, tag, text, with creation date included\n")
-
+        case ['list', '--watch', *options]:
+            app.watch(**parse_list_options(options))
+        case ['list', *options]:
+            app.list(**parse_list_options(options))
+        case ['done', '--between', start, end]:
+            app.done(date_to_ordinal(start), date_to_ordinal(end))
+        case ['done', '--search', *text]:
+            app.search_done(' '.join(text))
+        case ['archive']:
+            app.archive(get_current_day() - 30)
+        case ['archive', '--older-than', span]:
+            app.archive(get_current_day() - parse_days(span))
+        case ['stats']:
+            app.stats()
+        case ['sed', expression, *condition]:
+            dry_run = '--dry-run' in condition
+            condition = [word for word in condition if word != '--dry-run']
+            app.sed(expression, ' '.join(condition) or None, dry_run)
+        case ['pri-all', tag, raw_priority, *options] if options in ([], ['--dry-run']):
+            if not is_valid_tag(tag):
+                raise ValueError('Unrecognized tag.')
+            priority = '(' + raw_priority + ')'
+            if not is_valid_priority(priority):
+                raise ValueError('Unrecognized priority.')
+            app.pri_all(tag, priority, dry_run=bool(options))
+        case ['dedupe', *options]:
+            app.dedupe(**parse_dedupe_options(options))
+        case ['migrate', 'text' | 'sqlite' | 'binary' as kind]:
+            app.migrate(kind)
+        case ['query', '--explain', *text]:
+            app.query(' '.join(text), explain=True)
+        case ['query', *text]:
+            app.query(' '.join(text))
+        case ['sql', *condition]:
+            app.sql(' '.join(condition))
+        case ['undo']:
+            app.undo()
+        case ['undo', count] if count.isdecimal():
+            app.undo(int(count))
+        case ['redo']:
+            app.redo()
+        case ['redo', count] if count.isdecimal():
+            app.redo(int(count))
         case _:
-            raise ValueError("Unrecognized command.")
-
+            raise ValueError('Unrecognized command.')
+
+def run(args, config_path, todo_path, done_path):
+    """Run the command in args, after finishing a `t do` interrupted by a crash."""
+    intent_path = os.path.join(os.path.dirname(done_path), DONE_INTENT_NAME)
+    if os.path.exists(intent_path):
+        recover_and_report(intent_path, done_path, open_configured_storage(config_path, todo_path))
+    if parse_fast_command(args, config_path, todo_path, done_path):
+        return
+    lazy = args[:1] in (['list'], ['find'], ['query']) and '--watch' not in args
+    app = TodoApp(config_path, todo_path, done_path, lazy)
+    parse_command(args, app)
 
 def main():
     """The main operating loop of app."""
-    app = TodoApp(CONFIG_PATH, TODO_PATH, DONE_PATH)
-    parse_command(sys.argv[1:], app)
-
-
-if __name__ == "__main__":
-    main()
+    run(sys.argv[1:], CONFIG_PATH, TODO_PATH, DONE_PATH)
+if __name__ == '__main__':
+    main()
\ No newline at end of file